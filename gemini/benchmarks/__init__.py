@@ -0,0 +1,10 @@
+# Pruebas de rendimiento que no necesitan la interfaz.
+# Se corren desde la carpeta 'gemini', por ejemplo:
+#
+#   python -m benchmarks.bench_scanner
+#   python -m benchmarks.bench_kdf
+#   python -m benchmarks.bench_compression
+#   python -m benchmarks.bench_writer
+#   python -m benchmarks.bench_suite --output resultados.json
+#   python -m benchmarks.bench_zero_copy
+#   python -m benchmarks.bench_search
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import shutil
+import random
+import argparse
+import tempfile
+from cryptography.fernet import Fernet
+import crypto_utils
+import manifest
+import chunk_codecs
+from transfer_engine import ImportEngine
+
+# Efecto neto de comprimir antes de cifrar: tiempo total de importación
+# (hasta que los datos están de verdad en el destino, con os.sync) y bytes
+# escritos, para cada códec y cada tipo de datos.
+#
+#   python -m benchmarks.bench_compression                   # destino temporal en disco
+#   python -m benchmarks.bench_compression --target F:/prueba # carpeta en la USB
+#
+# Sin USB a mano, la columna "estimado" calcula el tiempo con una escritura
+# de --usb-mbps MB/s: como el cifrado y la escritura van en paralelo, el
+# total es el mayor de los dos.
+
+WORDS = [b"fecha", b"usuario", b"error", b"INFO", b"2024-05-01", b"12:30:01", b"ok", b";", b",", b"\n"]
+
+
+def make_dataset(folder, kind: str, size_mb: int):
+    """Crea un conjunto de archivos de prueba: texto, aleatorio o mezcla."""
+    os.makedirs(folder)
+    rng = random.Random(0)
+    size = size_mb * 1024 * 1024
+    if kind in ("texto", "mezcla"):
+        count = size // 2 if kind == "mezcla" else size
+        with open(os.path.join(folder, "registro.log"), 'wb') as f:
+            written = 0
+            while written < count:
+                line = b" ".join(rng.choice(WORDS) for _ in range(12)) + b"\n"
+                f.write(line)
+                written += len(line)
+    if kind in ("aleatorio", "mezcla"):
+        count = size // 2 if kind == "mezcla" else size
+        # Se guarda como .bin para que pase por el muestreo de entropía
+        with open(os.path.join(folder, "datos.bin"), 'wb') as f:
+            f.write(os.urandom(count))
+        with open(os.path.join(folder, "foto.jpg"), 'wb') as f:
+            f.write(os.urandom(count // 4))
+
+
+def run(source, target, compression):
+    session_key = crypto_utils.SessionKey(Fernet.generate_key())
+    destination = tempfile.mkdtemp(prefix="baul_", dir=target)
+    try:
+        manifests = manifest.ManifestStore(destination, session_key)
+        engine = ImportEngine(session_key, manifests, compression=compression)
+        started = time.perf_counter()
+        report = engine.run([source], destination)
+        if hasattr(os, "sync"):
+            os.sync()
+        elapsed = time.perf_counter() - started
+        return report, elapsed
+    finally:
+        shutil.rmtree(destination, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Efecto de la compresión en la importación")
+    parser.add_argument("--target", default=None, help="Carpeta destino (por ejemplo en la USB)")
+    parser.add_argument("--size", type=int, default=64, help="MB por conjunto de datos")
+    parser.add_argument("--codec", action="append", choices=chunk_codecs.available(),
+                        help="Códec a medir (se puede repetir); por defecto todos")
+    parser.add_argument("--usb-mbps", type=float, default=20.0,
+                        help="Velocidad de escritura supuesta para la columna 'estimado'")
+    args = parser.parse_args(argv)
+
+    work = tempfile.mkdtemp(prefix="baul_bench_")
+    try:
+        for kind in ("texto", "aleatorio", "mezcla"):
+            source = os.path.join(work, kind)
+            make_dataset(source, kind, args.size)
+            print(f"--- {kind} ({args.size} MB) ---")
+            for codec in args.codec or chunk_codecs.available():
+                report, elapsed = run(source, args.target, None if codec == "none" else codec)
+                ratio = report.bytes_written / report.bytes_read if report.bytes_read else 0.0
+                written_mb = report.bytes_written / (1024 * 1024)
+                estimated = max(elapsed, written_mb / args.usb_mbps)
+                print(f"  {codec:<5} {elapsed:7.2f} s  {report.bytes_read / (1024 * 1024) / elapsed:8.1f} MB/s  "
+                      f"escrito {written_mb:8.1f} MB ({ratio:.0%})  estimado {estimated:7.2f} s")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
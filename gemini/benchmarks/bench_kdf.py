@@ -0,0 +1,45 @@
+import sys
+import argparse
+import kdf
+
+# Tiempo de derivación de la llave para cada función y varios parámetros, y
+# lo que elegiría la calibración en esta PC.
+#
+#   python -m benchmarks.bench_kdf
+#   python -m benchmarks.bench_kdf --target 1.0
+
+
+def settings(name: str):
+    """Parámetros a medir: el mínimo y algunos múltiplos."""
+    base = kdf.MIN_PARAMS[name]
+    if name == kdf.PBKDF2:
+        for factor in (1, 2, 4, 8):
+            yield {"iterations": base["iterations"] * factor}
+        yield dict(kdf.LEGACY_PARAMS)
+    elif name == kdf.SCRYPT:
+        for shift in range(4):
+            yield dict(base, n=base["n"] << shift)
+    elif name == kdf.ARGON2ID:
+        for memory in (base["memory_cost"], 64 * 1024, 128 * 1024):
+            for iterations in (2, 4):
+                yield dict(base, memory_cost=memory, iterations=iterations)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiempo de derivación de la llave del baúl")
+    parser.add_argument("--target", type=float, default=kdf.TARGET_SECONDS,
+                        help="Tiempo de desbloqueo buscado por la calibración (segundos)")
+    parser.add_argument("--kdf", choices=kdf.available(), action="append",
+                        help="Medir solo esta función (se puede repetir)")
+    args = parser.parse_args(argv)
+
+    for name in args.kdf or kdf.available():
+        print(f"--- {name} ---")
+        for params in settings(name):
+            print(f"  {str(params):<55} {kdf.time_derive(name, params):7.3f} s")
+        _, calibrated = kdf.calibrate(name, args.target)
+        print(f"  calibrado para {args.target} s: {calibrated} -> {kdf.time_derive(name, calibrated):.3f} s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import scanner
+
+# Compara la forma anterior de leer el baúl (os.listdir + os.path.isdir por
+# cada elemento) con scanner.walk (una sola pasada con os.scandir).
+#
+#   python -m benchmarks.bench_scanner                  # árbol sintético de 100k elementos
+#   python -m benchmarks.bench_scanner --path E:\Baul   # un baúl real (solo lectura)
+
+
+def build_tree(root, total: int, per_folder: int = 500):
+    """Crea 'total' archivos vacíos repartidos en carpetas de 'per_folder'."""
+    created = 0
+    folder_index = 0
+    while created < total:
+        folder = os.path.join(root, f"carpeta_{folder_index:05d}")
+        os.makedirs(folder)
+        for i in range(min(per_folder, total - created)):
+            open(os.path.join(folder, f"{i:016x}.enc"), 'wb').close()
+        created += per_folder
+        folder_index += 1
+
+
+def walk_listdir(path) -> int:
+    """Recorrido como lo hacía el árbol antes: listdir y luego isdir dos veces."""
+    count = 0
+    try:
+        items = sorted(os.listdir(path))
+    except OSError:
+        return 0
+    dirs = [item for item in items if os.path.isdir(os.path.join(path, item))]
+    files = [item for item in items if not os.path.isdir(os.path.join(path, item))]
+    for item in dirs:
+        count += 1 + walk_listdir(os.path.join(path, item))
+    return count + len(files)
+
+
+def walk_scandir(path, with_stat: bool) -> int:
+    return sum(len(entries) for _, entries in scanner.walk(path, with_stat=with_stat))
+
+
+def measure(label, fn, *args):
+    started = time.perf_counter()
+    count = fn(*args)
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed else 0.0
+    print(f"{label:<28} {count:>8} elementos  {elapsed:8.3f} s  {rate:12,.0f} elem/s")
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rendimiento de la lectura de carpetas del baúl")
+    parser.add_argument("--path", help="Carpeta a recorrer (por defecto se crea un árbol sintético)")
+    parser.add_argument("--entries", type=int, default=100_000, help="Elementos del árbol sintético")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    tmp = None
+    path = args.path
+    if path is None:
+        tmp = tempfile.mkdtemp(prefix="baul_bench_")
+        path = tmp
+        print(f"Creando {args.entries} archivos en {tmp} ...")
+        build_tree(tmp, args.entries)
+
+    try:
+        for run in range(args.repeat):
+            print(f"--- Vuelta {run + 1} ---")
+            before = measure("listdir + isdir", walk_listdir, path)
+            after = measure("scanner.walk (sin stat)", walk_scandir, path, False)
+            measure("scanner.walk (con stat)", walk_scandir, path, True)
+            print(f"Mejora sin stat: x{before / after:.2f}" if after else "")
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
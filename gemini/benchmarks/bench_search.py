@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from cryptography.fernet import Fernet
+import manifest
+import search_index
+
+# Tiempo de armado del índice de búsqueda y de cada tipo de búsqueda sobre un
+# baúl sintético (por defecto 500k entradas). Los nombres se generan en
+# memoria, sin escribir nada en disco: solo se mide el índice.
+#
+#   python -m benchmarks.bench_search
+#   python -m benchmarks.bench_search --entries 100000 --repeat 20
+
+WORDS = ["vacaciones", "playa", "informe", "factura", "foto", "cancion", "Canción", "proyecto",
+         "copia", "final", "borrador", "reunion", "escaneo", "contrato", "video", "notas"]
+EXTENSIONS = [".jpg", ".pdf", ".docx", ".mp3", ".txt", ".mp4", ".xlsx"]
+TOP_FOLDERS = ["Fotos", "Documentos", "Musica", "Videos", "Trabajo"]
+
+# (etiqueta, texto, modo): los mismos tipos de búsqueda que usa la ventana
+QUERIES = [
+    ("prefijo", "vacac", "prefix"),
+    ("prefijo (raro)", "zzz", "prefix"),
+    ("subcadena", "playa", "substring"),
+    ("subcadena (rara)", "qqq", "substring"),
+    ("fuzzy", "vcn22", "fuzzy"),
+    ("fuzzy (raro)", "xkcd", "fuzzy"),
+    ("auto", "informe", "auto"),
+    ("auto (pocos)", "cntrt fnl", "auto"),
+    ("ruta", "fotos/2020/carpeta", "auto"),
+    ("ruta (fuzzy)", "fotos/vcn22", "fuzzy"),
+]
+
+
+def make_folders(total: int, per_folder: int = 500, seed: int = 0) -> list:
+    """
+    Crea 'total' nombres de archivo repartidos en carpetas de 'per_folder',
+    en el orden en que los lee SearchIndex.build (preorden).
+
+    Retorna:
+        list: (ruta relativa, elementos) de cada carpeta, con los elementos
+              como los retorna search_index.list_folder.
+    """
+    rng = random.Random(seed)
+    folders = []
+    created = 0
+    index = 0
+    while created < total:
+        top = TOP_FOLDERS[index % len(TOP_FOLDERS)]
+        relative = f"{top}/{2015 + index % 10}/carpeta_{index:05d}"
+        items = []
+        for i in range(min(per_folder, total - created)):
+            name = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {2015 + rng.randrange(10)}_{i}{rng.choice(EXTENSIONS)}"
+            items.append((name, f"{rng.getrandbits(64):016x}.enc", False))
+        folders.append((relative, items))
+        created += len(items)
+        index += 1
+    return folders
+
+
+def build(root: str, folders: list) -> search_index.SearchIndex:
+    """Arma un SearchIndex con 'folders' como índice base, igual que build() pero sin leer el disco."""
+    index = search_index.SearchIndex(manifest.ManifestStore(root, Fernet(Fernet.generate_key())))
+    segment = search_index._Segment()
+    for relative, items in folders:
+        folder = os.path.join(root, *relative.split("/"))
+        segment.add_folder(index._key(folder), folder, relative, items)
+    segment.finish()
+    index._base = segment
+    index.ready = True
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rendimiento del índice de búsqueda por nombre")
+    parser.add_argument("--entries", type=int, default=500_000, help="Entradas del baúl sintético")
+    parser.add_argument("--repeat", type=int, default=10, help="Veces que se repite cada búsqueda")
+    parser.add_argument("--limit", type=int, default=search_index.DEFAULT_LIMIT)
+    args = parser.parse_args(argv)
+
+    folders = make_folders(args.entries)
+    # La carpeta solo da una ruta a los manifiestos: no se escribe nada en ella
+    with tempfile.TemporaryDirectory(prefix="baul_bench_") as root:
+        started = time.perf_counter()
+        index = build(root, folders)
+        elapsed = time.perf_counter() - started
+        print(f"Índice de {index.size:,} entradas armado en {elapsed:.2f} s")
+
+        try:
+            print(f"{'búsqueda':<18} {'texto':<20} {'resultados':>10} {'mediana':>10} {'máximo':>10}")
+            for label, query, mode in QUERIES:
+                times = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    hits = index.search(query, mode, args.limit)
+                    times.append(time.perf_counter() - started)
+                print(f"{label:<18} {query:<20} {len(hits):>10} {statistics.median(times) * 1000:>8.1f} ms"
+                      f" {max(times) * 1000:>7.1f} ms")
+        finally:
+            index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
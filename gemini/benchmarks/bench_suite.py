@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+from datetime import datetime
+from cryptography.fernet import Fernet
+import kdf
+import crypto_utils
+import manifest
+from transfer_engine import ImportEngine, ExportEngine
+
+# Suite completa de rendimiento, sin interfaz: derivación de la llave
+# (derive_key, generate_vault_key, unlock_vault_key) e importación/exportación
+# con los mismos motores que usa la app, sobre conjuntos de archivos sintéticos:
+#
+# - pequeños: muchos archivos de pocos KB repartidos en carpetas.
+# - enormes: pocos archivos de cientos de MB.
+# - mezcla: un árbol con tamaños variados, mitad texto y mitad aleatorio.
+#
+# Cada medición de transferencia corre en un proceso aparte para que la
+# memoria máxima (peak RSS) sea solo la suya. Los resultados se guardan en
+# JSON junto con el commit, para comparar entre versiones:
+#
+#   python -m benchmarks.bench_suite --output antes.json
+#   (cambios...)
+#   python -m benchmarks.bench_suite --output despues.json --compare antes.json
+#   python -m benchmarks.bench_suite --compare antes.json despues.json   # solo comparar
+#
+# --scale agranda o achica todos los conjuntos (0.1 para una prueba rápida).
+
+PASSWORD = "contraseña de prueba"
+WORDS = [b"fecha", b"usuario", b"error", b"INFO", b"2024-05-01", b"ok", b";", b"\n"]
+
+# Métricas donde más es mejor (para marcar las regresiones al comparar)
+HIGHER_IS_BETTER = {"mb_per_s", "files_per_s"}
+METRICS = ("seconds", "mb_per_s", "files_per_s", "peak_rss_mb")
+
+
+def peak_rss_mb() -> float:
+    """Memoria máxima usada por este proceso hasta ahora (MB)."""
+    # En Linux ru_maxrss se hereda a través de exec (el proceso hijo
+    # reportaría la memoria del padre); VmHWM no
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + \
+                       [(name, ctypes.c_size_t) for name in (
+                           "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                           "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                           "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KB y macOS en bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# --- Conjuntos de archivos ---
+def _write(path, size: int, rng, text: bool):
+    with open(path, 'wb') as f:
+        if not text:
+            f.write(os.urandom(size))
+            return
+        written = 0
+        while written < size:
+            line = b" ".join(rng.choice(WORDS) for _ in range(10)) + b"\n"
+            f.write(line)
+            written += len(line)
+
+
+def make_file_set(folder, kind: str, scale: float):
+    """Crea uno de los conjuntos: 'pequeños', 'enormes' o 'mezcla'."""
+    rng = random.Random(0)
+    os.makedirs(folder)
+    if kind == "pequeños":
+        for index in range(max(1, int(5000 * scale))):
+            sub = os.path.join(folder, f"modulo{index // 100:03d}")
+            os.makedirs(sub, exist_ok=True)
+            _write(os.path.join(sub, f"archivo{index}.js"), rng.randint(200, 8 * 1024), rng, text=True)
+    elif kind == "enormes":
+        for index in range(2):
+            _write(os.path.join(folder, f"imagen{index}.bin"), max(1, int(256 * scale)) * 1024 * 1024,
+                   rng, text=False)
+    elif kind == "mezcla":
+        for index in range(max(1, int(400 * scale))):
+            sub = os.path.join(folder, f"carpeta{index // 40:02d}", f"sub{index % 4}")
+            os.makedirs(sub, exist_ok=True)
+            size = rng.choice([rng.randint(1, 64) * 1024] * 8 + [rng.randint(1, 8) * 1024 * 1024])
+            _write(os.path.join(sub, f"dato{index}"), size, rng, text=index % 2 == 0)
+
+
+# --- Mediciones ---
+def bench_kdf(repeat: int) -> list:
+    """Latencia de derive_key, generate_vault_key y unlock_vault_key."""
+    results = []
+    salt = os.urandom(16)
+    seconds = _median(repeat, lambda: crypto_utils.derive_key(PASSWORD, salt))
+    results.append({"name": "kdf/derive_key-antiguo", "seconds": seconds, "params": kdf.LEGACY_PARAMS})
+
+    for name in kdf.available():
+        started = time.perf_counter()
+        content = crypto_utils.generate_vault_key(PASSWORD, name)
+        generate = time.perf_counter() - started
+        params = crypto_utils.unpack_vault_key(content)[1]
+        results.append({"name": f"kdf/{name}/generate_vault_key", "seconds": generate, "params": params})
+        seconds = _median(repeat, lambda: crypto_utils.unlock_vault_key(PASSWORD, content))
+        results.append({"name": f"kdf/{name}/unlock_vault_key", "seconds": seconds, "params": params})
+    return results
+
+
+def _median(repeat: int, fn) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def _transfer_child(action, master_key, source, vault, destination, options, queue):
+    """Corre en un proceso aparte: una importación o una exportación."""
+    session_key = crypto_utils.SessionKey(master_key)
+    manifests = manifest.ManifestStore(vault, session_key)
+    if action == "importar":
+        engine = ImportEngine(session_key, manifests, **options)
+        started = time.perf_counter()
+        report = engine.run([source], vault)
+    else:
+        engine = ExportEngine(session_key, manifests)
+        started = time.perf_counter()
+        report = engine.run([os.path.join(vault, os.path.basename(source))], destination)
+    if hasattr(os, "sync"):
+        os.sync()
+    elapsed = time.perf_counter() - started
+    queue.put({
+        "seconds": elapsed,
+        "files": report.files_ok,
+        "failed": len(report.failed),
+        "bytes": report.bytes_read,
+        "mb_per_s": report.bytes_read / (1024 * 1024) / elapsed if elapsed else 0.0,
+        "files_per_s": report.files_ok / elapsed if elapsed else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def bench_transfers(work, target, scale: float, kinds, options: dict) -> list:
+    results = []
+    context = multiprocessing.get_context("spawn")
+    master_key = Fernet.generate_key()
+    for kind in kinds:
+        source = os.path.join(work, kind)
+        make_file_set(source, kind, scale)
+        vault = tempfile.mkdtemp(prefix="baul_", dir=target)
+        destination = tempfile.mkdtemp(prefix="salida_", dir=work)
+        try:
+            for action in ("importar", "exportar"):
+                queue = context.Queue()
+                child = context.Process(target=_transfer_child,
+                                        args=(action, master_key, source, vault, destination, options, queue))
+                child.start()
+                result = queue.get()
+                child.join()
+                result["name"] = f"{action}/{kind}"
+                results.append(result)
+                print(_format(result))
+        finally:
+            shutil.rmtree(vault, ignore_errors=True)
+            shutil.rmtree(destination, ignore_errors=True)
+            shutil.rmtree(source, ignore_errors=True)
+    return results
+
+
+# --- Resultados ---
+def _format(result: dict) -> str:
+    line = f"  {result['name']:<38} {result['seconds']:8.3f} s"
+    if "mb_per_s" in result:
+        line += (f"  {result['mb_per_s']:8.1f} MB/s  {result['files_per_s']:8.1f} archivos/s"
+                 f"  {result['peak_rss_mb']:7.1f} MB RSS")
+        if result.get("failed"):
+            line += f"  ({result['failed']} con error)"
+    return line
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base: dict, new: dict):
+    """Imprime la diferencia de cada métrica entre dos corridas."""
+    print(f"--- {base.get('commit')} -> {new.get('commit')} ---")
+    old_results = {result["name"]: result for result in base["results"]}
+    for result in new["results"]:
+        old = old_results.get(result["name"])
+        if old is None:
+            continue
+        changes = []
+        for metric in METRICS:
+            if metric not in result or not old.get(metric):
+                continue
+            change = (result[metric] - old[metric]) / old[metric]
+            worse = change < 0 if metric in HIGHER_IS_BETTER else change > 0
+            mark = " (!)" if worse and abs(change) >= 0.10 else ""
+            changes.append(f"{metric} {change:+.0%}{mark}")
+        print(f"  {result['name']:<38} " + "  ".join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rendimiento de la derivación de llaves y las transferencias")
+    parser.add_argument("--target", default=None, help="Carpeta donde crear el baúl (por ejemplo en la USB)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Factor de tamaño de los conjuntos")
+    parser.add_argument("--set", action="append", choices=["pequeños", "enormes", "mezcla"],
+                        help="Conjunto a medir (se puede repetir); por defecto todos")
+    parser.add_argument("--compression", default="auto", help="Códec para importar ('none' para no comprimir)")
+    parser.add_argument("--no-kdf", action="store_true", help="No medir la derivación de llaves")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones de cada medición de llaves")
+    parser.add_argument("--output", help="Guardar los resultados en este JSON")
+    parser.add_argument("--compare", nargs="+", metavar="JSON",
+                        help="Comparar con una corrida anterior (o dos JSON entre sí, sin medir)")
+    args = parser.parse_args(argv)
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0], encoding="utf-8") as f, open(args.compare[1], encoding="utf-8") as g:
+            compare(json.load(f), json.load(g))
+        return 0
+
+    run = {
+        "commit": current_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scale": args.scale,
+        "results": [],
+    }
+    if not args.no_kdf:
+        print("--- llaves ---")
+        for result in bench_kdf(args.repeat):
+            run["results"].append(result)
+            print(_format(result))
+
+    print("--- transferencias ---")
+    options = {"compression": None if args.compression == "none" else args.compression}
+    work = tempfile.mkdtemp(prefix="baul_suite_")
+    try:
+        run["results"] += bench_transfers(work, args.target, args.scale,
+                                          args.set or ["pequeños", "enormes", "mezcla"], options)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding="utf-8") as f:
+            json.dump(run, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            compare(json.load(f), run)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
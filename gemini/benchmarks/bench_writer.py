@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import vault_format
+import vault_writer
+
+# Escritura directa (como antes: open(..., 'wb') con el nombre final y un
+# write() por bloque cifrado) contra VaultWriter con cada política de fsync.
+# Solo mide la escritura: los datos ya vienen "cifrados" (aleatorios), en
+# piezas del tamaño de un bloque sellado.
+#
+# El tiempo incluye un os.sync() final, es decir, hasta que los datos están
+# de verdad en el destino. Lo ideal es medir sobre una imagen FAT32 montada
+# en loop (Linux), que se comporta como una USB sin depender de una:
+#
+#   truncate -s 2G /tmp/fat32.img
+#   mkfs.vfat -F 32 /tmp/fat32.img
+#   sudo mkdir -p /mnt/fat32
+#   sudo mount -o loop,uid=$(id -u) /tmp/fat32.img /mnt/fat32
+#   python -m benchmarks.bench_writer --target /mnt/fat32
+#   sudo umount /mnt/fat32
+#
+# En Windows se puede apuntar --target directamente a una carpeta de la USB.
+
+PIECE = vault_format.CHUNK_SIZE + vault_format.TAG_SIZE
+
+
+def file_sets(small_files: int, large_files: int, large_mb: int):
+    """(nombre, cantidad de archivos, tamaño de cada uno)"""
+    return [
+        ("pequeños", small_files, 96 * 1024),
+        ("grandes", large_files, large_mb * 1024 * 1024),
+    ]
+
+
+def pieces(size: int, data: bytes):
+    """Cabecera y bloques de un archivo de 'size' bytes."""
+    yield data[:vault_format.HEADER_SIZE]
+    while size > 0:
+        yield data[:min(size, PIECE)]
+        size -= PIECE
+
+
+def write_direct(folder, count, size, data):
+    for index in range(count):
+        with open(os.path.join(folder, f"{index:06d}.enc"), 'wb') as f:
+            for piece in pieces(size, data):
+                f.write(piece)
+
+
+def write_vault_writer(folder, count, size, data, policy):
+    sync = vault_writer.SyncPolicy(policy)
+    for index in range(count):
+        writer = vault_writer.VaultWriter(os.path.join(folder, f"{index:06d}.enc"), sync)
+        for piece in pieces(size, data):
+            writer.write(piece)
+        writer.commit()
+    sync.flush()
+
+
+def measure(target, method, count, size, data):
+    folder = tempfile.mkdtemp(prefix="baul_writer_", dir=target)
+    try:
+        started = time.perf_counter()
+        if method == "directo":
+            write_direct(folder, count, size, data)
+        else:
+            write_vault_writer(folder, count, size, data, method)
+        if hasattr(os, "sync"):
+            os.sync()
+        return time.perf_counter() - started
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Escritura directa contra VaultWriter")
+    parser.add_argument("--target", default=None, help="Carpeta destino (imagen FAT32 montada o USB)")
+    parser.add_argument("--small-files", type=int, default=2000, help="Cantidad de archivos pequeños")
+    parser.add_argument("--large-files", type=int, default=4, help="Cantidad de archivos grandes")
+    parser.add_argument("--large-mb", type=int, default=64, help="MB de cada archivo grande")
+    parser.add_argument("--policy", action="append", choices=vault_writer.POLICIES,
+                        help="Política a medir (se puede repetir); por defecto todas")
+    args = parser.parse_args(argv)
+
+    data = os.urandom(PIECE)
+    methods = ["directo"] + (args.policy or list(vault_writer.POLICIES))
+    for name, count, size in file_sets(args.small_files, args.large_files, args.large_mb):
+        total_mb = count * size / (1024 * 1024)
+        print(f"--- {name}: {count} x {size // 1024} KiB ({total_mb:.0f} MB) ---")
+        for method in methods:
+            elapsed = measure(args.target, method, count, size, data)
+            print(f"  {method:<8} {elapsed:7.2f} s  {total_mb / elapsed:8.1f} MB/s  {count / elapsed:9.1f} archivos/s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
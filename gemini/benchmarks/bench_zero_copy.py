@@ -0,0 +1,112 @@
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from cryptography.fernet import Fernet
+import crypto_utils
+import instrumentation
+import manifest
+import vault_format
+from transfer_engine import ImportEngine, ExportEngine
+from benchmarks.bench_suite import peak_rss_mb, _write
+
+# Camino anterior (un bytes nuevo por bloque en cada paso) contra el de
+# buffers reutilizados (zero_copy=True: readinto/mmap, update_into y
+# escritura directa desde el buffer) al importar y exportar archivos grandes.
+#
+# Por cada medición da MB/s, cuántos bytes se copiaron en memoria y cuántos
+# se pidieron en buffers nuevos por cada byte transferido (los contadores
+# "bytes_copied" y "bytes_allocated" de instrumentation.py) y la memoria
+# máxima del proceso (peak RSS). Cada medición corre en un proceso aparte
+# para que la memoria máxima sea solo la suya.
+#
+#   python -m benchmarks.bench_zero_copy
+#   python -m benchmarks.bench_zero_copy --scale 4 --mmap
+#
+# --mmap fuerza la lectura con mmap también fuera de Windows (ver
+# vault_format.MMAP_READS).
+
+MODES = (("antes", False), ("ahora", True))
+# (nombre, códec al importar, archivo de texto)
+DATA_SETS = (("aleatorio", None, False), ("texto", "zlib", True))
+
+
+def _child(action, master_key, source, vault, destination, zero_copy, compression, use_mmap, queue):
+    """Corre en un proceso aparte: una importación o una exportación medida."""
+    vault_format.MMAP_READS = use_mmap or vault_format.MMAP_READS
+    session_key = crypto_utils.SessionKey(master_key)
+    manifests = manifest.ManifestStore(vault, session_key)
+    instrumentation.start(os.path.join(destination, "traza.json"))
+    started = time.perf_counter()
+    if action == "importar":
+        report = ImportEngine(session_key, manifests, compression=compression, zero_copy=zero_copy).run([source], vault)
+    else:
+        report = ExportEngine(session_key, manifests, zero_copy=zero_copy).run(
+            [os.path.join(vault, os.path.basename(source))], destination)
+    elapsed = time.perf_counter() - started
+    counters = instrumentation.stop(save=False)["counters"]
+    transferred = report.bytes_read or 1
+    queue.put({
+        "seconds": elapsed,
+        "failed": len(report.failed),
+        "mb_per_s": report.bytes_read / (1024 * 1024) / elapsed if elapsed else 0.0,
+        "copied_per_byte": counters.get("bytes_copied", 0) / transferred,
+        "allocated_per_byte": counters.get("bytes_allocated", 0) / transferred,
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+
+def measure(context, action, master_key, source, vault, destination, zero_copy, compression, use_mmap):
+    queue = context.Queue()
+    child = context.Process(target=_child, args=(action, master_key, source, vault, destination, zero_copy,
+                                                 compression, use_mmap, queue))
+    child.start()
+    result = queue.get()
+    child.join()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copias de memoria y peak RSS: camino anterior contra zero_copy")
+    parser.add_argument("--target", default=None, help="Carpeta donde crear el baúl (por ejemplo en la USB)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Factor de tamaño (1 = archivos de 256 MB)")
+    parser.add_argument("--mmap", action="store_true", help="Leer los archivos de origen con mmap")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    master_key = Fernet.generate_key()
+    size = max(1, int(256 * args.scale)) * 1024 * 1024
+    work = tempfile.mkdtemp(prefix="baul_zero_copy_")
+    try:
+        for name, compression, text in DATA_SETS:
+            source = os.path.join(work, name)
+            os.makedirs(source)
+            _write(os.path.join(source, f"{name}.bin"), size, random.Random(0), text)
+            print(f"--- {name}: {size // (1024 * 1024)} MB, compresión {compression or 'ninguna'} ---")
+            for mode, zero_copy in MODES:
+                vault = tempfile.mkdtemp(prefix="baul_", dir=args.target)
+                destination = tempfile.mkdtemp(prefix="salida_", dir=work)
+                try:
+                    for action in ("importar", "exportar"):
+                        result = measure(context, action, master_key, source, vault, destination, zero_copy,
+                                         compression, args.mmap)
+                        failed = f"  ({result['failed']} con error)" if result["failed"] else ""
+                        print(f"  {action:<9} {mode:<6} {result['mb_per_s']:8.1f} MB/s"
+                              f"  {result['copied_per_byte']:5.2f} copiados/byte"
+                              f"  {result['allocated_per_byte']:5.2f} nuevos/byte"
+                              f"  {result['peak_rss_mb']:7.1f} MB RSS{failed}")
+                finally:
+                    shutil.rmtree(vault, ignore_errors=True)
+                    shutil.rmtree(destination, ignore_errors=True)
+            shutil.rmtree(source, ignore_errors=True)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
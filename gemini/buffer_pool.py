@@ -0,0 +1,55 @@
+import threading
+import instrumentation
+
+# Buffers reutilizables para los bloques de las transferencias.
+#
+# Antes cada bloque de 1 MiB pasaba por varios bytes nuevos: uno al leerlo
+# del archivo, otro con el resultado del cifrado (y más al comprimir o al
+# quitarle el byte del códec). Con archivos grandes eso es crear y liberar
+# varios MB por cada MB transferido, y la memoria máxima dependía de cuántos
+# bloques hubiera en las colas.
+#
+# Ahora los pasos que lo permiten escriben en bytearrays de un BufferPool
+# (readinto al leer, update_into de AES-GCM al cifrar y descifrar, ver
+# vault_format.py) y el buffer se devuelve al pool en cuanto el bloque se
+# escribió. Como el pool tiene un máximo de buffers, también limita la
+# memoria en vuelo: si se acaban, quien pide uno espera.
+
+
+class BufferPool:
+    """
+    Bytearrays de 'size' bytes que se reciclan. Se crean la primera vez que
+    se piden, hasta 'count'; después acquire() espera a que se devuelva uno.
+    Se puede usar desde varios hilos.
+    """
+    def __init__(self, size: int, count: int):
+        self.size = size
+        self.count = count
+        self.allocated = 0
+        self._free = []
+        self._available = threading.Condition()
+
+    def acquire(self) -> bytearray:
+        with self._available:
+            while not self._free and self.allocated >= self.count:
+                self._available.wait()
+            if self._free:
+                return self._free.pop()
+            self.allocated += 1
+        instrumentation.count("bytes_allocated", self.size)
+        return bytearray(self.size)
+
+    def release(self, buffer: bytearray):
+        """Devuelve un buffer; quien lo usaba ya no debe tocarlo."""
+        with self._available:
+            self._free.append(buffer)
+            self._available.notify()
+
+    def discard(self, buffer: bytearray):
+        """
+        Da por perdido un buffer que quizá todavía usa una tarea (por ejemplo
+        al cancelar). No se recicla; el pool podrá crear otro en su lugar.
+        """
+        with self._available:
+            self.allocated -= 1
+            self._available.notify()
@@ -0,0 +1,141 @@
+import os
+import zlib
+import lzma
+import math
+from collections import Counter
+from cryptography.fernet import InvalidToken
+
+try:
+    import zstandard
+except ImportError:
+    # Opcional: si no está instalado se usa zlib
+    zstandard = None
+
+# Compresión de los bloques antes de cifrarlos.
+#
+# Una vez cifrado, un archivo ya no se puede comprimir, así que los textos,
+# CSV, logs o carpetas de código ocupaban en la USB todo su tamaño original.
+# Ahora el motor de importación comprime cada bloque antes de cifrarlo:
+#
+# - Los archivos que ya vienen comprimidos (JPEG, ZIP, MP4...) se detectan
+#   por la extensión y se guardan tal cual, sin gastar CPU en ellos.
+# - En los demás se mide la entropía de una muestra de cada bloque; si parece
+#   aleatorio (ya comprimido o cifrado) ese bloque se guarda sin comprimir.
+# - Si al comprimir no se ahorra al menos MIN_SAVING, también se guarda tal cual.
+#
+# El códec elegido va en la cabecera del archivo y el que se usó de verdad va
+# en el primer byte de cada bloque (ver vault_format.pack_chunk), así que al
+# descifrar se deshace solo.
+
+NONE = 0
+ZLIB = 1
+LZMA = 2
+ZSTD = 3
+
+NAMES = {"none": NONE, "zlib": ZLIB, "lzma": LZMA, "zstd": ZSTD}
+DEFAULT_LEVELS = {ZLIB: 1, LZMA: 1, ZSTD: 3}
+
+# Formatos que ya vienen comprimidos
+SKIP_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp3", ".aac", ".m4a", ".ogg", ".opus", ".flac",
+    ".mp4", ".m4v", ".mkv", ".mov", ".avi", ".webm",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub", ".jar", ".apk",
+}
+
+ENTROPY_SAMPLE = 16 * 1024   # Bytes muestreados por bloque
+MAX_ENTROPY = 7.5            # Bits por byte; por encima se considera incompresible
+MIN_SAVING = 0.03            # Ahorro mínimo para quedarse con la versión comprimida
+
+
+def available() -> list:
+    """Nombres de los códecs que se pueden usar en esta PC."""
+    return [name for name, codec in NAMES.items() if codec != ZSTD or zstandard is not None]
+
+
+def default_codec() -> int:
+    """zstd si está instalado; si no, zlib."""
+    return ZSTD if zstandard is not None else ZLIB
+
+
+def codec_from_name(name: str) -> int:
+    """
+    'auto' elige default_codec().
+
+    Lanza:
+        ValueError: Si el códec no existe o no está instalado.
+    """
+    if name == "auto":
+        return default_codec()
+    if name not in available():
+        raise ValueError(f"Códec de compresión no disponible: {name}")
+    return NAMES[name]
+
+
+def should_compress_file(path) -> bool:
+    """False para los formatos que ya vienen comprimidos."""
+    return os.path.splitext(str(path))[1].lower() not in SKIP_EXTENSIONS
+
+
+def entropy(data) -> float:
+    """
+    Entropía de Shannon (bits por byte) de una muestra del bloque: cuatro
+    trozos repartidos a lo largo de 'data'.
+    """
+    if len(data) > ENTROPY_SAMPLE:
+        step = len(data) // 4
+        piece = ENTROPY_SAMPLE // 4
+        data = b"".join(data[i * step:i * step + piece] for i in range(4))
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(n / total * math.log2(n / total) for n in Counter(data).values())
+
+
+def compress(data: bytes, codec: int, level: int = None):
+    """
+    Comprime un bloque si vale la pena.
+
+    Retorna:
+        tuple: (códec usado, datos). El códec es NONE si se guardó sin comprimir.
+    """
+    if codec == NONE or len(data) < 64 or entropy(data) > MAX_ENTROPY:
+        return NONE, data
+    level = DEFAULT_LEVELS.get(codec) if level is None else level
+    if codec == ZLIB:
+        packed = zlib.compress(data, level)
+    elif codec == LZMA:
+        packed = lzma.compress(data, preset=level)
+    elif codec == ZSTD and zstandard is not None:
+        packed = zstandard.ZstdCompressor(level=level).compress(data)
+    else:
+        raise ValueError(f"Códec de compresión no disponible: {codec}")
+    if len(packed) > len(data) * (1 - MIN_SAVING):
+        return NONE, data
+    return codec, packed
+
+
+def decompress(codec: int, data: bytes, max_size: int) -> bytes:
+    """
+    Deshace compress(). 'max_size' es el tamaño original esperado.
+
+    Lanza:
+        InvalidToken: Si el códec no se reconoce o los datos no se pueden descomprimir.
+        ValueError: Si el bloque usa zstd y no está instalado.
+    """
+    if codec == NONE:
+        return data
+    if codec == ZSTD and zstandard is None:
+        raise ValueError("Este archivo usa zstd: instala el paquete 'zstandard' para abrirlo.")
+    try:
+        if codec == ZLIB:
+            return zlib.decompress(data, bufsize=max(max_size, 1))
+        if codec == LZMA:
+            return lzma.decompress(data)
+        if codec == ZSTD:
+            return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_size)
+    except Exception as e:
+        # zlib.error, lzma.LZMAError o zstandard.ZstdError
+        raise InvalidToken from e
+    raise InvalidToken
@@ -0,0 +1,496 @@
+import os
+import sys
+import json
+import time
+import getpass
+import argparse
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import InvalidToken
+import crypto_utils
+import manifest
+import scanner
+import pack_store
+import dedup_store
+import vault_writer
+import instrumentation
+from transfer_engine import ImportEngine, ExportEngine
+from transfers import TransferProgress
+from scrub import Scrubber
+from search_index import SearchIndex, MODES as SEARCH_MODES, DEFAULT_LIMIT as SEARCH_LIMIT
+
+# Línea de comandos del baúl, sin interfaz gráfica.
+#
+# Todo lo que hace la app (desbloquear, ver el árbol, cifrar y descifrar)
+# estaba dentro de las ventanas de Tk, así que no se podía automatizar (por
+# ejemplo, un respaldo nocturno en una PC sin pantalla). Aquí están los mismos
+# pasos con los mismos motores de transferencia en paralelo
+# (transfer_engine.py):
+#
+#   python cli.py unlock E:/Baul
+#   python cli.py list E:/Baul [carpeta] [-r]
+#   python cli.py search E:/Baul vacaciones [--mode fuzzy]
+#   python cli.py import E:/Baul C:/Fotos C:/notas.txt --to Respaldos/2024
+#   python cli.py export E:/Baul Respaldos/2024 --to C:/Restaurado
+#   python cli.py verify E:/Baul [carpeta o archivo ...]
+#   python cli.py scrub E:/Baul [carpeta ...] [--incremental]
+#   python cli.py stats E:/Baul
+#
+# Las rutas dentro del baúl se escriben con los nombres reales ('/' como
+# separador), relativas a la carpeta 'Baul'.
+#
+# La salida estándar es solo JSON, un evento por línea ("unlocked", "start",
+# "progress", "error", "done", ...), para que otro programa la lea y mida los
+# tiempos; los mensajes para personas van a la salida de errores. La
+# contraseña se pide por la terminal, o se lee de la variable PASSWORD_ENV o
+# de la entrada estándar (--password-stdin) para correr sin nadie enfrente.
+
+PASSWORD_ENV = "BAUL_PASSWORD"
+
+# Códigos de salida
+EXIT_OK = 0
+EXIT_FAILED = 1         # Algún archivo falló (el resto se procesó)
+EXIT_USAGE = 2          # Argumentos inválidos (el mismo de argparse)
+EXIT_PASSWORD = 3       # Contraseña incorrecta o 'vault.key' dañado
+EXIT_NOT_FOUND = 4      # No existe el baúl o una ruta pedida
+EXIT_CANCELLED = 130    # Ctrl+C
+
+
+class CliError(Exception):
+    """Error que termina el comando con el código de salida 'code'."""
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class JsonLines:
+    """Escribe un evento JSON por línea; se puede usar desde varios hilos."""
+    def __init__(self, out):
+        self.out = out
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, **fields):
+        line = json.dumps(dict(event=event, **fields))
+        with self._lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+
+# --- Desbloqueo ---
+def read_password(args) -> str:
+    if args.password_stdin:
+        return sys.stdin.readline().rstrip("\r\n")
+    password = os.environ.get(PASSWORD_ENV)
+    if password is not None:
+        return password
+    # getpass escribe el aviso en la terminal, no en la salida estándar
+    return getpass.getpass("Contraseña: ")
+
+
+def unlock(args, out: JsonLines):
+    """
+    Desbloquea el baúl y carga sus manifiestos.
+
+    Retorna:
+        tuple: (SessionKey, ManifestStore)
+
+    Lanza:
+        CliError: Si no existe el 'vault.key' o la contraseña es incorrecta.
+    """
+    key_path = os.path.join(args.baul_path, ".credentials", "vault.key")
+    try:
+        with open(key_path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        raise CliError(EXIT_NOT_FOUND, f"No se encontró el archivo 'vault.key' en {args.baul_path}")
+
+    password = read_password(args)
+    started = time.perf_counter()
+    try:
+        session_key = crypto_utils.unlock_vault_key(password, content)
+    except ValueError as e:
+        raise CliError(EXIT_PASSWORD, str(e))
+    kdf_name, params = crypto_utils.unpack_vault_key(content)[:2]
+    out.emit("unlocked", kdf=kdf_name, kdf_params=params, seconds=round(time.perf_counter() - started, 3),
+             rotation_pending=len(session_key.keys) > 1)
+
+    manifests = manifest.ManifestStore(args.baul_path, session_key)
+    manifests.preload()
+    return session_key, manifests
+
+
+# --- Rutas dentro del baúl ---
+def _is_hidden(name: str) -> bool:
+    return name == ".credentials" or manifest.is_internal_dir(name)
+
+
+def _split(vault_relative: str) -> list:
+    parts = [part for part in vault_relative.replace("\\", "/").split("/") if part not in ("", ".")]
+    if any(part == ".." or _is_hidden(part) for part in parts):
+        raise CliError(EXIT_USAGE, f"Ruta inválida dentro del baúl: {vault_relative}")
+    return parts
+
+
+def _find_file(manifests, folder: str, name: str):
+    """Id en disco del archivo llamado 'name' en 'folder' (también con nombre antiguo), o None."""
+    file_id = manifests.find_by_name(folder, name)
+    if file_id is not None:
+        return file_id
+    for entry in scanner.scan_dir(folder, with_stat=False):
+        if entry.is_dir or not entry.name.endswith(".enc") or manifests.lookup(folder, entry.name):
+            continue
+        try:
+            if manifest.resolve_name(manifests, folder, entry.name) == name:
+                return entry.name
+        except InvalidToken:
+            pass
+    return None
+
+
+def resolve(manifests, vault_relative: str) -> str:
+    """
+    Ruta real en disco de 'vault_relative' (carpeta o archivo, con los
+    nombres reales). Los archivos empaquetados no existen en disco: se
+    retorna la ruta con su id, como la que usa el árbol.
+
+    Lanza:
+        CliError: Si la ruta no existe en el baúl.
+    """
+    folder = manifests.baul_path
+    parts = _split(vault_relative)
+    for index, part in enumerate(parts):
+        candidate = os.path.join(folder, part)
+        if os.path.isdir(candidate):
+            folder = candidate
+            continue
+        if index == len(parts) - 1 and os.path.isdir(folder):
+            file_id = _find_file(manifests, folder, part)
+            if file_id is not None:
+                return os.path.join(folder, file_id)
+        break
+    else:
+        return folder
+    raise CliError(EXIT_NOT_FOUND, f"No existe en el baúl: {vault_relative}")
+
+
+def _relative(manifests, path: str) -> str:
+    relative = os.path.relpath(path, manifests.baul_path)
+    return "" if relative == "." else relative.replace(os.sep, "/")
+
+
+def list_folder(manifests, folder: str, recursive: bool, out: JsonLines):
+    """Un evento "entry" por cada carpeta y archivo de 'folder'."""
+    try:
+        entries = scanner.scan_dir(folder)
+    except OSError as e:
+        out.emit("error", path=_relative(manifests, folder), error=str(e))
+        return
+    manifests.revalidate(folder)
+    prefix = _relative(manifests, folder)
+    prefix = prefix + "/" if prefix else ""
+
+    subfolders = []
+    for entry in entries:
+        if entry.is_dir:
+            if not _is_hidden(entry.name):
+                out.emit("entry", path=prefix + entry.name, type="dir")
+                subfolders.append(entry.path)
+        elif entry.name.endswith(".enc"):
+            info = manifests.lookup(folder, entry.name)
+            if info is None:
+                try:
+                    info = {"name": manifest.resolve_name(manifests, folder, entry.name)}
+                except InvalidToken:
+                    out.emit("error", path=prefix + entry.name, error="No se pudo descifrar el nombre del archivo")
+                    continue
+            out.emit("entry", path=prefix + info["name"], type="file", size=info.get("size", entry.size),
+                     mtime=info.get("mtime"), stored_bytes=entry.size, storage="file")
+    for file_id, info in manifests.entries(folder).items():
+        if pack_store.is_packed(info):
+            out.emit("entry", path=prefix + info["name"], type="file", size=info["size"],
+                     mtime=info.get("mtime"), stored_bytes=info["size"], storage="pack")
+
+    if recursive:
+        for path in subfolders:
+            list_folder(manifests, path, recursive, out)
+
+
+# --- Transferencias ---
+def run_transfer(out: JsonLines, command: str, engine, sources, destination, interval: float,
+                 each_file: bool = False) -> int:
+    """
+    Corre 'engine' en un hilo aparte y escribe su avance cada 'interval'
+    segundos. Ctrl+C cancela la transferencia (se borra lo que quedó a medias).
+
+    Retorna:
+        int: El código de salida.
+    """
+    files_total, bytes_total = engine.measure(sources)
+    out.emit("start", command=command, files=files_total, bytes=bytes_total)
+
+    progress = TransferProgress(command, files_total=files_total, bytes_total=bytes_total)
+    lock = threading.Lock()
+
+    def on_progress(nbytes):
+        with lock:
+            progress.bytes_done += nbytes
+
+    def on_file_done(result):
+        with lock:
+            progress.files_done += 1
+        if not result.ok:
+            fields = {"name": result.name} if result.name else {}
+            out.emit("error", source=result.source, error=result.error, **fields)
+        elif each_file:
+            out.emit("file", source=result.source, destination=result.destination, size=result.size,
+                     written=result.written, skipped=result.skipped, seconds=round(result.seconds, 3))
+
+    outcome = {}
+    finished = threading.Event()
+
+    def work():
+        try:
+            outcome["report"] = engine.run(sources, destination, on_file_done, on_progress)
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            finished.set()
+
+    # Se espera al evento y no con join(): un Ctrl+C en medio de join() puede
+    # dejar el hilo como terminado cuando todavía no lo está
+    worker = threading.Thread(target=work, daemon=True)
+    started = time.perf_counter()
+    worker.start()
+    while not finished.is_set():
+        try:
+            if finished.wait(interval):
+                break
+        except KeyboardInterrupt:
+            engine.cancel()
+            out.emit("cancelling")
+            continue
+        with lock:
+            progress.elapsed = time.perf_counter() - started
+            eta = progress.eta_seconds
+            out.emit("progress", files_done=progress.files_done, files_total=files_total,
+                     bytes_done=progress.bytes_done, bytes_total=bytes_total,
+                     mb_per_s=round(progress.mb_per_second, 2),
+                     eta_seconds=None if eta is None else round(eta, 1))
+
+    if "error" in outcome:
+        out.emit("done", command=command, error=str(outcome["error"]))
+        return EXIT_FAILED
+    report = outcome["report"]
+    out.emit("done", command=command, files_ok=report.files_ok, files_failed=len(report.failed),
+             files_skipped=report.files_skipped, bytes_read=report.bytes_read,
+             bytes_written=report.bytes_written, bytes_skipped=report.bytes_skipped,
+             seconds=round(report.elapsed, 3), mb_per_s=round(report.mb_per_second, 2),
+             files_per_s=round(report.files_per_second, 2), cancelled=report.cancelled,
+             **getattr(report, "extra", {}))
+    if report.cancelled:
+        return EXIT_CANCELLED
+    return EXIT_FAILED if report.failed else EXIT_OK
+
+
+# --- Comandos ---
+def cmd_unlock(args, out: JsonLines) -> int:
+    unlock(args, out)
+    return EXIT_OK
+
+
+def cmd_list(args, out: JsonLines) -> int:
+    _, manifests = unlock(args, out)
+    path = resolve(manifests, args.path)
+    if not os.path.isdir(path):
+        raise CliError(EXIT_USAGE, f"No es una carpeta: {args.path}")
+    list_folder(manifests, path, args.recursive, out)
+    return EXIT_OK
+
+
+def cmd_search(args, out: JsonLines) -> int:
+    _, manifests = unlock(args, out)
+    index = SearchIndex(manifests)
+    started = time.perf_counter()
+    index.build()
+    out.emit("indexed", entries=index.size, seconds=round(time.perf_counter() - started, 3))
+    started = time.perf_counter()
+    hits = index.search(args.query, args.mode, args.limit)
+    seconds = time.perf_counter() - started
+    for hit in hits:
+        out.emit("match", path=hit.path, type="dir" if hit.is_dir else "file")
+    out.emit("done", command="search", matches=len(hits), ms=round(seconds * 1000, 3))
+    index.close()
+    return EXIT_OK
+
+
+def cmd_import(args, out: JsonLines) -> int:
+    session_key, manifests = unlock(args, out)
+    missing = [source for source in args.sources if not os.path.exists(source)]
+    if missing:
+        raise CliError(EXIT_NOT_FOUND, f"No existe: {missing[0]}")
+    # Las carpetas del baúl no van cifradas: la de destino se crea si falta
+    destination = os.path.join(manifests.baul_path, *_split(args.to))
+    os.makedirs(destination, exist_ok=True)
+    try:
+        engine = ImportEngine(session_key, manifests, workers=args.workers, use_processes=args.processes,
+                              compression=None if args.compression == "none" else args.compression,
+                              dedup=args.dedup, incremental=not args.full, fsync=args.fsync)
+    except (OSError, InvalidToken) as e:
+        raise CliError(EXIT_FAILED, f"No se pudo abrir el almacén de trozos: {e}")
+    return run_transfer(out, "import", engine, args.sources, destination, args.interval, args.each_file)
+
+
+def cmd_export(args, out: JsonLines) -> int:
+    session_key, manifests = unlock(args, out)
+    sources = [resolve(manifests, path) for path in args.paths]
+    os.makedirs(args.to, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=args.workers or os.cpu_count()) as pool:
+        engine = ExportEngine(session_key, manifests, pool=pool)
+        return run_transfer(out, "export", engine, sources, args.to, args.interval, args.each_file)
+
+
+def cmd_verify(args, out: JsonLines) -> int:
+    session_key, manifests = unlock(args, out)
+    sources = [resolve(manifests, path) for path in args.paths or [""]]
+    with ThreadPoolExecutor(max_workers=args.workers or os.cpu_count()) as pool:
+        engine = ExportEngine(session_key, manifests, pool=pool)
+        return run_transfer(out, "verify", engine, sources, None, args.interval, args.each_file)
+
+
+def cmd_scrub(args, out: JsonLines) -> int:
+    session_key, manifests = unlock(args, out)
+    sources = [resolve(manifests, path) for path in args.paths]
+    if any(not os.path.isdir(path) for path in sources):
+        raise CliError(EXIT_USAGE, "Solo se pueden revisar carpetas")
+    scrubber = Scrubber(session_key, manifests, workers=args.workers, incremental=args.incremental)
+    return run_transfer(out, "scrub", scrubber, sources, None, args.interval, args.each_file)
+
+
+def cmd_stats(args, out: JsonLines) -> int:
+    _, manifests = unlock(args, out)
+    started = time.perf_counter()
+    stats = dict(folders=0, files=0, packed_files=0, plain_bytes=0, encrypted_bytes=0,
+                 packs=0, pack_bytes=0, chunks=0, chunk_bytes=0, temp_files=0)
+    for folder, entries in scanner.walk(manifests.baul_path):
+        top = _relative(manifests, folder).split("/")[0]
+        if top == ".credentials":
+            continue
+        if top and not manifest.is_internal_dir(top):
+            stats["folders"] += 1
+        for entry in entries:
+            if entry.is_dir:
+                continue
+            if entry.name.endswith(vault_writer.TEMP_SUFFIX):
+                # Restos de una escritura interrumpida (ver vault_writer.py)
+                stats["temp_files"] += 1
+            elif top == dedup_store.STORE_DIR and entry.name.endswith(dedup_store.CHUNK_EXT):
+                stats["chunks"] += 1
+                stats["chunk_bytes"] += entry.size
+            elif top == pack_store.PACK_DIR and entry.name.endswith(pack_store.PACK_EXT):
+                stats["packs"] += 1
+                stats["pack_bytes"] += entry.size
+            elif not manifest.is_internal_dir(top) and entry.name.endswith(".enc"):
+                info = manifests.lookup(folder, entry.name) or {}
+                stats["files"] += 1
+                stats["plain_bytes"] += info.get("size", entry.size)
+                stats["encrypted_bytes"] += entry.size
+        if not manifest.is_internal_dir(top):
+            for info in manifests.entries(folder).values():
+                if pack_store.is_packed(info):
+                    stats["files"] += 1
+                    stats["packed_files"] += 1
+                    stats["plain_bytes"] += info["size"]
+    out.emit("stats", seconds=round(time.perf_counter() - started, 3), **stats)
+    return EXIT_OK
+
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("baul_path", help="Carpeta 'Baul' de la USB")
+    common.add_argument("--password-stdin", action="store_true",
+                        help=f"Leer la contraseña de la primera línea de la entrada estándar "
+                             f"(si no, de ${PASSWORD_ENV} o de la terminal)")
+    common.add_argument("--trace", metavar="JSON",
+                        help="Medir los tramos internos y guardar una traza Chrome/Perfetto (ver instrumentation.py)")
+
+    transfer = argparse.ArgumentParser(add_help=False)
+    transfer.add_argument("--workers", type=int, default=None, help="Hilos de trabajo (por defecto, uno por núcleo)")
+    transfer.add_argument("--interval", type=float, default=1.0, help="Segundos entre eventos de avance")
+    transfer.add_argument("--each-file", action="store_true", help="Un evento por cada archivo terminado")
+
+    parser = argparse.ArgumentParser(description="Baúl Seguro sin interfaz gráfica (salida en JSON, una línea por evento)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("unlock", parents=[common], help="Comprobar la contraseña")
+    p.set_defaults(handler=cmd_unlock)
+
+    p = commands.add_parser("list", parents=[common], help="Listar una carpeta del baúl")
+    p.add_argument("path", nargs="?", default="", help="Carpeta dentro del baúl (por defecto la raíz)")
+    p.add_argument("-r", "--recursive", action="store_true", help="Incluir las subcarpetas")
+    p.set_defaults(handler=cmd_list)
+
+    p = commands.add_parser("search", parents=[common], help="Buscar archivos y carpetas por nombre")
+    p.add_argument("query", help="Texto a buscar (con '/' se busca en la ruta completa)")
+    p.add_argument("--mode", choices=SEARCH_MODES, default="auto", help="Tipo de búsqueda (ver search_index.py)")
+    p.add_argument("--limit", type=int, default=SEARCH_LIMIT, help="Máximo de resultados")
+    p.set_defaults(handler=cmd_search)
+
+    p = commands.add_parser("import", parents=[common, transfer], help="Cifrar archivos y carpetas de la PC")
+    p.add_argument("sources", nargs="+", help="Archivos o carpetas de la PC")
+    p.add_argument("--to", default="", help="Carpeta destino dentro del baúl (se crea si falta)")
+    p.add_argument("--compression", default="auto", help="Códec ('zlib', 'lzma', 'zstd', 'auto' o 'none')")
+    p.add_argument("--dedup", action="store_true", help="Guardar como trozos deduplicados")
+    p.add_argument("--full", action="store_true", help="Volver a copiar también los archivos sin cambios")
+    p.add_argument("--processes", action="store_true", help="Cifrar en un pool de procesos en vez de hilos")
+    p.add_argument("--fsync", choices=vault_writer.POLICIES, default=vault_writer.FSYNC_BATCH,
+                   help="Cuándo forzar a disco lo escrito")
+    p.set_defaults(handler=cmd_import)
+
+    p = commands.add_parser("export", parents=[common, transfer], help="Descifrar a una carpeta de la PC")
+    p.add_argument("paths", nargs="+", help="Carpetas o archivos dentro del baúl")
+    p.add_argument("--to", required=True, help="Carpeta destino en la PC")
+    p.set_defaults(handler=cmd_export)
+
+    p = commands.add_parser("verify", parents=[common, transfer],
+                            help="Descifrar sin escribir nada para comprobar que todo se puede leer")
+    p.add_argument("paths", nargs="*", help="Carpetas o archivos dentro del baúl (por defecto todo)")
+    p.set_defaults(handler=cmd_verify)
+
+    p = commands.add_parser("scrub", parents=[common, transfer],
+                            help="Revisar en paralelo la integridad de todo el baúl (ver scrub.py)")
+    p.add_argument("paths", nargs="*", help="Carpetas dentro del baúl (por defecto todo)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Revisar solo lo que cambió desde la última revisión sin errores")
+    p.set_defaults(handler=cmd_scrub)
+
+    p = commands.add_parser("stats", parents=[common], help="Tamaños y cantidades del baúl")
+    p.set_defaults(handler=cmd_stats)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    out = JsonLines(sys.stdout)
+    if args.trace:
+        instrumentation.start(args.trace)
+    # Lo que el resto del código imprime (errores de lectura, manifiestos
+    # corruptos) va a la salida de errores para no mezclarse con el JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            if not os.path.isdir(args.baul_path):
+                raise CliError(EXIT_NOT_FOUND, f"No se encontró la carpeta del baúl: {args.baul_path}")
+            return args.handler(args, out)
+        except CliError as e:
+            out.emit("fatal", error=str(e), exit_code=e.code)
+            print(e)
+            return e.code
+        except KeyboardInterrupt:
+            out.emit("fatal", error="Cancelado", exit_code=EXIT_CANCELLED)
+            return EXIT_CANCELLED
+        finally:
+            instrumentation.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
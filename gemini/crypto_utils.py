@@ -1,74 +1,173 @@
 import os
+import json
 import base64
-from cryptography.fernet import Fernet, InvalidToken # <-- CORRECCIÓN AQUÍ
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.backends import default_backend
+import struct
+import hashlib
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken # <-- CORRECCIÓN AQUÍ
+import kdf
+import instrumentation
 
 # Este es el "cerebro" de la criptografía, siguiendo la lógica de respuesta.txt
+#
+# Formato del 'vault.key':
+#   - Antiguo: salt (16 bytes) + llave_fernet cifrada (token Fernet), siempre
+#     con PBKDF2-SHA256 de 480.000 iteraciones.
+#   - Actual: VAULT_KEY_MAGIC + largo de la cabecera (2 bytes) + cabecera JSON
+#     {"kdf": ..., "params": {...}, "salt": ...} + llave_fernet cifrada.
+#     Así cada baúl sabe con qué función y parámetros se derivó su llave.
+#
+# Lo que va cifrado dentro es la llave maestra (una llave Fernet). Durante una
+# rotación de la llave maestra (ver rekey.py) hay varias, una por línea, y la
+# primera es la actual; con una sola el contenido es igual al de siempre.
+#
+# La contraseña solo protege el 'vault.key': cambiarla es volver a cifrar
+# estas pocas líneas, sin tocar los archivos del baúl.
 
-def derive_key(password: str, salt: bytes) -> bytes:
+VAULT_KEY_MAGIC = b"BAULKEY\x02"
+
+def key_id(master_key: bytes) -> bytes:
+    """Identificador público (8 bytes) de una llave maestra."""
+    return hashlib.sha256(b"baul-key-id" + master_key).digest()[:8]
+
+class SessionKey(MultiFernet):
+    """
+    La llave de sesión del baúl ('llave_fernet' ya descifrada).
+    Se comporta como un Fernet normal (nombres, manifiestos y archivos
+    antiguos), pero además conserva los bytes crudos de la llave para
+    envolver las llaves de cada archivo (ver vault_format.py).
+
+    Si se pasan llaves anteriores ('old_keys'), se cifra siempre con la
+    primera y se puede descifrar con cualquiera.
+    """
+    def __init__(self, key: bytes, *old_keys: bytes):
+        self.keys = [key, *old_keys]
+        super().__init__([Fernet(k) for k in self.keys])
+        self.master_key = base64.urlsafe_b64decode(key)
+        self.key_id = key_id(self.master_key)
+        # Los archivos de la versión 1 no guardan id: son de la llave más antigua
+        self.oldest_master_key = base64.urlsafe_b64decode(self.keys[-1])
+        # id -> llave maestra cruda, para abrir archivos de cualquier generación
+        self.masters = {}
+        for k in self.keys:
+            raw = base64.urlsafe_b64decode(k)
+            self.masters[key_id(raw)] = raw
+
+def derive_key(password: str, salt: bytes, kdf_name: str = kdf.PBKDF2, params: dict = None) -> bytes:
     """
     Deriva una llave de 32 bytes (para Fernet) a partir de una contraseña y un salt.
+    Sin 'params' se usan los del formato antiguo (PBKDF2 con 480.000 iteraciones).
     """
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=480000, # Iteraciones altas para mayor seguridad
-        backend=default_backend()
-    )
     # Codificamos la contraseña a bytes antes de derivar
-    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+    with instrumentation.span("kdf"):
+        raw = kdf.derive(kdf_name, params or kdf.LEGACY_PARAMS, password.encode(), salt)
+    return base64.urlsafe_b64encode(raw)
 
-def generate_vault_key(password: str) -> bytes:
+def pack_vault_key(kdf_name: str, params: dict, salt: bytes, token: bytes) -> bytes:
+    header = json.dumps({"kdf": kdf_name, "params": params, "salt": salt.hex()}).encode()
+    return VAULT_KEY_MAGIC + struct.pack(">H", len(header)) + header + token
+
+def unpack_vault_key(vault_key_content: bytes) -> tuple:
+    """
+    Separa un 'vault.key' (de cualquier formato) en sus partes.
+
+    Retorna:
+        tuple: (kdf, parámetros, salt, llave_fernet cifrada)
+    """
+    if vault_key_content.startswith(VAULT_KEY_MAGIC):
+        start = len(VAULT_KEY_MAGIC) + 2
+        (header_len,) = struct.unpack(">H", vault_key_content[len(VAULT_KEY_MAGIC):start])
+        header = json.loads(vault_key_content[start:start + header_len])
+        return header["kdf"], header["params"], bytes.fromhex(header["salt"]), vault_key_content[start + header_len:]
+    # Formato antiguo: salt + token
+    return kdf.PBKDF2, kdf.LEGACY_PARAMS, vault_key_content[:16], vault_key_content[16:]
+
+def generate_vault_key(password: str, kdf_name: str = None, params: dict = None) -> bytes:
     """
     Genera una nueva 'llave_fernet' y la cifra con una llave derivada de la contraseña.
+    Sin 'params', se calibran en esta PC (ver kdf.calibrate).
     
     Retorna:
-        bytes: El contenido completo del archivo 'vault.key' (salt + llave_cifrada).
+        bytes: El contenido completo del archivo 'vault.key' (cabecera + llave_cifrada).
+    """
+    return create_vault_key(password, kdf_name, params)[0]
+
+def create_vault_key(password: str, kdf_name: str = None, params: dict = None) -> tuple:
+    """
+    Igual que generate_vault_key, pero además retorna la llave de sesión ya
+    desbloqueada, para abrir el baúl recién creado sin volver a derivar la
+    llave de la contraseña.
+
+    Retorna:
+        tuple: (contenido de 'vault.key', SessionKey)
     """
     # 1. Generar la llave real (Fernet)
     llave_fernet = Fernet.generate_key()
 
-    # 2. Generar un salt nuevo
+    # 2. Cifrarla con la contraseña
+    return wrap_vault_keys(password, [llave_fernet], kdf_name, params), SessionKey(llave_fernet)
+
+def wrap_vault_keys(password: str, keys: list, kdf_name: str = None, params: dict = None) -> bytes:
+    """
+    Cifra las llaves maestras 'keys' (la actual primero) con una llave
+    derivada de la contraseña.
+
+    Retorna:
+        bytes: El contenido completo del archivo 'vault.key' (cabecera + llaves cifradas).
+    """
+    # 1. Generar un salt nuevo y elegir la función de derivación
     salt = os.urandom(16)
+    if params is None:
+        kdf_name, params = kdf.calibrate(kdf_name)
 
-    # 3. Derivar la "llave de encapsulación" desde la contraseña
-    llave_para_cifrar = derive_key(password, salt)
+    # 2. Derivar la "llave de encapsulación" desde la contraseña
+    llave_para_cifrar = derive_key(password, salt, kdf_name, params)
 
-    # 4. Cifrar la 'llave_fernet'
+    # 3. Cifrar las llaves, una por línea
     f = Fernet(llave_para_cifrar)
-    llave_fernet_cifrada = f.encrypt(llave_fernet)
+    llave_fernet_cifrada = f.encrypt(b"\n".join(keys))
 
-    # 5. Retornar el contenido combinado (salt + llave_cifrada)
-    # Guardamos el salt al inicio para saber cómo descifrarlo después
-    return salt + llave_fernet_cifrada
+    # 4. Retornar el contenido combinado (cabecera + llave_cifrada)
+    # La cabecera guarda el salt y la función para saber cómo descifrarlo después
+    return pack_vault_key(kdf_name, params, salt, llave_fernet_cifrada)
+
+def change_password(vault_key_content: bytes, old_password: str, new_password: str) -> bytes:
+    """
+    Cambia la contraseña de un 'vault.key'. Los archivos del baúl no cambian:
+    solo se vuelven a cifrar las llaves maestras con la nueva contraseña.
+
+    Retorna:
+        bytes: El nuevo contenido del 'vault.key'.
+
+    Lanza:
+        ValueError: Si la contraseña actual es incorrecta.
+    """
+    session_key = unlock_vault_key(old_password, vault_key_content)
+    return wrap_vault_keys(new_password, session_key.keys)
 
-def unlock_vault_key(password: str, vault_key_content: bytes) -> Fernet:
+def unlock_vault_key(password: str, vault_key_content: bytes) -> SessionKey:
     """
     Intenta desbloquear el contenido de 'vault.key' usando la contraseña.
     
     Retorna:
-        Fernet: Un objeto Fernet inicializado con la 'llave_fernet' descifrada.
+        SessionKey: Un objeto Fernet inicializado con la 'llave_fernet' descifrada.
     
     Lanza:
         ValueError: Si la contraseña es incorrecta (InvalidToken).
     """
     try:
-        # 1. Extraer el salt y la llave cifrada
-        salt = vault_key_content[:16]
-        llave_fernet_cifrada = vault_key_content[16:]
+        # 1. Extraer la función de derivación, el salt y la llave cifrada
+        kdf_name, params, salt, llave_fernet_cifrada = unpack_vault_key(vault_key_content)
 
         # 2. Derivar la llave de descifrado
-        llave_para_descifrar = derive_key(password, salt)
+        llave_para_descifrar = derive_key(password, salt, kdf_name, params)
 
         # 3. Intentar descifrar
         f = Fernet(llave_para_descifrar)
         llave_fernet = f.decrypt(llave_fernet_cifrada)
 
-        # 4. ¡Éxito! Retornar un nuevo objeto Fernet con la llave real
-        return Fernet(llave_fernet)
+        # 4. ¡Éxito! Retornar la llave de sesión con la llave real (y las
+        # anteriores, si quedó una rotación a medias)
+        return SessionKey(*llave_fernet.split(b"\n"))
 
     except InvalidToken:
         # Esto ocurre si la contraseña es incorrecta y el descifrado falla
@@ -0,0 +1,481 @@
+import os
+import re
+import sys
+import json
+import hmac
+import base64
+import bisect
+import struct
+import hashlib
+import getpass
+import argparse
+import threading
+from cryptography.fernet import InvalidToken
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+import vault_format
+import chunk_codecs
+import scanner
+
+# Almacén de trozos deduplicados dentro del baúl (modo opcional).
+#
+# Al guardar muchas versiones casi iguales de un archivo grande (imágenes de
+# máquinas virtuales, datasets, compilaciones) cada copia se cifraba y
+# escribía completa. En este modo los archivos se parten en trozos según su
+# contenido (content-defined chunking): si se inserta o borra algo en medio,
+# solo cambian los trozos de alrededor.
+#
+# - Cada trozo se identifica con un HMAC de su contenido y se guarda una sola
+#   vez, cifrado, en Baul/STORE_DIR/ab/abcd....chunk.
+# - El archivo del baúl (el .enc de siempre, con su nombre en el manifiesto)
+#   pasa a ser una lista cifrada de (id, largo) con FLAG_RECIPE en la
+#   cabecera. Al exportar se arma de nuevo con RecipeReader.
+# - 'refs' cuenta cuántas veces se usa cada trozo. Cuando un archivo
+#   deduplicado se reemplaza o se quita del manifiesto, ManifestStore.flush()
+#   le resta sus referencias (release) y se borran los trozos que quedan sin
+#   uso. Como un .enc también se puede borrar desde fuera de la app, la
+#   fuente de verdad es gc(): recorre todas las listas del baúl, recuenta y
+#   borra los trozos que ya nadie usa.
+#
+# Las llaves del almacén son aleatorias y van en STORE_KEY cifradas con la
+# llave maestra (rekey.py las rota junto con los manifiestos). Los cortes
+# también dependen de esas llaves, así que no revelan el contenido.
+
+STORE_DIR = ".baul.chunks"
+STORE_KEY = "store.key"
+REFS_NAME = "refs"
+CHUNK_EXT = ".chunk"
+
+MIN_CHUNK = 128 * 1024
+AVG_CHUNK = 512 * 1024       # Promedio con datos aleatorios
+MAX_CHUNK = 2 * 1024 * 1024
+WINDOW = 48                  # Bytes que deciden si hay un corte
+READ_SIZE = 4 * 1024 * 1024
+
+_ENTRY = struct.Struct(">16sI")  # id del trozo, largo
+
+
+class Chunker:
+    """
+    Decide dónde cortar un archivo en trozos.
+
+    Un "gear hash" byte por byte (FastCDC) en Python puro no pasa de unos
+    pocos MB/s, así que el corte se hace en dos pasos:
+
+    1. Una expresión regular (en C) busca los pares de bytes "ancla": el
+       primero de un grupo de 16 valores y el segundo de otro, elegidos con
+       la llave. La mitad de cada grupo son caracteres imprimibles, para que
+       también haya cortes en archivos de texto.
+    2. En cada ancla se calcula un BLAKE2 con llave de los WINDOW bytes que
+       terminan ahí; si cae bajo el umbral, ahí se corta.
+
+    Como la decisión solo depende de esos WINDOW bytes, insertar o borrar
+    datos mueve los cortes junto con el contenido.
+    """
+    def __init__(self, seed: bytes):
+        groups = [_keyed_byte_group(seed + bytes((index,))) for index in range(2)]
+        self._anchors = re.compile(b"".join(
+            b"[" + b"".join(re.escape(bytes((value,))) for value in group) + b"]" for group in groups))
+        self._key = hashlib.sha256(seed + b"cortes").digest()
+        # Con datos aleatorios hay un ancla cada 256 bytes
+        odds = (AVG_CHUNK - MIN_CHUNK) * len(groups[0]) * len(groups[1]) // (256 * 256)
+        self._threshold = (1 << 64) // odds
+
+    def find_cut(self, data) -> int:
+        """
+        Largo del primer trozo de 'data': el primer corte después de
+        MIN_CHUNK, o MAX_CHUNK como máximo.
+        """
+        n = len(data)
+        if n <= MIN_CHUNK:
+            return n
+        end = min(n, MAX_CHUNK)
+        for match in self._anchors.finditer(data, MIN_CHUNK, end):
+            position = match.end()
+            digest = hashlib.blake2b(data[position - WINDOW:position], digest_size=8, key=self._key).digest()
+            if int.from_bytes(digest, "big") < self._threshold:
+                return position
+        return end
+
+
+def _keyed_byte_group(seed: bytes) -> list:
+    """16 valores de byte distintos: 8 imprimibles y 8 de cualquier tipo."""
+    group = []
+    counter = 0
+    while len(group) < 16:
+        for value in hashlib.sha256(seed + counter.to_bytes(4, "big")).digest():
+            if len(group) < 8:
+                value = 0x20 + value % 95
+            if value not in group and len(group) < 16:
+                group.append(value)
+        counter += 1
+    return group
+
+
+def parse_recipe(recipe: bytes) -> list:
+    """
+    Retorna:
+        list: [(id del trozo, largo), ...]
+
+    Lanza:
+        InvalidToken: Si la lista está dañada.
+    """
+    if len(recipe) % _ENTRY.size:
+        raise InvalidToken
+    return list(_ENTRY.iter_unpack(recipe))
+
+
+class ChunkStore:
+    """
+    Los trozos cifrados de un baúl. Se puede usar desde varios hilos.
+
+    Parámetros:
+        baul_path: La carpeta 'Baul'.
+        session_key: La llave de sesión descifrada.
+        codec: Códec para comprimir cada trozo antes de cifrarlo (ver chunk_codecs.py).
+        create: Si es False y el almacén no existe se lanza FileNotFoundError.
+    """
+    def __init__(self, baul_path, session_key, codec: int = chunk_codecs.NONE, create: bool = True):
+        self.path = os.path.join(str(baul_path), STORE_DIR)
+        self.session_key = session_key
+        self.codec = codec
+        self._lock = threading.Lock()
+        self._refs = None    # id hex -> veces que se usa (se carga al necesitarlo)
+        # False si el contador se perdió o se dañó: hasta el próximo gc()
+        # puede quedarse corto, así que release() no borra trozos
+        self._refs_exact = True
+        self._load_keys(create)
+
+    def _load_keys(self, create: bool):
+        key_path = os.path.join(self.path, STORE_KEY)
+        try:
+            with open(key_path, 'rb') as f:
+                token = f.read()
+        except FileNotFoundError:
+            if not create:
+                raise
+            keys = {name: base64.b64encode(os.urandom(32)).decode() for name in ("data_key", "id_key", "chunk_seed")}
+            token = self.session_key.encrypt(json.dumps(keys).encode())
+            os.makedirs(self.path, exist_ok=True)
+            _write_atomic(key_path, token)
+
+        keys = json.loads(self.session_key.decrypt(token))
+        self._aead = AESGCM(base64.b64decode(keys["data_key"]))
+        self._id_key = base64.b64decode(keys["id_key"])
+        self.chunker = Chunker(base64.b64decode(keys["chunk_seed"]))
+
+    # --- Trozos ---
+    def chunk_id(self, data) -> bytes:
+        return hmac.new(self._id_key, data, hashlib.sha256).digest()[:16]
+
+    def chunk_path(self, chunk_id: bytes) -> str:
+        name = chunk_id.hex()
+        return os.path.join(self.path, name[:2], name + CHUNK_EXT)
+
+    def put(self, data: bytes, codec: int = None):
+        """
+        Guarda un trozo (si no estaba) y le suma una referencia. 'codec'
+        reemplaza al del almacén para este trozo.
+
+        Retorna:
+            tuple: (id, bytes escritos en disco; 0 si ya existía)
+        """
+        chunk_id = self.chunk_id(data)
+        path = self.chunk_path(chunk_id)
+        with self._lock:
+            refs = self.refs
+            known = chunk_id.hex() in refs
+            refs[chunk_id.hex()] = refs.get(chunk_id.hex(), 0) + 1
+        if known and os.path.exists(path):
+            return chunk_id, 0
+
+        codec, payload = chunk_codecs.compress(data, self.codec if codec is None else codec)
+        nonce = os.urandom(12)
+        sealed = nonce + self._aead.encrypt(nonce, bytes((codec,)) + payload, chunk_id)
+        # Dos hilos pueden escribir el mismo trozo a la vez: cada uno usa su
+        # propio temporal y el contenido final es idéntico
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(sealed)
+        os.replace(tmp_path, path)
+        return chunk_id, len(sealed)
+
+    def get(self, chunk_id: bytes, size: int) -> bytes:
+        """
+        Lanza:
+            InvalidToken: Si el trozo fue alterado o no corresponde a su id.
+            FileNotFoundError: Si el trozo no está en el almacén.
+        """
+        with open(self.chunk_path(chunk_id), 'rb') as f:
+            sealed = f.read()
+        try:
+            payload = self._aead.decrypt(sealed[:12], sealed[12:], chunk_id)
+        except InvalidTag:
+            raise InvalidToken
+        data = chunk_codecs.decompress(payload[0], payload[1:], size)
+        if len(data) != size or not hmac.compare_digest(self.chunk_id(data), chunk_id):
+            raise InvalidToken
+        return data
+
+    def store_file(self, src, cancelled=None, codec: int = None):
+        """
+        Parte el archivo abierto 'src' en trozos y los guarda (ver put()).
+
+        Retorna:
+            tuple: (lista cifrable de trozos, bytes del archivo, bytes nuevos
+                    escritos), o None si 'cancelled()' se volvió True.
+        """
+        recipe = bytearray()
+        size = written = 0
+        buffer = bytearray()
+        eof = False
+        while True:
+            while not eof and len(buffer) < MAX_CHUNK:
+                more = src.read(READ_SIZE)
+                if more:
+                    buffer += more
+                else:
+                    eof = True
+            if not buffer:
+                break
+            if cancelled is not None and cancelled():
+                return None
+            cut = self.chunker.find_cut(buffer)
+            data = bytes(buffer[:cut])
+            del buffer[:cut]
+            chunk_id, new_bytes = self.put(data, codec)
+            recipe += _ENTRY.pack(chunk_id, len(data))
+            size += len(data)
+            written += new_bytes
+        return bytes(recipe), size, written
+
+    # --- Referencias ---
+    @property
+    def refs(self) -> dict:
+        if self._refs is None:
+            self._refs = self._load_refs()
+        return self._refs
+
+    def _load_refs(self) -> dict:
+        try:
+            with open(os.path.join(self.path, REFS_NAME), 'rb') as f:
+                sealed = f.read()
+            return json.loads(self._aead.decrypt(sealed[:12], sealed[12:], REFS_NAME.encode()))
+        except FileNotFoundError:
+            # Sin contador pero con trozos (una importación que no llegó a
+            # guardarlo): los conteos no son confiables hasta el gc()
+            self._refs_exact = not any(entry.is_dir for entry in scanner.scan_dir(self.path, with_stat=False))
+            return {}
+        except (InvalidTag, ValueError) as e:
+            # Se reconstruye en el siguiente gc()
+            print(f"Contador de referencias dañado: {e}")
+            self._refs_exact = False
+            return {}
+
+    def save(self):
+        """Guarda el contador de referencias (al terminar una importación)."""
+        with self._lock:
+            if self._refs is None:
+                return
+            nonce = os.urandom(12)
+            data = json.dumps(self._refs).encode()
+            _write_atomic(os.path.join(self.path, REFS_NAME),
+                          nonce + self._aead.encrypt(nonce, data, REFS_NAME.encode()))
+
+    def release(self, recipe: bytes):
+        """
+        Quita las referencias de una lista de trozos y borra los que quedan
+        sin usar. Si el contador no es confiable solo resta: los trozos los
+        borra el próximo gc().
+        """
+        with self._lock:
+            refs = self.refs
+            for chunk_id, _ in parse_recipe(recipe):
+                name = chunk_id.hex()
+                if name not in refs:
+                    continue
+                refs[name] -= 1
+                if refs[name] <= 0:
+                    del refs[name]
+                    if not self._refs_exact:
+                        continue
+                    try:
+                        os.remove(self.chunk_path(chunk_id))
+                    except FileNotFoundError:
+                        pass
+
+    def gc(self, baul_path) -> dict:
+        """
+        Recuenta las referencias desde todas las listas de trozos del baúl y
+        borra los trozos que ya no usa nadie (por ejemplo, de archivos que se
+        borraron o reemplazaron).
+
+        Si algún archivo del baúl no se puede leer, no se borra nada: podría
+        ser una lista que todavía usa trozos.
+
+        Retorna:
+            dict: live, removed, freed (bytes) y errors [(ruta, error)].
+        """
+        counts = {}
+        errors = []
+        # El almacén tiene miles de subcarpetas: ni se entra en él
+        for folder, entries in scanner.walk(baul_path, with_stat=False,
+                                            skip=lambda name: name in (STORE_DIR, ".credentials")):
+            for entry in entries:
+                if entry.is_dir or not entry.name.endswith(".enc"):
+                    continue
+                try:
+                    recipe = read_recipe(self.session_key, entry.path)
+                    if recipe is None:
+                        continue
+                    for chunk_id, _ in parse_recipe(recipe):
+                        counts[chunk_id.hex()] = counts.get(chunk_id.hex(), 0) + 1
+                except (OSError, InvalidToken) as e:
+                    errors.append((entry.path, str(e) or "Archivo corrupto"))
+
+        report = {"live": len(counts), "removed": 0, "freed": 0, "errors": errors}
+        if errors:
+            return report
+
+        for folder, entries in scanner.walk(self.path):
+            for entry in entries:
+                if entry.is_dir or folder == self.path:
+                    continue
+                stale_tmp = entry.name.endswith(".tmp")
+                if stale_tmp or entry.name[:-len(CHUNK_EXT)] not in counts:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        continue
+                    report["removed"] += 0 if stale_tmp else 1
+                    report["freed"] += entry.size
+
+        with self._lock:
+            self._refs = counts
+            self._refs_exact = True
+        self.save()
+        return report
+
+
+class RecipeReader:
+    """
+    Lee un archivo deduplicado como si fuera un VaultFileReader: mismo
+    'size', iter_chunks, read_range y copy_to.
+    """
+    def __init__(self, store: ChunkStore, reader):
+        # 'reader' es el VaultFileReader de la lista de trozos; se cierra aquí
+        try:
+            entries = parse_recipe(reader.read_range(0, reader.size))
+        finally:
+            reader.close()
+        self.store = store
+        self._ids = [chunk_id for chunk_id, _ in entries]
+        self._sizes = [size for _, size in entries]
+        self._starts = []
+        position = 0
+        for size in self._sizes:
+            self._starts.append(position)
+            position += size
+        self.size = position
+        self.chunk_count = len(entries)
+
+    def iter_chunks(self, offset: int = 0, length: int = None, pool=None):
+        end = self.size if length is None else min(self.size, offset + length)
+        if offset >= end:
+            return
+        first = bisect.bisect_right(self._starts, offset) - 1
+        last = bisect.bisect_right(self._starts, end - 1) - 1
+        indexes = range(first, last + 1)
+        calls = ((self._ids[index], self._sizes[index]) for index in indexes)
+        if pool is not None and len(indexes) >= vault_format.PARALLEL_MIN_CHUNKS:
+            chunks = vault_format.ordered_map(pool, self.store.get, calls)
+        else:
+            chunks = (self.store.get(*args) for args in calls)
+        for index, chunk in zip(indexes, chunks):
+            chunk_start = self._starts[index]
+            yield chunk[max(0, offset - chunk_start):end - chunk_start]
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        return b"".join(self.iter_chunks(offset, length))
+
+    def copy_to(self, dst, offset: int = 0, length: int = None, pool=None) -> int:
+        written = 0
+        for plain in self.iter_chunks(offset, length, pool):
+            dst.write(plain)
+            written += len(plain)
+        return written
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_recipe(session_key, path):
+    """
+    Retorna la lista de trozos del archivo 'path' del baúl, o None si no es
+    un archivo deduplicado (solo se lee la cabecera).
+
+    Lanza:
+        InvalidToken: Si el archivo está dañado.
+    """
+    with open(path, 'rb') as f:
+        first_bytes = f.read(vault_format.BASE_HEADER_SIZE)
+    if not vault_format.is_chunked(first_bytes):
+        return None
+    if not vault_format.unpack_header(first_bytes)["flags"] & vault_format.FLAG_RECIPE:
+        return None
+    with vault_format.VaultFileReader(session_key, path) as reader:
+        return reader.read_range(0, reader.size)
+
+
+def _write_atomic(path, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    import crypto_utils
+
+    parser = argparse.ArgumentParser(description="Mantenimiento del almacén de trozos deduplicados")
+    parser.add_argument("action", choices=["gc", "stats"])
+    parser.add_argument("baul_path", help="Carpeta 'Baul' de la USB")
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(args.baul_path, ".credentials", "vault.key"), 'rb') as f:
+        content = f.read()
+    try:
+        session_key = crypto_utils.unlock_vault_key(getpass.getpass("Contraseña: "), content)
+        store = ChunkStore(args.baul_path, session_key, create=False)
+    except (ValueError, FileNotFoundError) as e:
+        print(e)
+        return 1
+
+    if args.action == "stats":
+        refs = store.refs
+        shared = sum(1 for count in refs.values() if count > 1)
+        print(f"Trozos: {len(refs)} · Compartidos: {shared} · Referencias: {sum(refs.values())}")
+        return 0
+
+    report = store.gc(args.baul_path)
+    for path, error in report["errors"]:
+        print(f"No se pudo leer {path}: {error}")
+    if report["errors"]:
+        print("No se borró nada.")
+        return 1
+    print(f"Trozos en uso: {report['live']} · Borrados: {report['removed']} · "
+          f"Liberados: {report['freed'] / (1024 * 1024):.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import multiprocessing
+
+# Medición de dónde se va el tiempo (KDF, lectura de carpetas, descifrado de
+# nombres, lectura, cifrado, escritura, fsync, armado del árbol).
+#
+# Cuando una transferencia iba lenta no había forma de saber si el tiempo se
+# iba en leer la USB, en cifrar, en el fsync o en Tk. Ahora las partes
+# calientes del código marcan sus tramos con:
+#
+#   with instrumentation.span("encrypt", len(data)):
+#       ...
+#
+# o, para una función completa, con @instrumentation.traced("render").
+#
+# Apagado (lo normal) span() retorna siempre el mismo objeto que no hace
+# nada: cuesta una llamada y una comparación. Se enciende con la variable de
+# entorno ENV_VAR (o con --trace en cli.py):
+#
+#   BAUL_TRACE=traza.json python run.py
+#   python cli.py import E:/Baul C:/Fotos --trace traza.json
+#
+# Al salir del programa se escribe la traza en formato Chrome/Perfetto
+# (abrir con https://ui.perfetto.dev o chrome://tracing) y se imprime en la
+# salida de errores un resumen por tramo: cuántas veces, tiempo total,
+# promedio, máximo y MB/s cuando el tramo mueve bytes. El resumen también va
+# dentro de la traza ("otherData").
+#
+# Los contadores "bytes_copied" y "bytes_allocated" suman cuántos bytes de
+# los bloques se copian en memoria y cuántos se piden en buffers nuevos (ver
+# benchmarks/bench_zero_copy.py).
+#
+# Solo se mide el proceso principal: con el pool de procesos de cifrado
+# (use_processes=True) los bloques que se cifran en otros procesos no salen.
+
+ENV_VAR = "BAUL_TRACE"
+DEFAULT_PATH = "baul-trace.json"   # Con BAUL_TRACE=1
+MAX_EVENTS = 1_000_000             # Tramos guardados en la traza; después solo el resumen
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+_recorder = None
+
+
+class _Span:
+    __slots__ = ("recorder", "name", "size", "started")
+
+    def __init__(self, recorder, name: str, size: int):
+        self.recorder = recorder
+        self.name = name
+        self.size = size
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.add(self.name, self.started, time.perf_counter_ns() - self.started, self.size)
+        return False
+
+
+class _Recorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.origin = time.perf_counter_ns()
+        self.wall_started = time.time()
+        self.events = []        # (nombre, hilo, inicio, duración, bytes)
+        self.dropped = 0
+        self.totals = {}        # nombre -> [veces, ns, ns máximo, bytes]
+        self.counters = {}      # nombre -> valor acumulado
+        self.counter_events = []
+        self.threads = {}       # id del hilo -> nombre
+        self._lock = threading.Lock()
+
+    def add(self, name: str, started: int, duration: int, size: int):
+        tid = threading.get_ident()
+        with self._lock:
+            if tid not in self.threads:
+                self.threads[tid] = threading.current_thread().name
+            total = self.totals.get(name)
+            if total is None:
+                total = self.totals[name] = [0, 0, 0, 0]
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+            total[3] += size
+            if len(self.events) < MAX_EVENTS:
+                self.events.append((name, tid, started, duration, size))
+            else:
+                self.dropped += 1
+
+    def count(self, name: str, value: int):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            if len(self.counter_events) < MAX_EVENTS:
+                self.counter_events.append((name, time.perf_counter_ns(), self.counters[name]))
+
+    def summary(self) -> dict:
+        elapsed = (time.perf_counter_ns() - self.origin) / 1e9
+        spans = {}
+        for name, (calls, total_ns, max_ns, size) in sorted(self.totals.items(), key=lambda item: -item[1][1]):
+            spans[name] = {
+                "count": calls,
+                "total_ms": total_ns / 1e6,
+                "avg_us": total_ns / calls / 1e3,
+                "max_ms": max_ns / 1e6,
+                "bytes": size,
+                "mb_per_s": size / (1024 * 1024) / (total_ns / 1e9) if size and total_ns else None,
+            }
+        return {"elapsed_s": elapsed, "spans": spans, "counters": dict(self.counters), "dropped": self.dropped}
+
+    def trace(self, summary: dict) -> dict:
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in self.threads.items()]
+        for name, tid, started, duration, size in self.events:
+            event = {"name": name, "cat": "baul", "ph": "X", "pid": pid, "tid": tid,
+                     "ts": (started - self.origin) / 1e3, "dur": duration / 1e3}
+            if size:
+                event["args"] = {"bytes": size}
+            events.append(event)
+        for name, at, value in self.counter_events:
+            events.append({"name": name, "ph": "C", "pid": pid, "ts": (at - self.origin) / 1e3,
+                           "args": {name: value}})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"started": self.wall_started, "argv": sys.argv, "summary": summary}}
+
+
+def span(name: str, size: int = 0):
+    """
+    Marca un tramo con 'with'. 'size' son los bytes que procesa (para
+    calcular MB/s en el resumen).
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NO_SPAN
+    return _Span(recorder, name, size)
+
+
+def traced(name: str):
+    """Decorador: mide cada llamada de la función como un tramo 'name'."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return fn(*args, **kwargs)
+            with _Span(recorder, name, 0):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: int = 1):
+    """Suma 'value' a un contador (sale como gráfico en la traza)."""
+    recorder = _recorder
+    if recorder is not None:
+        recorder.count(name, value)
+
+
+def enabled() -> bool:
+    return _recorder is not None
+
+
+def start(path: str = DEFAULT_PATH):
+    """Empieza a medir; la traza se guarda en 'path' al llamar stop() o al salir."""
+    global _recorder
+    if _recorder is None:
+        _recorder = _Recorder(str(path))
+        atexit.register(stop)
+
+
+def stop(save: bool = True):
+    """
+    Deja de medir, guarda la traza e imprime el resumen. Con save=False solo
+    retorna el resumen (por ejemplo para leer los contadores en un benchmark).
+
+    Retorna:
+        dict: El resumen, o None si no se estaba midiendo.
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is None:
+        return None
+    summary = recorder.summary()
+    if not save:
+        return summary
+    try:
+        with open(recorder.path, 'w', encoding="utf-8") as f:
+            json.dump(recorder.trace(summary), f)
+    except OSError as e:
+        print(f"No se pudo guardar la traza en {recorder.path}: {e}", file=sys.stderr)
+    print_summary(summary, recorder.path)
+    return summary
+
+
+def print_summary(summary: dict, path: str = None, out=None):
+    out = out or sys.stderr
+    print(f"--- Tramos medidos ({summary['elapsed_s']:.2f} s en total) ---", file=out)
+    print(f"  {'tramo':<18} {'veces':>9} {'total ms':>11} {'prom. µs':>10} {'máx. ms':>9} {'MB/s':>9}", file=out)
+    for name, info in summary["spans"].items():
+        speed = f"{info['mb_per_s']:9.1f}" if info["mb_per_s"] is not None else f"{'':>9}"
+        print(f"  {name:<18} {info['count']:9d} {info['total_ms']:11.1f} {info['avg_us']:10.1f}"
+              f" {info['max_ms']:9.2f} {speed}", file=out)
+    for name, value in summary["counters"].items():
+        print(f"  {name}: {value}", file=out)
+    if summary["dropped"]:
+        print(f"  ({summary['dropped']} tramos solo en el resumen: la traza llegó a {MAX_EVENTS})", file=out)
+    if path:
+        print(f"Traza: {path}", file=out)
+
+
+def start_from_env():
+    """Enciende la medición si está la variable ENV_VAR (solo en el proceso principal)."""
+    value = os.environ.get(ENV_VAR)
+    if value and value != "0" and multiprocessing.parent_process() is None:
+        start(DEFAULT_PATH if value == "1" else value)
+
+
+start_from_env()
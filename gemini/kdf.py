@@ -0,0 +1,122 @@
+import os
+import time
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+try:
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:
+    # Versiones de 'cryptography' anteriores a la 44 no traen Argon2
+    Argon2id = None
+
+# Funciones para derivar la llave de encapsulación desde la contraseña.
+#
+# Antes siempre era PBKDF2-SHA256 con 480.000 iteraciones: casi un segundo
+# en una laptop lenta y bastante menos costoso de lo que podría ser en una
+# rápida. Ahora el 'vault.key' guarda qué función se usó y con qué
+# parámetros (ver crypto_utils.py), y al crear un baúl se calibran para que
+# desbloquear tarde más o menos TARGET_SECONDS en la PC donde se crea.
+
+PBKDF2 = "pbkdf2-sha256"
+SCRYPT = "scrypt"
+ARGON2ID = "argon2id"
+
+KEY_LENGTH = 32
+TARGET_SECONDS = 0.5
+
+# Parámetros del formato antiguo (salt + token, sin cabecera)
+LEGACY_PARAMS = {"iterations": 480_000}
+
+# Nunca se baja de estos mínimos aunque la PC sea muy lenta
+MIN_PARAMS = {
+    PBKDF2: {"iterations": 200_000},
+    SCRYPT: {"n": 2 ** 14, "r": 8, "p": 1},
+    ARGON2ID: {"iterations": 2, "lanes": 1, "memory_cost": 19 * 1024},
+}
+
+# Máximo de memoria que se le pide a scrypt/Argon2id (KiB)
+MAX_MEMORY_KIB = 256 * 1024
+
+
+def available() -> list:
+    """Las funciones que se pueden usar con la versión instalada de 'cryptography'."""
+    names = [PBKDF2, SCRYPT]
+    if Argon2id is not None:
+        names.append(ARGON2ID)
+    return names
+
+
+def default_kdf() -> str:
+    """Argon2id si está disponible; si no, scrypt."""
+    return ARGON2ID if Argon2id is not None else SCRYPT
+
+
+def derive(name: str, params: dict, password: bytes, salt: bytes) -> bytes:
+    """
+    Deriva KEY_LENGTH bytes desde 'password' con la función 'name'.
+
+    Lanza:
+        ValueError: Si la función no existe o no está disponible.
+    """
+    if name == PBKDF2:
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=KEY_LENGTH, salt=salt,
+                         iterations=params["iterations"])
+    elif name == SCRYPT:
+        kdf = Scrypt(salt=salt, length=KEY_LENGTH, n=params["n"], r=params["r"], p=params["p"])
+    elif name == ARGON2ID and Argon2id is not None:
+        kdf = Argon2id(salt=salt, length=KEY_LENGTH, iterations=params["iterations"],
+                       lanes=params["lanes"], memory_cost=params["memory_cost"])
+    else:
+        raise ValueError(f"Función de derivación no disponible: {name}")
+    return kdf.derive(password)
+
+
+def time_derive(name: str, params: dict) -> float:
+    """Segundos que tarda una derivación con estos parámetros."""
+    started = time.perf_counter()
+    derive(name, params, b"calibracion", os.urandom(16))
+    return time.perf_counter() - started
+
+
+def calibrate(name: str = None, target: float = TARGET_SECONDS) -> tuple:
+    """
+    Busca parámetros para que una derivación tarde unos 'target' segundos
+    en esta PC, sin bajar de MIN_PARAMS.
+
+    Retorna:
+        tuple: (nombre, parámetros)
+
+    Lanza:
+        ValueError: Si la función no existe o no está disponible.
+    """
+    name = name or default_kdf()
+    if name not in available():
+        raise ValueError(f"Función de derivación no disponible: {name} "
+                         f"(disponibles: {', '.join(available())})")
+    params = dict(MIN_PARAMS[name])
+
+    if name == PBKDF2:
+        # El costo es lineal en las iteraciones: basta con una medición
+        elapsed = time_derive(name, params)
+        params["iterations"] = max(params["iterations"], int(params["iterations"] * target / elapsed))
+
+    elif name == SCRYPT:
+        # 'n' tiene que ser potencia de 2: se duplica mientras eso acerque
+        # el tiempo al objetivo
+        elapsed = time_derive(name, params)
+        while elapsed * 3 < target * 2 and 128 * params["r"] * params["n"] * 2 <= MAX_MEMORY_KIB * 1024:
+            params["n"] *= 2
+            elapsed *= 2
+
+    elif name == ARGON2ID:
+        # Primero memoria (es lo que más le cuesta a un atacante) y luego pasadas
+        params["lanes"] = min(4, os.cpu_count() or 1)
+        elapsed = time_derive(name, params)
+        while elapsed * 2 <= target and params["memory_cost"] * 2 <= MAX_MEMORY_KIB:
+            params["memory_cost"] *= 2
+            elapsed *= 2
+        elapsed = time_derive(name, params)
+        params["iterations"] = max(params["iterations"], int(params["iterations"] * target / elapsed))
+
+    return name, params
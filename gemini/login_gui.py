@@ -1,9 +1,16 @@
 import customtkinter as ctk
 from tkinter import messagebox
 import crypto_utils
+from transfers import run_in_background # También lo usa setup_gui
 import main_app # La app principal del explorador de archivos
 from cryptography.fernet import Fernet, InvalidToken # <-- CORRECCIÓN AQUÍ
 
+def launch_app(window, baul_path, session_key):
+    """Cierra 'window' y abre la app principal con la llave ya desbloqueada."""
+    window.destroy()
+    app = main_app.App(baul_path=str(baul_path), session_key=session_key)
+    app.mainloop()
+
 class LoginWindow(ctk.CTk):
     """
     Ventana para la Fase 3: Desbloqueo del Baúl.
@@ -15,7 +22,7 @@ class LoginWindow(ctk.CTk):
         self.key_file_path = key_file_path
         
         self.title("Desbloquear Baúl")
-        self.geometry("350x200")
+        self.geometry("350x220")
         self.resizable(False, False)
 
         self.grid_columnconfigure(0, weight=1)
@@ -32,47 +39,55 @@ class LoginWindow(ctk.CTk):
         self.login_button.grid(row=2, column=0, padx=20, pady=10)
 
         self.status_label = ctk.CTkLabel(self, text="", text_color="red")
-        self.status_label.grid(row=3, column=0, padx=20, pady=(0, 10))
+        self.status_label.grid(row=3, column=0, padx=20, pady=(0, 5))
+
+        # Indicador mientras se deriva la llave (solo visible al desbloquear)
+        self.progress_bar = ctk.CTkProgressBar(self, mode="indeterminate", width=300)
         
         # Enfocar el campo de contraseña al iniciar
         self.pass_entry.focus()
 
     def attempt_login(self, event=None):
-        """Intenta descifrar la llave y lanzar la app principal."""
+        """Lee el 'vault.key' y lo desbloquea en segundo plano."""
         password = self.pass_entry.get()
         if not password:
             self.status_label.configure(text="Ingresa una contraseña.")
             return
 
-        self.status_label.configure(text="Descifrando...", text_color="gray")
-        self.login_button.configure(state="disabled")
-        self.pass_entry.configure(state="disabled")
-        self.update_idletasks() # Forzar actualización de UI
-
         try:
             # 1. Leer el contenido del 'vault.key'
             with open(self.key_file_path, "rb") as f:
                 vault_key_content = f.read()
-            
-            # 2. Intentar desbloquear
-            session_key = crypto_utils.unlock_vault_key(password, vault_key_content)
-            
-            # 3. ¡Éxito! Lanzar la app principal
-            self.destroy() # Cerrar ventana de login
-            app = main_app.App(baul_path=str(self.baul_path), session_key=session_key)
-            app.mainloop()
-
-        except ValueError as e: # Captura "Contraseña incorrecta"
-            self.status_label.configure(text=str(e), text_color="red")
-            self.login_button.configure(state="normal")
-            self.pass_entry.configure(state="normal")
-            self.pass_entry.delete(0, "end")
         except FileNotFoundError:
             self.status_label.configure(text="Error: No se encontró el archivo 'vault.key'.", text_color="red")
-        except Exception as e:
-            self.status_label.configure(text=f"Error inesperado: {e}", text_color="red")
-            self.login_button.configure(state="normal")
-            self.pass_entry.configure(state="normal")
+            return
+
+        self.status_label.configure(text="Desbloqueando...", text_color="gray")
+        self.login_button.configure(state="disabled")
+        self.pass_entry.configure(state="disabled")
+        self.progress_bar.grid(row=4, column=0, padx=20, pady=(0, 10))
+        self.progress_bar.start()
+
+        # 2. Intentar desbloquear sin congelar la ventana
+        run_in_background(self, lambda: crypto_utils.unlock_vault_key(password, vault_key_content),
+                          self.on_unlocked, self.on_unlock_failed)
+
+    def on_unlocked(self, session_key):
+        # 3. ¡Éxito! Lanzar la app principal
+        self.progress_bar.stop()
+        launch_app(self, self.baul_path, session_key)
+
+    def on_unlock_failed(self, error):
+        self.progress_bar.stop()
+        self.progress_bar.grid_remove()
+        self.login_button.configure(state="normal")
+        self.pass_entry.configure(state="normal")
+        if isinstance(error, ValueError): # Captura "Contraseña incorrecta"
+            self.status_label.configure(text=str(error), text_color="red")
+            self.pass_entry.delete(0, "end")
+        else:
+            self.status_label.configure(text=f"Error inesperado: {error}", text_color="red")
+        self.pass_entry.focus()
 
 if __name__ == "__main__":
     # Para pruebas (ejecutar este archivo directamente)
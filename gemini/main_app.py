@@ -2,136 +2,348 @@ import customtkinter as ctk
 import tkinter as tk
 import os, time, pywinstyles
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import messagebox
 from pathlib import Path
 from tkinter import filedialog
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 from cryptography.fernet import Fernet, InvalidToken # <-- CORRECCIÓN AQUÍ
+import vault_format
+import manifest
+import scanner
+import pack_store
+import instrumentation
+from search_index import SearchIndex, DEFAULT_LIMIT as SEARCH_LIMIT
+from name_cache import NameCache
+from tree_model import TreeModel, TreeNode
+from tree_events import TreeUpdater, ChangeHandler
+from transfer_engine import ImportEngine, ExportEngine
+from transfers import TransferManager, format_eta
 
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
 
-# Clase para el arbol de archivos, hereda de la clase padre: CTkScrollableFrame
-class FileTreeView(ctk.CTkScrollableFrame):
-    def __init__(self, master, path, fernet: Fernet, **kwargs):
+# Alto de cada fila del árbol (checkbox de 24px + pady de 2px arriba y abajo)
+ROW_HEIGHT = 28
+
+# Clase para el arbol de archivos, hereda de la clase padre: CTkFrame
+# El árbol es "virtual": solo existen los checkboxes que caben en la ventana
+# y al hacer scroll se reutilizan mostrando otras filas de 'self.model.rows'.
+# Mientras hay una búsqueda (ver search_index.py) las filas son los resultados.
+# Así dibujar el árbol cuesta lo mismo con 100 archivos que con 100k.
+# Las carpetas se leen del disco (en segundo plano) solo al expandirlas.
+class FileTreeView(ctk.CTkFrame):
+    def __init__(self, master, path, fernet: Fernet, manifests: manifest.ManifestStore, on_root_loaded=None,
+                 **kwargs):
         super().__init__(master, **kwargs)
 
         self.path = path
         self.fernet = fernet # La llave de sesión descifrada
-        self.checkboxes = {}
-        self.folder_children = {}
-        self.real_path_map = {} # Mapea el texto del checkbox al path cifrado real
+        self.manifests = manifests # Nombres reales de los archivos, ya descifrados
+        # Nombres descifrados de refrescos anteriores (se conserva entre refrescos)
+        self.name_cache = NameCache()
+        self.model = TreeModel(self.path)
+        # Aplica los eventos de watchdog sobre el modelo (ver tree_events.py)
+        self.updater = TreeUpdater(self.model, self.manifests, self.file_display_name)
+
+        self.first_row = 0       # Índice en model.rows de la primera fila visible
+        self.row_widgets = []    # (fila, flecha, checkbox) reciclados, uno por fila visible
+        self.visible_slots = 0   # Cuántos de ellos caben en la ventana ahora
+        self.search_rows = None  # Resultados de la búsqueda en pantalla (None: el árbol)
+        self.tree_first_row = 0  # Posición en el árbol antes de buscar
+        # Un solo hilo para leer carpetas: las lecturas no compiten entre sí
+        # por la USB y 'name_cache' no se usa desde dos hilos a la vez.
+        self.scan_pool = ThreadPoolExecutor(max_workers=1)
+        # Se llama una vez, cuando la raíz ya está dibujada (ver on_children_loaded)
+        self.on_root_loaded = on_root_loaded
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
 
-        self.populate_tree(self.path, 0)
+        self.rows_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.rows_frame.grid(row=0, column=0, sticky="nsew")
+        self.rows_frame.grid_columnconfigure(0, weight=1)
+        self.rows_frame.bind("<Configure>", self.on_resize)
+        self.bind_mousewheel(self.rows_frame)
+
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self.refresh()
+
+    @property
+    def rows(self):
+        """Filas a mostrar: las del árbol o, si hay una búsqueda, sus resultados."""
+        return self.model.rows if self.search_rows is None else self.search_rows
+
+    # --- Scroll ---
+    def bind_mousewheel(self, widget):
+        widget.bind("<MouseWheel>", self.on_mousewheel)  # Windows / macOS
+        widget.bind("<Button-4>", lambda e: self.scroll_rows(-3))  # Linux
+        widget.bind("<Button-5>", lambda e: self.scroll_rows(3))
+
+    def on_mousewheel(self, event):
+        self.scroll_rows(-3 if event.delta > 0 else 3)
+
+    def on_scrollbar(self, action, value, unit=None):
+        total = len(self.rows)
+        if action == "moveto":
+            self.first_row = int(float(value) * total)
+        elif action == "scroll":
+            step = self.visible_slots if unit == "pages" else 1
+            self.first_row += int(value) * step
+        self.render()
+
+    def scroll_rows(self, amount):
+        self.first_row += amount
+        self.render()
+
+    # --- Pool de filas ---
+    @instrumentation.traced("widget_build")
+    def on_resize(self, event):
+        """Ajusta la cantidad de filas visibles al alto de la ventana."""
+        self.visible_slots = max(1, event.height // ROW_HEIGHT)
+        while len(self.row_widgets) < self.visible_slots:
+            slot = len(self.row_widgets)
+            row = ctk.CTkFrame(self.rows_frame, fg_color="transparent", height=ROW_HEIGHT)
+            arrow = ctk.CTkLabel(row, text="", width=20)
+            arrow.pack(side="left")
+            arrow.bind("<Button-1>", lambda e, s=slot: self.on_arrow_click(s))
+            cb = ctk.CTkCheckBox(row, text="",
+                                 command=lambda s=slot: self.on_checkbox_toggle(s))
+            cb.pack(side="left")
+            for widget in (row, arrow, cb):
+                self.bind_mousewheel(widget)
+            self.row_widgets.append((row, arrow, cb))
+        self.render()
+
+    @instrumentation.traced("render")
+    def render(self):
+        """Vuelve a asignar cada fila visible a su nodo del modelo."""
+        rows = self.rows
+        total = len(rows)
+        self.first_row = max(0, min(self.first_row, total - self.visible_slots))
+
+        for slot, (row, arrow, cb) in enumerate(self.row_widgets):
+            index = self.first_row + slot
+            if slot >= self.visible_slots or index >= total:
+                row.grid_remove()
+                continue
+
+            node = rows[index]
+            if not node.is_dir or self.search_rows is not None:
+                arrow.configure(text="")
+            elif node.loading:
+                arrow.configure(text="⏳")
+            else:
+                arrow.configure(text="▼" if node.expanded else "▶")
+            icon = "📁" if node.is_dir else "📄"
+            cb.configure(text=f"{icon} {node.name}")
+            row.grid(row=slot, column=0, sticky="w", padx=(node.depth * 20, 0), pady=2)
+            if node.checked:
+                cb.select()
+            else:
+                cb.deselect()
+
+        if total > self.visible_slots:
+            self.scrollbar.set(self.first_row / total, (self.first_row + self.visible_slots) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def on_checkbox_toggle(self, slot):
+        node = self.rows[self.first_row + slot]
+        # Si es carpeta, se marcan o desmarcan también todos sus hijos
+        self.model.set_checked(node, self.row_widgets[slot][2].get() == 1)
+        self.render()
+
+    def on_arrow_click(self, slot):
+        """Expande o contrae una carpeta."""
+        index = self.first_row + slot
+        if self.search_rows is not None or index >= len(self.rows):
+            return
+        node = self.rows[index]
+        if not node.is_dir:
+            return
 
-    def on_checkbox_toggle(self, display_path):
-        is_checked = self.checkboxes[display_path].get()
-        if display_path in self.folder_children:
-            self.update_children_state(display_path, is_checked)
-    
-    def update_children_state(self, parent_display_path, state):
-        if parent_display_path in self.folder_children:
-            for child_display_path in self.folder_children[parent_display_path]:
-                if state == 1:
-                    self.checkboxes[child_display_path].select()
-                else:
-                    self.checkboxes[child_display_path].deselect()
-                self.update_children_state(child_display_path, state)
-
-    def populate_tree(self, current_path, row, indent=0, parent_display_path=""):
+        node.expanded = not node.expanded
+        # La primera vez (o si cambió algo mientras estaba contraída) se lee
+        # del disco; si no, se muestran los hijos que ya estaban en caché.
+        if node.expanded and (not node.loaded or node.stale):
+            self.load_children(node)
+        self.model.rebuild_rows()
+        self.render()
+
+    # --- Lectura del baúl ---
+    def load_children(self, node):
+        """Lee en segundo plano los hijos de 'node' y los muestra al terminar."""
+        if node.loading:
+            return
+        node.loading = True
+
+        def job():
+            children = self.populate_tree(node.real_path)
+            if self.winfo_exists():
+                self.after(0, self.on_children_loaded, node, children)
+
+        self.scan_pool.submit(job)
+
+    @instrumentation.traced("tree_build")
+    def on_children_loaded(self, node, children):
+        self.model.set_children(node, children)
+        self.model.rebuild_rows()
+        self.render()
+        if node is self.model.root and self.on_root_loaded is not None:
+            # Después de que Tk pinte el árbol, no antes
+            self.after_idle(self.on_root_loaded)
+            self.on_root_loaded = None
+
+    @instrumentation.traced("populate_tree")
+    def populate_tree(self, current_path):
+        """
+        Lee del disco los hijos directos de una carpeta (sin entrar en las
+        subcarpetas). Corre en el hilo de 'scan_pool', no en el de Tk.
+
+        Retorna:
+            list: Nodos nuevos (sin padre); el orden lo pone TreeModel.set_children.
+        """
         try:
-            # Leemos los nombres de archivo cifrados del disco
-            items = sorted(os.listdir(current_path))
-        except (FileNotFoundError, PermissionError) as e:
+            # Leemos los nombres de archivo cifrados del disco (una sola
+            # pasada con os.scandir, ver scanner.py)
+            entries = scanner.scan_dir(current_path)
+        except OSError as e:
             print(f"Error al acceder a {current_path}: {e}")
-            return row
-
-        parent_path = os.path.dirname(current_path)
-        if parent_display_path not in self.folder_children:
-            self.folder_children[parent_display_path] = []
-
-        dirs = [item for item in items if os.path.isdir(os.path.join(current_path, item))]
-        # MODIFICADO: Solo listamos archivos que terminan en .enc
-        files = [item for item in items if not os.path.isdir(os.path.join(current_path, item)) and item.endswith(".enc")]
-        
-        all_items = dirs + files
-
-        current_display_children = []
-
-        for item in all_items:
-            real_item_path = os.path.join(current_path, item)
-            is_dir = os.path.isdir(real_item_path)
-            
-            display_name = ""
-            if is_dir:
-                icon = "📁"
-                display_name = item # Las carpetas no están cifradas
-            else:
-                icon = "📄"
-                try:
-                    # Desciframos el nombre del archivo para mostrarlo
-                    encrypted_name_hex = item.replace(".enc", "")
-                    decrypted_name_bytes = self.fernet.decrypt(bytes.fromhex(encrypted_name_hex))
-                    display_name = decrypted_name_bytes.decode()
-                except (InvalidToken, ValueError, TypeError):
-                    display_name = f"¡Archivo corrupto! ({item[:10]}...)"
-                except Exception:
-                     display_name = f"¡Error al leer! ({item[:10]}...)"
-
-            # Usamos el 'display_name' para el arbol y los diccionarios
-            # El 'display_path' es la ruta visual, no la real
-            display_path = os.path.join(parent_display_path, display_name)
-            current_display_children.append(display_path)
-
-            cb = ctk.CTkCheckBox(self, text=f"{icon} {display_name}", 
-                                 command=lambda p=display_path: self.on_checkbox_toggle(p))
-            cb.grid(row=row, column=0, sticky="w", padx=(indent * 20, 0), pady=2)
-            
-            self.checkboxes[display_path] = cb
-            # Guardamos el mapeo: "Ruta/Visual/Archivo.txt" -> "E:/Baul/...hex...enc"
-            self.real_path_map[display_path] = real_item_path 
-            row += 1
-            
-            if is_dir:
-                row = self.populate_tree(real_item_path, row, indent + 1, parent_display_path=display_path)
-        
-        if parent_display_path:
-            self.folder_children[parent_display_path] = current_display_children
-        
-        return row
+            return []
+
+        # Si otro programa modificó el manifiesto, se vuelve a leer
+        self.manifests.revalidate(current_path)
+
+        nodes = []
+        for entry in entries:
+            if entry.is_dir:
+                if manifest.is_internal_dir(entry.name):
+                    # Trozos deduplicados y paquetes: no se muestran
+                    continue
+                # Las carpetas no están cifradas
+                nodes.append(TreeNode(entry.name, entry.path, True))
+            elif entry.name.endswith(".enc"):
+                # MODIFICADO: Solo listamos archivos que terminan en .enc (el manifiesto no)
+                name = self.file_display_name(current_path, entry.name, entry.mtime)
+                nodes.append(TreeNode(name, entry.path, False))
+
+        # Los archivos pequeños empaquetados (ver pack_store.py) solo existen
+        # en el manifiesto
+        for file_id, entry in self.manifests.entries(current_path).items():
+            if pack_store.is_packed(entry):
+                nodes.append(TreeNode(entry["name"], os.path.join(current_path, file_id), False))
+        return nodes
+
+    def file_display_name(self, folder, item, mtime=None):
+        """
+        Nombre a mostrar para el archivo 'item' de 'folder'.
+
+        Los nombres que están en el manifiesto ya están descifrados en memoria.
+        Los de archivos antiguos requieren un descifrado Fernet, así que se
+        guardan en 'name_cache' junto con el mtime del archivo: mientras el
+        archivo no cambie, no se vuelve a descifrar en el siguiente refresco.
+        """
+        entry = self.manifests.lookup(folder, item)
+        if entry is not None:
+            return entry["name"]
+        if manifest.is_file_id(item):
+            # Archivo recién escrito cuyo nombre todavía no llega al manifiesto
+            # (o que quedó huérfano); no se guarda en caché.
+            return f"¡Archivo sin nombre! ({item[:10]}...)"
+
+        real_item_path = os.path.join(folder, item)
+        if mtime is None:
+            try:
+                mtime = os.stat(real_item_path).st_mtime_ns
+            except OSError:
+                return f"¡Error al leer! ({item[:10]}...)"
+
+        display_name = self.name_cache.get(real_item_path, mtime)
+        if display_name is not None:
+            return display_name
+
+        try:
+            display_name = manifest.resolve_name(self.manifests, folder, item)
+        except (InvalidToken, ValueError, TypeError):
+            display_name = f"¡Archivo corrupto! ({item[:10]}...)"
+        except Exception:
+            return f"¡Error al leer! ({item[:10]}...)"
+
+        self.name_cache.put(real_item_path, mtime, display_name)
+        return display_name
 
     def get_checked_items(self):
         """Retorna una lista de las RUTAS REALES (cifradas) de los items seleccionados."""
-        checked_real_paths = []
-        for display_path, checkbox in self.checkboxes.items():
-            if checkbox.get() == 1:
-                # Añadimos la ruta real cifrada, no la visual
-                checked_real_paths.append(self.real_path_map[display_path])
-        return checked_real_paths
-        
+        paths = self.model.checked_paths()
+        if self.search_rows is None:
+            return paths
+        # Resultados marcados que no estén ya dentro de algo marcado
+        chosen = set(paths)
+        for node in sorted((node for node in self.search_rows if node.checked), key=lambda n: len(n.real_path)):
+            parent = node.real_path
+            while parent not in chosen and parent != self.model.root.real_path and parent != os.path.dirname(parent):
+                parent = os.path.dirname(parent)
+            if parent not in chosen:
+                chosen.add(node.real_path)
+                paths.append(node.real_path)
+        return paths
+
+    # --- Búsqueda ---
+    def show_search(self, hits, reset: bool = True):
+        """
+        Muestra solo los resultados de una búsqueda (SearchHit), cada uno
+        como una fila suelta con su ruta. Lo marcado en los resultados
+        anteriores se conserva si el resultado sigue apareciendo.
+        """
+        checked = {node.real_path for node in self.search_rows or () if node.checked}
+        rows = []
+        for hit in hits:
+            node = TreeNode(hit.path, hit.real_path, hit.is_dir)
+            node.depth = 0
+            node.checked = hit.real_path in checked
+            rows.append(node)
+        if self.search_rows is None:
+            self.tree_first_row = self.first_row
+        if reset:
+            self.first_row = 0
+        self.search_rows = rows
+        self.render()
+
+    def clear_search(self):
+        """Vuelve a mostrar el árbol donde estaba antes de buscar."""
+        if self.search_rows is None:
+            return
+        self.search_rows = None
+        self.first_row = self.tree_first_row
+        self.render()
+
     def refresh(self):
-        for widget in self.winfo_children():
-            widget.destroy()
-        
-        self.checkboxes = {}
-        self.folder_children = {}
-        self.real_path_map = {}
-        self.populate_tree(self.path, 0, parent_display_path="")
-
-# ... (Clase ChangeHandler sin cambios) ...
-class ChangeHandler(FileSystemEventHandler):
-    def __init__(self, app_instance):
-        self.app = app_instance
-        self.last_event_time = 0
-        self.debounce_time = 0.5
-
-    def on_any_event(self, event):
-        current_time = time.time()
-        if current_time - self.last_event_time > self.debounce_time:
-            self.last_event_time = current_time
-            if self.app.winfo_exists():
-                self.app.after(100, self.app.tree_view.refresh)
+        """
+        Vuelve a leer las carpetas que se están viendo. Las que están
+        contraídas no se leen ahora: se marcan como desactualizadas y se leen
+        cuando se vuelvan a expandir. Lo marcado y expandido se conserva.
+        """
+        for node in list(self.model.iter_loaded_dirs()):
+            if node.expanded and self.model.is_shown(node):
+                self.load_children(node)
+            else:
+                node.stale = True
+        if not self.model.root.loaded:
+            # Primera vez: solo la raíz, el resto se lee al expandir
+            self.load_children(self.model.root)
+
+    # --- Cambios en disco (watchdog) ---
+    def apply_events(self, events):
+        """
+        Aplica un lote de eventos de watchdog directamente sobre el modelo:
+        solo se tocan los nodos afectados (ver tree_events.py).
+        """
+        if self.updater.apply(events):
+            self.model.rebuild_rows()
+            self.render()
 
 class App(ctk.CTk):
     # MODIFICADO: __init__ ahora acepta la llave de sesión
@@ -140,11 +352,23 @@ class App(ctk.CTk):
 
         self.baul_path = baul_path
         self.fernet = session_key # La llave de sesión descifrada
+        # Pool para descifrar en paralelo los bloques de archivos grandes
+        self.chunk_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
 
         if not os.path.exists(self.baul_path):
             messagebox.showerror("Error", "No se encontró la carpeta 'Baul'.")
             exit(1)
 
+        # Cada manifiesto de nombres se descifra la primera vez que se abre su
+        # carpeta; no se recorre el baúl antes de mostrar la ventana
+        self.manifests = manifest.ManifestStore(self.baul_path, self.fernet)
+        # Índice de búsqueda por nombre, solo en memoria; se arma en segundo plano
+        # (y de paso deja cargados los manifiestos de las demás carpetas) una
+        # vez que el árbol ya se ve: leer todo el baúl no retrasa la ventana
+        # ni compite por la USB con la lectura de la raíz
+        self.search_index = SearchIndex(self.manifests, on_update=self.on_index_updated)
+        self.search_job = None
+
         self.title("Baúl Seguro")
         self.minsize(800, 600)
 
@@ -157,8 +381,19 @@ class App(ctk.CTk):
         file_tree.grid_rowconfigure(1, weight=1)
         file_tree.grid_columnconfigure(0, weight=1)
 
+        search_bar = ctk.CTkFrame(file_tree, fg_color="transparent")
+        search_bar.grid(row=0, column=0, padx=10, pady=(5, 0), sticky="ew")
+        search_bar.grid_columnconfigure(0, weight=1)
+        self.search_entry = ctk.CTkEntry(search_bar, placeholder_text="Buscar por nombre (o ruta con /)...")
+        self.search_entry.grid(row=0, column=0, sticky="ew")
+        self.search_entry.bind("<KeyRelease>", self.on_search_changed)
+        self.search_entry.bind("<Escape>", self.on_search_cleared)
+        self.search_status = ctk.CTkLabel(search_bar, text="", text_color="gray", width=140)
+        self.search_status.grid(row=0, column=1, padx=(10, 0))
+
         # MODIFICADO: Pasamos la llave 'fernet' al FileTreeView
-        self.tree_view = FileTreeView(file_tree, path=self.baul_path, fernet=self.fernet)
+        self.tree_view = FileTreeView(file_tree, path=self.baul_path, fernet=self.fernet, manifests=self.manifests,
+                                      on_root_loaded=self.search_index.start)
         self.tree_view.grid(row=1, column=0, padx=10, pady=5, sticky="nsew")
 
         drop_area = ctk.CTkFrame(self)
@@ -170,6 +405,24 @@ class App(ctk.CTk):
         label = ctk.CTkLabel(drop_area, text="Arrastra y suelta archivos aquí\n(para CIFRAR y guardar)", font=("Arial", 16))
         label.pack(expand=True)
 
+        # Avance de la transferencia en curso (ver transfers.py)
+        self.cancel_button = ctk.CTkButton(drop_area, text="Cancelar", width=90, state="disabled",
+                                           command=self.on_cancel_transfer)
+        self.cancel_button.pack(side="bottom", pady=(0, 10))
+        self.status_label = ctk.CTkLabel(drop_area, text="", text_color="gray")
+        self.status_label.pack(side="bottom", pady=5)
+        self.progress_bar = ctk.CTkProgressBar(drop_area)
+        self.progress_bar.set(0)
+        self.progress_bar.pack(side="bottom", fill="x", padx=10)
+        # Modo opcional: guardar solo los trozos que cambiaron (ver dedup_store.py)
+        self.dedup_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(drop_area, text="Deduplicar (versiones de archivos grandes)",
+                        variable=self.dedup_var).pack(side="bottom", pady=(0, 10))
+
+        # Las importaciones y exportaciones corren en orden en un hilo aparte
+        self.transfers = TransferManager(self, on_progress=self.on_transfer_progress,
+                                         on_finished=self.on_transfer_finished)
+
         self.observer = Observer()
         event_handler = ChangeHandler(self)
         self.observer.schedule(event_handler, self.baul_path, recursive=True)
@@ -178,50 +431,57 @@ class App(ctk.CTk):
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
         pywinstyles.apply_dnd(drop_area, self.on_drop_to_usb)
 
+    # --- Búsqueda ---
+    def on_search_changed(self, event=None):
+        # Se espera a que se deje de escribir un momento antes de buscar
+        if self.search_job is not None:
+            self.after_cancel(self.search_job)
+        self.search_job = self.after(80, self.run_search)
+
+    def on_search_cleared(self, event=None):
+        self.search_entry.delete(0, "end")
+        self.run_search()
+
+    def run_search(self, reset: bool = True):
+        self.search_job = None
+        query = self.search_entry.get().strip()
+        if not query:
+            self.tree_view.clear_search()
+            self.search_status.configure(text="")
+            return
+        hits = self.search_index.search(query)
+        self.tree_view.show_search(hits, reset=reset)
+        # La búsqueda se corta en SEARCH_LIMIT resultados (los mejores)
+        text = f"primeros {len(hits)}" if len(hits) >= SEARCH_LIMIT else f"{len(hits)} resultado(s)"
+        if not self.search_index.ready:
+            text += " (indexando...)"
+        self.search_status.configure(text=text)
+
+    def on_index_updated(self):
+        # Se llama desde el hilo del índice: la búsqueda se repite en el de Tk
+        if self.winfo_exists():
+            self.after(0, self.refresh_search)
+
+    def refresh_search(self):
+        """Repite la búsqueda en pantalla (si hay una) sin moverse de donde se estaba."""
+        if self.search_entry.get().strip():
+            self.run_search(reset=False)
+
     # MODIFICADO: Esta función ahora CIFRA todo lo que se le arrastra
     def on_drop_to_usb(self, files_dragged):
         if not files_dragged:
             return
-        
+
+        # El cifrado corre en segundo plano (ver transfers.py) para que la
+        # ventana no se congele; si ya hay otra transferencia, espera su turno
+        # Se comprime antes de cifrar lo que vale la pena (ver chunk_codecs.py)
         try:
-            for item_path_str in files_dragged:
-                item_path = Path(item_path_str)
-                self.encrypt_and_copy_item(item_path, self.baul_path)
-            
-            messagebox.showinfo("Éxito", f"{len(files_dragged)} elemento(s) cifrados y copiados a la USB.")
-        except Exception as e:
-            messagebox.showerror("Error", f"Ocurrió un error al cifrar y copiar:\n{e}")
-
-    def encrypt_and_copy_item(self, source_path: Path, destination_folder: str):
-        """
-        Cifra y copia un item (archivo o carpeta) al baúl.
-        Las carpetas se recrean y los archivos dentro se cifran.
-        """
-        if source_path.is_dir():
-            # Si es una carpeta, la creamos (sin cifrar) en el destino
-            new_dest_folder = os.path.join(destination_folder, source_path.name)
-            os.makedirs(new_dest_folder, exist_ok=True)
-            # Recursión: Ciframos todo el contenido de esta carpeta
-            for sub_item in source_path.iterdir():
-                self.encrypt_and_copy_item(sub_item, new_dest_folder)
-        
-        elif source_path.is_file():
-            # Si es un archivo, ciframos el nombre y el contenido
-            
-            # 1. Cifrar nombre
-            encrypted_name_hex = self.fernet.encrypt(source_path.name.encode()).hex()
-            destination_path = os.path.join(destination_folder, encrypted_name_hex + ".enc")
-            
-            # 2. Cifrar contenido (¡Cuidado con archivos grandes!)
-            # Fernet carga todo en RAM. Para archivos > 1GB esto puede ser lento.
-            # Como pediste, mantenemos la implementación simple por ahora.
-            with open(source_path, 'rb') as f:
-                data = f.read()
-            
-            encrypted_data = self.fernet.encrypt(data)
-            
-            with open(destination_path, 'wb') as f:
-                f.write(encrypted_data)
+            engine = ImportEngine(self.fernet, self.manifests, compression="auto", dedup=self.dedup_var.get())
+        except (OSError, InvalidToken) as e:
+            messagebox.showerror("Error", f"No se pudo abrir el almacén de trozos:\n{e}")
+            return
+        self.transfers.submit(f"Cifrando {len(files_dragged)} elemento(s)", engine, files_dragged, self.baul_path)
+        self.cancel_button.configure(state="normal")
 
     # MODIFICADO: Esta función ahora DESCIFRA todo lo seleccionado
     def button_event(self):
@@ -249,57 +509,60 @@ class App(ctk.CTk):
         destination_folder = filedialog.askdirectory(title="Selecciona una carpeta de destino")
 
         if destination_folder:
-            try:
-                for item_path_str in top_level_items:
-                    self.decrypt_and_copy_item(Path(item_path_str), destination_folder)
-                
-                messagebox.showinfo("Éxito", f"{len(top_level_items)} elemento(s) descifrados y copiados a:\n{destination_folder}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Ocurrió un error al descifrar y copiar:\n{e}")
-
-    def decrypt_and_copy_item(self, source_path: Path, destination_folder: str):
-        """
-        Descifra y copia un item (archivo o carpeta) del baúl a la PC.
-        """
-        if source_path.is_dir():
-            # Si es una carpeta, creamos la carpeta (descifrada = nombre normal)
-            new_dest_folder = os.path.join(destination_folder, source_path.name)
-            os.makedirs(new_dest_folder, exist_ok=True)
-            # Recursión: Desciframos todo su contenido
-            for sub_item in source_path.iterdir():
-                self.decrypt_and_copy_item(sub_item, new_dest_folder)
-
-        elif source_path.is_file() and source_path.name.endswith(".enc"):
-            # Si es un archivo .enc...
-            
-            # 1. Descifrar nombre
-            try:
-                encrypted_name_hex = source_path.name.replace(".enc", "")
-                decrypted_name = self.fernet.decrypt(bytes.fromhex(encrypted_name_hex)).decode()
-                destination_path = os.path.join(destination_folder, decrypted_name)
-            except Exception as e:
-                print(f"No se pudo descifrar el nombre {source_path.name}: {e}")
-                messagebox.showwarning("Error de nombre", f"No se pudo descifrar el nombre del archivo {source_path.name}. Se omitirá.")
-                return
-
-            # 2. Descifrar contenido
-            try:
-                with open(source_path, 'rb') as f:
-                    encrypted_data = f.read()
-                
-                data = self.fernet.decrypt(encrypted_data)
-                
-                with open(destination_path, 'wb') as f:
-                    f.write(data)
-            except InvalidToken:
-                messagebox.showerror("Error", f"Error de llave al descifrar {decrypted_name}. ¿Archivo corrupto?")
-            except Exception as e:
-                messagebox.showerror("Error", f"No se pudo descifrar el contenido de {decrypted_name}: {e}")
+            engine = ExportEngine(self.fernet, self.manifests, pool=self.chunk_pool)
+            self.transfers.submit(f"Descifrando {len(top_level_items)} elemento(s)", engine,
+                                  top_level_items, destination_folder)
+            self.cancel_button.configure(state="normal")
+
+    def on_cancel_transfer(self):
+        self.transfers.cancel()
+
+    def on_transfer_progress(self, progress):
+        text = f"{progress.label}\n{progress.files_done}/{progress.files_total} archivo(s)"
+        if progress.bytes_done:
+            text += f" · {progress.mb_per_second:.1f} MB/s · faltan {format_eta(progress.eta_seconds)}"
+        if progress.queued:
+            text += f"\n({progress.queued} más en cola)"
+        self.status_label.configure(text=text)
+        self.progress_bar.set(progress.fraction)
+
+    def on_transfer_finished(self, job):
+        """Un solo resumen al final de cada trabajo, con todos los errores juntos."""
+        if not self.transfers.busy:
+            self.cancel_button.configure(state="disabled")
+            self.progress_bar.set(0)
+
+        report = job.report
+        if report is None:
+            self.status_label.configure(text="")
+            messagebox.showerror("Error", f"Ocurrió un error en '{job.label}':\n{job.error}")
+            return
 
+        resumen = f"{report.files_ok} archivo(s) · {report.mb_per_second:.1f} MB/s"
+        if report.files_skipped:
+            # Importación incremental: lo que ya estaba en el baúl no se copia de nuevo
+            resumen += (f" · {report.files_skipped} sin cambios ({report.bytes_skipped / (1024 * 1024):.1f} MB)"
+                        f" · {report.bytes_written / (1024 * 1024):.1f} MB escritos")
+        if report.cancelled:
+            self.status_label.configure(text=f"Cancelado: {resumen}")
+        else:
+            self.status_label.configure(text=f"Listo: {resumen}")
+
+        if report.failed:
+            detalle = "\n".join(f"{os.path.basename(r.source)}: {r.error}" for r in report.failed[:10])
+            if len(report.failed) > 10:
+                detalle += f"\n... y {len(report.failed) - 10} más"
+            messagebox.showerror("Error", f"{job.label}: {len(report.failed)} archivo(s) con error:\n{detalle}")
+        elif not report.cancelled:
+            messagebox.showinfo("Éxito", f"{job.label}: {resumen}\nDestino:\n{job.destination}")
 
     def on_closing(self):
         self.observer.stop()
         self.observer.join()
+        self.transfers.shutdown()
+        self.chunk_pool.shutdown(cancel_futures=True)
+        self.tree_view.scan_pool.shutdown(wait=False, cancel_futures=True)
+        self.search_index.close()
         self.destroy()
 
 if __name__ == "__main__":
@@ -0,0 +1,253 @@
+import os
+import json
+import secrets
+import threading
+from cryptography.fernet import InvalidToken
+import instrumentation
+import dedup_store
+
+# Manifiesto cifrado de nombres, uno por carpeta del baúl.
+#
+# Antes cada archivo se guardaba como fernet.encrypt(nombre).hex() + ".enc":
+# nombres de cientos de caracteres (lentos en FAT32/exFAT y con el límite de
+# 255) y un descifrado Fernet por archivo cada vez que se mostraba el árbol.
+#
+# Ahora cada archivo se guarda con un identificador corto y opaco
+# ("3f9a0c1d2b4e5f60.enc") y cada carpeta tiene un archivo MANIFEST_NAME con
+# un solo token Fernet que contiene:
+#
+#   {"version": 1, "entries": {"3f9a0c1d2b4e5f60.enc": {"name": ..., "size": ..., "mtime": ...}}}
+#
+# Los manifiestos se descifran una sola vez (al desbloquear) y se reescriben
+# de forma atómica: primero un archivo temporal y luego os.replace().
+#
+# Los archivos reemplazados o quitados se borran recién después de guardar
+# el manifiesto; si eran deduplicados, antes se sueltan sus trozos del
+# almacén (ver dedup_store.py).
+
+MANIFEST_NAME = ".baul.manifest"
+# Carpetas internas del baúl (almacén de trozos, paquetes): empiezan así y no
+# tienen manifiestos ni se muestran en el árbol
+INTERNAL_PREFIX = ".baul."
+MANIFEST_VERSION = 1
+
+
+def new_file_id() -> str:
+    """Nombre en disco para un archivo nuevo: 16 caracteres hex + '.enc'."""
+    return secrets.token_hex(8) + ".enc"
+
+
+def is_internal_dir(name: str) -> bool:
+    """True para las carpetas internas del baúl (ver dedup_store.py y pack_store.py)."""
+    return name.startswith(INTERNAL_PREFIX)
+
+
+def is_file_id(disk_name: str) -> bool:
+    """True si 'disk_name' tiene la forma de un id de new_file_id()."""
+    stem = disk_name[:-len(".enc")]
+    return disk_name.endswith(".enc") and len(stem) == 16 and all(c in "0123456789abcdef" for c in stem)
+
+
+class ManifestStore:
+    """
+    Manifiestos de todas las carpetas del baúl, ya descifrados en memoria.
+
+    Es seguro usarlo desde varios hilos (el motor de importación agrega
+    entradas desde su hilo de escritura mientras la interfaz las lee).
+    """
+    def __init__(self, baul_path, session_key):
+        self.baul_path = str(baul_path)
+        self.session_key = session_key
+        self._lock = threading.RLock()
+        self._manifests = {}       # carpeta -> {id: entrada}
+        self._mtimes = {}          # carpeta -> mtime del manifiesto leído
+        self._dirty = set()        # carpetas con cambios sin guardar
+        self._pending_deletes = {} # carpeta -> [ids a borrar tras guardar]
+        self._chunk_store = None   # ver chunk_store()
+
+    def _key(self, folder) -> str:
+        return os.path.normpath(str(folder))
+
+    def preload(self):
+        """Carga y descifra todos los manifiestos del baúl (para recorridos completos, como scrub.py)."""
+        for folder, dirs, files in os.walk(self.baul_path):
+            dirs[:] = [name for name in dirs if not is_internal_dir(name)]
+            if MANIFEST_NAME in files:
+                self.entries(folder)
+
+    def entries(self, folder) -> dict:
+        """
+        Retorna las entradas {id: {"name": ..., ...}} de una carpeta.
+        Si la carpeta no tiene manifiesto se retorna un diccionario vacío.
+        """
+        key = self._key(folder)
+        with self._lock:
+            if key not in self._manifests:
+                self._manifests[key] = self._read(key)
+            return self._manifests[key]
+
+    def revalidate(self, folder):
+        """
+        Si el manifiesto de la carpeta cambió en disco (otro programa u otra
+        PC escribió en la USB), se descarta la copia en memoria para que se
+        vuelva a leer. Cuesta un solo stat por carpeta.
+        """
+        key = self._key(folder)
+        with self._lock:
+            if key not in self._manifests or key in self._dirty:
+                return
+            if self._manifest_mtime(key) != self._mtimes.get(key):
+                del self._manifests[key]
+
+    def _manifest_mtime(self, folder):
+        try:
+            return os.stat(os.path.join(folder, MANIFEST_NAME)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read(self, folder) -> dict:
+        path = os.path.join(folder, MANIFEST_NAME)
+        self._mtimes[folder] = self._manifest_mtime(folder)
+        try:
+            with open(path, 'rb') as f:
+                token = f.read()
+        except FileNotFoundError:
+            return {}
+
+        try:
+            with instrumentation.span("manifest_decrypt", len(token)):
+                data = json.loads(self.session_key.decrypt(token))
+        except (InvalidToken, ValueError) as e:
+            # Un manifiesto dañado no debe impedir abrir el resto del baúl
+            print(f"Manifiesto corrupto en {folder}: {e}")
+            return {}
+        return data.get("entries", {})
+
+    def lookup(self, folder, file_id: str):
+        """Retorna la entrada de 'file_id' o None si no está en el manifiesto."""
+        return self.entries(folder).get(file_id)
+
+    def find_by_name(self, folder, name: str):
+        """Retorna el id del archivo llamado 'name' en la carpeta, o None."""
+        for file_id, entry in self.entries(folder).items():
+            if entry.get("name") == name:
+                return file_id
+        return None
+
+    def add(self, folder, file_id: str, name: str, **metadata):
+        """
+        Registra un archivo en el manifiesto de su carpeta (en memoria).
+        Si ya había otro archivo con el mismo nombre, lo reemplaza: el archivo
+        viejo se borra del disco después de guardar el manifiesto.
+        """
+        key = self._key(folder)
+        with self._lock:
+            entries = self.entries(key)
+            old_id = self.find_by_name(key, name)
+            if old_id and old_id != file_id:
+                del entries[old_id]
+                self._pending_deletes.setdefault(key, []).append(old_id)
+            entries[file_id] = dict(metadata, name=name)
+            self._dirty.add(key)
+
+    def remove(self, folder, file_id: str):
+        """Quita un archivo del manifiesto y lo borra del disco al guardar."""
+        key = self._key(folder)
+        with self._lock:
+            if self.entries(key).pop(file_id, None) is not None:
+                self._pending_deletes.setdefault(key, []).append(file_id)
+                self._dirty.add(key)
+
+    def flush(self):
+        """Guarda en disco todos los manifiestos con cambios."""
+        with self._lock:
+            released = False
+            for key in list(self._dirty):
+                self._write(key)
+                self._dirty.discard(key)
+                for file_id in self._pending_deletes.pop(key, []):
+                    released |= self._delete_file(os.path.join(key, file_id))
+            if released:
+                self._chunk_store.save()
+
+    def chunk_store(self, create: bool = False):
+        """
+        El almacén de trozos deduplicados del baúl. Es uno solo por
+        ManifestStore, así las importaciones y los borrados de flush() usan
+        el mismo contador de referencias.
+
+        Lanza:
+            FileNotFoundError: Si el almacén no existe y 'create' es False.
+        """
+        with self._lock:
+            if self._chunk_store is None:
+                self._chunk_store = dedup_store.ChunkStore(self.baul_path, self.session_key, create=create)
+            return self._chunk_store
+
+    def _delete_file(self, path) -> bool:
+        """
+        Borra un archivo que ya no está en el manifiesto. Si era deduplicado
+        le resta sus referencias a los trozos que usaba.
+
+        Retorna:
+            bool: True si se soltaron trozos (hay que guardar el contador).
+        """
+        released = False
+        try:
+            recipe = dedup_store.read_recipe(self.session_key, path)
+        except FileNotFoundError:
+            # Ya lo borraron desde fuera de la app
+            return False
+        except (OSError, InvalidToken) as e:
+            # Los trozos que usaba los borra el próximo gc()
+            print(f"No se pudieron soltar los trozos de {path}: {e}")
+            recipe = None
+        if recipe is not None:
+            try:
+                self.chunk_store().release(recipe)
+                released = True
+            except (OSError, InvalidToken) as e:
+                # Sin almacén (o sin su llave) no hay trozos que soltar; el
+                # archivo se borra igual
+                print(f"No se pudieron soltar los trozos de {path}: {e}")
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return released
+
+    def _write(self, folder):
+        data = {"version": MANIFEST_VERSION, "entries": self._manifests[folder]}
+        token = self.session_key.encrypt(json.dumps(data).encode())
+
+        # Escritura atómica: si se desconecta la USB a medias, queda el
+        # manifiesto anterior completo y no uno truncado.
+        path = os.path.join(folder, MANIFEST_NAME)
+        tmp_path = path + ".tmp"
+        with instrumentation.span("manifest_write", len(token)):
+            with open(tmp_path, 'wb') as f:
+                f.write(token)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        self._mtimes[folder] = self._manifest_mtime(folder)
+
+
+def resolve_name(manifests: ManifestStore, folder, disk_name: str) -> str:
+    """
+    Retorna el nombre real de un archivo del baúl: primero se busca en el
+    manifiesto y, si no está, se intenta como nombre antiguo (Fernet en hex).
+
+    Lanza:
+        InvalidToken: Si el archivo no está en el manifiesto ni es un nombre
+                      antiguo válido.
+    """
+    entry = manifests.lookup(folder, disk_name)
+    if entry is not None:
+        return entry["name"]
+    try:
+        encrypted_name_hex = disk_name[:-len(".enc")]
+        with instrumentation.span("name_decrypt"):
+            return manifests.session_key.decrypt(bytes.fromhex(encrypted_name_hex)).decode()
+    except (ValueError, TypeError):
+        raise InvalidToken
@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+
+# Caché de nombres ya descifrados para el árbol de archivos.
+#
+# Descifrar un nombre con Fernet cuesta un HMAC y un AES, y el árbol se
+# vuelve a dibujar con cada evento de watchdog. Con esta caché un archivo que
+# no cambió no se vuelve a descifrar: la entrada se guarda con el mtime del
+# archivo y solo es válida mientras ese mtime no cambie.
+
+
+class NameCache:
+    """
+    Caché LRU de tamaño limitado: ruta en disco -> (mtime, nombre).
+
+    Los contadores 'hits', 'misses' y 'evictions' sirven para medir qué tanto
+    se está aprovechando (ver stats()). Se puede usar desde varios hilos.
+    """
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, mtime):
+        """
+        Retorna el nombre guardado para 'key' si su mtime coincide.
+        Retorna None si no está o si el archivo cambió desde que se guardó.
+        """
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None or cached[0] != mtime:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, key, mtime, name):
+        with self._lock:
+            self._entries[key] = (mtime, name)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,334 @@
+import os
+import sys
+import getpass
+import secrets
+import argparse
+from collections import OrderedDict
+from cryptography.fernet import InvalidToken
+import vault_format
+import chunk_codecs
+import manifest
+import scanner
+import vault_writer
+
+# Paquetes de archivos pequeños.
+#
+# Cada archivo del baúl era su propio .enc. En una USB con FAT32/exFAT eso
+# significa, por cada archivo, una entrada de directorio, un cluster (aunque
+# el archivo mida 200 bytes) y escrituras en la FAT: importar un árbol tipo
+# node_modules con 200k archivos diminutos tardaba muchísimo y desperdiciaba
+# mucho espacio.
+#
+# Ahora los archivos de hasta SMALL_FILE bytes se van agregando uno tras otro
+# a un "paquete" de hasta PACK_SIZE bytes en Baul/PACK_DIR. El paquete es un
+# archivo del baúl normal (mismo formato por bloques, ver vault_format.py) y
+# la entrada del manifiesto de cada archivo dice en qué paquete está y en qué
+# posición:
+#
+#   {"name": ..., "size": ..., "pack": "<paquete>", "offset": ...}
+#
+# El árbol y la exportación leen esas entradas como cualquier otro archivo
+# (PackedFileReader tiene la misma interfaz que VaultFileReader).
+#
+# Al borrar o reemplazar un archivo empaquetado su espacio queda libre dentro
+# del paquete; compact() borra los paquetes que ya no usa nadie y reescribe los
+# que quedaron casi vacíos:
+#
+#   python pack_store.py compact E:/Baul
+
+PACK_DIR = ".baul.packs"
+PACK_EXT = ".pack"
+SMALL_FILE = 64 * 1024            # Hasta este tamaño los archivos se empaquetan
+PACK_SIZE = 32 * 1024 * 1024      # Tamaño al que se cierra un paquete
+MIN_LIVE = 0.5                    # compact() reescribe los paquetes con menos de esto en uso
+OPEN_PACKS = 4                    # Paquetes abiertos a la vez en un PackCache
+
+
+def pack_path(baul_path, pack_name: str) -> str:
+    return os.path.join(str(baul_path), PACK_DIR, pack_name + PACK_EXT)
+
+
+def is_packed(entry) -> bool:
+    """True si la entrada del manifiesto es de un archivo empaquetado."""
+    return entry is not None and "pack" in entry
+
+
+class PackWriter:
+    """
+    Un paquete nuevo abierto para escritura. Los bloques se cifran a medida
+    que se llenan; el paquete solo es válido después de close().
+    """
+    def __init__(self, session_key, baul_path, codec: int = chunk_codecs.NONE, level: int = None,
+                 chunk_size: int = vault_format.CHUNK_SIZE):
+        self.name = secrets.token_hex(8)
+        self.path = pack_path(baul_path, self.name)
+        self.codec = codec
+        self.level = level
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._header, self._file_key = vault_format.new_file_header(session_key, chunk_size, codec)
+        self._buffer = bytearray()
+        self._index = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = vault_writer.VaultWriter(self.path)
+        self._file.write(self._header)
+
+    def append(self, data: bytes) -> int:
+        """
+        Agrega un archivo al paquete.
+
+        Retorna:
+            int: Posición del archivo dentro del paquete.
+        """
+        offset = self.size
+        self._buffer += data
+        self.size += len(data)
+        # Siempre se deja al menos un bloque en el buffer para marcar el último
+        while len(self._buffer) > self.chunk_size:
+            self._seal(bytes(self._buffer[:self.chunk_size]), False)
+            del self._buffer[:self.chunk_size]
+        return offset
+
+    def _seal(self, data: bytes, is_last: bool):
+        if self.codec:
+            piece = vault_format.pack_chunk(self._file_key, self._header, self._index, is_last, data,
+                                            self.codec, self.level)
+        else:
+            piece = vault_format.seal_chunk(self._file_key, self._header, self._index, is_last, data)
+        self._file.write(piece)
+        self._index += 1
+
+    def close(self):
+        """Cifra el último bloque y guarda el paquete en disco (con fsync)."""
+        try:
+            self._seal(bytes(self._buffer), True)
+        except Exception:
+            self._file.abort()
+            raise
+        self._buffer.clear()
+        self._file.commit()
+
+    def discard(self):
+        """Descarta un paquete a medias."""
+        self._file.abort()
+
+
+class _OpenPack:
+    """
+    Un paquete abierto que recuerda el último bloque descifrado: al exportar
+    muchos archivos pequeños seguidos, casi todos salen del mismo bloque.
+    """
+    def __init__(self, session_key, path):
+        self.reader = vault_format.VaultFileReader(session_key, path)
+        self._cached_index = None
+        self._cached = b""
+
+    def _chunk(self, index: int) -> bytes:
+        if index != self._cached_index:
+            self._cached = self.reader.read_chunk(index)
+            self._cached_index = index
+        return self._cached
+
+    def read(self, offset: int, length: int) -> bytes:
+        pieces = []
+        while length > 0:
+            index, start = divmod(offset, self.reader.chunk_size)
+            piece = self._chunk(index)[start:start + length]
+            pieces.append(piece)
+            offset += len(piece)
+            length -= len(piece)
+        return b"".join(pieces)
+
+    def close(self):
+        self.reader.close()
+
+
+class PackCache:
+    """
+    Mantiene abiertos los últimos OPEN_PACKS paquetes usados, para no volver
+    a abrir (y descifrar) el mismo paquete por cada archivo pequeño.
+    """
+    def __init__(self, session_key, baul_path):
+        self.session_key = session_key
+        self.baul_path = baul_path
+        self._packs = OrderedDict()
+
+    def get(self, pack_name: str) -> _OpenPack:
+        pack = self._packs.pop(pack_name, None)
+        if pack is None:
+            pack = _OpenPack(self.session_key, pack_path(self.baul_path, pack_name))
+            if len(self._packs) >= OPEN_PACKS:
+                self._packs.popitem(last=False)[1].close()
+        self._packs[pack_name] = pack
+        return pack
+
+    def close(self):
+        for pack in self._packs.values():
+            pack.close()
+        self._packs.clear()
+
+
+class PackedFileReader:
+    """
+    Lee un archivo empaquetado con la misma interfaz que VaultFileReader
+    ('size', iter_chunks, read_range y copy_to). Con un PackCache el paquete
+    se comparte con los demás archivos.
+
+    Lanza:
+        InvalidToken: Si el archivo se sale del paquete.
+    """
+    def __init__(self, session_key, baul_path, entry: dict, cache: PackCache = None):
+        self._owned = cache is None
+        if self._owned:
+            self._pack = _OpenPack(session_key, pack_path(baul_path, entry["pack"]))
+        else:
+            self._pack = cache.get(entry["pack"])
+        self.offset = entry["offset"]
+        self.size = entry["size"]
+        if self.offset + self.size > self._pack.reader.size:
+            self.close()
+            raise InvalidToken
+
+    def iter_chunks(self, offset: int = 0, length: int = None, pool=None):
+        # Un archivo empaquetado mide a lo más SMALL_FILE: sale en una pieza
+        end = self.size if length is None else min(self.size, offset + length)
+        if offset < end:
+            yield self._pack.read(self.offset + offset, end - offset)
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        return b"".join(self.iter_chunks(offset, length))
+
+    def copy_to(self, dst, offset: int = 0, length: int = None, pool=None) -> int:
+        written = 0
+        for plain in self.iter_chunks(offset, length, pool):
+            dst.write(plain)
+            written += len(plain)
+        return written
+
+    def close(self):
+        if self._owned:
+            self._pack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _packed_entries(manifests):
+    """
+    Recorre los manifiestos de todo el baúl.
+
+    Retorna:
+        tuple: ({paquete: [(carpeta, id, entrada), ...]}, [(ruta, error)])
+    """
+    by_pack = {}
+    errors = []
+    skip = lambda name: name == ".credentials" or manifest.is_internal_dir(name)
+    for folder, entries in scanner.walk(manifests.baul_path, with_stat=False, skip=skip):
+        if not any(entry.name == manifest.MANIFEST_NAME for entry in entries):
+            continue
+        # Un manifiesto que no se puede leer podría usar cualquier paquete
+        path = os.path.join(folder, manifest.MANIFEST_NAME)
+        try:
+            with open(path, 'rb') as f:
+                manifests.session_key.decrypt(f.read())
+        except (OSError, InvalidToken) as e:
+            errors.append((path, str(e) or "Manifiesto corrupto"))
+            continue
+        manifests.revalidate(folder)
+        for file_id, entry in manifests.entries(folder).items():
+            if is_packed(entry):
+                by_pack.setdefault(entry["pack"], []).append((folder, file_id, entry))
+    return by_pack, errors
+
+
+def compact(manifests, min_live: float = MIN_LIVE, codec: int = None) -> dict:
+    """
+    Borra los paquetes que ya no usa ningún archivo y reescribe los que
+    tienen menos de 'min_live' de su contenido en uso ('codec' por defecto:
+    chunk_codecs.default_codec()).
+
+    Si algún manifiesto no se puede leer no se toca nada.
+
+    Retorna:
+        dict: removed, rewritten, freed (bytes) y errors [(ruta, error)].
+    """
+    session_key = manifests.session_key
+    codec = chunk_codecs.default_codec() if codec is None else codec
+    by_pack, errors = _packed_entries(manifests)
+    report = {"removed": 0, "rewritten": 0, "freed": 0, "errors": errors}
+    if errors:
+        return report
+
+    pack_dir = os.path.join(manifests.baul_path, PACK_DIR)
+    try:
+        packs = [entry for entry in scanner.scan_dir(pack_dir) if entry.name.endswith(PACK_EXT)]
+    except FileNotFoundError:
+        return report
+
+    for pack in packs:
+        name = pack.name[:-len(PACK_EXT)]
+        users = by_pack.get(name, [])
+        try:
+            if not users:
+                os.remove(pack.path)
+                report["removed"] += 1
+                report["freed"] += pack.size
+                continue
+
+            with vault_format.VaultFileReader(session_key, pack.path) as reader:
+                if sum(entry["size"] for _, _, entry in users) >= reader.size * min_live:
+                    continue
+                # Se copian los archivos vivos a un paquete nuevo; el viejo se
+                # borra solo después de guardar los manifiestos
+                writer = PackWriter(session_key, manifests.baul_path, codec)
+                try:
+                    for folder, file_id, entry in users:
+                        data = reader.read_range(entry["offset"], entry["size"])
+                        metadata = {key: value for key, value in entry.items() if key != "name"}
+                        metadata.update(pack=writer.name, offset=writer.append(data))
+                        manifests.add(folder, file_id, entry["name"], **metadata)
+                    writer.close()
+                except Exception:
+                    writer.discard()
+                    raise
+            manifests.flush()
+            new_size = os.path.getsize(writer.path)
+            os.remove(pack.path)
+            report["rewritten"] += 1
+            report["freed"] += max(0, pack.size - new_size)
+        except (OSError, InvalidToken) as e:
+            errors.append((pack.path, str(e) or "Paquete corrupto"))
+    return report
+
+
+def main(argv=None):
+    import crypto_utils
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de los paquetes de archivos pequeños")
+    parser.add_argument("action", choices=["compact"])
+    parser.add_argument("baul_path", help="Carpeta 'Baul' de la USB")
+    parser.add_argument("--min-live", type=float, default=MIN_LIVE,
+                        help="Reescribir los paquetes con menos de esta fracción en uso")
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(args.baul_path, ".credentials", "vault.key"), 'rb') as f:
+        content = f.read()
+    try:
+        session_key = crypto_utils.unlock_vault_key(getpass.getpass("Contraseña: "), content)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    report = compact(manifest.ManifestStore(args.baul_path, session_key), args.min_live)
+    for path, error in report["errors"]:
+        print(f"Error en {path}: {error}")
+    print(f"Paquetes borrados: {report['removed']} · Reescritos: {report['rewritten']} · "
+          f"Liberados: {report['freed'] / (1024 * 1024):.1f} MB")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+import os
+import sys
+import getpass
+import argparse
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import Fernet, InvalidToken
+import crypto_utils
+import vault_format
+import manifest
+import scanner
+import dedup_store
+import pack_store
+
+# Cambio de contraseña y rotación de la llave maestra.
+#
+# La jerarquía de llaves es:
+#
+#   contraseña -> vault.key (llave maestra) -> llave de cada archivo
+#
+# - Cambiar la contraseña solo vuelve a cifrar el 'vault.key' (unos cientos
+#   de bytes). Los respaldos viejos del 'vault.key' siguen abriendo el baúl
+#   con la contraseña vieja.
+# - Rotar la llave maestra reescribe el registro de llave de cada cabecera
+#   (68 bytes por archivo, ver vault_format.py), los manifiestos y las llaves
+#   del almacén de trozos (ver dedup_store.py). Solo los archivos en formatos
+#   anteriores se vuelven a cifrar completos, una vez.
+#
+# La rotación se puede interrumpir y retomar: mientras dura, el 'vault.key'
+# guarda la llave nueva y la anterior, y cada archivo dice en su cabecera con
+# cuál está envuelta, así que volver a correrla solo toca lo que falta.
+#
+# Uso (con la app cerrada), desde la carpeta 'gemini':
+#   python rekey.py password E:/Baul
+#   python rekey.py rotate E:/Baul
+
+
+@dataclass
+class RotationReport:
+    """Resultado de una rotación de la llave maestra."""
+    skipped: int = 0        # Ya tenían la llave nueva
+    rewrapped: int = 0      # Solo se reescribió la cabecera
+    reencrypted: int = 0    # Formato anterior: se cifró de nuevo completo
+    manifests: int = 0
+    failed: list = field(default_factory=list)  # (ruta, error)
+    finished: bool = False  # Se quitó la llave anterior del 'vault.key'
+
+
+def key_file_path(baul_path) -> str:
+    return os.path.join(str(baul_path), ".credentials", "vault.key")
+
+
+def _write_atomic(path, data: bytes):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def change_password(key_path, old_password: str, new_password: str):
+    """
+    Cambia la contraseña del baúl sin tocar ningún archivo cifrado.
+
+    Lanza:
+        ValueError: Si la contraseña actual es incorrecta.
+    """
+    with open(key_path, 'rb') as f:
+        content = f.read()
+    _write_atomic(str(key_path), crypto_utils.change_password(content, old_password, new_password))
+
+
+def rotate_master_key(baul_path, password: str, workers: int = None, on_progress=None) -> RotationReport:
+    """
+    Genera una llave maestra nueva y migra a ella todo el baúl.
+
+    Si una rotación anterior quedó a medias, se continúa con la misma llave
+    nueva. 'on_progress(ruta, acción)' se llama desde los hilos de trabajo
+    por cada archivo.
+
+    Retorna:
+        RotationReport: Si hubo errores, la llave anterior se conserva en el
+                        'vault.key' y se puede volver a correr para terminar.
+
+    Lanza:
+        ValueError: Si la contraseña es incorrecta.
+    """
+    key_path = key_file_path(baul_path)
+    with open(key_path, 'rb') as f:
+        session_key = crypto_utils.unlock_vault_key(password, f.read())
+
+    # 1. Llave nueva (o la de la rotación pendiente) más las anteriores
+    if len(session_key.keys) == 1:
+        keys = [Fernet.generate_key()] + session_key.keys
+        _write_atomic(key_path, crypto_utils.wrap_vault_keys(password, keys))
+        session_key = crypto_utils.SessionKey(*keys)
+
+    report = RotationReport()
+    report_lock = threading.Lock()
+    manifests = manifest.ManifestStore(baul_path, session_key)
+
+    # 2. Archivos, en paralelo
+    def migrate(folder, disk_name):
+        path = os.path.join(folder, disk_name)
+        try:
+            action = _migrate_file(session_key, manifests, folder, disk_name)
+        except Exception as e:
+            # Cualquier error (no solo de disco o de llave) deja el archivo
+            # pendiente: con algo en 'failed' no se olvida la llave anterior.
+            # Dentro del pool, una excepción sin capturar se perdería.
+            with report_lock:
+                report.failed.append((path, str(e) or "Archivo corrupto o llave desconocida"))
+            action = "failed"
+        else:
+            with report_lock:
+                setattr(report, action, getattr(report, action) + 1)
+        if on_progress:
+            on_progress(path, action)
+
+    manifest_folders = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for folder, entries in scanner.walk(baul_path, with_stat=False,
+                                            skip=lambda name: name in (".credentials", dedup_store.STORE_DIR)):
+            for entry in entries:
+                if entry.name == manifest.MANIFEST_NAME:
+                    manifest_folders.append(folder)
+                elif not entry.is_dir and entry.name.endswith((".enc", pack_store.PACK_EXT)):
+                    pool.submit(migrate, folder, entry.name)
+    manifests.flush()
+
+    # 3. Manifiestos (pequeños: se vuelven a cifrar todos) y las llaves del
+    # almacén de trozos, que también van cifradas con la maestra
+    small_files = [os.path.join(folder, manifest.MANIFEST_NAME) for folder in manifest_folders]
+    store_key = os.path.join(str(baul_path), dedup_store.STORE_DIR, dedup_store.STORE_KEY)
+    if os.path.exists(store_key):
+        small_files.append(store_key)
+    for path in small_files:
+        try:
+            with open(path, 'rb') as f:
+                _write_atomic(path, session_key.rotate(f.read()))
+            report.manifests += 1
+        except (OSError, InvalidToken) as e:
+            report.failed.append((path, str(e) or "Manifiesto corrupto"))
+
+    # 4. Solo si no quedó nada pendiente se olvida la llave anterior
+    if not report.failed:
+        _write_atomic(key_path, crypto_utils.wrap_vault_keys(password, session_key.keys[:1]))
+        report.finished = True
+    return report
+
+
+def _migrate_file(session_key, manifests, folder, disk_name) -> str:
+    """
+    Pasa un archivo a la llave maestra actual.
+
+    Retorna:
+        str: "skipped", "rewrapped" o "reencrypted".
+    """
+    path = os.path.join(folder, disk_name)
+
+    if (disk_name.endswith(".enc") and manifests.lookup(folder, disk_name) is None
+            and not manifest.is_file_id(disk_name)):
+        # Nombre antiguo (Fernet en hex, cifrado con la llave anterior): se
+        # pasa al manifiesto con un id nuevo
+        name = manifest.resolve_name(manifests, folder, disk_name)
+        file_id = manifest.new_file_id()
+        size = vault_format.reencrypt_file(session_key, path, os.path.join(folder, file_id))
+        manifests.add(folder, file_id, name, size=size)
+        manifests.flush()
+        os.remove(path)
+        return "reencrypted"
+
+    with open(path, 'r+b') as f:
+        header = f.read(vault_format.HEADER_SIZE)
+        if vault_format.is_chunked(header) and vault_format.unpack_header(header)["version"] >= 2:
+            record = vault_format.rewrap_header(session_key, header)
+            if record is None:
+                return "skipped"
+            # Mismo tamaño y misma posición: el contenido no se toca
+            f.seek(vault_format.BASE_HEADER_SIZE)
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+            return "rewrapped"
+
+    # Fernet antiguo o versión 1: la llave depende de la maestra, hay que
+    # cifrarlo de nuevo
+    tmp_path = path + ".tmp"
+    try:
+        vault_format.reencrypt_file(session_key, path, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return "reencrypted"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cambiar la contraseña o rotar la llave maestra del baúl")
+    parser.add_argument("action", choices=["password", "rotate"])
+    parser.add_argument("baul_path", help="Carpeta 'Baul' de la USB")
+    args = parser.parse_args(argv)
+
+    password = getpass.getpass("Contraseña actual: ")
+    try:
+        if args.action == "password":
+            new_password = getpass.getpass("Contraseña nueva: ")
+            if new_password != getpass.getpass("Confirmar contraseña nueva: "):
+                print("Las contraseñas no coinciden.")
+                return 1
+            change_password(key_file_path(args.baul_path), password, new_password)
+            print("Contraseña cambiada. Guarda un respaldo nuevo de 'vault.key'.")
+            return 0
+
+        report = rotate_master_key(args.baul_path, password)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    print(f"Cabeceras reescritas: {report.rewrapped} · Cifrados de nuevo: {report.reencrypted} · "
+          f"Sin cambios: {report.skipped} · Manifiestos: {report.manifests}")
+    for path, error in report.failed:
+        print(f"Error en {path}: {error}")
+    if not report.finished:
+        print("La rotación quedó a medias; vuelve a correrla para terminar.")
+        return 1
+    print("Rotación terminada. Guarda un respaldo nuevo de 'vault.key': los anteriores ya no sirven.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
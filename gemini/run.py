@@ -1,6 +1,7 @@
 import customtkinter as ctk
 import psutil
 import os
+import multiprocessing
 from pathlib import Path
 from tkinter import messagebox
 import setup_gui  # Importamos la nueva ventana de configuración
@@ -102,6 +103,8 @@ def main_bootstrapper():
         login_app.mainloop()
 
 if __name__ == "__main__":
+    # Necesario en el .exe de PyInstaller para el pool de procesos del cifrado
+    multiprocessing.freeze_support()
     ctk.set_appearance_mode("dark")
     ctk.set_default_color_theme("blue")
     main_bootstrapper()
@@ -0,0 +1,419 @@
+import os
+import sys
+import json
+import time
+import getpass
+import hashlib
+import argparse
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import InvalidToken
+import vault_format
+import manifest
+import scanner
+import pack_store
+import dedup_store
+import vault_writer
+import instrumentation
+from transfer_engine import FileResult, TransferReport
+
+# Revisión de integridad de todo el baúl ("scrub").
+#
+# Un .enc dañado solo se descubría al abrir la carpeta en el árbol
+# ("¡Archivo corrupto!") o a la mitad de una exportación. La revisión
+# descifra todo el baúl sin escribir texto plano en ningún lado:
+#
+# - Cada archivo: su nombre (entrada del manifiesto, o nombre antiguo que se
+#   pueda descifrar) y cada bloque de su contenido (AES-GCM autentica cada
+#   uno), y si el manifiesto guarda el hash del original, también el hash.
+#   Los archivos deduplicados se leen a través de sus trozos.
+# - Cada paquete (ver pack_store.py) se descifra una sola vez, y al pasar se
+#   calcula el hash de cada archivo que contiene.
+# - Entradas del manifiesto cuyo archivo ya no está en disco.
+#
+# Los archivos se revisan en paralelo en un pool de hilos, bloque por bloque
+# (memoria constante, salvo los archivos en formato Fernet antiguo, que se
+# descifran completos). Scrubber tiene la misma interfaz que los motores de
+# transfer_engine.py (measure, run, cancel), así que cli.py lo corre igual que
+# una exportación y reporta bytes/s y tiempo total.
+#
+# En modo incremental solo se revisa lo que cambió (tamaño o fecha en disco)
+# desde la última revisión sin errores; eso se guarda en Baul/STATE_NAME.
+#
+#   python scrub.py E:/Baul [--incremental]
+#   python cli.py scrub E:/Baul [--incremental]
+
+STATE_NAME = ".baul.scrub"
+STATE_VERSION = 1
+
+
+@dataclass
+class ScrubReport(TransferReport):
+    """TransferReport más los restos de escrituras interrumpidas encontrados."""
+    temp_files: list = field(default_factory=list)
+
+    @property
+    def extra(self) -> dict:
+        return {"temp_files": self.temp_files}
+
+
+class _Unit:
+    """Algo que se revisa de una vez: un archivo .enc o un paquete con sus archivos."""
+    def __init__(self, path: str, size: int, mtime: int, plain_size: int, packed=None):
+        self.path = path
+        self.size = size            # En disco (para el modo incremental)
+        self.mtime = mtime
+        self.plain_size = plain_size
+        self.packed = packed        # Solo paquetes: [(carpeta, id, entrada)]
+
+
+class Scrubber:
+    """
+    Revisa la integridad de los archivos del baúl usando varios hilos.
+
+    Parámetros:
+        session_key: La llave de sesión descifrada.
+        manifests: El ManifestStore del baúl.
+        workers: Hilos de revisión (por defecto, uno por núcleo).
+        incremental: Si es True se saltan los archivos sin cambios desde la
+                     última revisión.
+    """
+    def __init__(self, session_key, manifests, workers: int = None, incremental: bool = False):
+        self.session_key = session_key
+        self.manifests = manifests
+        self.workers = workers or os.cpu_count() or 1
+        self.incremental = incremental
+        self.state_path = os.path.join(manifests.baul_path, STATE_NAME)
+        self._chunk_store = None
+        self._store_lock = threading.Lock()
+        self._plan = None
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Pide que la revisión se detenga en el siguiente bloque."""
+        self._cancel.set()
+
+    # --- Qué hay que revisar ---
+    def _make_plan(self, sources):
+        """
+        Recorre las carpetas 'sources' (rutas reales dentro del baúl; por
+        defecto todo) sin descifrar nada.
+
+        Retorna:
+            tuple: ([_Unit], [FileResult con error], [archivos .tmp])
+        """
+        units, problems, temp_files = [], [], []
+        by_pack = {}
+        for source in sources or [self.manifests.baul_path]:
+            for folder, entries in scanner.walk(source):
+                top = self._relative(folder).split("/")[0]
+                if top == ".credentials" or manifest.is_internal_dir(top):
+                    for entry in entries:
+                        if entry.name.endswith(vault_writer.TEMP_SUFFIX):
+                            temp_files.append(entry.path)
+                    continue
+                self.manifests.revalidate(folder)
+                known = self.manifests.entries(folder)
+                on_disk = set()
+                for entry in entries:
+                    if entry.is_dir:
+                        continue
+                    if entry.name.endswith(vault_writer.TEMP_SUFFIX):
+                        temp_files.append(entry.path)
+                    elif entry.name.endswith(".enc"):
+                        on_disk.add(entry.name)
+                        plain = known.get(entry.name, {}).get("size", entry.size)
+                        units.append(_Unit(entry.path, entry.size, entry.mtime, plain))
+                for file_id, info in list(known.items()):
+                    if pack_store.is_packed(info):
+                        by_pack.setdefault(info["pack"], []).append((folder, file_id, info))
+                    elif file_id not in on_disk:
+                        problems.append(FileResult(source=os.path.join(folder, file_id), name=info["name"],
+                                                   size=info.get("size", 0),
+                                                   error="Falta el archivo (está en el manifiesto)"))
+
+        for pack_name, packed in by_pack.items():
+            path = pack_store.pack_path(self.manifests.baul_path, pack_name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                for folder, file_id, info in packed:
+                    problems.append(FileResult(source=os.path.join(folder, file_id), name=info["name"],
+                                               size=info["size"], error="Falta el paquete del archivo"))
+                continue
+            units.append(_Unit(path, st.st_size, st.st_mtime_ns, sum(info["size"] for _, _, info in packed),
+                               packed))
+        return units, problems, temp_files
+
+    def measure(self, sources):
+        """Retorna (archivos, bytes de texto plano) a revisar."""
+        self._plan = (list(sources or []), self._make_plan(sources))
+        units, problems, _ = self._plan[1]
+        files = sum(len(unit.packed) if unit.packed else 1 for unit in units) + len(problems)
+        return files, sum(unit.plain_size for unit in units)
+
+    # --- Estado del modo incremental ---
+    def _relative(self, path) -> str:
+        relative = os.path.relpath(str(path), self.manifests.baul_path).replace(os.sep, "/")
+        return "" if relative == "." else relative
+
+    def _state_key(self, unit: _Unit) -> str:
+        return self._relative(unit.path)
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data.get("checked", {}) if data.get("version") == STATE_VERSION else {}
+
+    def _save_state(self, checked: dict):
+        data = {"version": STATE_VERSION, "finished": time.time(), "checked": checked}
+        tmp_path = self.state_path + vault_writer.TEMP_SUFFIX
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    # --- Revisión ---
+    def run(self, sources=None, destination_folder=None, on_file_done=None, on_progress=None) -> ScrubReport:
+        """
+        Revisa 'sources' (rutas reales dentro del baúl; por defecto todo) y
+        espera a que termine. 'destination_folder' no se usa (está por la
+        interfaz común con los motores); los callbacks funcionan igual que en
+        ImportEngine.run.
+
+        Retorna:
+            ScrubReport: Un resultado por archivo (los dañados con su error).
+        """
+        report = ScrubReport()
+        started = time.perf_counter()
+        if self._plan is None or self._plan[0] != list(sources or []):
+            self.measure(sources)
+        units, problems, report.temp_files = self._plan[1]
+        self._plan = None
+        self._on_file_done = on_file_done
+        self._on_progress = on_progress
+        self._report = report
+        self._lock = threading.Lock()
+
+        previous = self._load_state()
+        checked = {}
+        attempted = set()
+        for result in problems:
+            self._finish(result)
+
+        # Como mucho unas pocas unidades en vuelo por hilo: la memoria no
+        # crece con la cantidad de archivos
+        slots = threading.BoundedSemaphore(self.workers * 4)
+
+        def check(unit, key):
+            try:
+                if self._check(unit) and not self._cancel.is_set():
+                    with self._lock:
+                        checked[key] = [unit.size, unit.mtime]
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for unit in units:
+                if self._cancel.is_set():
+                    break
+                key = self._state_key(unit)
+                attempted.add(key)
+                if self.incremental and previous.get(key) == [unit.size, unit.mtime]:
+                    checked[key] = previous[key]
+                    self._skip(unit)
+                    continue
+                slots.acquire()
+                pool.submit(check, unit, key)
+
+        # Lo revisado antes fuera de 'sources' sigue valiendo para la próxima vez
+        scope = [self._relative(source) for source in sources or [self.manifests.baul_path]]
+        if "" not in scope:
+            for key, value in previous.items():
+                if key not in attempted and not any(key.startswith(prefix + "/") for prefix in scope):
+                    checked[key] = value
+        try:
+            self._save_state(checked)
+        except OSError as e:
+            print(f"No se pudo guardar el estado de la revisión: {e}")
+
+        report.elapsed = time.perf_counter() - started
+        report.cancelled = self._cancel.is_set()
+        return report
+
+    def _skip(self, unit: _Unit):
+        """Sin cambios desde la última revisión."""
+        if unit.packed is None:
+            self._finish(FileResult(source=unit.path, size=unit.plain_size, skipped=True))
+            return
+        for folder, file_id, info in unit.packed:
+            self._finish(FileResult(source=os.path.join(folder, file_id), name=info["name"],
+                                    size=info["size"], skipped=True))
+
+    def _finish(self, result: FileResult, started: float = None):
+        if started is not None:
+            result.seconds = time.perf_counter() - started
+        if result.skipped and self._on_progress:
+            self._on_progress(result.size)
+        with self._lock:
+            self._report.results.append(result)
+        instrumentation.count("files_scrubbed")
+        if self._on_file_done:
+            self._on_file_done(result)
+
+    def _check(self, unit: _Unit) -> bool:
+        """Revisa una unidad. Retorna True si no tuvo errores."""
+        try:
+            if unit.packed is not None:
+                return self._check_pack(unit)
+            return self._check_file(unit)
+        except Exception as e:
+            # Un error inesperado en un archivo no detiene la revisión
+            self._finish(FileResult(source=unit.path, error=f"Error inesperado: {e}"))
+            return False
+
+    def _check_file(self, unit: _Unit) -> bool:
+        started = time.perf_counter()
+        folder, disk_name = os.path.split(unit.path)
+        result = FileResult(source=unit.path)
+        info = self.manifests.lookup(folder, disk_name)
+        if info is None and manifest.is_file_id(disk_name):
+            result.error = "Archivo sin nombre (no está en el manifiesto)"
+            self._finish(result, started)
+            return False
+        try:
+            result.name = manifest.resolve_name(self.manifests, folder, disk_name)
+        except (InvalidToken, ValueError):
+            result.error = "No se pudo descifrar el nombre del archivo"
+            self._finish(result, started)
+            return False
+
+        hasher = hashlib.blake2b(digest_size=16)
+        try:
+            with self._open_reader(unit.path) as reader:
+                for plain in reader.iter_chunks():
+                    if self._cancel.is_set():
+                        return False
+                    hasher.update(plain)
+                    result.size += len(plain)
+                    if self._on_progress:
+                        self._on_progress(len(plain))
+        except (InvalidToken, ValueError):
+            result.error = "Error de llave al descifrar. ¿Archivo corrupto?"
+        except OSError as e:
+            result.error = str(e)
+        else:
+            expected = (info or {}).get("blake2b")
+            if expected is not None and hasher.hexdigest() != expected:
+                result.error = "El contenido no coincide con el hash del manifiesto"
+        self._finish(result, started)
+        return result.ok
+
+    def _open_reader(self, path):
+        reader = vault_format.VaultFileReader(self.session_key, path)
+        if not reader.is_recipe:
+            return reader
+        try:
+            with self._store_lock:
+                if self._chunk_store is None:
+                    self._chunk_store = dedup_store.ChunkStore(self.manifests.baul_path, self.session_key,
+                                                               create=False)
+        except Exception:
+            reader.close()
+            raise
+        return dedup_store.RecipeReader(self._chunk_store, reader)
+
+    def _check_pack(self, unit: _Unit) -> bool:
+        """
+        Descifra el paquete una vez, de principio a fin, y calcula al pasar
+        el hash de cada archivo que contiene. Un bloque dañado solo marca
+        los archivos que tocan ese bloque.
+        """
+        started = time.perf_counter()
+        packed = sorted(unit.packed, key=lambda item: item[2]["offset"])
+        results = [FileResult(source=os.path.join(folder, file_id), name=info["name"])
+                   for folder, file_id, info in packed]
+        hashers = [hashlib.blake2b(digest_size=16) for _ in packed]
+        first = 0   # Primer archivo que todavía no termina
+        try:
+            with vault_format.VaultFileReader(self.session_key, unit.path) as reader:
+                for index in range(reader.chunk_count):
+                    if self._cancel.is_set():
+                        return False
+                    position = index * reader.chunk_size
+                    try:
+                        plain = reader.read_chunk(index)
+                    except (InvalidToken, ValueError):
+                        plain = None
+                    end = position + (len(plain) if plain is not None else reader.chunk_size)
+                    for current in range(first, len(packed)):
+                        info = packed[current][2]
+                        start, stop = info["offset"], info["offset"] + info["size"]
+                        if start >= end:
+                            break
+                        if plain is None:
+                            results[current].error = "Bloque dañado en el paquete. ¿Archivo corrupto?"
+                            continue
+                        piece = plain[max(0, start - position):min(stop, end) - position]
+                        hashers[current].update(piece)
+                        results[current].size += len(piece)
+                    while first < len(packed) and packed[first][2]["offset"] + packed[first][2]["size"] <= end:
+                        first += 1
+                    if self._on_progress and plain is not None:
+                        self._on_progress(len(plain))
+        except (InvalidToken, ValueError):
+            for result in results:
+                result.error = "Error de llave al descifrar el paquete. ¿Archivo corrupto?"
+        except OSError as e:
+            for result in results:
+                result.error = str(e)
+
+        ok = True
+        for (_, _, info), result, hasher in zip(packed, results, hashers):
+            if result.ok and result.size != info["size"]:
+                result.error = "El archivo se sale del paquete"
+            elif result.ok and "blake2b" in info and hasher.hexdigest() != info["blake2b"]:
+                result.error = "El contenido no coincide con el hash del manifiesto"
+            ok = ok and result.ok
+            self._finish(result, started)
+        return ok
+
+
+def main(argv=None):
+    import crypto_utils
+
+    parser = argparse.ArgumentParser(description="Revisar la integridad de todos los archivos del baúl")
+    parser.add_argument("baul_path", help="Carpeta 'Baul' de la USB")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Revisar solo lo que cambió desde la última revisión sin errores")
+    parser.add_argument("--workers", type=int, default=None, help="Hilos de revisión")
+    args = parser.parse_args(argv)
+
+    with open(os.path.join(args.baul_path, ".credentials", "vault.key"), 'rb') as f:
+        content = f.read()
+    try:
+        session_key = crypto_utils.unlock_vault_key(getpass.getpass("Contraseña: "), content)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    manifests = manifest.ManifestStore(args.baul_path, session_key)
+    manifests.preload()
+    report = Scrubber(session_key, manifests, args.workers, args.incremental).run()
+    for result in report.failed:
+        print(f"Dañado: {result.name or result.source}: {result.error}")
+    for path in report.temp_files:
+        print(f"Resto de una escritura interrumpida (se puede borrar): {path}")
+    print(f"Revisados: {report.files_ok - report.files_skipped} · Sin cambios: {report.files_skipped} · "
+          f"Dañados: {len(report.failed)} · {report.bytes_read / (1024 * 1024):.1f} MB en "
+          f"{report.elapsed:.1f} s ({report.mb_per_second:.1f} MB/s)")
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,598 @@
+import os
+import re
+import bisect
+import threading
+import unicodedata
+from array import array
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import InvalidToken
+import manifest
+import scanner
+import pack_store
+import instrumentation
+
+# Búsqueda instantánea por nombre descifrado.
+#
+# En disco los archivos solo tienen ids opacos ("3f9a0c1d2b4e5f60.enc") y los
+# nombres reales están dentro de los manifiestos cifrados, así que para
+# encontrar un archivo había que ir abriendo carpetas en el árbol.
+#
+# Ahora, después de desbloquear, se arma en segundo plano un índice en memoria
+# con el nombre y la ruta (ya descifrados) de cada archivo y carpeta del baúl.
+# Los nombres se guardan "doblados" (minúsculas y sin acentos: "Canción" ->
+# "cancion") en un solo str por tipo, separados por "\n":
+#
+#   "\nfotos\nplaya.jpg\ncancion.mp3\n..."
+#
+# Así una búsqueda es un str.find (o una expresión regular) que recorre el
+# texto en C, y la posición encontrada se convierte en la entrada con bisect
+# sobre el arreglo de posiciones de inicio. Además el texto está partido en
+# tramos con los caracteres que contiene cada uno, y se saltan los tramos a
+# los que les falta alguna letra de la búsqueda. Con 500k entradas se responde
+# en pocos milisegundos, sin un bucle de Python por archivo. Tipos de búsqueda:
+#
+# - prefix: el nombre empieza con el texto.
+# - substring: el texto aparece en cualquier parte del nombre.
+# - fuzzy: las letras del texto aparecen en orden, no necesariamente juntas
+#   ("vcn22" encuentra "vacaciones 2022").
+# - auto: primero los de prefijo, luego los de subcadena y, si faltan, los
+#   fuzzy (solo para nombres).
+#
+# Si el texto tiene "/" se busca en la ruta completa ("fotos/2024/pla").
+#
+# Los cambios en disco (eventos de watchdog) no reconstruyen el índice: la
+# carpeta afectada se vuelve a leer y su lista nueva va a un "overlay" que
+# tiene prioridad sobre el índice base (las entradas viejas de esa carpeta se
+# ocultan). Cuando el overlay crece demasiado se reconstruye todo en segundo
+# plano.
+#
+# El índice solo vive en memoria: nunca se escribe en disco, ni siquiera en
+# un archivo temporal, porque contiene los nombres en claro.
+
+MODES = ("auto", "prefix", "substring", "fuzzy")
+DEFAULT_LIMIT = 500
+# Entradas en el overlay antes de reconstruir el índice completo
+OVERLAY_LIMIT = 20_000
+# Entradas por tramo del texto de búsqueda (ver _Segment._chunks)
+CHUNK_ENTRIES = 4096
+CREDENTIALS_DIR = ".credentials"
+
+
+def fold(text: str) -> str:
+    """Texto para comparar: minúsculas, sin acentos y sin saltos de línea."""
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return text.casefold().replace("\n", " ")
+
+
+class SearchHit(NamedTuple):
+    """Un resultado de búsqueda."""
+    name: str        # Nombre descifrado
+    path: str        # Ruta a mostrar, relativa al baúl ("Fotos/2024/playa.jpg")
+    real_path: str   # Ruta real (cifrada) en la USB
+    is_dir: bool
+
+
+def _skipped_dir(name: str) -> bool:
+    return manifest.is_internal_dir(name) or name == CREDENTIALS_DIR
+
+
+def list_folder(manifests: manifest.ManifestStore, folder) -> list:
+    """
+    Lee los elementos de una carpeta del baúl con sus nombres descifrados,
+    los mismos que muestra el árbol.
+
+    Retorna:
+        list: (nombre, nombre en disco, es carpeta) de cada elemento.
+
+    Lanza:
+        OSError: Si la carpeta no existe o no se puede leer.
+    """
+    entries = scanner.scan_dir(folder, with_stat=False)
+    manifests.revalidate(folder)
+    known = manifests.entries(folder)
+    items = []
+    for entry in entries:
+        if entry.is_dir:
+            if not _skipped_dir(entry.name):
+                items.append((entry.name, entry.name, True))
+        elif entry.name.endswith(".enc"):
+            info = known.get(entry.name)
+            if info is not None:
+                items.append((info["name"], entry.name, False))
+            elif not manifest.is_file_id(entry.name):
+                try:
+                    items.append((manifest.resolve_name(manifests, folder, entry.name), entry.name, False))
+                except (InvalidToken, ValueError, TypeError):
+                    # Nombre dañado: no hay nada que buscar
+                    pass
+    # El motor de importación puede agregar entradas mientras tanto
+    for file_id, info in list(known.items()):
+        if pack_store.is_packed(info):
+            items.append((info["name"], file_id, False))
+    return items
+
+
+def _fuzzy_regex(query: str):
+    """'abc' -> a[^\\nb]*b[^\\nc]*c: sin retrocesos, cada letra en la primera posición posible."""
+    chars = [c for c in query if not c.isspace()]
+    if not chars:
+        return None
+    parts = []
+    for c, following in zip(chars, chars[1:] + [None]):
+        parts.append(re.escape(c))
+        if following is not None:
+            parts.append(f"[^\\n{re.escape(following)}]*")
+    return re.compile("".join(parts))
+
+
+def _matches(text: str, query: str, mode: str, regex) -> bool:
+    if mode == "prefix":
+        return text.startswith(query)
+    if mode == "substring":
+        return query in text
+    return regex is not None and regex.search(text) is not None
+
+
+class _Segment:
+    """
+    Índice base: todas las carpetas leídas en una pasada, en preorden (cada
+    carpeta seguida de todas sus subcarpetas). No cambia después de armarse;
+    solo 'hidden' marca las carpetas cuyas entradas ya no valen.
+    """
+    def __init__(self):
+        self.folders = []               # Rutas reales
+        self.relative = []              # Ruta a mostrar de cada carpeta
+        self.folder_index = {}          # clave de la carpeta -> índice
+        self.subtree_end = array("l")   # Índice después de la última subcarpeta
+        self.entry_folder = array("l")
+        self.names = []
+        self.disk_names = []
+        self.is_dir = bytearray()
+        self.name_starts = array("q")
+        self.path_starts = array("q")
+        self.hidden = bytearray()
+        self._names_folded = []
+        self._paths_folded = []
+        self._next_name = self._next_path = 1   # Después del "\n" inicial
+
+    def add_folder(self, key: str, folder: str, relative: str, items: list):
+        index = len(self.folders)
+        self.folders.append(folder)
+        self.relative.append(relative)
+        self.folder_index[key] = index
+        folded_folder = fold(relative)
+        for name, disk_name, is_dir in items:
+            folded = fold(name)
+            folded_path = f"{folded_folder}/{folded}" if folded_folder else folded
+            self.entry_folder.append(index)
+            self.names.append(name)
+            self.disk_names.append(disk_name)
+            self.is_dir.append(is_dir)
+            self.name_starts.append(self._next_name)
+            self.path_starts.append(self._next_path)
+            self._names_folded.append(folded)
+            self._paths_folded.append(folded_path)
+            self._next_name += len(folded) + 1
+            self._next_path += len(folded_path) + 1
+
+    def finish(self):
+        """Une los nombres en los dos textos de búsqueda y calcula los subárboles."""
+        self.names_blob = "\n" + "\n".join(self._names_folded) + "\n"
+        self.paths_blob = "\n" + "\n".join(self._paths_folded) + "\n"
+        self._names_folded = self._paths_folded = None
+        self.hidden = bytearray(len(self.folders))
+        self.name_chunks = self._chunks(self.names_blob, self.name_starts)
+        self.path_chunks = self._chunks(self.paths_blob, self.path_starts)
+
+        # En preorden el subárbol de una carpeta son las siguientes carpetas
+        # hasta la primera que no está dentro de ella
+        self.subtree_end = array("l", range(1, len(self.folders) + 1))
+        open_folders = []
+        for index, folder in enumerate(self.folders):
+            while open_folders and not _is_inside(folder, self.folders[open_folders[-1]]):
+                self.subtree_end[open_folders.pop()] = index
+            open_folders.append(index)
+        for index in open_folders:
+            self.subtree_end[index] = len(self.folders)
+
+    @staticmethod
+    def _chunks(blob: str, starts) -> list:
+        """
+        Parte el texto en tramos de CHUNK_ENTRIES entradas y guarda qué
+        caracteres aparecen en cada uno: una búsqueda se salta los tramos a
+        los que les falta alguna letra del texto buscado.
+
+        Retorna:
+            list: (primera entrada, inicio, fin, caracteres) de cada tramo.
+        """
+        chunks = []
+        for first in range(0, len(starts), CHUNK_ENTRIES):
+            begin = starts[first] - 1
+            end = starts[first + CHUNK_ENTRIES] - 1 if first + CHUNK_ENTRIES < len(starts) else len(blob)
+            chunks.append((first, begin, end, frozenset(blob[begin:end])))
+        return chunks
+
+    def matches(self, by_path: bool, query: str, mode: str, first: int = 0):
+        """
+        Índices de las entradas (desde 'first') que coinciden con 'query', en
+        orden y una sola vez cada una, junto con la posición donde coincidió.
+        """
+        blob, starts, chunks = ((self.paths_blob, self.path_starts, self.path_chunks) if by_path
+                                else (self.names_blob, self.name_starts, self.name_chunks))
+        total = len(starts)
+        regex = _fuzzy_regex(query) if mode == "fuzzy" else None
+        if mode == "fuzzy" and regex is None:
+            return
+        needed = {c for c in query if not c.isspace()} if mode == "fuzzy" else set(query)
+        # Con prefijo se busca "\n" + texto: solo coincide al inicio de una entrada
+        needle, shift = ("\n" + query, 1) if mode == "prefix" else (query, 0)
+
+        for chunk_first, begin, end, chars in chunks:
+            if chunk_first + CHUNK_ENTRIES <= first or not needed <= chars:
+                continue
+            pos = max(begin, starts[first] - 1) if first < total else end
+            while pos < end:
+                if regex is None:
+                    pos = blob.find(needle, pos, end)
+                    if pos < 0:
+                        break
+                else:
+                    match = regex.search(blob, pos, end)
+                    if match is None:
+                        break
+                    pos = match.start()
+                index = bisect.bisect_right(starts, pos + shift) - 1
+                yield index, pos + shift
+                if index + 1 >= total:
+                    return
+                # La siguiente búsqueda empieza en la entrada que sigue
+                pos = starts[index + 1] - shift
+
+    def hit(self, index: int) -> SearchHit:
+        folder = self.entry_folder[index]
+        relative = self.relative[folder]
+        name = self.names[index]
+        return SearchHit(name, f"{relative}/{name}" if relative else name,
+                         os.path.join(self.folders[folder], self.disk_names[index]), bool(self.is_dir[index]))
+
+
+def _is_inside(path: str, folder: str) -> bool:
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+
+class _Listing(NamedTuple):
+    """Contenido actual de una carpeta que cambió después de armar el índice base."""
+    folder: str
+    relative: str
+    items: list   # (nombre, nombre en disco, es carpeta, nombre doblado, ruta doblada)
+    seq: int
+
+
+class SearchIndex:
+    """
+    Índice de búsqueda de todo el baúl, en memoria.
+
+    start() lo arma en un hilo aparte; apply_events() lo mantiene al día con
+    los eventos de watchdog y search() se puede llamar desde cualquier hilo
+    (también mientras se arma: solo encuentra lo que ya está indexado).
+
+    Parámetros:
+        manifests (ManifestStore): Manifiestos ya descifrados del baúl.
+        on_update (callable): Se llama (desde el hilo del índice) cada vez que
+                              el índice cambia, por ejemplo para repetir la
+                              búsqueda en pantalla.
+    """
+    def __init__(self, manifests: manifest.ManifestStore, on_update=None):
+        self.manifests = manifests
+        self.root = manifests.baul_path
+        self.on_update = on_update
+        self._lock = threading.Lock()
+        self._base = _Segment()
+        self._base.finish()
+        self._overlay = {}       # clave de la carpeta -> _Listing
+        self._overlay_size = 0
+        self._removed = {}       # clave de una carpeta borrada -> seq
+        self._seq = 0
+        self._pending = (set(), set(), set())   # carpetas a releer, subárboles a leer, borrados
+        self._drain_scheduled = False
+        self._build_scheduled = False
+        self._closed = False
+        self.ready = False       # Ya terminó la primera pasada
+        # Un solo hilo: la construcción y las actualizaciones no se cruzan
+        self._pool = ThreadPoolExecutor(max_workers=1)
+
+    def _key(self, path) -> str:
+        return os.path.normcase(os.path.normpath(path))
+
+    def _relative(self, folder) -> str:
+        relative = os.path.relpath(folder, self.root)
+        return "" if relative == "." else relative.replace(os.sep, "/")
+
+    @property
+    def size(self) -> int:
+        """Cantidad de entradas indexadas (aproximada mientras hay cambios pendientes)."""
+        with self._lock:
+            return len(self._base.names) + self._overlay_size
+
+    # --- Construcción ---
+    def start(self):
+        """Arma (o vuelve a armar) el índice completo en segundo plano."""
+        with self._lock:
+            if self._build_scheduled or self._closed:
+                return
+            self._build_scheduled = True
+        self._pool.submit(self.build)
+
+    def build(self):
+        """Arma el índice completo en este hilo (start() lo hace en segundo plano)."""
+        with self._lock:
+            self._build_scheduled = False
+            started_seq = self._seq
+        segment = _Segment()
+        with instrumentation.span("index_build"):
+            pending = [self.root]
+            while pending and not self._closed:
+                folder = pending.pop()
+                try:
+                    items = list_folder(self.manifests, folder)
+                except OSError as e:
+                    print(f"Error al acceder a {folder}: {e}")
+                    continue
+                segment.add_folder(self._key(folder), folder, self._relative(folder), items)
+                pending.extend(os.path.join(folder, disk_name)
+                               for _, disk_name, is_dir in reversed(items) if is_dir)
+            segment.finish()
+        if self._closed:
+            return
+
+        with self._lock:
+            # Lo que cambió mientras se leía el baúl sigue en el overlay; lo
+            # anterior ya quedó en el índice nuevo
+            self._base = segment
+            self._overlay = {key: listing for key, listing in self._overlay.items() if listing.seq > started_seq}
+            self._overlay_size = sum(len(listing.items) for listing in self._overlay.values())
+            self._removed = {key: seq for key, seq in self._removed.items() if seq > started_seq}
+            for key in self._removed:
+                self._hide_tree(key)
+            for key in self._overlay:
+                self._hide_folder(key)
+            self.ready = True
+        instrumentation.count("index_entries", len(segment.names))
+        self._notify()
+
+    def _notify(self):
+        if self.on_update is not None and not self._closed:
+            self.on_update()
+
+    # --- Cambios en disco ---
+    def apply_events(self, events):
+        """
+        Registra un lote de eventos de watchdog. Las carpetas afectadas se
+        vuelven a leer en el hilo del índice (varios lotes seguidos se juntan
+        en una sola lectura por carpeta).
+        """
+        refresh, trees, removed = set(), set(), set()
+        for event in events:
+            src = event.src_path
+            dest = getattr(event, "dest_path", "") or ""
+            for path in (src, dest):
+                if path and os.path.basename(path) == manifest.MANIFEST_NAME:
+                    refresh.add(os.path.dirname(path))
+            if event.event_type not in ("created", "deleted", "moved"):
+                continue
+            if event.is_directory and event.event_type in ("deleted", "moved"):
+                removed.add(src)
+            if event.is_directory and event.event_type in ("created", "moved"):
+                trees.add(dest or src)
+            for path in (src, dest):
+                if path and self._indexed(path, event.is_directory):
+                    refresh.add(os.path.dirname(path))
+
+        if not (refresh or trees or removed):
+            return
+        with self._lock:
+            if self._closed:
+                return
+            self._pending[0].update(refresh)
+            self._pending[1].update(trees)
+            self._pending[2].update(removed)
+            if self._drain_scheduled:
+                return
+            self._drain_scheduled = True
+        self._pool.submit(self._drain)
+
+    def _indexed(self, path, is_dir: bool) -> bool:
+        """True si 'path' es algo que sale en el índice (y en el árbol)."""
+        relative = os.path.relpath(path, self.root)
+        if relative == "." or relative.startswith(".."):
+            return False
+        if any(_skipped_dir(part) for part in relative.split(os.sep)[:-1 if not is_dir else None]):
+            return False
+        return is_dir or path.endswith(".enc")
+
+    def _drain(self):
+        with self._lock:
+            refresh, trees, removed = self._pending
+            self._pending = (set(), set(), set())
+            self._drain_scheduled = False
+
+        for folder in removed:
+            with self._lock:
+                self._seq += 1
+                self._remove_tree(self._key(folder))
+        walked = set()
+        for tree in trees:
+            for folder in self._walk(tree):
+                walked.add(self._key(folder))
+        root = self._key(self.root)
+        for folder in refresh:
+            key = self._key(folder)
+            if key not in walked and (key == root or self._indexed(folder, True)):
+                self._refresh_folder(folder)
+
+        rebuild = self._overlay_size > OVERLAY_LIMIT
+        if rebuild:
+            self.start()
+        self._notify()
+
+    def _walk(self, tree):
+        """Lee una carpeta nueva (creada o movida) y todas sus subcarpetas."""
+        pending = [tree]
+        while pending and not self._closed:
+            folder = pending.pop()
+            items = self._refresh_folder(folder)
+            yield folder
+            pending.extend(os.path.join(folder, disk_name) for _, disk_name, is_dir in items if is_dir)
+
+    def _refresh_folder(self, folder) -> list:
+        try:
+            items = list_folder(self.manifests, folder)
+        except OSError:
+            # Ya no existe: su borrado llega (o llegó) como evento
+            with self._lock:
+                self._seq += 1
+                self._remove_tree(self._key(folder))
+            return []
+        relative = self._relative(folder)
+        folded_folder = fold(relative)
+        rows = []
+        for name, disk_name, is_dir in items:
+            folded = fold(name)
+            rows.append((name, disk_name, is_dir, folded,
+                         f"{folded_folder}/{folded}" if folded_folder else folded))
+        key = self._key(folder)
+        with self._lock:
+            self._seq += 1
+            old = self._overlay.get(key)
+            self._overlay_size += len(rows) - (len(old.items) if old else 0)
+            self._overlay[key] = _Listing(folder, relative, rows, self._seq)
+            self._hide_folder(key)
+        return items
+
+    def _hide_folder(self, key):
+        index = self._base.folder_index.get(key)
+        if index is not None:
+            self._base.hidden[index] = 1
+
+    def _hide_tree(self, key):
+        index = self._base.folder_index.get(key)
+        if index is not None:
+            end = self._base.subtree_end[index]
+            self._base.hidden[index:end] = b"\x01" * (end - index)
+
+    def _remove_tree(self, key):
+        """Una carpeta (y todo lo de adentro) ya no existe. Requiere el candado."""
+        self._removed[key] = self._seq
+        self._hide_tree(key)
+        for other in [other for other in self._overlay if _is_inside(other, key)]:
+            self._overlay_size -= len(self._overlay.pop(other).items)
+
+    # --- Búsqueda ---
+    def search(self, query: str, mode: str = "auto", limit: int = DEFAULT_LIMIT) -> list:
+        """
+        Busca archivos y carpetas por nombre (o por ruta, si 'query' tiene
+        "/"). No distingue mayúsculas ni acentos.
+
+        Retorna:
+            list: Hasta 'limit' SearchHit, los mejores primero.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Modo de búsqueda desconocido: {mode}")
+        query = fold(query.strip())
+        if not query:
+            return []
+        by_path = "/" in query
+        tiers = ("prefix", "substring", "fuzzy") if mode == "auto" else (mode,)
+
+        with instrumentation.span("search"), self._lock:
+            base = self._base
+            starts = base.path_starts if by_path else base.name_starts
+            # Índices del índice base y SearchHit del overlay, por nivel
+            base_hits = {"prefix": [], "substring": [], "fuzzy": []}
+            found = 0
+            if mode == "auto":
+                # Una sola pasada de subcadena: los que coinciden al inicio
+                # son los de prefijo
+                for index, pos in base.matches(by_path, query, "substring"):
+                    if base.hidden[base.entry_folder[index]]:
+                        continue
+                    base_hits["prefix" if pos == starts[index] else "substring"].append(index)
+                    found += 1
+                    if found >= limit:
+                        # Con el cupo lleno solo pueden mejorar los de prefijo
+                        # que falten más adelante
+                        prefix = base_hits["prefix"]
+                        for index, _ in base.matches(by_path, query, "prefix", first=index + 1):
+                            if len(prefix) >= limit:
+                                break
+                            if not base.hidden[base.entry_folder[index]]:
+                                prefix.append(index)
+                        break
+            else:
+                for index, _ in base.matches(by_path, query, mode):
+                    if found >= limit:
+                        break
+                    if not base.hidden[base.entry_folder[index]]:
+                        base_hits[mode].append(index)
+                        found += 1
+
+            overlay_hits = {"prefix": [], "substring": [], "fuzzy": []}
+            tiers = ("prefix", "substring") if mode == "auto" else (mode,)
+            found += self._search_overlay(by_path, query, tiers, overlay_hits, limit)
+            if mode == "auto" and found < limit and not by_path:
+                # Faltan resultados: se completan con los fuzzy (no con rutas:
+                # recorrer rutas largas letra por letra ya no es instantáneo)
+                seen = set(base_hits["prefix"]) | set(base_hits["substring"])
+                for index, _ in base.matches(by_path, query, "fuzzy"):
+                    if found >= limit:
+                        break
+                    if index not in seen and not base.hidden[base.entry_folder[index]]:
+                        base_hits["fuzzy"].append(index)
+                        found += 1
+                self._search_overlay(by_path, query, ("fuzzy",), overlay_hits, limit - found, skip_substring=True)
+
+            hits = []
+            for tier in ("prefix", "substring", "fuzzy"):
+                hits.extend(base.hit(index) for index in base_hits[tier])
+                hits.extend(overlay_hits[tier])
+            return hits[:limit]
+
+    def _search_overlay(self, by_path: bool, query: str, tiers, hits: dict, limit: int,
+                        skip_substring: bool = False) -> int:
+        """
+        Busca en las carpetas del overlay (recorrido en Python: son pocas
+        entradas). Cada entrada cuenta en el primer nivel de 'tiers' donde
+        coincide; con 'skip_substring' se saltan las que ya se encontraron
+        como subcadena. Requiere el candado.
+
+        Retorna:
+            int: Cuántas se agregaron a 'hits'.
+        """
+        regex = _fuzzy_regex(query) if "fuzzy" in tiers else None
+        found = 0
+        for listing in self._overlay.values():
+            for name, disk_name, is_dir, folded, folded_path in listing.items:
+                if found >= limit:
+                    return found
+                text = folded_path if by_path else folded
+                if skip_substring and query in text:
+                    continue
+                for tier in tiers:
+                    if _matches(text, query, tier, regex):
+                        hits[tier].append(SearchHit(name, f"{listing.relative}/{name}" if listing.relative else name,
+                                                    os.path.join(listing.folder, disk_name), is_dir))
+                        found += 1
+                        break
+        return found
+
+    def close(self):
+        """Detiene el hilo del índice y libera la memoria de los nombres."""
+        with self._lock:
+            self._closed = True
+            self._base = _Segment()
+            self._base.finish()
+            self._overlay = {}
+            self._overlay_size = 0
+        self._pool.shutdown(wait=False, cancel_futures=True)
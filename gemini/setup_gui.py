@@ -3,7 +3,7 @@ import os
 import shutil
 from tkinter import filedialog, messagebox
 import crypto_utils
-import login_gui # Para lanzarlo después de configurar
+import login_gui # Para abrir el baúl después de configurar
 
 class SetupWindow(ctk.CTk):
     """
@@ -51,8 +51,8 @@ class SetupWindow(ctk.CTk):
         self.confirm_pass_entry = ctk.CTkEntry(self.main_frame, placeholder_text="Confirmar contraseña", show="*")
         self.confirm_pass_entry.pack(pady=5, fill="x", padx=20)
 
-        btn_create = ctk.CTkButton(self.main_frame, text="Crear y Guardar", command=self.create_new_vault)
-        btn_create.pack(pady=20, fill="x", padx=20)
+        self.btn_create = ctk.CTkButton(self.main_frame, text="Crear y Guardar", command=self.create_new_vault)
+        self.btn_create.pack(pady=20, fill="x", padx=20)
         
         btn_back = ctk.CTkButton(self.main_frame, text="Volver", fg_color="transparent", border_width=1,
                                  command=self.show_initial_options)
@@ -71,10 +71,16 @@ class SetupWindow(ctk.CTk):
             messagebox.showerror("Error", "Las contraseñas no coinciden.")
             return
 
-        try:
-            # 1. Generar el contenido de la llave
-            vault_key_content = crypto_utils.generate_vault_key(password)
+        # 1. Generar el contenido de la llave (en segundo plano: derivar la
+        # llave de la contraseña tarda a propósito)
+        self.show_busy(self.btn_create, "Creando llave...")
+        login_gui.run_in_background(self, lambda: crypto_utils.create_vault_key(password),
+                                    self.on_vault_created, self.on_setup_failed)
 
+    def on_vault_created(self, result):
+        vault_key_content, session_key = result
+        self.hide_busy()
+        try:
             # 2. Crear directorios
             os.makedirs(self.credentials_path, exist_ok=True)
             
@@ -101,11 +107,12 @@ class SetupWindow(ctk.CTk):
                     f.write(vault_key_content)
                 messagebox.showinfo("Éxito", "Respaldo guardado con éxito.")
 
-            # 5. Finalizar y pasar al login
-            self.launch_login()
-
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo crear el Baúl: {e}")
+            return
+
+        # 5. Finalizar y abrir el baúl con la llave que ya tenemos
+        self.launch_app(session_key)
 
     def show_restore_vault(self):
         """Muestra la UI para restaurar desde un .key."""
@@ -124,8 +131,8 @@ class SetupWindow(ctk.CTk):
         btn_find_key = ctk.CTkButton(self.main_frame, text="Buscar archivo .key", command=self.find_key_file)
         btn_find_key.pack(pady=5, fill="x", padx=20)
 
-        btn_restore = ctk.CTkButton(self.main_frame, text="Restaurar Baúl", command=self.restore_vault)
-        btn_restore.pack(pady=10, fill="x", padx=20)
+        self.btn_restore = ctk.CTkButton(self.main_frame, text="Restaurar Baúl", command=self.restore_vault)
+        self.btn_restore.pack(pady=10, fill="x", padx=20)
         
         btn_back = ctk.CTkButton(self.main_frame, text="Volver", fg_color="transparent", border_width=1,
                                  command=self.show_initial_options)
@@ -154,35 +161,61 @@ class SetupWindow(ctk.CTk):
             messagebox.showerror("Error", "Selecciona tu archivo de respaldo .key.")
             return
             
+        # 1. Verificar que la contraseña y la llave sean correctas (en
+        # segundo plano); la llave desbloqueada se usa para abrir el baúl
+        key_file_content = self.key_file_content
+        self.show_busy(self.btn_restore, "Verificando contraseña...")
+        login_gui.run_in_background(self, lambda: crypto_utils.unlock_vault_key(password, key_file_content),
+                                    lambda session_key: self.on_vault_verified(key_file_content, session_key),
+                                    self.on_setup_failed)
+
+    def on_vault_verified(self, key_file_content, session_key):
+        self.hide_busy()
         try:
-            # 1. Verificar que la contraseña y la llave sean correctas
-            crypto_utils.unlock_vault_key(password, self.key_file_content)
-            
             # 2. Si es correcto, crear directorios y copiar el archivo
             os.makedirs(self.credentials_path, exist_ok=True)
             with open(self.key_file_path, "wb") as f:
-                f.write(self.key_file_content)
+                f.write(key_file_content)
                 
             messagebox.showinfo("Éxito", "¡Baúl restaurado con éxito en la USB!")
-            
-            # 3. Finalizar y pasar al login
-            self.launch_login()
-            
-        except ValueError as e: # Captura el "Contraseña incorrecta"
-            messagebox.showerror("Error", f"{e}")
         except Exception as e:
             messagebox.showerror("Error", f"Ocurrió un error inesperado: {e}")
+            return
+
+        # 3. Finalizar y abrir el baúl
+        self.launch_app(session_key)
+
+    def on_setup_failed(self, error):
+        self.hide_busy()
+        if isinstance(error, ValueError): # Captura el "Contraseña incorrecta"
+            messagebox.showerror("Error", f"{error}")
+        else:
+            messagebox.showerror("Error", f"Ocurrió un error inesperado: {error}")
+
+    def show_busy(self, button, text):
+        """Desactiva 'button' y muestra un indicador mientras se deriva la llave."""
+        self.busy_button = button
+        button.configure(state="disabled")
+        self.busy_label = ctk.CTkLabel(self.main_frame, text=text, text_color="gray")
+        self.busy_label.pack(pady=(5, 0))
+        self.busy_bar = ctk.CTkProgressBar(self.main_frame, mode="indeterminate")
+        self.busy_bar.pack(pady=5, fill="x", padx=20)
+        self.busy_bar.start()
+
+    def hide_busy(self):
+        self.busy_bar.stop()
+        self.busy_bar.destroy()
+        self.busy_label.destroy()
+        self.busy_button.configure(state="normal")
 
     def clear_frame(self):
         """Limpia el frame principal."""
         for widget in self.main_frame.winfo_children():
             widget.destroy()
 
-    def launch_login(self):
-        """Cierra esta ventana y abre la de login."""
-        self.destroy()
-        login_app = login_gui.LoginWindow(baul_path=self.baul_path, key_file_path=self.key_file_path)
-        login_app.mainloop()
+    def launch_app(self, session_key):
+        """Cierra esta ventana y abre el baúl (sin pedir otra vez la contraseña)."""
+        login_gui.launch_app(self, self.baul_path, session_key)
 
 if __name__ == "__main__":
     # Para pruebas (ejecutar este archivo directamente)
@@ -0,0 +1,36 @@
+import os
+import sys
+import pytest
+
+# Los módulos de la app se importan por nombre (import vault_format), igual
+# que cuando se corre desde la carpeta 'gemini'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypto_utils
+import kdf
+
+PASSWORD = "contraseña de prueba"
+# Pocas iteraciones: aquí no se prueba la derivación sino el formato
+FAST_KDF = {"iterations": 1000}
+# Bloques chicos para que los archivos de prueba tengan varios bloques
+CHUNK = 4096
+
+
+@pytest.fixture
+def vault_key():
+    """(contenido de 'vault.key', SessionKey) de un baúl nuevo."""
+    return crypto_utils.create_vault_key(PASSWORD, kdf.PBKDF2, FAST_KDF)
+
+
+@pytest.fixture
+def session_key(vault_key):
+    return vault_key[1]
+
+
+@pytest.fixture
+def baul(tmp_path, vault_key):
+    """Carpeta 'Baul' vacía con su .credentials/vault.key."""
+    path = tmp_path / "Baul"
+    (path / ".credentials").mkdir(parents=True)
+    (path / ".credentials" / "vault.key").write_bytes(vault_key[0])
+    return path
@@ -0,0 +1,80 @@
+import os
+import json
+import pytest
+import kdf
+from benchmarks import bench_suite
+from conftest import FAST_KDF
+
+
+def _sizes(folder):
+    return sorted((os.path.relpath(os.path.join(root, name), folder), os.path.getsize(os.path.join(root, name)))
+                  for root, _, files in os.walk(folder) for name in files)
+
+
+@pytest.mark.parametrize("kind, files", [("pequeños", 10), ("enormes", 2), ("mezcla", 1)])
+def test_file_sets_are_the_same_on_every_run(tmp_path, kind, files):
+    bench_suite.make_file_set(tmp_path / "a", kind, 0.002)
+    bench_suite.make_file_set(tmp_path / "b", kind, 0.002)
+    sizes = _sizes(tmp_path / "a")
+    assert len(sizes) == files
+    assert sizes == _sizes(tmp_path / "b")
+
+
+def _run(commit, **metrics):
+    return {"commit": commit, "results": [dict(name="importar/mezcla", **metrics),
+                                          {"name": f"solo en {commit}", "seconds": 1.0}]}
+
+
+def test_compare_marks_only_large_regressions(capsys):
+    base = _run("antes", seconds=10.0, mb_per_s=100.0, files_per_s=50.0, peak_rss_mb=0.0)
+    new = _run("despues", seconds=12.0, mb_per_s=95.0, files_per_s=70.0, peak_rss_mb=80.0)
+    bench_suite.compare(base, new)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "--- antes -> despues ---"
+    # Una sola medición en común; sin valor anterior (0) no hay porcentaje
+    assert len(lines) == 2
+    line = lines[1]
+    assert "seconds +20% (!)" in line
+    assert "mb_per_s -5%" in line and "mb_per_s -5% (!)" not in line
+    assert "files_per_s +40%" in line and "files_per_s +40% (!)" not in line
+    assert "peak_rss_mb" not in line
+
+
+def test_compare_two_saved_runs_without_measuring(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(bench_suite, "bench_transfers", pytest.fail)
+    paths = []
+    for commit, seconds in (("antes", 1.0), ("despues", 2.0)):
+        paths.append(tmp_path / f"{commit}.json")
+        paths[-1].write_text(json.dumps(_run(commit, seconds=seconds)), encoding="utf-8")
+
+    assert bench_suite.main(["--compare", str(paths[0]), str(paths[1])]) == 0
+    assert "seconds +100% (!)" in capsys.readouterr().out
+
+
+def test_kdf_results_cover_every_available_function(monkeypatch):
+    # Sin calibrar y con el formato antiguo abreviado: aquí no se mide nada
+    monkeypatch.setattr(kdf, "LEGACY_PARAMS", FAST_KDF)
+    monkeypatch.setattr(kdf, "calibrate", lambda name=None, target=None: (
+        name, FAST_KDF if name == kdf.PBKDF2 else kdf.MIN_PARAMS[name]))
+
+    results = bench_suite.bench_kdf(repeat=1)
+    names = [result["name"] for result in results]
+    assert names[0] == "kdf/derive_key-antiguo"
+    for name in kdf.available():
+        assert f"kdf/{name}/generate_vault_key" in names and f"kdf/{name}/unlock_vault_key" in names
+    assert all(result["seconds"] > 0 for result in results)
+
+
+def test_small_run_writes_json(tmp_path, capsys):
+    output = tmp_path / "corrida.json"
+    assert bench_suite.main(["--no-kdf", "--set", "pequeños", "--scale", "0.002", "--compression", "none",
+                             "--output", str(output)]) == 0
+
+    run = json.loads(output.read_text(encoding="utf-8"))
+    assert run["scale"] == 0.002 and run["cpu_count"] == os.cpu_count()
+    assert [result["name"] for result in run["results"]] == ["importar/pequeños", "exportar/pequeños"]
+    for result in run["results"]:
+        assert (result["files"], result["failed"]) == (10, 0)
+        assert result["peak_rss_mb"] > 0
+    assert "importar/pequeños" in capsys.readouterr().out
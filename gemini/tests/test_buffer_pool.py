@@ -0,0 +1,165 @@
+import os
+import filecmp
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import InvalidToken
+import chunk_codecs
+import manifest
+import vault_format
+from buffer_pool import BufferPool
+from transfer_engine import ImportEngine, ExportEngine
+from conftest import CHUNK
+
+SIZES = [0, 1, CHUNK, CHUNK + 1, (vault_format.PARALLEL_MIN_CHUNKS + 2) * CHUNK + 7]
+TEXT = b"linea de registro 2024-05-01 INFO usuario ok\n"
+
+
+@pytest.fixture(params=[False, True], ids=["readinto", "mmap"])
+def mmap_reads(request, monkeypatch):
+    monkeypatch.setattr(vault_format, "MMAP_READS", request.param)
+    return request.param
+
+
+def _pool():
+    return BufferPool(vault_format.chunk_buffer_size(CHUNK), 4)
+
+
+def _all_returned(buffers):
+    return len(buffers._free) == buffers.allocated
+
+
+def _write_with_buffers(session_key, source, encrypted, codec=chunk_codecs.NONE):
+    """Cifra 'source' como lo hace ImportEngine con zero_copy."""
+    header, file_key = vault_format.new_file_header(session_key, CHUNK, codec)
+    buffers = _pool()
+    with open(source, 'rb') as src, open(encrypted, 'wb') as dst:
+        dst.write(header)
+        out = buffers.acquire()
+        for index, is_last, data, buffer in vault_format.iter_source_chunks(src, CHUNK, buffers):
+            if codec:
+                sealed = vault_format.pack_chunk_into(file_key, header, index, is_last, data, codec, None, out)
+            else:
+                sealed = vault_format.seal_chunk_into(file_key, header, index, is_last, data, out)
+            dst.write(sealed)
+            del data, sealed
+            if buffer is not None:
+                buffers.release(buffer)
+        buffers.release(out)
+    assert _all_returned(buffers)
+
+
+@pytest.mark.parametrize("codec", [chunk_codecs.NONE, chunk_codecs.ZLIB])
+@pytest.mark.parametrize("size", SIZES)
+def test_buffered_writes_are_read_by_the_plain_reader(session_key, tmp_path, mmap_reads, codec, size):
+    data = (TEXT * (size // len(TEXT) + 1))[:size // 2] + os.urandom(size - size // 2)
+    source = tmp_path / "original.bin"
+    source.write_bytes(data)
+    encrypted = tmp_path / "cifrado.enc"
+    _write_with_buffers(session_key, source, encrypted, codec)
+
+    with vault_format.VaultFileReader(session_key, encrypted) as reader:
+        assert b"".join(reader.read_chunk(index) for index in range(reader.chunk_count)) == data
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+@pytest.mark.parametrize("codec", [chunk_codecs.NONE, chunk_codecs.ZLIB])
+def test_buffered_reads_match_the_plain_path(session_key, tmp_path, codec, parallel):
+    data = TEXT * ((vault_format.PARALLEL_MIN_CHUNKS + 2) * CHUNK // len(TEXT)) + os.urandom(CHUNK)
+    source = tmp_path / "original.bin"
+    source.write_bytes(data)
+    encrypted = tmp_path / "cifrado.enc"
+    _write_with_buffers(session_key, source, encrypted, codec)
+
+    buffers = BufferPool(vault_format.chunk_buffer_size(CHUNK), 2 * (vault_format.PARALLEL_WINDOW + 1))
+    with ThreadPoolExecutor(max_workers=4) as pool, vault_format.VaultFileReader(session_key, encrypted) as reader:
+        for offset, length in [(0, None), (CHUNK - 3, 2 * CHUNK), (len(data) - 5, 100)]:
+            plain = b"".join(reader.iter_chunks(offset, length))
+            buffered = b"".join(bytes(chunk) for chunk in
+                                reader.iter_chunks(offset, length, pool if parallel else None, buffers))
+            assert buffered == plain
+            assert _all_returned(buffers)
+
+
+@pytest.fixture
+def long_file(session_key, tmp_path):
+    """(datos, archivo cifrado) con el doble de bloques de los que hacen falta para ir en paralelo."""
+    data = os.urandom(2 * vault_format.PARALLEL_MIN_CHUNKS * CHUNK + 5)
+    source = tmp_path / "original.bin"
+    source.write_bytes(data)
+    encrypted = tmp_path / "cifrado.enc"
+    _write_with_buffers(session_key, source, encrypted)
+    return data, encrypted
+
+
+@pytest.mark.parametrize("offset, length", [(CHUNK + 1, 12 * CHUNK), (3 * CHUNK, 9 * CHUNK - 1),
+                                            (5 * CHUNK - 1, None)])
+def test_buffered_parallel_ranged_read(session_key, long_file, offset, length):
+    # Rangos de suficientes bloques para ir en paralelo, que no empiezan en el bloque 0
+    data, encrypted = long_file
+    buffers = BufferPool(vault_format.chunk_buffer_size(CHUNK), 2 * (vault_format.PARALLEL_WINDOW + 1))
+    with ThreadPoolExecutor(max_workers=4) as pool, vault_format.VaultFileReader(session_key, encrypted) as reader:
+        chunks = reader.iter_chunks(offset, length, pool, buffers)
+        expected = data[offset:] if length is None else data[offset:offset + length]
+        assert b"".join(bytes(chunk) for chunk in chunks) == expected
+    assert _all_returned(buffers)
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_buffers_come_back_after_an_early_exit(session_key, long_file, parallel):
+    data, encrypted = long_file
+    buffers = BufferPool(vault_format.chunk_buffer_size(CHUNK), 2 * (vault_format.PARALLEL_WINDOW + 1))
+    with ThreadPoolExecutor(max_workers=4) as pool, vault_format.VaultFileReader(session_key, encrypted) as reader:
+        chunks = reader.iter_chunks(CHUNK, None, pool if parallel else None, buffers)
+        assert bytes(next(chunks)) == data[CHUNK:2 * CHUNK]
+        chunks.close()
+        # Sin pool se reciclan; con pool se descartan (alguna tarea podía
+        # seguir escribiendo) y dejan su lugar libre para buffers nuevos
+        assert _all_returned(buffers)
+        if not parallel:
+            assert buffers.allocated == 2
+        again = b"".join(bytes(chunk) for chunk in reader.iter_chunks(CHUNK, None, pool, buffers))
+        assert again == data[CHUNK:]
+    assert _all_returned(buffers)
+
+
+def test_buffered_read_rejects_tampered_chunk(session_key, tmp_path):
+    source = tmp_path / "original.bin"
+    source.write_bytes(os.urandom(3 * CHUNK))
+    encrypted = tmp_path / "cifrado.enc"
+    _write_with_buffers(session_key, source, encrypted)
+    data = bytearray(encrypted.read_bytes())
+    data[vault_format.HEADER_SIZE + CHUNK + 100] ^= 1
+    encrypted.write_bytes(bytes(data))
+
+    buffers = _pool()
+    with vault_format.VaultFileReader(session_key, encrypted) as reader:
+        with pytest.raises(InvalidToken):
+            for _ in reader.iter_chunks(buffers=buffers):
+                pass
+    assert _all_returned(buffers)
+
+
+def test_discarded_buffer_frees_a_slot():
+    buffers = BufferPool(16, 1)
+    first = buffers.acquire()
+    buffers.discard(first)
+    assert buffers.acquire() is not first
+
+
+@pytest.mark.parametrize("zero_copy", [False, True])
+def test_engine_round_trip(baul, session_key, tmp_path, mmap_reads, zero_copy):
+    source = tmp_path / "origen" / "carpeta"
+    source.mkdir(parents=True)
+    (source / "aleatorio.bin").write_bytes(os.urandom(5 * CHUNK + 1))
+    (source / "texto.txt").write_bytes(TEXT * (5 * CHUNK // len(TEXT)))
+    manifests = manifest.ManifestStore(baul, session_key)
+    report = ImportEngine(session_key, manifests, chunk_size=CHUNK, compression="zlib",
+                          pack_small_files=False, zero_copy=zero_copy).run([source], baul)
+    assert not report.failed
+
+    destination = tmp_path / "salida"
+    destination.mkdir()
+    report = ExportEngine(session_key, manifests, zero_copy=zero_copy).run([baul / "carpeta"], destination)
+    assert not report.failed
+    for path in source.iterdir():
+        assert filecmp.cmp(path, destination / "carpeta" / path.name, shallow=False)
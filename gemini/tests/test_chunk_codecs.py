@@ -0,0 +1,30 @@
+import os
+import pytest
+from cryptography.fernet import InvalidToken
+import chunk_codecs
+
+TEXT = b"fecha usuario error INFO 2024-05-01 ok;\n" * 500
+
+
+@pytest.mark.parametrize("name", [name for name in chunk_codecs.available() if name != "none"])
+def test_compress_round_trip(name):
+    codec = chunk_codecs.codec_from_name(name)
+    used, packed = chunk_codecs.compress(TEXT, codec)
+    assert used == codec and len(packed) < len(TEXT)
+    assert chunk_codecs.decompress(used, packed, len(TEXT)) == TEXT
+
+
+def test_random_data_is_stored_as_is():
+    data = os.urandom(64 * 1024)
+    assert chunk_codecs.entropy(data) > chunk_codecs.MAX_ENTROPY
+    assert chunk_codecs.compress(data, chunk_codecs.ZLIB) == (chunk_codecs.NONE, data)
+
+
+def test_already_compressed_formats_are_skipped():
+    assert not chunk_codecs.should_compress_file("foto.JPG")
+    assert chunk_codecs.should_compress_file("notas.txt")
+
+
+def test_garbage_is_rejected():
+    with pytest.raises(InvalidToken):
+        chunk_codecs.decompress(chunk_codecs.ZLIB, b"esto no es zlib", 100)
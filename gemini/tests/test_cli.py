@@ -0,0 +1,185 @@
+import io
+import os
+import json
+import filecmp
+import pytest
+import cli
+import manifest
+import pack_store
+from transfer_engine import ImportEngine, ExportEngine
+from conftest import CHUNK, PASSWORD
+
+
+@pytest.fixture
+def source(tmp_path):
+    folder = tmp_path / "origen" / "Fotos"
+    (folder / "2024").mkdir(parents=True)
+    (folder / "grande.bin").write_bytes(os.urandom(pack_store.SMALL_FILE + 3 * CHUNK))
+    (folder / "nota.txt").write_bytes(b"una nota")
+    (folder / "2024" / "playa.jpg").write_bytes(os.urandom(5000))
+    return folder
+
+
+@pytest.fixture
+def filled(baul, session_key, source, monkeypatch):
+    """Baúl con la carpeta 'Fotos' importada; la contraseña va en la variable de entorno."""
+    monkeypatch.setenv(cli.PASSWORD_ENV, PASSWORD)
+    report = ImportEngine(session_key, manifest.ManifestStore(baul, session_key), chunk_size=CHUNK).run(
+        [source], baul)
+    assert not report.failed
+    return baul
+
+
+def _run(capsys, *argv):
+    """Corre la línea de comandos; retorna (código de salida, eventos)."""
+    code = cli.main([str(arg) for arg in argv])
+    out = capsys.readouterr().out
+    # La salida estándar es solo JSON, una línea por evento
+    return code, [json.loads(line) for line in out.splitlines()]
+
+
+def _events(events, name):
+    return [event for event in events if event["event"] == name]
+
+
+def _big_file(baul):
+    return next(path for path in (baul / "Fotos").iterdir() if path.suffix == ".enc")
+
+
+def test_unlock(filled, capsys):
+    code, events = _run(capsys, "unlock", filled)
+    assert code == cli.EXIT_OK
+    assert [event["event"] for event in events] == ["unlocked"]
+    assert events[0]["rotation_pending"] is False
+
+
+def test_wrong_password(filled, capsys, monkeypatch):
+    monkeypatch.setenv(cli.PASSWORD_ENV, "equivocada")
+    code, events = _run(capsys, "unlock", filled)
+    assert code == cli.EXIT_PASSWORD
+    assert events == [{"event": "fatal", "error": "Contraseña incorrecta", "exit_code": cli.EXIT_PASSWORD}]
+
+
+def test_password_from_stdin(filled, capsys, monkeypatch):
+    monkeypatch.delenv(cli.PASSWORD_ENV)
+    monkeypatch.setattr("sys.stdin", io.StringIO(PASSWORD + "\r\n"))
+    assert _run(capsys, "unlock", filled, "--password-stdin")[0] == cli.EXIT_OK
+
+
+def test_missing_vault_or_key(tmp_path, filled, capsys):
+    assert _run(capsys, "unlock", tmp_path / "no_existe")[0] == cli.EXIT_NOT_FOUND
+    (filled / ".credentials" / "vault.key").unlink()
+    code, events = _run(capsys, "unlock", filled)
+    assert code == cli.EXIT_NOT_FOUND and events[0]["event"] == "fatal"
+
+
+@pytest.mark.parametrize("path, code", [("Fotos/no_existe.txt", cli.EXIT_NOT_FOUND),
+                                        ("../fuera", cli.EXIT_USAGE),
+                                        (".credentials", cli.EXIT_USAGE),
+                                        ("Fotos/nota.txt", cli.EXIT_USAGE)])
+def test_list_rejects_bad_paths(filled, capsys, path, code):
+    assert _run(capsys, "list", filled, path)[0] == code
+
+
+def test_bad_arguments_exit_with_usage():
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(["borrar", "E:/Baul"])
+    assert exit_info.value.code == cli.EXIT_USAGE
+
+
+def test_list_shows_real_names(filled, capsys):
+    code, events = _run(capsys, "list", filled, "-r")
+    assert code == cli.EXIT_OK
+    entries = {event["path"]: event for event in _events(events, "entry")}
+    assert set(entries) == {"Fotos", "Fotos/2024", "Fotos/grande.bin", "Fotos/nota.txt", "Fotos/2024/playa.jpg"}
+    assert entries["Fotos/nota.txt"]["storage"] == "pack"
+    assert entries["Fotos/grande.bin"]["storage"] == "file"
+    assert entries["Fotos/grande.bin"]["size"] == pack_store.SMALL_FILE + 3 * CHUNK
+
+
+def test_import_and_export_round_trip(filled, capsys, tmp_path, source):
+    extra = tmp_path / "extra.txt"
+    extra.write_bytes(b"otro archivo")
+    code, events = _run(capsys, "import", filled, extra, "--to", "Nuevos/2024", "--each-file")
+    assert code == cli.EXIT_OK
+    assert [event["event"] for event in events] == ["unlocked", "start", "file", "done"]
+    assert events[-1]["files_ok"] == 1 and events[-1]["bytes_read"] == len(b"otro archivo")
+
+    code, events = _run(capsys, "export", filled, "Fotos", "Nuevos/2024/extra.txt", "--to", tmp_path / "salida")
+    assert code == cli.EXIT_OK
+    done = _events(events, "done")[0]
+    assert (done["files_ok"], done["files_failed"]) == (4, 0)
+    assert _events(events, "start")[0]["files"] == 4
+    assert not filecmp.dircmp(source, tmp_path / "salida" / "Fotos").diff_files
+    assert (tmp_path / "salida" / "extra.txt").read_bytes() == b"otro archivo"
+
+
+def test_import_of_a_missing_source(filled, capsys, tmp_path):
+    assert _run(capsys, "import", filled, tmp_path / "no_existe")[0] == cli.EXIT_NOT_FOUND
+
+
+def test_verify_writes_nothing(filled, capsys):
+    before = sorted(filled.rglob("*"))
+    code, events = _run(capsys, "verify", filled)
+    assert code == cli.EXIT_OK
+    done = _events(events, "done")[0]
+    assert (done["files_ok"], done["files_failed"], done["bytes_written"]) == (3, 0, 0)
+    assert sorted(filled.rglob("*")) == before
+
+
+def test_verify_reports_a_damaged_file(filled, capsys):
+    damaged = _big_file(filled)
+    data = bytearray(damaged.read_bytes())
+    data[len(data) // 2] ^= 1
+    damaged.write_bytes(bytes(data))
+
+    code, events = _run(capsys, "verify", filled, "Fotos")
+    assert code == cli.EXIT_FAILED
+    errors = _events(events, "error")
+    assert [event["source"] for event in errors] == [str(damaged)]
+    assert _events(events, "done")[0]["files_ok"] == 2
+
+
+def test_stats(filled, capsys):
+    (filled / "Fotos" / ("a" * 16 + ".enc" + ".tmp")).write_bytes(b"resto")
+    code, events = _run(capsys, "stats", filled)
+    assert code == cli.EXIT_OK
+    stats = events[-1]
+    assert (stats["folders"], stats["files"], stats["packed_files"], stats["packs"]) == (2, 3, 2, 1)
+    assert stats["temp_files"] == 1
+    assert stats["plain_bytes"] == pack_store.SMALL_FILE + 3 * CHUNK + len(b"una nota") + 5000
+
+
+# --- ExportEngine solo verificando (destino None) ---
+def _verify(session_key, baul, sources=None):
+    manifests = manifest.ManifestStore(baul, session_key)
+    return ExportEngine(session_key, manifests).run(sources or [baul / "Fotos"], None)
+
+
+def test_verify_mode_reads_every_file(filled, session_key):
+    report = _verify(session_key, filled)
+    assert (report.files_ok, report.bytes_written) == (3, 0)
+    assert all(result.destination == "" and result.size > 0 for result in report.results)
+
+
+def test_verify_mode_compares_the_hash(filled, session_key):
+    manifests = manifest.ManifestStore(filled, session_key)
+    folder = filled / "Fotos"
+    file_id = manifests.find_by_name(folder, "nota.txt")
+    entry = dict(manifests.lookup(folder, file_id))
+    assert "blake2b" in entry
+    # El archivo se descifra bien, pero no es el que se importó
+    entry["blake2b"] = "0" * 32
+    manifests.add(folder, file_id, **entry)
+    manifests.flush()
+
+    report = _verify(session_key, filled)
+    assert [os.path.basename(result.source) for result in report.failed] == [file_id]
+    assert "hash" in report.failed[0].error
+
+
+def test_verify_mode_rejects_a_truncated_file(filled, session_key):
+    damaged = _big_file(filled)
+    damaged.write_bytes(damaged.read_bytes()[:-1])
+    report = _verify(session_key, filled, [damaged])
+    assert len(report.failed) == 1 and report.files_ok == 0
@@ -0,0 +1,93 @@
+import os
+import pytest
+from cryptography.fernet import Fernet
+import crypto_utils
+import kdf
+from conftest import PASSWORD, FAST_KDF
+
+FAST_SCRYPT = {"n": 2 ** 10, "r": 8, "p": 1}
+
+
+@pytest.mark.parametrize("name, params", [(kdf.PBKDF2, FAST_KDF), (kdf.SCRYPT, FAST_SCRYPT)])
+def test_vault_key_records_its_kdf(name, params):
+    content, session_key = crypto_utils.create_vault_key(PASSWORD, name, params)
+
+    kdf_name, stored_params, salt, _ = crypto_utils.unpack_vault_key(content)
+    assert (kdf_name, stored_params, len(salt)) == (name, params, 16)
+    unlocked = crypto_utils.unlock_vault_key(PASSWORD, content)
+    assert unlocked.keys == session_key.keys
+
+
+def test_wrong_password_is_rejected(vault_key):
+    with pytest.raises(ValueError):
+        crypto_utils.unlock_vault_key("otra contraseña", vault_key[0])
+
+
+def test_legacy_vault_key_still_unlocks():
+    # Formato anterior: salt + token, PBKDF2 con los parámetros de siempre
+    salt = os.urandom(16)
+    master = Fernet.generate_key()
+    content = salt + Fernet(crypto_utils.derive_key(PASSWORD, salt)).encrypt(master)
+
+    assert crypto_utils.unpack_vault_key(content)[:2] == (kdf.PBKDF2, kdf.LEGACY_PARAMS)
+    assert crypto_utils.unlock_vault_key(PASSWORD, content).keys == [master]
+
+
+def test_change_password_keeps_the_master_keys(vault_key, monkeypatch):
+    # Sin calibrar (lento): los parámetros nuevos son los mínimos de prueba
+    monkeypatch.setattr(kdf, "calibrate", lambda name=None, target=None: (kdf.PBKDF2, FAST_KDF))
+    content, session_key = vault_key
+
+    changed = crypto_utils.change_password(content, PASSWORD, "nueva")
+    assert crypto_utils.unlock_vault_key("nueva", changed).keys == session_key.keys
+    with pytest.raises(ValueError):
+        crypto_utils.unlock_vault_key(PASSWORD, changed)
+    with pytest.raises(ValueError):
+        crypto_utils.change_password(content, "equivocada", "nueva")
+
+
+def test_new_and_unlocked_vaults_derive_the_key_once(monkeypatch):
+    # La derivación es lo lento: crear o abrir el baúl no debe repetirla
+    calls = []
+    real_derive = kdf.derive
+    monkeypatch.setattr(kdf, "derive", lambda *args: calls.append(args[0]) or real_derive(*args))
+
+    content, session_key = crypto_utils.create_vault_key(PASSWORD, kdf.PBKDF2, FAST_KDF)
+    assert calls == [kdf.PBKDF2]
+    # La llave de sesión recién creada ya abre el baúl, sin pedir la contraseña
+    assert crypto_utils.unlock_vault_key(PASSWORD, content).keys == session_key.keys
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("name", ["bcrypt", "PBKDF2-SHA256"])
+def test_unknown_kdf_is_rejected(name):
+    with pytest.raises(ValueError, match="disponibles"):
+        kdf.calibrate(name)
+    with pytest.raises(ValueError):
+        kdf.derive(name, {}, b"x", os.urandom(16))
+
+
+def test_argon2id_missing_falls_back_to_scrypt(monkeypatch):
+    # 'cryptography' anterior a la 44: sin Argon2id
+    monkeypatch.setattr(kdf, "Argon2id", None)
+    assert kdf.ARGON2ID not in kdf.available()
+    assert kdf.default_kdf() == kdf.SCRYPT
+    with pytest.raises(ValueError, match=kdf.SCRYPT):
+        kdf.calibrate(kdf.ARGON2ID)
+    with pytest.raises(ValueError):
+        kdf.derive(kdf.ARGON2ID, kdf.MIN_PARAMS[kdf.ARGON2ID], b"x", os.urandom(16))
+
+
+@pytest.mark.parametrize("name", [kdf.PBKDF2, kdf.SCRYPT])
+def test_calibration_never_goes_below_the_minimum(name):
+    # Objetivo imposible de cumplir: se quedan los mínimos
+    assert kdf.calibrate(name, target=0.0) == (name, kdf.MIN_PARAMS[name])
+
+
+def test_calibration_scales_with_the_measured_time(monkeypatch):
+    monkeypatch.setattr(kdf, "time_derive", lambda name, params: 0.01)
+    # PBKDF2 es lineal: 50 veces el tiempo medido, 50 veces las iteraciones
+    assert kdf.calibrate(kdf.PBKDF2, target=0.5)[1] == {"iterations": 10_000_000}
+    # scrypt se duplica hasta el tope de memoria aunque no alcance el objetivo
+    params = kdf.calibrate(kdf.SCRYPT, target=10.0)[1]
+    assert 128 * params["r"] * params["n"] == kdf.MAX_MEMORY_KIB * 1024
@@ -0,0 +1,160 @@
+import os
+import shutil
+import filecmp
+import pytest
+from cryptography.fernet import InvalidToken
+import dedup_store
+import kdf
+import manifest
+import rekey
+import vault_format
+from transfer_engine import ImportEngine, ExportEngine
+from conftest import PASSWORD, FAST_KDF
+
+SIZE = 1_500_000
+
+
+def _chunk_files(baul):
+    return sorted(path for path in (baul / dedup_store.STORE_DIR).rglob("*" + dedup_store.CHUNK_EXT))
+
+
+def _import(session_key, manifests, source, baul):
+    report = ImportEngine(session_key, manifests, dedup=True).run([source], baul)
+    assert not report.failed
+    return report
+
+
+def _export(session_key, manifests, baul, tmp_path):
+    destination = tmp_path / "salida"
+    destination.mkdir(exist_ok=True)
+    report = ExportEngine(session_key, manifests).run([baul / "carpeta"], destination)
+    assert not report.failed
+    return destination / "carpeta"
+
+
+@pytest.fixture
+def source(tmp_path):
+    folder = tmp_path / "origen" / "carpeta"
+    folder.mkdir(parents=True)
+    (folder / "original.bin").write_bytes(os.urandom(SIZE))
+    return folder
+
+
+def test_round_trip(baul, session_key, source, tmp_path):
+    (source / "vacio.bin").write_bytes(b"")
+    manifests = manifest.ManifestStore(baul, session_key)
+    _import(session_key, manifests, source, baul)
+
+    exported = _export(session_key, manifests, baul, tmp_path)
+    for name in ("original.bin", "vacio.bin"):
+        assert filecmp.cmp(source / name, exported / name, shallow=False)
+
+
+def test_identical_content_shares_chunks(baul, session_key, source):
+    manifests = manifest.ManifestStore(baul, session_key)
+    _import(session_key, manifests, source, baul)
+    chunks = _chunk_files(baul)
+    assert chunks
+
+    # Misma información con otro nombre y un poco más al final
+    data = (source / "original.bin").read_bytes()
+    (source / "copia.bin").write_bytes(data + os.urandom(1000))
+    report = _import(session_key, manifests, source, baul)
+    # El último trozo del original terminaba en el fin del archivo: con datos
+    # después se cambia por a lo más dos trozos nuevos, que juntos miden lo
+    # mismo que él más lo agregado (los cortes dependen del contenido, así
+    # que ese último trozo puede ser de cualquier tamaño)
+    assert len(_chunk_files(baul)) <= len(chunks) + 2
+    assert report.bytes_written < max(path.stat().st_size for path in chunks) + 1000 + 4096
+
+
+def test_replaced_file_releases_its_chunks(baul, session_key, source, tmp_path):
+    manifests = manifest.ManifestStore(baul, session_key)
+    _import(session_key, manifests, source, baul)
+    old_chunks = set(_chunk_files(baul))
+
+    path = source / "original.bin"
+    path.write_bytes(os.urandom(SIZE))
+    os.utime(path, (1, 1))
+    _import(session_key, manifests, source, baul)
+
+    assert not old_chunks & set(_chunk_files(baul))
+    store = manifests.chunk_store()
+    assert dedup_store.ChunkStore(baul, session_key, create=False).refs == store.refs
+    # Nada quedó huérfano para el gc
+    assert store.gc(baul)["removed"] == 0
+    assert filecmp.cmp(path, _export(session_key, manifests, baul, tmp_path) / "original.bin", shallow=False)
+
+
+def test_removed_file_releases_its_chunks(baul, session_key, source):
+    manifests = manifest.ManifestStore(baul, session_key)
+    _import(session_key, manifests, source, baul)
+    folder = baul / "carpeta"
+    file_id = manifests.find_by_name(folder, "original.bin")
+
+    manifests.remove(folder, file_id)
+    manifests.flush()
+    assert _chunk_files(baul) == []
+    assert manifests.chunk_store().refs == {}
+
+
+def test_tampered_chunk_is_rejected(baul, session_key, source, tmp_path):
+    manifests = manifest.ManifestStore(baul, session_key)
+    _import(session_key, manifests, source, baul)
+    chunk = _chunk_files(baul)[0]
+    data = bytearray(chunk.read_bytes())
+    data[20] ^= 1
+    chunk.write_bytes(bytes(data))
+
+    store = dedup_store.ChunkStore(baul, session_key, create=False)
+    chunk_id = bytes.fromhex(chunk.name[:-len(dedup_store.CHUNK_EXT)])
+    with pytest.raises(InvalidToken):
+        store.get(chunk_id, dedup_store.MIN_CHUNK)
+    destination = tmp_path / "salida"
+    destination.mkdir()
+    report = ExportEngine(session_key, manifests).run([baul / "carpeta"], destination)
+    assert report.failed
+
+
+def test_file_is_deleted_even_without_the_chunk_store(baul, session_key, source):
+    manifests = manifest.ManifestStore(baul, session_key)
+    _import(session_key, manifests, source, baul)
+    folder = baul / "carpeta"
+    file_id = manifests.find_by_name(folder, "original.bin")
+    # Almacén borrado a mano: no hay trozos que soltar, pero el archivo se va igual
+    shutil.rmtree(baul / dedup_store.STORE_DIR)
+
+    reloaded = manifest.ManifestStore(baul, session_key)
+    reloaded.remove(folder, file_id)
+    reloaded.flush()
+    assert not (folder / file_id).exists()
+
+
+def _decoy(baul, session_key):
+    """Un .enc dañado dentro del almacén, donde nadie debería buscar archivos."""
+    decoy = baul / dedup_store.STORE_DIR / "ab" / manifest.new_file_id()
+    decoy.parent.mkdir(exist_ok=True)
+    header, _ = vault_format.new_file_header(session_key, flags=vault_format.FLAG_RECIPE)
+    decoy.write_bytes(header + b"basura")
+    return decoy
+
+
+def test_gc_does_not_look_inside_the_store(baul, session_key, source):
+    manifests = manifest.ManifestStore(baul, session_key)
+    _import(session_key, manifests, source, baul)
+    _decoy(baul, session_key)
+
+    report = manifests.chunk_store().gc(baul)
+    assert report["errors"] == []
+    assert report["live"] == len(_chunk_files(baul))
+
+
+def test_rotation_does_not_look_inside_the_store(baul, session_key, source, monkeypatch):
+    monkeypatch.setattr(kdf, "calibrate", lambda name=None, target=None: (kdf.PBKDF2, FAST_KDF))
+    _import(session_key, manifest.ManifestStore(baul, session_key), source, baul)
+    decoy = _decoy(baul, session_key)
+    before = decoy.read_bytes()
+
+    report = rekey.rotate_master_key(baul, PASSWORD)
+    assert report.finished and not report.failed
+    assert decoy.read_bytes() == before
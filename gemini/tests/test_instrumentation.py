@@ -0,0 +1,111 @@
+import json
+import threading
+import pytest
+import instrumentation
+
+
+@pytest.fixture(autouse=True)
+def stopped():
+    # Cada prueba empieza y termina sin medir
+    instrumentation.stop(save=False)
+    yield
+    instrumentation.stop(save=False)
+
+
+def test_off_by_default_costs_nothing(tmp_path):
+    assert not instrumentation.enabled()
+    assert instrumentation.span("encrypt", 10) is instrumentation.span("read")
+    instrumentation.count("bytes_copied", 5)
+    assert instrumentation.traced("render")(lambda x: x * 2)(21) == 42
+    assert instrumentation.stop() is None
+
+
+@pytest.mark.parametrize("value, path", [(None, None), ("", None), ("0", None),
+                                         ("1", instrumentation.DEFAULT_PATH), ("mi-traza.json", "mi-traza.json")])
+def test_environment_switch(monkeypatch, value, path):
+    if value is None:
+        monkeypatch.delenv(instrumentation.ENV_VAR, raising=False)
+    else:
+        monkeypatch.setenv(instrumentation.ENV_VAR, value)
+    instrumentation.start_from_env()
+    assert instrumentation.enabled() == (path is not None)
+    if path is not None:
+        assert instrumentation._recorder.path == path
+
+
+def test_trace_and_summary(tmp_path, capsys):
+    path = tmp_path / "traza.json"
+    instrumentation.start(path)
+    # Un segundo start no reinicia la medición
+    instrumentation.start(tmp_path / "otra.json")
+
+    @instrumentation.traced("render")
+    def render():
+        pass
+
+    def worker():
+        for _ in range(3):
+            with instrumentation.span("encrypt", 1024 * 1024):
+                pass
+        instrumentation.count("bytes_copied", 100)
+
+    thread = threading.Thread(target=worker, name="cifrado")
+    thread.start()
+    thread.join()
+    render()
+    instrumentation.count("bytes_copied", 50)
+    summary = instrumentation.stop()
+
+    assert not instrumentation.enabled()
+    assert summary["spans"]["encrypt"]["count"] == 3
+    assert summary["spans"]["encrypt"]["bytes"] == 3 * 1024 * 1024
+    assert summary["spans"]["render"]["mb_per_s"] is None
+    assert summary["counters"] == {"bytes_copied": 150}
+
+    trace = json.loads(path.read_text(encoding="utf-8"))
+    events = trace["traceEvents"]
+    assert {event["args"]["name"] for event in events if event["ph"] == "M"} >= {"cifrado"}
+    spans = [event for event in events if event["ph"] == "X"]
+    assert sorted(event["name"] for event in spans) == ["encrypt"] * 3 + ["render"]
+    assert all(event["dur"] >= 0 and event["ts"] >= 0 for event in spans)
+    assert [event["args"]["bytes_copied"] for event in events if event["ph"] == "C"] == [100, 150]
+    assert trace["otherData"]["summary"]["counters"] == summary["counters"]
+    assert not (tmp_path / "otra.json").exists()
+
+    err = capsys.readouterr().err
+    assert "encrypt" in err and "bytes_copied: 150" in err and str(path) in err
+
+
+def test_span_is_recorded_when_the_code_fails():
+    instrumentation.start("no-se-guarda.json")
+
+    @instrumentation.traced("kdf")
+    def fails():
+        raise ValueError("contraseña")
+
+    with pytest.raises(ValueError):
+        fails()
+    assert instrumentation.stop(save=False)["spans"]["kdf"]["count"] == 1
+
+
+def test_events_past_the_limit_go_only_to_the_summary(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(instrumentation, "MAX_EVENTS", 3)
+    path = tmp_path / "traza.json"
+    instrumentation.start(path)
+    for _ in range(5):
+        with instrumentation.span("write", 10):
+            pass
+    summary = instrumentation.stop()
+
+    assert summary["spans"]["write"]["count"] == 5 and summary["dropped"] == 2
+    assert len([event for event in json.loads(path.read_text())["traceEvents"] if event["ph"] == "X"]) == 3
+    assert "2 tramos solo en el resumen" in capsys.readouterr().err
+
+
+def test_unwritable_trace_still_prints_the_summary(tmp_path, capsys):
+    instrumentation.start(tmp_path / "no_existe" / "traza.json")
+    with instrumentation.span("fsync"):
+        pass
+    assert instrumentation.stop()["spans"]["fsync"]["count"] == 1
+    err = capsys.readouterr().err
+    assert "No se pudo guardar la traza" in err and "fsync" in err
@@ -0,0 +1,216 @@
+import os
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+import crypto_utils
+import manifest
+
+
+def _store(baul, session_key):
+    return manifest.ManifestStore(baul, session_key)
+
+
+def test_entries_survive_a_reload(baul, session_key):
+    store = _store(baul, session_key)
+    file_id = manifest.new_file_id()
+    store.add(baul, file_id, "Informe final.pdf", size=10)
+    store.flush()
+
+    assert manifest.is_file_id(file_id)
+    # El manifiesto en disco va cifrado: el nombre no aparece en claro
+    assert b"Informe" not in (baul / manifest.MANIFEST_NAME).read_bytes()
+    reloaded = _store(baul, session_key)
+    assert reloaded.lookup(baul, file_id) == {"name": "Informe final.pdf", "size": 10}
+    assert manifest.resolve_name(reloaded, baul, file_id) == "Informe final.pdf"
+
+
+def test_nothing_is_written_before_flush(baul, session_key):
+    store = _store(baul, session_key)
+    store.add(baul, manifest.new_file_id(), "a.txt")
+    assert not (baul / manifest.MANIFEST_NAME).exists()
+
+
+def test_replace_deletes_old_file_only_after_the_manifest_is_saved(baul, session_key, monkeypatch):
+    store = _store(baul, session_key)
+    old_id, new_id = manifest.new_file_id(), manifest.new_file_id()
+    (baul / old_id).write_bytes(b"version anterior")
+    (baul / new_id).write_bytes(b"version nueva")
+    store.add(baul, old_id, "a.txt")
+    store.flush()
+
+    store.add(baul, new_id, "a.txt")
+    assert store.find_by_name(baul, "a.txt") == new_id
+    # Hasta guardar, el archivo viejo sigue en disco (el manifiesto en disco lo nombra)
+    assert (baul / old_id).exists()
+
+    removed = []
+    real_remove = os.remove
+
+    def checked_remove(path):
+        # Cuando se borra el archivo viejo, el manifiesto en disco ya apunta al nuevo
+        on_disk = _store(baul, session_key)
+        assert on_disk.find_by_name(baul, "a.txt") == new_id
+        removed.append(os.path.basename(path))
+        real_remove(path)
+
+    monkeypatch.setattr(os, "remove", checked_remove)
+    store.flush()
+
+    assert removed == [old_id]
+    assert not (baul / old_id).exists()
+    assert (baul / new_id).exists()
+
+
+def test_remove_deletes_the_file_on_flush(baul, session_key):
+    store = _store(baul, session_key)
+    file_id = manifest.new_file_id()
+    (baul / file_id).write_bytes(b"datos")
+    store.add(baul, file_id, "a.txt")
+    store.flush()
+
+    store.remove(baul, file_id)
+    assert (baul / file_id).exists()
+    store.flush()
+    assert not (baul / file_id).exists()
+    assert _store(baul, session_key).entries(baul) == {}
+
+
+def test_changes_from_another_store_are_picked_up(baul, session_key):
+    store = _store(baul, session_key)
+    store.add(baul, manifest.new_file_id(), "a.txt")
+    store.flush()
+    assert store.find_by_name(baul, "b.txt") is None
+
+    other = _store(baul, session_key)
+    other.add(baul, manifest.new_file_id(), "b.txt")
+    other.flush()
+    # Mismo mtime en sistemas de archivos con poca resolución: se fuerza otro
+    stat = os.stat(baul / manifest.MANIFEST_NAME)
+    os.utime(baul / manifest.MANIFEST_NAME, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    store.revalidate(baul)
+    assert store.find_by_name(baul, "b.txt") is not None
+
+
+def test_legacy_hex_names_still_resolve(baul, session_key):
+    store = _store(baul, session_key)
+    legacy = session_key.encrypt("viejo.txt".encode()).hex() + ".enc"
+    assert manifest.resolve_name(store, baul, legacy) == "viejo.txt"
+    with pytest.raises(InvalidToken):
+        manifest.resolve_name(store, baul, "no-es-hex.enc")
+
+
+def test_failed_save_keeps_the_old_manifest_and_file(baul, session_key, monkeypatch):
+    store = _store(baul, session_key)
+    old_id, new_id = manifest.new_file_id(), manifest.new_file_id()
+    (baul / old_id).write_bytes(b"version anterior")
+    store.add(baul, old_id, "a.txt")
+    store.flush()
+    store.add(baul, new_id, "a.txt")
+
+    real_replace = os.replace
+
+    def unplugged(src, dst):
+        raise OSError("USB desconectada")
+
+    monkeypatch.setattr(os, "replace", unplugged)
+    with pytest.raises(OSError):
+        store.flush()
+    # El manifiesto en disco sigue completo y nombrando al archivo viejo
+    assert _store(baul, session_key).find_by_name(baul, "a.txt") == old_id
+    assert (baul / old_id).exists()
+
+    # Al reintentar se guarda y recién entonces se borra el viejo
+    monkeypatch.setattr(os, "replace", real_replace)
+    store.flush()
+    assert _store(baul, session_key).find_by_name(baul, "a.txt") == new_id
+    assert not (baul / old_id).exists()
+
+
+@pytest.mark.parametrize("content", [b"", b"basura", None])
+def test_damaged_manifest_does_not_block_the_vault(baul, session_key, content):
+    store = _store(baul, session_key)
+    other = baul / "otra"
+    other.mkdir()
+    store.add(baul, manifest.new_file_id(), "a.txt")
+    store.add(other, manifest.new_file_id(), "b.txt")
+    store.flush()
+    if content is None:
+        # Manifiesto de otro baúl: válido, pero con otra llave
+        content = crypto_utils.SessionKey(Fernet.generate_key()).encrypt(b'{"entries": {}}')
+    (baul / manifest.MANIFEST_NAME).write_bytes(content)
+
+    reloaded = _store(baul, session_key)
+    assert reloaded.entries(baul) == {}
+    assert reloaded.find_by_name(other, "b.txt") is not None
+
+
+def test_unsaved_changes_survive_revalidate(baul, session_key):
+    store = _store(baul, session_key)
+    store.add(baul, manifest.new_file_id(), "a.txt")
+    store.flush()
+    file_id = manifest.new_file_id()
+    store.add(baul, file_id, "b.txt")
+
+    # Otro programa reescribe el manifiesto mientras tanto
+    other = _store(baul, session_key)
+    other.add(baul, manifest.new_file_id(), "c.txt")
+    other.flush()
+    store.revalidate(baul)
+    assert store.lookup(baul, file_id) is not None
+
+
+def test_readding_the_same_id_does_not_delete_it(baul, session_key):
+    store = _store(baul, session_key)
+    file_id = manifest.new_file_id()
+    (baul / file_id).write_bytes(b"datos")
+    store.add(baul, file_id, "a.txt", mtime=1)
+    store.flush()
+    store.add(baul, file_id, "a.txt", mtime=2)
+    store.flush()
+
+    assert (baul / file_id).exists()
+    assert _store(baul, session_key).lookup(baul, file_id)["mtime"] == 2
+
+
+def test_names_keep_every_character(baul, session_key):
+    store = _store(baul, session_key)
+    names = ["Canción ñandú.mp3", "línea\nnueva.txt", "emoji 📁.bin", "x" * 250 + ".txt", " espacios .txt"]
+    ids = [manifest.new_file_id() for _ in names]
+    for file_id, name in zip(ids, names):
+        store.add(baul, file_id, name)
+    store.flush()
+
+    reloaded = _store(baul, session_key)
+    assert [reloaded.lookup(baul, file_id)["name"] for file_id in ids] == names
+    assert all(len(file_id) == 20 for file_id in ids)
+
+
+@pytest.mark.parametrize("disk_name, expected", [("0123456789abcdef.enc", True), ("0123456789ABCDEF.enc", False),
+                                                  ("0123456789abcde.enc", False), ("0123456789abcdef.tmp", False),
+                                                  ("0123456789abcdef", False)])
+def test_is_file_id(disk_name, expected):
+    assert manifest.is_file_id(disk_name) is expected
+
+
+def test_unknown_name_is_rejected(baul, session_key):
+    store = _store(baul, session_key)
+    for disk_name in ("no-es-hex.enc", "abcd.enc", manifest.new_file_id()):
+        with pytest.raises(InvalidToken):
+            manifest.resolve_name(store, baul, disk_name)
+
+
+def test_manifests_are_decrypted_only_when_their_folder_is_opened(baul, session_key, monkeypatch):
+    store = _store(baul, session_key)
+    for name in ("a", "b", "c"):
+        (baul / name).mkdir()
+        store.add(baul / name, manifest.new_file_id(), f"{name}.txt")
+    store.flush()
+
+    reloaded = _store(baul, session_key)
+    opened = []
+    real_decrypt = session_key.decrypt
+    monkeypatch.setattr(session_key, "decrypt", lambda token: opened.append(token) or real_decrypt(token))
+    assert reloaded.entries(baul) == {}
+    assert reloaded.find_by_name(baul / "b", "b.txt") is not None
+    reloaded.entries(baul / "b")
+    assert len(opened) == 1
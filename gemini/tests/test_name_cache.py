@@ -0,0 +1,72 @@
+import threading
+from name_cache import NameCache
+
+
+def test_hit_only_while_mtime_matches():
+    cache = NameCache()
+    cache.put("a.enc", 100, "Informe.pdf")
+    assert cache.get("a.enc", 100) == "Informe.pdf"
+    # El archivo cambió en disco: hay que volver a descifrar
+    assert cache.get("a.enc", 101) is None
+    assert cache.get("b.enc", 100) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_least_recently_used_is_evicted():
+    cache = NameCache(max_entries=3)
+    for name in "abc":
+        cache.put(name, 1, name.upper())
+    cache.get("a", 1)           # 'a' pasa a ser el más reciente
+    cache.put("d", 1, "D")
+
+    assert cache.get("b", 1) is None
+    assert [cache.get(name, 1) for name in "acd"] == ["A", "C", "D"]
+    assert len(cache) == 3 and cache.evictions == 1
+
+
+def test_put_replaces_without_growing():
+    cache = NameCache(max_entries=2)
+    cache.put("a", 1, "viejo")
+    cache.put("a", 2, "nuevo")
+    cache.put("b", 1, "B")
+    assert len(cache) == 2 and cache.evictions == 0
+    assert cache.get("a", 2) == "nuevo" and cache.get("a", 1) is None
+
+
+def test_discard_and_clear():
+    cache = NameCache()
+    cache.put("a", 1, "A")
+    cache.put("b", 1, "B")
+    cache.discard("a")
+    cache.discard("no-existe")
+    assert cache.get("a", 1) is None and len(cache) == 1
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_stats():
+    cache = NameCache()
+    assert cache.stats()["hit_rate"] == 0.0
+    cache.put("a", 1, "A")
+    for _ in range(3):
+        cache.get("a", 1)
+    cache.get("b", 1)
+    assert cache.stats() == {"entries": 1, "hits": 3, "misses": 1, "evictions": 0, "hit_rate": 0.75}
+
+
+def test_concurrent_use_keeps_the_limit():
+    cache = NameCache(max_entries=100)
+
+    def worker(offset):
+        for index in range(2000):
+            cache.put(f"{offset}-{index}", index, str(index))
+            cache.get(f"{offset}-{index - 1}", index - 1)
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) == 100
+    assert cache.evictions == 4 * 2000 - 100
+    assert cache.hits + cache.misses == 4 * 2000
@@ -0,0 +1,172 @@
+import os
+import filecmp
+import pytest
+from cryptography.fernet import InvalidToken
+import chunk_codecs
+import manifest
+import pack_store
+from transfer_engine import ImportEngine, ExportEngine
+from conftest import CHUNK
+
+FILES = [b"", b"x", os.urandom(CHUNK - 10), b"texto repetido " * 900, os.urandom(3 * CHUNK)]
+
+
+def _write_pack(session_key, baul, codec=chunk_codecs.NONE):
+    writer = pack_store.PackWriter(session_key, baul, codec, chunk_size=CHUNK)
+    entries = [{"pack": writer.name, "offset": writer.append(data), "size": len(data)} for data in FILES]
+    writer.close()
+    return entries
+
+
+@pytest.mark.parametrize("codec", [chunk_codecs.NONE, chunk_codecs.ZLIB])
+def test_pack_round_trip(baul, session_key, codec):
+    entries = _write_pack(session_key, baul, codec)
+    cache = pack_store.PackCache(session_key, baul)
+    try:
+        for data, entry in zip(FILES, entries):
+            with pack_store.PackedFileReader(session_key, baul, entry) as reader:
+                assert reader.read_range(0, reader.size) == data
+            # Los archivos que cruzan un bloque salen enteros también desde el caché
+            with pack_store.PackedFileReader(session_key, baul, entry, cache) as reader:
+                assert reader.read_range(1, 10) == data[1:11]
+    finally:
+        cache.close()
+
+
+def test_entry_outside_the_pack_is_rejected(baul, session_key):
+    entry = dict(_write_pack(session_key, baul)[-1])
+    entry["size"] += 1
+    with pytest.raises(InvalidToken):
+        pack_store.PackedFileReader(session_key, baul, entry)
+
+
+def test_discarded_pack_leaves_nothing(baul, session_key):
+    writer = pack_store.PackWriter(session_key, baul, chunk_size=CHUNK)
+    writer.append(os.urandom(2 * CHUNK))
+    writer.discard()
+    assert not os.path.exists(writer.path)
+
+
+@pytest.fixture
+def small_files(tmp_path):
+    source = tmp_path / "origen" / "carpeta"
+    source.mkdir(parents=True)
+    for index in range(5):
+        (source / f"chico{index}.txt").write_bytes(os.urandom(100 * index))
+    (source / "grande.bin").write_bytes(os.urandom(pack_store.SMALL_FILE + 1))
+    return source
+
+
+def _export(session_key, manifests, baul, tmp_path, name="salida"):
+    destination = tmp_path / name
+    destination.mkdir()
+    report = ExportEngine(session_key, manifests).run([baul / "carpeta"], destination)
+    assert not report.failed
+    return destination / "carpeta"
+
+
+def test_import_packs_small_files(baul, session_key, small_files, tmp_path):
+    manifests = manifest.ManifestStore(baul, session_key)
+    report = ImportEngine(session_key, manifests, chunk_size=CHUNK).run([small_files], baul)
+    assert not report.failed
+
+    entries = manifests.entries(baul / "carpeta").values()
+    packed = {entry["name"] for entry in entries if pack_store.is_packed(entry)}
+    assert packed == {f"chico{index}.txt" for index in range(5)}
+    assert len(list((baul / pack_store.PACK_DIR).glob("*" + pack_store.PACK_EXT))) == 1
+
+    exported = _export(session_key, manifests, baul, tmp_path)
+    for path in small_files.iterdir():
+        assert filecmp.cmp(path, exported / path.name, shallow=False)
+
+
+def test_compact_rewrites_mostly_unused_packs(baul, session_key, small_files, tmp_path):
+    manifests = manifest.ManifestStore(baul, session_key)
+    ImportEngine(session_key, manifests, chunk_size=CHUNK).run([small_files], baul)
+    folder = baul / "carpeta"
+    for index in range(1, 4):
+        manifests.remove(folder, manifests.find_by_name(folder, f"chico{index}.txt"))
+        (small_files / f"chico{index}.txt").unlink()
+    manifests.flush()
+
+    report = pack_store.compact(manifests)
+    assert report["rewritten"] == 1 and not report["errors"]
+    exported = _export(session_key, manifests, baul, tmp_path)
+    for path in small_files.iterdir():
+        assert filecmp.cmp(path, exported / path.name, shallow=False)
+
+
+def test_damaged_pack_is_rejected(baul, session_key):
+    entries = _write_pack(session_key, baul)
+    path = pack_store.pack_path(baul, entries[0]["pack"])
+    data = bytearray(open(path, 'rb').read())
+
+    # Un byte alterado en el último bloque: los archivos de ese bloque no se leen
+    data[-1] ^= 1
+    with open(path, 'wb') as f:
+        f.write(bytes(data))
+    with pytest.raises(InvalidToken):
+        with pack_store.PackedFileReader(session_key, baul, entries[-1]) as reader:
+            reader.read_range(reader.size - 1, 1)
+
+    # Cortado: ni siquiera se abre
+    with open(path, 'wb') as f:
+        f.write(bytes(data[:-5 - CHUNK]))
+    with pytest.raises(InvalidToken):
+        pack_store.PackedFileReader(session_key, baul, entries[-1])
+
+
+def test_cache_keeps_only_the_last_packs(baul, session_key):
+    packs = [_write_pack(session_key, baul) for _ in range(pack_store.OPEN_PACKS + 2)]
+    cache = pack_store.PackCache(session_key, baul)
+    try:
+        for _ in range(2):
+            for entries in packs:
+                with pack_store.PackedFileReader(session_key, baul, entries[3], cache) as reader:
+                    assert reader.read_range(0, reader.size) == FILES[3]
+                assert len(cache._packs) <= pack_store.OPEN_PACKS
+    finally:
+        cache.close()
+
+
+def test_only_files_up_to_the_limit_are_packed(baul, session_key, tmp_path):
+    source = tmp_path / "origen" / "carpeta"
+    source.mkdir(parents=True)
+    (source / "limite.bin").write_bytes(os.urandom(pack_store.SMALL_FILE))
+    (source / "uno_mas.bin").write_bytes(os.urandom(pack_store.SMALL_FILE + 1))
+    manifests = manifest.ManifestStore(baul, session_key)
+    ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+
+    packed = {entry["name"]: pack_store.is_packed(entry) for entry in manifests.entries(baul / "carpeta").values()}
+    assert packed == {"limite.bin": True, "uno_mas.bin": False}
+    # Sin empaquetar, ni el pequeño
+    other = tmp_path / "otro_baul"
+    other.mkdir()
+    manifests = manifest.ManifestStore(other, session_key)
+    ImportEngine(session_key, manifests, chunk_size=CHUNK, pack_small_files=False).run([source], other)
+    assert not any(pack_store.is_packed(entry) for entry in manifests.entries(other / "carpeta").values())
+
+
+def test_compact_removes_unused_packs_and_keeps_busy_ones(baul, session_key, small_files):
+    manifests = manifest.ManifestStore(baul, session_key)
+    ImportEngine(session_key, manifests, chunk_size=CHUNK).run([small_files], baul)
+    unused = _write_pack(session_key, baul)[0]["pack"]
+
+    report = pack_store.compact(manifests)
+    assert (report["removed"], report["rewritten"], report["errors"]) == (1, 0, [])
+    assert not os.path.exists(pack_store.pack_path(baul, unused))
+    # El paquete en uso queda como estaba
+    assert len(list((baul / pack_store.PACK_DIR).glob("*" + pack_store.PACK_EXT))) == 1
+
+
+def test_compact_touches_nothing_if_a_manifest_is_unreadable(baul, session_key, small_files):
+    manifests = manifest.ManifestStore(baul, session_key)
+    ImportEngine(session_key, manifests, chunk_size=CHUNK).run([small_files], baul)
+    _write_pack(session_key, baul)
+    packs = sorted((baul / pack_store.PACK_DIR).iterdir())
+    (baul / "carpeta" / manifest.MANIFEST_NAME).write_bytes(b"basura")
+
+    report = pack_store.compact(manifests)
+    assert [os.path.basename(path) for path, _ in report["errors"]] == [manifest.MANIFEST_NAME]
+    assert report["removed"] == report["rewritten"] == 0
+    assert sorted((baul / pack_store.PACK_DIR).iterdir()) == packs
@@ -0,0 +1,216 @@
+import os
+import filecmp
+import pytest
+from cryptography.fernet import InvalidToken
+import crypto_utils
+import dedup_store
+import kdf
+import manifest
+import rekey
+import vault_format
+from transfer_engine import ImportEngine, ExportEngine
+from conftest import CHUNK, PASSWORD, FAST_KDF
+
+
+@pytest.fixture(autouse=True)
+def fast_calibrate(monkeypatch):
+    # Cada rotación vuelve a cifrar el vault.key; sin calibrar (lento)
+    monkeypatch.setattr(kdf, "calibrate", lambda name=None, target=None: (kdf.PBKDF2, FAST_KDF))
+
+
+def _write_v1(session_key, path, data: bytes):
+    """Archivo de la versión 1: llave derivada de la maestra, sin registro de llave."""
+    salt = os.urandom(16)
+    header = vault_format.pack_header(CHUNK, salt, version=1)
+    file_key = vault_format.derive_file_key(session_key, salt)
+    pieces = [data[i:i + CHUNK] for i in range(0, len(data), CHUNK)] or [b""]
+    with open(path, 'wb') as f:
+        f.write(header)
+        for index, piece in enumerate(pieces):
+            f.write(vault_format.seal_chunk(file_key, header, index, index == len(pieces) - 1, piece))
+
+
+def _unlock(baul):
+    return crypto_utils.unlock_vault_key(PASSWORD, (baul / ".credentials" / "vault.key").read_bytes())
+
+
+@pytest.fixture
+def filled_baul(baul, session_key, tmp_path):
+    """Baúl con archivos v2 grandes y empaquetados, uno v1 y uno Fernet antiguo."""
+    source = tmp_path / "origen" / "carpeta"
+    source.mkdir(parents=True)
+    (source / "grande.bin").write_bytes(os.urandom(200_000))
+    for index in range(3):
+        (source / f"chico{index}.txt").write_bytes(os.urandom(1000))
+    manifests = manifest.ManifestStore(baul, session_key)
+    report = ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+    assert not report.failed
+
+    folder = baul / "carpeta"
+    (source / "v1.bin").write_bytes(os.urandom(3 * CHUNK + 1))
+    v1_id = manifest.new_file_id()
+    _write_v1(session_key, folder / v1_id, (source / "v1.bin").read_bytes())
+    (source / "fernet.bin").write_bytes(os.urandom(5000))
+    fernet_id = manifest.new_file_id()
+    (folder / fernet_id).write_bytes(session_key.encrypt((source / "fernet.bin").read_bytes()))
+    manifests.add(folder, v1_id, "v1.bin")
+    manifests.add(folder, fernet_id, "fernet.bin")
+    manifests.flush()
+    return source
+
+
+def _assert_exports(baul, session_key, source, tmp_path):
+    destination = tmp_path / "exportado"
+    destination.mkdir(exist_ok=True)
+    report = ExportEngine(session_key, manifest.ManifestStore(baul, session_key)).run([baul / "carpeta"],
+                                                                                   destination)
+    assert not report.failed
+    exported = destination / "carpeta"
+    assert sorted(os.listdir(exported)) == sorted(os.listdir(source))
+    for name in os.listdir(source):
+        assert filecmp.cmp(source / name, exported / name, shallow=False), name
+
+
+def test_version_1_files_are_readable(baul, session_key, tmp_path):
+    data = os.urandom(2 * CHUNK + 3)
+    path = tmp_path / "v1.enc"
+    _write_v1(session_key, path, data)
+    with vault_format.VaultFileReader(session_key, path) as reader:
+        assert reader.header_size == vault_format.BASE_HEADER_SIZE
+        assert reader.read_range(0, reader.size) == data
+
+
+def test_rotation_moves_everything_to_the_new_key(baul, session_key, filled_baul, tmp_path):
+    report = rekey.rotate_master_key(baul, PASSWORD)
+    assert report.finished and not report.failed
+
+    new_key = _unlock(baul)
+    assert len(new_key.keys) == 1 and new_key.keys != session_key.keys
+    _assert_exports(baul, new_key, filled_baul, tmp_path)
+
+    # Con la llave anterior ya no se abre ni el manifiesto ni los archivos
+    some_file = next(p for p in (baul / "carpeta").iterdir() if manifest.is_file_id(p.name))
+    with pytest.raises(InvalidToken):
+        vault_format.VaultFileReader(session_key, some_file)
+
+
+def test_interrupted_rotation_resumes_with_the_same_key(baul, session_key, filled_baul, tmp_path, monkeypatch):
+    real_migrate = rekey._migrate_file
+    calls = []
+
+    def interrupted(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise OSError("USB desconectada")
+        return real_migrate(*args)
+
+    monkeypatch.setattr(rekey, "_migrate_file", interrupted)
+    report = rekey.rotate_master_key(baul, PASSWORD, workers=1)
+    assert not report.finished
+    assert len(report.failed) == 1
+
+    # La llave anterior se conserva: todo se sigue leyendo
+    pending = _unlock(baul)
+    assert len(pending.keys) == 2 and pending.keys[1] == session_key.keys[0]
+    _assert_exports(baul, pending, filled_baul, tmp_path)
+
+    monkeypatch.setattr(rekey, "_migrate_file", real_migrate)
+    report = rekey.rotate_master_key(baul, PASSWORD)
+    assert report.finished and not report.failed
+    # Lo que ya se había migrado no se vuelve a tocar
+    assert report.skipped == len(calls) - 1
+    assert report.rewrapped + report.reencrypted == 1
+
+    final = _unlock(baul)
+    assert final.keys == pending.keys[:1]
+    _assert_exports(baul, final, filled_baul, tmp_path)
+
+
+def test_unexpected_error_keeps_the_old_key(baul, session_key, filled_baul):
+    # Registro de llave truncado: struct.error, no InvalidToken
+    damaged = next(p for p in (baul / "carpeta").iterdir()
+                   if manifest.is_file_id(p.name) and p.stat().st_size > 100_000)
+    damaged.write_bytes(damaged.read_bytes()[:vault_format.BASE_HEADER_SIZE + 5])
+
+    report = rekey.rotate_master_key(baul, PASSWORD)
+    assert not report.finished
+    assert [path for path, _ in report.failed] == [str(damaged)]
+    assert len(_unlock(baul).keys) == 2
+
+
+@pytest.fixture
+def dedup_baul(baul, session_key, tmp_path):
+    source = tmp_path / "origen" / "carpeta"
+    source.mkdir(parents=True)
+    data = os.urandom(600_000)
+    (source / "original.bin").write_bytes(data)
+    (source / "copia.bin").write_bytes(data + b"fin")
+    report = ImportEngine(session_key, manifest.ManifestStore(baul, session_key), dedup=True).run([source], baul)
+    assert not report.failed
+    return source
+
+
+def _store_key(baul):
+    return (baul / dedup_store.STORE_DIR / dedup_store.STORE_KEY).read_bytes()
+
+
+def test_rotation_rewraps_the_chunk_store_key(baul, session_key, dedup_baul, tmp_path):
+    chunks = sorted((baul / dedup_store.STORE_DIR).rglob("*" + dedup_store.CHUNK_EXT))
+    before = {path: path.read_bytes() for path in chunks}
+
+    report = rekey.rotate_master_key(baul, PASSWORD)
+    assert report.finished and not report.failed
+    # Manifiesto + llaves del almacén
+    assert report.manifests == 2
+
+    new_key = _unlock(baul)
+    _assert_exports(baul, new_key, dedup_baul, tmp_path)
+    with pytest.raises(InvalidToken):
+        session_key.decrypt(_store_key(baul))
+    # Los trozos van cifrados con las llaves del almacén, que no cambian
+    assert {path: path.read_bytes() for path in chunks} == before
+
+
+def test_rotation_resumes_after_failing_on_the_store_key(baul, session_key, dedup_baul, tmp_path, monkeypatch):
+    real_write = rekey._write_atomic
+
+    def unplugged(path, data):
+        if path.endswith(dedup_store.STORE_KEY):
+            raise OSError("USB desconectada")
+        real_write(path, data)
+
+    monkeypatch.setattr(rekey, "_write_atomic", unplugged)
+    report = rekey.rotate_master_key(baul, PASSWORD)
+    assert not report.finished
+    assert [os.path.basename(path) for path, _ in report.failed] == [dedup_store.STORE_KEY]
+    # Las llaves del almacén siguen con la maestra anterior, que no se olvidó
+    pending = _unlock(baul)
+    assert len(pending.keys) == 2
+    _assert_exports(baul, pending, dedup_baul, tmp_path)
+
+    monkeypatch.setattr(rekey, "_write_atomic", real_write)
+    report = rekey.rotate_master_key(baul, PASSWORD)
+    assert report.finished and not report.failed
+    # Los archivos ya estaban migrados: solo faltaban las llaves
+    assert report.rewrapped == report.reencrypted == 0
+
+    final = _unlock(baul)
+    assert final.keys == pending.keys[:1]
+    _assert_exports(baul, final, dedup_baul, tmp_path)
+
+
+def test_wrong_password_changes_nothing(baul, filled_baul):
+    key_file = baul / ".credentials" / "vault.key"
+    before = key_file.read_bytes()
+    with pytest.raises(ValueError):
+        rekey.rotate_master_key(baul, "equivocada")
+    with pytest.raises(ValueError):
+        rekey.change_password(key_file, "equivocada", "nueva")
+    assert key_file.read_bytes() == before
+
+
+def test_empty_vault_rotates(baul, session_key):
+    report = rekey.rotate_master_key(baul, PASSWORD)
+    assert report.finished
+    assert (report.skipped, report.rewrapped, report.reencrypted, report.manifests) == (0, 0, 0, 0)
+    assert _unlock(baul).keys != session_key.keys
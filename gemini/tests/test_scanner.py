@@ -0,0 +1,84 @@
+import os
+import pytest
+import scanner
+
+
+@pytest.fixture
+def folder(tmp_path):
+    root = tmp_path / "raiz"
+    (root / "b_carpeta" / "honda").mkdir(parents=True)
+    (root / "a_carpeta").mkdir()
+    (root / "c.enc").write_bytes(b"12345")
+    (root / "B.enc").write_bytes(b"")
+    (root / "b_carpeta" / "dentro.enc").write_bytes(b"x" * 10)
+    (root / "b_carpeta" / "honda" / "muy_dentro.enc").write_bytes(b"")
+    return root
+
+
+def test_scan_dir_returns_typed_sorted_entries(folder):
+    entries = scanner.scan_dir(folder)
+    assert [entry.name for entry in entries] == ["B.enc", "a_carpeta", "b_carpeta", "c.enc"]
+    by_name = {entry.name: entry for entry in entries}
+    assert by_name["c.enc"].size == 5 and not by_name["c.enc"].is_dir
+    assert by_name["b_carpeta"].is_dir and by_name["b_carpeta"].size == 0
+    assert by_name["c.enc"].mtime == os.stat(folder / "c.enc").st_mtime_ns
+    assert by_name["c.enc"].path == os.path.join(folder, "c.enc")
+
+
+def test_scan_dir_without_stat_makes_no_extra_calls(folder, monkeypatch):
+    calls = []
+    real_stat, real_isdir = os.stat, os.path.isdir
+    monkeypatch.setattr(os, "stat", lambda *args, **kwargs: calls.append(args) or real_stat(*args, **kwargs))
+    monkeypatch.setattr(os.path, "isdir", lambda path: calls.append(path) or real_isdir(path))
+
+    entries = scanner.scan_dir(folder, with_stat=False)
+    assert calls == []
+    assert all(entry.size == entry.mtime == 0 for entry in entries)
+    assert [entry.is_dir for entry in entries] == [False, True, True, False]
+
+
+def test_scan_dir_skips_entries_that_vanish(folder):
+    # Un enlace roto se comporta como un archivo borrado a mitad de la lectura
+    os.symlink(folder / "no-existe", folder / "roto.enc")
+    assert "roto.enc" not in [entry.name for entry in scanner.scan_dir(folder)]
+
+
+@pytest.mark.parametrize("name", ["no-existe", "c.enc"])
+def test_scan_dir_of_a_missing_folder_or_a_file_raises(folder, name):
+    with pytest.raises(OSError):
+        scanner.scan_dir(folder / name)
+
+
+def test_walk_visits_parents_before_children(folder):
+    walked = [(os.path.relpath(path, folder), [entry.name for entry in entries])
+              for path, entries in scanner.walk(folder)]
+    assert walked == [
+        (".", ["B.enc", "a_carpeta", "b_carpeta", "c.enc"]),
+        ("a_carpeta", []),
+        ("b_carpeta", ["dentro.enc", "honda"]),
+        (os.path.join("b_carpeta", "honda"), ["muy_dentro.enc"]),
+    ]
+
+
+def test_walk_does_not_enter_skipped_folders(folder):
+    visited = [os.path.relpath(path, folder) for path, _ in scanner.walk(folder, skip=lambda name: name == "b_carpeta")]
+    # La carpeta se sigue listando en su padre, pero no se entra en ella
+    assert visited == [".", "a_carpeta"]
+
+
+def test_walk_skips_folders_that_disappear(folder, capsys):
+    walked = []
+    for path, _ in scanner.walk(folder):
+        walked.append(os.path.relpath(path, folder))
+        if path == str(folder):
+            # Se borra una carpeta que ya se listó pero no se ha leído
+            os.remove(folder / "b_carpeta" / "honda" / "muy_dentro.enc")
+            os.rmdir(folder / "b_carpeta" / "honda")
+            os.remove(folder / "b_carpeta" / "dentro.enc")
+            os.rmdir(folder / "b_carpeta")
+    assert walked == [".", "a_carpeta"]
+    assert "b_carpeta" in capsys.readouterr().out
+
+
+def test_walk_of_a_missing_folder_yields_nothing(tmp_path, capsys):
+    assert list(scanner.walk(tmp_path / "no-existe")) == []
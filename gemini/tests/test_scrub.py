@@ -0,0 +1,169 @@
+import os
+import json
+import pytest
+import dedup_store
+import manifest
+import pack_store
+import scrub
+import vault_format
+from transfer_engine import ImportEngine
+from conftest import CHUNK
+
+SMALL = 3000    # Varios archivos empaquetados por bloque del paquete, y algunos que cruzan de un bloque a otro
+
+
+@pytest.fixture
+def filled(baul, session_key, tmp_path):
+    """Baúl con archivos grandes, empaquetados y (en otra carpeta) deduplicados."""
+    source = tmp_path / "origen" / "Docs"
+    (source / "sub").mkdir(parents=True)
+    (source / "grande.bin").write_bytes(os.urandom(pack_store.SMALL_FILE + 2 * CHUNK))
+    (source / "sub" / "otro.bin").write_bytes(os.urandom(pack_store.SMALL_FILE + 1))
+    for index in range(6):
+        (source / f"chico{index}.txt").write_bytes(os.urandom(SMALL))
+    manifests = manifest.ManifestStore(baul, session_key)
+    assert not ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul).failed
+
+    dedup = tmp_path / "origen" / "Imagenes"
+    dedup.mkdir()
+    (dedup / "disco.img").write_bytes(os.urandom(300_000))
+    assert not ImportEngine(session_key, manifests, chunk_size=CHUNK, dedup=True,
+                            pack_small_files=False).run([dedup], baul).failed
+    return baul
+
+
+def _scrub(session_key, baul, sources=None, incremental=False):
+    manifests = manifest.ManifestStore(baul, session_key)
+    return scrub.Scrubber(session_key, manifests, workers=4, incremental=incremental).run(sources)
+
+
+def _flip(path, offset):
+    data = bytearray(path.read_bytes())
+    data[offset] ^= 1
+    path.write_bytes(bytes(data))
+
+
+def _failed(report) -> dict:
+    return {result.name or os.path.basename(result.source): result.error for result in report.failed}
+
+
+def _id(session_key, folder, name):
+    return manifest.ManifestStore(folder.parent, session_key).find_by_name(folder, name)
+
+
+def test_clean_vault(filled, session_key):
+    manifests = manifest.ManifestStore(filled, session_key)
+    scrubber = scrub.Scrubber(session_key, manifests)
+    before = set(filled.rglob("*"))
+    files, total = scrubber.measure(None)
+    progress = []
+    report = scrubber.run(None, None, on_progress=progress.append)
+
+    assert not report.failed and report.files_ok == files == 9
+    assert report.bytes_read == sum(progress) == total
+    assert report.temp_files == []
+    # No se escribe nada más que el estado de la revisión
+    assert set(filled.rglob("*")) == before | {filled / scrub.STATE_NAME}
+
+
+def test_damaged_file_is_reported_alone(filled, session_key):
+    folder = filled / "Docs"
+    _flip(folder / _id(session_key, folder, "grande.bin"), -CHUNK)
+    assert _failed(_scrub(session_key, filled)) == {"grande.bin": "Error de llave al descifrar. ¿Archivo corrupto?"}
+
+
+def test_damaged_pack_chunk_marks_only_its_files(filled, session_key):
+    pack = next((filled / pack_store.PACK_DIR).iterdir())
+    # Segundo bloque del paquete: los archivos que lo tocan (el que empieza
+    # en el primero y sigue en el segundo, y los que empiezan en él)
+    _flip(pack, vault_format.HEADER_SIZE + CHUNK + vault_format.TAG_SIZE + 10)
+    report = _scrub(session_key, filled)
+
+    failed = _failed(report)
+    entries = manifest.ManifestStore(filled, session_key).entries(filled / "Docs").values()
+    touching = {entry["name"] for entry in entries if pack_store.is_packed(entry)
+                and entry["offset"] < 2 * CHUNK and entry["offset"] + entry["size"] > CHUNK}
+    assert set(failed) == touching and touching
+    assert report.files_ok == 9 - len(touching)
+
+
+def test_damaged_chunk_of_a_deduplicated_file(filled, session_key):
+    chunk = next((filled / dedup_store.STORE_DIR).rglob("*" + dedup_store.CHUNK_EXT))
+    _flip(chunk, 20)
+    assert set(_failed(_scrub(session_key, filled))) == {"disco.img"}
+
+
+def test_missing_files_and_leftovers(filled, session_key):
+    folder = filled / "Docs"
+    (folder / _id(session_key, folder, "grande.bin")).unlink()
+    orphan = folder / manifest.new_file_id()
+    orphan.write_bytes(b"sin nombre")
+    (folder / "resto.enc.tmp").write_bytes(b"")
+
+    report = _scrub(session_key, filled)
+    failed = _failed(report)
+    assert failed["grande.bin"] == "Falta el archivo (está en el manifiesto)"
+    assert failed[orphan.name] == "Archivo sin nombre (no está en el manifiesto)"
+    assert report.temp_files == [str(folder / "resto.enc.tmp")]
+
+
+def test_missing_pack(filled, session_key):
+    next((filled / pack_store.PACK_DIR).iterdir()).unlink()
+    failed = _failed(_scrub(session_key, filled))
+    assert set(failed) == {f"chico{index}.txt" for index in range(6)}
+    assert set(failed.values()) == {"Falta el paquete del archivo"}
+
+
+def test_hash_mismatch(filled, session_key):
+    manifests = manifest.ManifestStore(filled, session_key)
+    folder = filled / "Docs"
+    for name in ("grande.bin", "chico0.txt"):
+        file_id = manifests.find_by_name(folder, name)
+        entry = dict(manifests.lookup(folder, file_id), blake2b="0" * 32)
+        manifests.add(folder, file_id, **entry)
+    manifests.flush()
+
+    failed = _failed(_scrub(session_key, filled))
+    assert set(failed) == {"grande.bin", "chico0.txt"}
+    assert all("hash" in error for error in failed.values())
+
+
+# --- Modo incremental ---
+def test_incremental_skips_what_did_not_change(filled, session_key):
+    assert not _scrub(session_key, filled).failed
+    report = _scrub(session_key, filled, incremental=True)
+    assert (report.files_skipped, report.bytes_read) == (9, 0)
+
+    # Un archivo reescrito (otra fecha) se vuelve a revisar, y el daño se encuentra
+    folder = filled / "Docs"
+    path = folder / _id(session_key, folder, "grande.bin")
+    _flip(path, -CHUNK)
+    os.utime(path, ns=(0, 10 ** 9))
+    report = _scrub(session_key, filled, incremental=True)
+    assert set(_failed(report)) == {"grande.bin"}
+    assert report.files_skipped == 8
+
+    # Lo que falló no se da por bueno: se vuelve a revisar la próxima vez
+    assert set(_failed(_scrub(session_key, filled, incremental=True))) == {"grande.bin"}
+
+
+def test_full_run_ignores_the_saved_state(filled, session_key):
+    _scrub(session_key, filled)
+    report = _scrub(session_key, filled)
+    assert report.files_skipped == 0 and report.files_ok == 9
+
+
+def test_partial_run_keeps_the_state_of_other_folders(filled, session_key):
+    _scrub(session_key, filled)
+    report = _scrub(session_key, filled, [filled / "Docs" / "sub"], incremental=True)
+    assert report.files_skipped == 1
+    # Lo de fuera de 'sub' sigue valiendo
+    assert _scrub(session_key, filled, incremental=True).files_skipped == 9
+
+
+@pytest.mark.parametrize("content", ["basura", json.dumps({"version": 99, "checked": {}})])
+def test_unreadable_state_means_checking_everything(filled, session_key, content):
+    _scrub(session_key, filled)
+    (filled / scrub.STATE_NAME).write_text(content, encoding="utf-8")
+    report = _scrub(session_key, filled, incremental=True)
+    assert report.files_skipped == 0 and report.files_ok == 9
@@ -0,0 +1,227 @@
+import os
+import pytest
+from watchdog.events import DirCreatedEvent, DirDeletedEvent, DirMovedEvent, FileCreatedEvent, FileDeletedEvent
+import manifest
+import search_index
+from search_index import SearchIndex
+from transfer_engine import ImportEngine
+from conftest import CHUNK
+
+
+def _add(baul, manifests, folder, name):
+    (baul / folder).mkdir(parents=True, exist_ok=True)
+    file_id = manifest.new_file_id()
+    (baul / folder / file_id).write_bytes(b"x")
+    manifests.add(baul / folder, file_id, name)
+    return str(baul / folder / file_id)
+
+
+@pytest.fixture
+def vault(baul, session_key):
+    """Baúl con algunos archivos con nombre; retorna (baúl, manifiestos)."""
+    manifests = manifest.ManifestStore(baul, session_key)
+    for folder, name in [(".", "playa.jpg"), (".", "Canción de playa.mp3"), ("Fotos", "vacaciones 2022.zip"),
+                         ("Fotos/2024", "playa.jpg"), ("Fotos/2024", "Informe.pdf")]:
+        _add(baul, manifests, folder, name)
+    manifests.flush()
+    return baul, manifests
+
+
+def _index(manifests, **kwargs):
+    index = SearchIndex(manifests, **kwargs)
+    index.build()
+    return index
+
+
+def _wait(index):
+    # Un solo hilo: cuando corre esta tarea ya terminaron las anteriores
+    index._pool.submit(lambda: None).result()
+
+
+def _paths(hits):
+    return [hit.path for hit in hits]
+
+
+def test_search_modes(vault):
+    baul, manifests = vault
+    index = _index(manifests)
+    assert index.ready and index.size == 7   # 5 archivos y 2 carpetas
+
+    assert sorted(_paths(index.search("pla", "prefix"))) == ["Fotos/2024/playa.jpg", "playa.jpg"]
+    assert len(index.search("playa", "substring")) == 3
+    assert _paths(index.search("vcn22", "fuzzy")) == ["Fotos/vacaciones 2022.zip"]
+    # Sin mayúsculas ni acentos
+    assert _paths(index.search("CANCION", "prefix")) == ["Canción de playa.mp3"]
+    assert _paths(index.search("  informe ")) == ["Fotos/2024/Informe.pdf"]
+
+    hit, = index.search("fotos/2024/pla")
+    assert hit.path == "Fotos/2024/playa.jpg" and not hit.is_dir
+    assert os.path.dirname(hit.real_path) == str(baul / "Fotos" / "2024")
+    assert manifests.lookup(baul / "Fotos" / "2024", os.path.basename(hit.real_path))["name"] == "playa.jpg"
+    folder, = index.search("2024", "prefix")
+    assert folder.is_dir and folder.real_path == str(baul / "Fotos" / "2024")
+
+
+def test_auto_ranks_prefix_then_substring_then_fuzzy(vault):
+    _, manifests = vault
+    index = _index(manifests)
+    names = [hit.name for hit in index.search("playa")]
+    assert sorted(names[:2]) == ["playa.jpg", "playa.jpg"] and names[2] == "Canción de playa.mp3"
+    # Sin coincidencias exactas se completa con las fuzzy
+    assert [hit.name for hit in index.search("infrm")] == ["Informe.pdf"]
+
+
+def test_bad_queries(vault):
+    index = _index(vault[1])
+    assert index.search("   ") == []
+    assert index.search("zzz") == []
+    with pytest.raises(ValueError):
+        index.search("playa", "regex")
+
+
+def test_limit_keeps_the_best(baul, session_key):
+    manifests = manifest.ManifestStore(baul, session_key)
+    # La raíz se indexa primero: sus subcadenas aparecen antes que el prefijo
+    for i in range(10):
+        _add(baul, manifests, ".", f"mi foto {i}.jpg")
+    _add(baul, manifests, "sub", "foto.jpg")
+    manifests.flush()
+    index = _index(manifests)
+
+    assert len(index.search("foto", "substring", limit=4)) == 4
+    hits = index.search("foto", limit=3)
+    assert len(hits) == 3 and hits[0].path == "sub/foto.jpg"
+
+
+@pytest.mark.parametrize("query", ["a", "foto 1", "o1", "zz"])
+def test_chunk_skipping_finds_the_same(baul, session_key, monkeypatch, query):
+    manifests = manifest.ManifestStore(baul, session_key)
+    names = [f"foto {i}.jpg" for i in range(20)] + ["zz.txt", "árbol.png"]
+    for name in names:
+        _add(baul, manifests, ".", name)
+    manifests.flush()
+    monkeypatch.setattr(search_index, "CHUNK_ENTRIES", 3)
+    index = _index(manifests)
+
+    for mode in ("prefix", "substring", "fuzzy"):
+        regex = search_index._fuzzy_regex(query)
+        expected = {name for name in names if search_index._matches(search_index.fold(name), query, mode, regex)}
+        found = [hit.name for hit in index.search(query, mode)]
+        assert len(found) == len(set(found)) and set(found) == expected
+
+
+def test_packed_files_are_found_and_internal_folders_are_not(baul, session_key, tmp_path):
+    manifests = manifest.ManifestStore(baul, session_key)
+    source = tmp_path / "origen" / "Notas"
+    source.mkdir(parents=True)
+    (source / "nota.txt").write_bytes(b"una nota")
+    assert not ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul).failed
+    index = _index(manifests)
+
+    assert _paths(index.search("nota.txt")) == ["Notas/nota.txt"]
+    assert index.search("vault") == [] and index.search(".baul") == []
+
+
+# --- Eventos de watchdog ---
+def test_events_update_the_index(vault):
+    baul, manifests = vault
+    updates = []
+    index = _index(manifests, on_update=lambda: updates.append(1))
+    del updates[:]
+
+    created = _add(baul, manifests, "Fotos", "nuevo.txt")
+    manifests.flush()
+    index.apply_events([FileCreatedEvent(created)])
+    _wait(index)
+    assert _paths(index.search("nuevo")) == ["Fotos/nuevo.txt"] and updates
+
+    deleted = index.search("vacaciones")[0].real_path
+    manifests.remove(baul / "Fotos", os.path.basename(deleted))
+    manifests.flush()
+    index.apply_events([FileDeletedEvent(deleted)])
+    _wait(index)
+    assert index.search("vacaciones") == []
+
+
+def test_moved_and_deleted_folders(vault):
+    baul, manifests = vault
+    index = _index(manifests)
+
+    os.rename(baul / "Fotos" / "2024", baul / "Viejas")
+    index.apply_events([DirMovedEvent(str(baul / "Fotos" / "2024"), str(baul / "Viejas"))])
+    _wait(index)
+    assert sorted(_paths(index.search("viejas/"))) == ["Viejas/Informe.pdf", "Viejas/playa.jpg"]
+    assert index.search("fotos/2024") == []
+
+    (baul / "Nueva" / "sub").mkdir(parents=True)
+    _add(baul, manifests, "Nueva/sub", "dentro.txt")
+    manifests.flush()
+    # La carpeta llega ya con contenido: se lee entera
+    index.apply_events([DirCreatedEvent(str(baul / "Nueva"))])
+    _wait(index)
+    assert _paths(index.search("dentro")) == ["Nueva/sub/dentro.txt"]
+
+    for path in sorted(baul.joinpath("Nueva").rglob("*"), reverse=True):
+        path.unlink() if path.is_file() else path.rmdir()
+    (baul / "Nueva").rmdir()
+    index.apply_events([DirDeletedEvent(str(baul / "Nueva"))])
+    _wait(index)
+    assert index.search("dentro") == [] and index.search("nueva") == []
+
+
+def test_ignored_events(vault):
+    baul, manifests = vault
+    updates = []
+    index = _index(manifests, on_update=lambda: updates.append(1))
+    del updates[:]
+    index.apply_events([FileCreatedEvent(str(baul / "a.enc.tmp")),
+                        FileCreatedEvent(str(baul / ".credentials" / "vault.key.enc"))])
+    _wait(index)
+    assert updates == [] and index._overlay == {}
+
+
+def test_large_overlay_rebuilds_the_index(vault, monkeypatch):
+    baul, manifests = vault
+    monkeypatch.setattr(search_index, "OVERLAY_LIMIT", 0)
+    index = _index(manifests)
+    created = _add(baul, manifests, ".", "otro.txt")
+    manifests.flush()
+    index.apply_events([FileCreatedEvent(created)])
+    _wait(index)
+    _wait(index)   # La reconstrucción que pidió el overlay
+    assert index._overlay == {} and _paths(index.search("otro")) == ["otro.txt"]
+
+
+# --- Solo en memoria ---
+def _snapshot(folder):
+    return sorted((str(path), path.stat().st_size, path.stat().st_mtime_ns) for path in folder.rglob("*"))
+
+
+def test_nothing_is_written_to_disk(vault, tmp_path):
+    baul, manifests = vault
+    before = _snapshot(tmp_path)
+    index = SearchIndex(manifests)
+    index.start()
+    _wait(index)
+    for mode in search_index.MODES:
+        index.search("playa", mode)
+    index.apply_events([DirCreatedEvent(str(baul / "Fotos"))])
+    _wait(index)
+    assert _snapshot(tmp_path) == before
+
+    index.close()
+    assert index.size == 0 and index.search("playa") == []
+    index.start()   # Cerrado: ya no se arma
+    assert index.size == 0
+
+
+def test_benchmark_runs_on_a_small_vault(tmp_path, capsys):
+    from benchmarks import bench_search
+    folders = bench_search.make_folders(1200, per_folder=500)
+    assert [len(items) for _, items in folders] == [500, 500, 200]
+    index = bench_search.build(str(tmp_path), folders)
+    assert index.size == 1200 and index.search("vacac", "prefix")
+    index.close()
+
+    assert bench_search.main(["--entries", "1000", "--repeat", "1"]) == 0
+    assert "1,000 entradas" in capsys.readouterr().out
@@ -0,0 +1,229 @@
+import os
+import filecmp
+import threading
+import pytest
+import manifest
+import pack_store
+import transfer_engine
+import vault_writer
+from transfer_engine import ImportEngine, ExportEngine, measure_sources
+from conftest import CHUNK
+
+
+def _tree(root, files: int = 30):
+    """Carpeta con subcarpetas, una vacía, archivos pequeños y algunos de varios bloques."""
+    source = root / "origen" / "proyecto"
+    (source / "vacia").mkdir(parents=True)
+    for index in range(files):
+        folder = source / f"sub{index % 3}" / ("hondo" if index % 2 else "")
+        folder.mkdir(parents=True, exist_ok=True)
+        size = pack_store.SMALL_FILE + CHUNK + index if index % 10 == 0 else 50 * index
+        (folder / f"archivo{index}.bin").write_bytes(os.urandom(size))
+    return source
+
+
+def _export_and_compare(session_key, manifests, baul, tmp_path, source):
+    destination = tmp_path / "salida"
+    destination.mkdir(exist_ok=True)
+    report = ExportEngine(session_key, manifests).run([baul / source.name], destination)
+    assert not report.failed
+    assert not filecmp.dircmp(source, destination / source.name).diff_files
+    for folder, _, files in os.walk(source):
+        relative = os.path.relpath(folder, source)
+        assert os.path.isdir(destination / source.name / relative)
+        for name in files:
+            assert filecmp.cmp(os.path.join(folder, name), destination / source.name / relative / name,
+                               shallow=False)
+    return report
+
+
+def _leftovers(baul):
+    return [path for path in baul.rglob("*") if path.name.endswith(vault_writer.TEMP_SUFFIX)]
+
+
+@pytest.mark.parametrize("workers, queue_size", [(1, 1), (4, 2), (8, 64)])
+def test_import_reports_every_file_once(baul, session_key, tmp_path, workers, queue_size):
+    source = _tree(tmp_path)
+    files, total = measure_sources([source])
+    manifests = manifest.ManifestStore(baul, session_key)
+    done, progress = [], []
+    lock = threading.Lock()
+
+    def on_file_done(result):
+        with lock:
+            done.append(result.source)
+
+    def on_progress(size):
+        with lock:
+            progress.append(size)
+
+    report = ImportEngine(session_key, manifests, workers=workers, queue_size=queue_size, chunk_size=CHUNK).run(
+        [source], baul, on_file_done=on_file_done, on_progress=on_progress)
+
+    assert not report.failed and not report.cancelled
+    assert report.files_ok == files == len(done) == len(set(done))
+    assert report.bytes_read == sum(progress) == total
+    assert report.mb_per_second >= 0 and report.files_per_second > 0
+    assert (baul / "proyecto" / "vacia").is_dir()
+    assert not _leftovers(baul)
+    _export_and_compare(session_key, manifests, baul, tmp_path, source)
+
+
+def test_import_with_a_process_pool(baul, session_key, tmp_path):
+    source = _tree(tmp_path, files=6)
+    manifests = manifest.ManifestStore(baul, session_key)
+    report = ImportEngine(session_key, manifests, workers=2, use_processes=True, chunk_size=CHUNK,
+                          pack_small_files=False).run([source], baul)
+    assert not report.failed
+    _export_and_compare(session_key, manifests, baul, tmp_path, source)
+
+
+def test_missing_source_is_reported_and_the_rest_imported(baul, session_key, tmp_path):
+    source = _tree(tmp_path, files=4)
+    manifests = manifest.ManifestStore(baul, session_key)
+    report = ImportEngine(session_key, manifests, chunk_size=CHUNK).run([tmp_path / "no-existe.txt", source], baul)
+
+    assert [os.path.basename(result.source) for result in report.failed] == ["no-existe.txt"]
+    assert report.files_ok == 4
+
+
+def test_write_error_discards_only_that_file(baul, session_key, tmp_path, monkeypatch):
+    source = _tree(tmp_path, files=20)
+    original_write = vault_writer.VaultWriter.write
+    broken = []
+
+    def failing_write(self, data):
+        # El primer archivo grande (no un paquete) falla a medio escribir
+        if pack_store.PACK_DIR not in self.path and (not broken or broken[0] == self.path):
+            if not broken:
+                broken.append(self.path)
+            if os.path.getsize(self.tmp_path) or self._buffer:
+                raise OSError("USB desconectada")
+        return original_write(self, data)
+
+    monkeypatch.setattr(vault_writer.VaultWriter, "write", failing_write)
+    manifests = manifest.ManifestStore(baul, session_key)
+    report = ImportEngine(session_key, manifests, workers=2, chunk_size=CHUNK).run([source], baul)
+
+    assert len(report.failed) == 1 and "USB desconectada" in report.failed[0].error
+    failed = report.failed[0]
+    assert not os.path.exists(failed.destination) and not _leftovers(baul)
+    folder = os.path.dirname(failed.destination)
+    assert manifests.find_by_name(folder, os.path.basename(failed.source)) is None
+    assert report.files_ok == 19
+
+
+def test_cancel_stops_and_leaves_no_partial_files(baul, session_key, tmp_path):
+    source = _tree(tmp_path, files=40)
+    manifests = manifest.ManifestStore(baul, session_key)
+    engine = ImportEngine(session_key, manifests, workers=2, queue_size=1, chunk_size=CHUNK,
+                          pack_small_files=False)
+    report = engine.run([source], baul, on_file_done=lambda result: engine.cancel())
+
+    assert report.cancelled and not report.failed
+    assert 1 <= report.files_ok < 40
+    assert not _leftovers(baul)
+    # En el baúl quedan exactamente los archivos reportados, todos con nombre
+    on_disk = {path.name for path in baul.rglob("*.enc")}
+    named = set()
+    for folder, _, _ in os.walk(baul / "proyecto"):
+        named |= set(manifests.entries(folder))
+    assert on_disk == named
+    assert len(named) == report.files_ok
+
+
+def _no_hashing(*args):
+    raise AssertionError("no debería leer el archivo para compararlo")
+
+
+def _ids(manifests, folder):
+    return {entry["name"]: file_id for file_id, entry in manifests.entries(folder).items()}
+
+
+def test_unchanged_files_are_skipped_without_reading_them(baul, session_key, tmp_path, monkeypatch):
+    source = _tree(tmp_path, files=12)
+    files, total = measure_sources([source])
+    manifests = manifest.ManifestStore(baul, session_key)
+    first = ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+    assert first.files_skipped == 0 and first.bytes_read == total
+
+    monkeypatch.setattr(transfer_engine, "file_hash", _no_hashing)
+    again = ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+    assert not again.failed
+    assert (again.files_skipped, again.bytes_skipped) == (files, total)
+    assert (again.bytes_read, again.bytes_written) == (0, 0)
+    # Cada archivo saltado apunta a su versión en el baúl (o en un paquete)
+    for result in again.results:
+        folder, file_id = os.path.split(result.destination)
+        assert manifests.lookup(folder, file_id)["name"] == os.path.basename(result.source)
+
+
+@pytest.mark.parametrize("size", [100, pack_store.SMALL_FILE + CHUNK])
+def test_touched_file_is_compared_by_hash(baul, session_key, tmp_path, monkeypatch, size):
+    source = tmp_path / "origen"
+    source.mkdir()
+    path = source / "a.bin"
+    path.write_bytes(os.urandom(size))
+    manifests = manifest.ManifestStore(baul, session_key)
+    ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+    before = _ids(manifests, baul / "origen")
+
+    # Mismo contenido, otro mtime (un 'touch' o una copia)
+    os.utime(path, (1_000_000, 1_000_000))
+    report = ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+    assert (report.files_skipped, report.bytes_skipped, report.bytes_written) == (1, size, 0)
+    assert _ids(manifests, baul / "origen") == before
+    # El mtime nuevo quedó guardado: la próxima vez ni se lee
+    assert manifests.lookup(baul / "origen", before["a.bin"])["mtime"] == 1_000_000
+    monkeypatch.setattr(transfer_engine, "file_hash", _no_hashing)
+    assert ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul).files_skipped == 1
+
+
+@pytest.mark.parametrize("size", [100, pack_store.SMALL_FILE + CHUNK])
+def test_changed_file_replaces_the_old_version(baul, session_key, tmp_path, size):
+    source = tmp_path / "origen"
+    source.mkdir()
+    path = source / "a.bin"
+    path.write_bytes(os.urandom(size))
+    manifests = manifest.ManifestStore(baul, session_key)
+    ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+    old_id = _ids(manifests, baul / "origen")["a.bin"]
+
+    # Mismo tamaño, contenido distinto
+    path.write_bytes(os.urandom(size))
+    os.utime(path, (2_000_000, 2_000_000))
+    report = ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+    assert (report.files_skipped, report.bytes_read) == (0, size)
+    assert report.bytes_written >= size
+
+    new_id = _ids(manifests, baul / "origen")["a.bin"]
+    assert new_id != old_id and len(manifests.entries(baul / "origen")) == 1
+    if size > pack_store.SMALL_FILE:
+        assert not (baul / "origen" / old_id).exists()
+    _export_and_compare(session_key, manifests, baul, tmp_path, source)
+
+
+def test_file_of_another_size_is_reimported_without_hashing(baul, session_key, tmp_path, monkeypatch):
+    source = tmp_path / "origen"
+    source.mkdir()
+    path = source / "a.bin"
+    path.write_bytes(os.urandom(5000))
+    manifests = manifest.ManifestStore(baul, session_key)
+    ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+
+    path.write_bytes(os.urandom(5001))
+    monkeypatch.setattr(transfer_engine, "file_hash", _no_hashing)
+    report = ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+    assert report.files_skipped == 0 and not report.failed
+    _export_and_compare(session_key, manifests, baul, tmp_path, source)
+
+
+def test_without_incremental_everything_is_imported_again(baul, session_key, tmp_path):
+    source = _tree(tmp_path, files=6)
+    files, total = measure_sources([source])
+    manifests = manifest.ManifestStore(baul, session_key)
+    ImportEngine(session_key, manifests, chunk_size=CHUNK).run([source], baul)
+
+    report = ImportEngine(session_key, manifests, chunk_size=CHUNK, incremental=False).run([source], baul)
+    assert (report.files_skipped, report.bytes_read) == (0, total)
+    _export_and_compare(session_key, manifests, baul, tmp_path, source)
@@ -0,0 +1,208 @@
+import os
+import queue
+import threading
+import tkinter as tk
+import pytest
+import crypto_utils
+import manifest
+from transfers import TransferManager, TransferProgress, format_eta, run_in_background
+from transfer_engine import ImportEngine
+from conftest import CHUNK, PASSWORD
+
+
+class _Widget:
+    """Hace de la ventana: after() deja el callback para el "hilo de Tk" (el de la prueba)."""
+    def __init__(self):
+        self.calls = queue.Queue()
+
+    def after(self, delay, callback, *args):
+        self.calls.put((callback, args))
+
+    def run_until(self, done, timeout=10):
+        while not done():
+            callback, args = self.calls.get(timeout=timeout)
+            callback(*args)
+
+
+class _Engine:
+    """Motor de prueba: reporta 'files' archivos de 'size' bytes; espera 'gate' antes de terminar."""
+    def __init__(self, name, log, files=3, size=100, gate=None, error=None):
+        self.name, self.log, self.files, self.size = name, log, files, size
+        self.gate, self.error = gate, error
+        self.cancelled = threading.Event()
+
+    def measure(self, sources):
+        return self.files, self.files * self.size
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self, sources, destination, on_file_done=None, on_progress=None):
+        self.log.append(self.name)
+        if self.error:
+            raise self.error
+        for _ in range(self.files):
+            on_progress(self.size)
+            on_file_done(None)
+        if self.gate is not None:
+            self.gate.wait(10)
+        return f"reporte de {self.name}"
+
+
+def _manager(widget, finished, progress=None):
+    return TransferManager(widget, on_progress=(progress.append if progress is not None else lambda p: None),
+                           on_finished=finished.append, min_interval=0)
+
+
+def test_jobs_run_in_order_with_a_final_progress():
+    widget, log, finished, progress = _Widget(), [], [], []
+    manager = _manager(widget, finished, progress)
+    for name in ("primero", "segundo", "tercero"):
+        manager.submit(name, _Engine(name, log), [], "destino")
+
+    widget.run_until(lambda: len(finished) == 3)
+    assert log == ["primero", "segundo", "tercero"]
+    assert [job.report for job in finished] == ["reporte de primero", "reporte de segundo", "reporte de tercero"]
+    last = [p for p in progress if p.label == "tercero"][-1]
+    assert (last.files_done, last.bytes_done, last.fraction) == (3, 300, 1.0)
+    assert not manager.busy
+    manager.shutdown()
+
+
+def test_engine_error_does_not_stop_the_queue(capsys):
+    widget, log, finished = _Widget(), [], []
+    manager = _manager(widget, finished)
+    manager.submit("roto", _Engine("roto", log, error=RuntimeError("disco lleno")), [], "destino")
+    manager.submit("bien", _Engine("bien", log), [], "destino")
+
+    widget.run_until(lambda: len(finished) == 2)
+    assert finished[0].report is None and finished[0].error == "disco lleno"
+    assert finished[1].report == "reporte de bien"
+    manager.shutdown()
+
+
+def test_cancel_current_and_queued_jobs():
+    widget, log, finished = _Widget(), [], []
+    gate = threading.Event()
+    manager = _manager(widget, finished)
+    running = _Engine("largo", log, gate=gate)
+    queued = _Engine("en cola", log)
+    manager.submit("largo", running, [], "destino")
+    manager.submit("en cola", queued, [], "destino")
+    widget.run_until(lambda: log == ["largo"])
+
+    manager.cancel(all_jobs=True)
+    assert running.cancelled.is_set() and not queued.cancelled.is_set()
+    gate.set()
+    widget.run_until(lambda: len(finished) == 1)
+    manager.submit("después", _Engine("después", log), [], "destino")
+    widget.run_until(lambda: len(finished) == 2)
+    assert log == ["largo", "después"]
+    manager.shutdown()
+
+
+def test_shutdown_stops_the_worker_without_more_callbacks():
+    widget, log, finished = _Widget(), [], []
+    gate = threading.Event()
+    manager = _manager(widget, finished)
+    engine = _Engine("largo", log, gate=gate)
+    manager.submit("largo", engine, [], "destino")
+    widget.run_until(lambda: log == ["largo"])
+
+    manager.shutdown()
+    gate.set()
+    manager._thread.join(5)
+    assert not manager._thread.is_alive() and engine.cancelled.is_set()
+    while not widget.calls.empty():
+        callback, _ = widget.calls.get()
+        assert callback != finished.append
+
+
+def test_cancelling_a_real_import_at_a_chunk_boundary(baul, session_key, tmp_path):
+    source = tmp_path / "origen"
+    source.mkdir()
+    (source / "grande.bin").write_bytes(os.urandom(400 * CHUNK))
+    finished = []
+    done = threading.Event()
+    manager = None
+
+    class ImmediateWidget:
+        # Los callbacks corren en el hilo que avisa: se cancela en el mismo bloque
+        def after(self, delay, callback, *args):
+            callback(*args)
+
+    def on_progress(progress):
+        if progress.bytes_done:
+            manager.cancel()
+
+    def on_finished(job):
+        finished.append(job)
+        done.set()
+
+    manager = TransferManager(ImmediateWidget(), on_progress=on_progress, on_finished=on_finished, min_interval=0)
+    engine = ImportEngine(session_key, manifest.ManifestStore(baul, session_key), workers=1, queue_size=1,
+                          chunk_size=CHUNK)
+    manager.submit("importar", engine, [source], str(baul))
+    assert done.wait(10)
+
+    report = finished[0].report
+    assert report.cancelled and report.files_ok == 0 and not report.failed
+    assert [path.name for path in baul.rglob("*") if path.is_file()] == ["vault.key"]
+    manager.shutdown()
+
+
+@pytest.mark.parametrize("done, total, elapsed, fraction, eta", [
+    (0, 0, 0.0, 0.0, None), (0, 100, 1.0, 0.0, None), (50, 100, 2.0, 0.5, 2.0), (150, 100, 1.0, 1.0, 0.0)])
+def test_progress_fraction_and_eta(done, total, elapsed, fraction, eta):
+    progress = TransferProgress("x", bytes_done=done, bytes_total=total, elapsed=elapsed)
+    assert progress.fraction == fraction
+    assert progress.eta_seconds == eta
+
+
+@pytest.mark.parametrize("seconds, text", [(None, "..."), (0, "0 s"), (59.4, "59 s"), (59.6, "1 min 00 s"),
+                                           (3599, "59 min 59 s"), (3600, "1 h 00 min"), (7385, "2 h 03 min")])
+def test_format_eta(seconds, text):
+    assert format_eta(seconds) == text
+
+
+def test_unlock_runs_off_the_tk_thread(vault_key):
+    widget, results, threads = _Widget(), [], []
+
+    def unlock():
+        threads.append(threading.get_ident())
+        return crypto_utils.unlock_vault_key(PASSWORD, vault_key[0])
+
+    run_in_background(widget, unlock, results.append, results.append)
+    widget.run_until(lambda: results)
+
+    # La derivación corrió en otro hilo; el resultado llega por after()
+    assert threads and threads[0] != threading.get_ident()
+    assert results[0].keys == vault_key[1].keys
+
+
+def test_wrong_password_comes_back_as_an_error(vault_key):
+    widget, ok, errors = _Widget(), [], []
+    run_in_background(widget, lambda: crypto_utils.unlock_vault_key("otra", vault_key[0]), ok.append, errors.append)
+    widget.run_until(lambda: errors)
+
+    assert ok == []
+    assert isinstance(errors[0], ValueError)
+
+
+@pytest.mark.parametrize("error", [RuntimeError("main thread is not in main loop"), tk.TclError("application destroyed")])
+def test_closed_window_is_ignored(monkeypatch, error):
+    # La ventana se cerró mientras se derivaba la llave: el hilo termina sin romperse
+    crashed, done = [], threading.Event()
+    monkeypatch.setattr(threading, "excepthook", crashed.append)
+
+    class Closed:
+        def after(self, delay, callback, *args):
+            done.set()
+            raise error
+
+    run_in_background(Closed(), lambda: 1, None, None)
+    assert done.wait(10)
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and thread.daemon:
+            thread.join(1)
+    assert crashed == []
@@ -0,0 +1,217 @@
+import os
+import pytest
+from watchdog.events import (DirCreatedEvent, DirDeletedEvent, DirModifiedEvent, DirMovedEvent, FileCreatedEvent,
+                             FileDeletedEvent, FileModifiedEvent, FileMovedEvent)
+from cryptography.fernet import InvalidToken
+import manifest
+from tree_model import TreeModel, TreeNode
+from tree_events import ChangeHandler, TreeUpdater
+
+
+@pytest.fixture
+def tree(baul, session_key):
+    """Baúl con 'fotos/' (cargada) y 'otra/' (nunca expandida) y su árbol con la raíz leída."""
+    manifests = manifest.ManifestStore(baul, session_key)
+    (baul / "fotos").mkdir()
+    (baul / "otra").mkdir()
+    model = TreeModel(baul)
+    model.set_children(model.root, [TreeNode("fotos", str(baul / "fotos"), True),
+                                    TreeNode("otra", str(baul / "otra"), True)])
+    model.set_children(model.find(baul / "fotos"), [])
+    names = []
+
+    def display_name(folder, item):
+        names.append(item)
+        try:
+            return manifest.resolve_name(manifests, folder, item)
+        except InvalidToken:
+            return f"¡Archivo corrupto! ({item[:10]}...)"
+
+    return TreeUpdater(model, manifests, display_name), manifests, names
+
+
+def _add_file(baul, manifests, folder, name, content=b"x"):
+    file_id = manifest.new_file_id()
+    (baul / folder / file_id).write_bytes(content)
+    manifests.add(baul / folder, file_id, name)
+    return str(baul / folder / file_id)
+
+
+def _children(updater, path):
+    return [child.name for child in updater.model.find(path).children]
+
+
+def test_created_deleted_and_moved_files(tree, baul):
+    updater, manifests, _ = tree
+    path = _add_file(baul, manifests, "fotos", "playa.jpg")
+    assert updater.apply([FileCreatedEvent(path)])
+    assert _children(updater, baul / "fotos") == ["playa.jpg"]
+    # Eventos repetidos o de temporales no agregan nada
+    assert not updater.apply([FileCreatedEvent(path), FileCreatedEvent(path + ".tmp")])
+
+    moved = str(baul / path.split(os.sep)[-1])
+    manifests.add(baul, os.path.basename(moved), "playa.jpg")
+    assert updater.apply([FileMovedEvent(path, moved)])
+    assert _children(updater, baul / "fotos") == []
+    assert "playa.jpg" in _children(updater, baul)
+
+    assert updater.apply([FileDeletedEvent(moved)])
+    assert _children(updater, baul) == ["fotos", "otra"]
+    assert not updater.apply([FileDeletedEvent(moved)])
+
+
+def test_events_in_unloaded_folders_are_ignored(tree, baul):
+    updater, manifests, names = tree
+    path = _add_file(baul, manifests, "otra", "oculto.txt")
+    assert not updater.apply([FileCreatedEvent(path), FileModifiedEvent(path), FileDeletedEvent(path)])
+    # Ni siquiera se calcula su nombre
+    assert names == []
+
+
+def test_moving_out_of_the_loaded_tree_removes_the_node(tree, baul):
+    updater, manifests, _ = tree
+    path = _add_file(baul, manifests, "fotos", "playa.jpg")
+    updater.apply([FileCreatedEvent(path)])
+    assert updater.apply([FileMovedEvent(path, str(baul / "otra" / os.path.basename(path)))])
+    assert _children(updater, baul / "fotos") == []
+
+
+def test_moving_a_folder_keeps_its_loaded_children(tree, baul):
+    updater, manifests, _ = tree
+    path = _add_file(baul, manifests, "fotos", "playa.jpg")
+    updater.apply([FileCreatedEvent(path)])
+    fotos = updater.model.find(baul / "fotos")
+    fotos.expanded = True
+
+    assert updater.apply([DirMovedEvent(str(baul / "fotos"), str(baul / "imagenes"))])
+    imagenes = updater.model.find(baul / "imagenes")
+    assert imagenes is fotos and imagenes.name == "imagenes" and imagenes.expanded
+    assert updater.model.find(baul / "imagenes" / os.path.basename(path)) is not None
+    assert updater.model.find(path) is None
+
+
+def test_created_and_deleted_folders(tree, baul):
+    updater, _, _ = tree
+    assert updater.apply([DirCreatedEvent(str(baul / "nueva"))])
+    # Las carpetas internas del baúl no se muestran
+    assert not updater.apply([DirCreatedEvent(str(baul / ".baul.chunks"))])
+    assert _children(updater, baul) == ["fotos", "nueva", "otra"]
+    assert updater.apply([DirDeletedEvent(str(baul / "fotos"))])
+    assert updater.model.find(baul / "fotos") is None
+
+
+def test_modified_file_gets_its_name_again(tree, baul, session_key):
+    updater, manifests, _ = tree
+    # Archivo con nombre antiguo (Fernet en hex): el nombre sale del propio archivo
+    legacy = baul / "fotos" / (session_key.encrypt(b"viejo.txt").hex() + ".enc")
+    legacy.write_bytes(b"x")
+    updater.apply([FileCreatedEvent(str(legacy))])
+    assert _children(updater, baul / "fotos") == ["viejo.txt"]
+
+    # Se reescribe con el mismo nombre: no hay nada que redibujar
+    assert not updater.apply([FileModifiedEvent(str(legacy))])
+    # Llega un 'modified' de un archivo cuyo 'created' se perdió
+    path = _add_file(baul, manifests, "fotos", "perdido.txt")
+    assert updater.apply([FileModifiedEvent(path)])
+    assert _children(updater, baul / "fotos") == ["perdido.txt", "viejo.txt"]
+    # Cambios de mtime de carpetas no tocan el árbol
+    assert not updater.apply([DirModifiedEvent(str(baul / "fotos"))])
+
+
+def test_manifest_change_renames_and_adds_packed_files(tree, baul, session_key):
+    updater, manifests, _ = tree
+    path = _add_file(baul, manifests, "fotos", "antes.txt")
+    updater.apply([FileCreatedEvent(path)])
+    manifests.flush()
+
+    # Otro programa renombra el archivo y agrega uno empaquetado
+    other = manifest.ManifestStore(baul, session_key)
+    other.add(baul / "fotos", os.path.basename(path), "despues.txt")
+    other.add(baul / "fotos", manifest.new_file_id(), "chico.txt", pack="abc", offset=0, size=1)
+    other.flush()
+
+    event = FileModifiedEvent(str(baul / "fotos" / manifest.MANIFEST_NAME))
+    assert updater.apply([event])
+    assert _children(updater, baul / "fotos") == ["chico.txt", "despues.txt"]
+
+    # Y luego quita el empaquetado
+    packed = next(child for child in updater.model.find(baul / "fotos").children if child.name == "chico.txt")
+    other.remove(baul / "fotos", os.path.basename(packed.real_path))
+    other.flush()
+    assert updater.apply([event])
+    assert _children(updater, baul / "fotos") == ["despues.txt"]
+
+
+class _FakeApp:
+    """Lo que ChangeHandler usa de App: after() y los dos receptores de eventos."""
+    def __init__(self):
+        self.scheduled = []
+        self.tree_view = _Recorder()
+        self.search_index = _Recorder()
+
+    def winfo_exists(self):
+        return True
+
+    def after(self, delay, callback):
+        self.scheduled.append(callback)
+
+    def run_scheduled(self):
+        scheduled, self.scheduled = self.scheduled, []
+        for callback in scheduled:
+            callback()
+
+
+class _Recorder:
+    def __init__(self):
+        self.batches = []
+        self.resyncs = 0
+
+    def apply_events(self, events):
+        self.batches.append(list(events))
+
+    def refresh(self):
+        self.resyncs += 1
+
+    start = refresh
+
+
+def test_events_are_batched_in_one_callback(tmp_path):
+    app = _FakeApp()
+    handler = ChangeHandler(app)
+    events = [FileCreatedEvent(str(tmp_path / f"{index}.enc")) for index in range(10)]
+    for event in events:
+        handler.on_any_event(event)
+
+    assert len(app.scheduled) == 1
+    app.run_scheduled()
+    assert app.tree_view.batches == [events] and app.search_index.batches == [events]
+    # El siguiente evento programa otro lote
+    handler.on_any_event(events[0])
+    assert len(app.scheduled) == 1
+
+
+def test_overflow_triggers_one_full_resync(tmp_path, monkeypatch):
+    monkeypatch.setattr(ChangeHandler, "MAX_PENDING_EVENTS", 5)
+    app = _FakeApp()
+    handler = ChangeHandler(app)
+    for index in range(20):
+        handler.on_any_event(FileCreatedEvent(str(tmp_path / f"{index}.enc")))
+
+    app.run_scheduled()
+    assert app.tree_view.batches == [] and app.search_index.batches == []
+    assert app.tree_view.resyncs == 1 and app.search_index.resyncs == 1
+
+    # Después de releer se vuelve a aplicar evento por evento
+    handler.on_any_event(FileDeletedEvent(str(tmp_path / "0.enc")))
+    app.run_scheduled()
+    assert len(app.tree_view.batches) == 1 and app.tree_view.resyncs == 1
+
+
+def test_exactly_max_pending_events_is_not_an_overflow(tmp_path, monkeypatch):
+    monkeypatch.setattr(ChangeHandler, "MAX_PENDING_EVENTS", 5)
+    app = _FakeApp()
+    handler = ChangeHandler(app)
+    for index in range(5):
+        handler.on_any_event(FileCreatedEvent(str(tmp_path / f"{index}.enc")))
+    app.run_scheduled()
+    assert len(app.tree_view.batches[0]) == 5 and app.tree_view.resyncs == 0
@@ -0,0 +1,136 @@
+import os
+from tree_model import TreeModel, TreeNode
+
+
+def _dir(parent, name):
+    return TreeNode(name, os.path.join(parent.real_path, name), True)
+
+
+def _file(parent, name, disk_name=None):
+    return TreeNode(name, os.path.join(parent.real_path, disk_name or name + ".enc"), False)
+
+
+def _names(model):
+    return [("  " * node.depth) + node.name for node in model.rows]
+
+
+def _model(tmp_path):
+    model = TreeModel(tmp_path)
+    root = model.root
+    model.set_children(root, [_file(root, "zeta.txt"), _dir(root, "Fotos"), _file(root, "Alfa.txt"),
+                              _dir(root, "documentos")])
+    return model
+
+
+def test_rows_are_folders_first_then_files_by_name(tmp_path):
+    model = _model(tmp_path)
+    model.rebuild_rows()
+    assert _names(model) == ["documentos", "Fotos", "Alfa.txt", "zeta.txt"]
+    assert all(node.depth == 0 for node in model.rows)
+
+
+def test_only_expanded_folders_add_rows(tmp_path):
+    model = _model(tmp_path)
+    fotos = model.find(tmp_path / "Fotos")
+    model.set_children(fotos, [_file(fotos, "playa.jpg"), _dir(fotos, "2024")])
+    year = model.find(tmp_path / "Fotos" / "2024")
+    model.set_children(year, [_file(year, "enero.jpg")])
+
+    model.rebuild_rows()
+    assert "playa.jpg" not in [node.name for node in model.rows]
+
+    fotos.expanded = True
+    model.rebuild_rows()
+    assert _names(model) == ["documentos", "Fotos", "  2024", "  playa.jpg", "Alfa.txt", "zeta.txt"]
+
+    # Expandir una subcarpeta de una carpeta contraída no la muestra
+    year.expanded = True
+    fotos.expanded = False
+    model.rebuild_rows()
+    assert len(model.rows) == 4
+    assert not model.is_shown(year.children[0])
+
+    fotos.expanded = True
+    model.rebuild_rows()
+    assert _names(model)[2:4] == ["  2024", "    enero.jpg"]
+    assert model.is_shown(year.children[0])
+
+
+def test_rows_cost_depends_on_what_is_expanded(tmp_path):
+    model = TreeModel(tmp_path)
+    big = TreeNode("grande", str(tmp_path / "grande"), True)
+    model.set_children(model.root, [big])
+    model.set_children(big, [_file(big, f"{index:06}") for index in range(50_000)])
+
+    model.rebuild_rows()
+    assert len(model.rows) == 1
+    big.expanded = True
+    model.rebuild_rows()
+    assert len(model.rows) == 50_001
+    assert model.rows[1].name == "000000" and model.rows[-1].depth == 1
+
+
+def test_checking_a_folder_checks_everything_below(tmp_path):
+    model = _model(tmp_path)
+    fotos = model.find(tmp_path / "Fotos")
+    model.set_children(fotos, [_file(fotos, "playa.jpg")])
+
+    model.set_checked(fotos, True)
+    assert fotos.children[0].checked
+    assert model.checked_paths() == [fotos.real_path, fotos.children[0].real_path]
+
+    model.set_checked(fotos.children[0], False)
+    assert model.checked_paths() == [fotos.real_path]
+    model.set_checked(fotos, False)
+    assert model.checked_paths() == []
+
+
+def test_find_normalizes_paths(tmp_path):
+    model = _model(tmp_path)
+    assert model.find(str(tmp_path / "Fotos") + os.sep) is model.find(tmp_path / "Fotos")
+    assert model.find(tmp_path / "no-existe") is None
+
+
+def test_reloading_children_keeps_their_state(tmp_path):
+    model = _model(tmp_path)
+    root = model.root
+    fotos = model.find(tmp_path / "Fotos")
+    model.set_children(fotos, [_file(fotos, "playa.jpg")])
+    fotos.expanded = True
+    model.set_checked(model.find(tmp_path / "documentos"), True)
+
+    # Segunda lectura: 'zeta' se borró, llegó 'nuevo' y 'documentos' ahora es un archivo
+    model.set_children(root, [_dir(root, "Fotos"), _file(root, "Alfa.txt"), _file(root, "nuevo.txt"),
+                              TreeNode("documentos", str(tmp_path / "documentos"), False)])
+
+    assert model.find(tmp_path / "Fotos") is fotos and fotos.expanded
+    assert [child.name for child in fotos.children] == ["playa.jpg"]
+    assert model.find(tmp_path / "Fotos" / "playa.jpg.enc") is not None
+    assert model.find(tmp_path / "zeta.txt.enc") is None
+    documentos = model.find(tmp_path / "documentos")
+    assert not documentos.is_dir and not documentos.checked
+
+
+def test_new_children_inherit_the_folder_check(tmp_path):
+    model = _model(tmp_path)
+    fotos = model.find(tmp_path / "Fotos")
+    model.set_checked(fotos, True)
+    model.set_children(fotos, [_file(fotos, "playa.jpg")])
+    assert fotos.children[0].checked and fotos.children[0].depth == 1
+
+
+def test_loaded_and_stale_flags(tmp_path):
+    model = TreeModel(tmp_path)
+    assert not model.root.loaded
+    assert list(model.iter_loaded_dirs()) == []
+
+    model = _model(tmp_path)
+    fotos = model.find(tmp_path / "Fotos")
+    # Las subcarpetas no se leen hasta expandirlas
+    assert not fotos.loaded
+    assert list(model.iter_loaded_dirs()) == [model.root]
+
+    fotos.loading = fotos.stale = True
+    model.set_children(fotos, [])
+    assert fotos.loaded and not fotos.loading and not fotos.stale
+    assert {node.name for node in model.iter_loaded_dirs()} == {"", "Fotos"}
@@ -0,0 +1,447 @@
+import os
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import InvalidToken
+import chunk_codecs
+import crypto_utils
+import kdf
+import vault_format
+from conftest import CHUNK, PASSWORD, FAST_KDF
+
+SIZES = [0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 3 * CHUNK + 5]
+
+
+def _encrypt(session_key, tmp_path, data: bytes, **kwargs):
+    source = tmp_path / "original.bin"
+    source.write_bytes(data)
+    encrypted = tmp_path / "cifrado.enc"
+    vault_format.encrypt_file(session_key, source, encrypted, chunk_size=CHUNK, **kwargs)
+    return encrypted
+
+
+def _decrypt(session_key, tmp_path, encrypted) -> bytes:
+    destination = tmp_path / "descifrado.bin"
+    vault_format.decrypt_file(session_key, encrypted, destination)
+    return destination.read_bytes()
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_round_trip(session_key, tmp_path, size):
+    data = os.urandom(size)
+    encrypted = _encrypt(session_key, tmp_path, data)
+
+    assert vault_format.is_chunked(encrypted.read_bytes())
+    body = os.path.getsize(encrypted) - vault_format.HEADER_SIZE
+    assert body == size + max(1, -(-size // CHUNK)) * vault_format.TAG_SIZE
+    assert _decrypt(session_key, tmp_path, encrypted) == data
+
+
+def test_same_content_encrypts_differently(session_key, tmp_path):
+    data = os.urandom(CHUNK)
+    first = _encrypt(session_key, tmp_path, data).read_bytes()
+    second = _encrypt(session_key, tmp_path, data).read_bytes()
+    assert first != second
+
+
+def test_reads_legacy_fernet_file(session_key, tmp_path):
+    data = os.urandom(3 * CHUNK)
+    legacy = tmp_path / "antiguo.enc"
+    legacy.write_bytes(session_key.encrypt(data))
+
+    with vault_format.VaultFileReader(session_key, legacy) as reader:
+        assert reader.is_legacy
+        assert reader.size == len(data)
+    assert _decrypt(session_key, tmp_path, legacy) == data
+
+
+def test_wrong_key_is_rejected(session_key, tmp_path):
+    encrypted = _encrypt(session_key, tmp_path, os.urandom(CHUNK))
+    other_key = crypto_utils.create_vault_key(PASSWORD, kdf.PBKDF2, FAST_KDF)[1]
+    with pytest.raises(InvalidToken):
+        vault_format.VaultFileReader(other_key, encrypted)
+
+
+def test_tampered_chunk_is_rejected(session_key, tmp_path):
+    encrypted = _encrypt(session_key, tmp_path, os.urandom(3 * CHUNK))
+    data = bytearray(encrypted.read_bytes())
+    # Un bit del segundo bloque
+    data[vault_format.HEADER_SIZE + CHUNK + vault_format.TAG_SIZE + 10] ^= 1
+    encrypted.write_bytes(bytes(data))
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+    # No queda un archivo a medias con lo que se alcanzó a descifrar
+    assert not (tmp_path / "descifrado.bin").exists()
+
+
+def test_tampered_header_is_rejected(session_key, tmp_path):
+    encrypted = _encrypt(session_key, tmp_path, os.urandom(CHUNK))
+    data = bytearray(encrypted.read_bytes())
+    data[8] ^= 1  # tamaño de bloque
+    encrypted.write_bytes(bytes(data))
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+
+
+@pytest.mark.parametrize("cut", [1, vault_format.TAG_SIZE, CHUNK + vault_format.TAG_SIZE])
+def test_truncated_file_is_rejected(session_key, tmp_path, cut):
+    # Cortar unos bytes daña el último bloque; cortar un bloque entero deja
+    # como último uno que no fue cifrado como último
+    encrypted = _encrypt(session_key, tmp_path, os.urandom(3 * CHUNK))
+    data = encrypted.read_bytes()
+    encrypted.write_bytes(data[:-cut])
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+
+
+@pytest.mark.parametrize("size", [2 * CHUNK, 2 * CHUNK + 5])
+def test_tampered_last_chunk_is_rejected(session_key, tmp_path, size):
+    encrypted = _encrypt(session_key, tmp_path, os.urandom(size))
+    data = bytearray(encrypted.read_bytes())
+    # Primer byte del último bloque
+    last = vault_format.HEADER_SIZE + (max(1, -(-size // CHUNK)) - 1) * (CHUNK + vault_format.TAG_SIZE)
+    data[last] ^= 1
+    encrypted.write_bytes(bytes(data))
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+    assert not (tmp_path / "descifrado.bin").exists()
+
+
+@pytest.mark.parametrize("size", [0, 2 * CHUNK])
+def test_dropped_last_chunk_is_rejected(session_key, tmp_path, size):
+    # Sin el último bloque el archivo sigue teniendo un largo válido (solo
+    # el encabezado, o bloques completos): lo detecta la marca de "último"
+    encrypted = _encrypt(session_key, tmp_path, os.urandom(size))
+    sealed_last = (size - (size // CHUNK - 1) * CHUNK if size else 0) + vault_format.TAG_SIZE
+    encrypted.write_bytes(encrypted.read_bytes()[:-sealed_last])
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+
+
+@pytest.mark.parametrize("cut", [1, vault_format.BASE_HEADER_SIZE, vault_format.HEADER_SIZE - 1])
+def test_truncated_header_is_rejected(session_key, tmp_path, cut):
+    encrypted = _encrypt(session_key, tmp_path, os.urandom(10))
+    encrypted.write_bytes(encrypted.read_bytes()[:cut])
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+
+
+def test_trailing_bytes_are_rejected(session_key, tmp_path):
+    encrypted = _encrypt(session_key, tmp_path, os.urandom(2 * CHUNK))
+    encrypted.write_bytes(encrypted.read_bytes() + b"\0" * 7)
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+
+
+def test_chunk_from_another_file_is_rejected(session_key, tmp_path):
+    data = os.urandom(2 * CHUNK)
+    first = _encrypt(session_key, tmp_path, data).read_bytes()
+    second = _encrypt(session_key, tmp_path, data).read_bytes()
+    start, sealed = vault_format.HEADER_SIZE, CHUNK + vault_format.TAG_SIZE
+    # Mismo contenido, mismo índice y misma llave maestra, pero otra llave de archivo
+    spliced = tmp_path / "mezclado.enc"
+    spliced.write_bytes(first[:start] + second[start:start + sealed] + first[start + sealed:])
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, spliced)
+
+
+def test_reordered_chunks_are_rejected(session_key, tmp_path):
+    encrypted = _encrypt(session_key, tmp_path, os.urandom(3 * CHUNK))
+    data = encrypted.read_bytes()
+    sealed = CHUNK + vault_format.TAG_SIZE
+    start = vault_format.HEADER_SIZE
+    first, second = data[start:start + sealed], data[start + sealed:start + 2 * sealed]
+    encrypted.write_bytes(data[:start] + second + first + data[start + 2 * sealed:])
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+
+
+@pytest.mark.parametrize("offset, length", [(0, 10), (CHUNK - 3, 7), (CHUNK, CHUNK), (2 * CHUNK + 1, 10 ** 6),
+                                            (5, 0), (10 ** 6, 10)])
+def test_read_range(session_key, tmp_path, offset, length):
+    data = os.urandom(3 * CHUNK + 5)
+    encrypted = _encrypt(session_key, tmp_path, data)
+
+    with vault_format.VaultFileReader(session_key, encrypted) as reader:
+        assert reader.size == len(data)
+        assert reader.chunk_count == 4
+        assert reader.read_range(offset, length) == data[offset:offset + length]
+
+
+def test_read_range_skips_damaged_chunks_outside_the_range(session_key, tmp_path):
+    data = os.urandom(3 * CHUNK)
+    encrypted = _encrypt(session_key, tmp_path, data)
+    damaged = bytearray(encrypted.read_bytes())
+    damaged[-1] ^= 1  # tag del último bloque
+    encrypted.write_bytes(bytes(damaged))
+
+    with vault_format.VaultFileReader(session_key, encrypted) as reader:
+        assert reader.read_range(0, CHUNK) == data[:CHUNK]
+        with pytest.raises(InvalidToken):
+            reader.read_range(2 * CHUNK, 1)
+
+
+def test_empty_file_is_authenticated(session_key, tmp_path):
+    encrypted = _encrypt(session_key, tmp_path, b"")
+    data = bytearray(encrypted.read_bytes())
+    data[-1] ^= 1  # tag del único bloque (vacío)
+    encrypted.write_bytes(bytes(data))
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+    with vault_format.VaultFileReader(session_key, encrypted) as reader:
+        with pytest.raises(InvalidToken):
+            list(reader.iter_chunks())
+
+
+def test_read_range_rejects_tampered_last_chunk(session_key, tmp_path):
+    data = os.urandom(2 * CHUNK + 5)
+    encrypted = _encrypt(session_key, tmp_path, data)
+    damaged = bytearray(encrypted.read_bytes())
+    damaged[-vault_format.TAG_SIZE - 1] ^= 1
+    encrypted.write_bytes(bytes(damaged))
+
+    with vault_format.VaultFileReader(session_key, encrypted) as reader:
+        assert reader.read_range(CHUNK, CHUNK) == data[CHUNK:2 * CHUNK]
+        # Un rango que toca el último bloque aunque sea en un byte
+        with pytest.raises(InvalidToken):
+            reader.read_range(2 * CHUNK - 1, 2)
+
+
+def test_read_chunk_out_of_range(session_key, tmp_path):
+    encrypted = _encrypt(session_key, tmp_path, os.urandom(CHUNK + 1))
+    with vault_format.VaultFileReader(session_key, encrypted) as reader:
+        for index in (-1, reader.chunk_count):
+            with pytest.raises(IndexError):
+                reader.read_chunk(index)
+
+
+def test_resume_from_a_longer_destination_rewrites_nothing(session_key, tmp_path):
+    data = os.urandom(CHUNK + 5)
+    encrypted = _encrypt(session_key, tmp_path, data)
+    destination = tmp_path / "descifrado.bin"
+    destination.write_bytes(data + b"sobra")
+
+    # Lo que ya estaba se conserva; solo se recorta lo que sobra
+    assert vault_format.decrypt_file(session_key, encrypted, destination, resume=True) == 0
+    assert destination.read_bytes() == data
+
+
+def test_failed_resume_keeps_the_partial_copy(session_key, tmp_path):
+    data = os.urandom(3 * CHUNK)
+    encrypted = _encrypt(session_key, tmp_path, data)
+    damaged = bytearray(encrypted.read_bytes())
+    damaged[-1] ^= 1
+    encrypted.write_bytes(bytes(damaged))
+    destination = tmp_path / "descifrado.bin"
+    destination.write_bytes(data[:CHUNK])
+
+    with pytest.raises(InvalidToken):
+        vault_format.decrypt_file(session_key, encrypted, destination, resume=True)
+    assert destination.read_bytes()[:CHUNK] == data[:CHUNK]
+
+
+def test_decrypt_resumes_a_partial_copy(session_key, tmp_path):
+    data = os.urandom(3 * CHUNK + 5)
+    encrypted = _encrypt(session_key, tmp_path, data)
+    destination = tmp_path / "descifrado.bin"
+    destination.write_bytes(data[:CHUNK + 7])
+
+    written = vault_format.decrypt_file(session_key, encrypted, destination, resume=True)
+    assert written == len(data) - (CHUNK + 7)
+    assert destination.read_bytes() == data
+
+
+def test_parallel_round_trip_matches_serial_format(session_key, tmp_path):
+    data = os.urandom(vault_format.PARALLEL_MIN_CHUNKS * CHUNK * 2 + 3)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        encrypted = _encrypt(session_key, tmp_path, data, pool=pool)
+        destination = tmp_path / "descifrado.bin"
+        vault_format.decrypt_file(session_key, encrypted, destination, pool=pool)
+    assert destination.read_bytes() == data
+    # Lo cifrado en paralelo se lee igual sin pool
+    assert _decrypt(session_key, tmp_path, encrypted) == data
+
+
+def test_parallel_decrypt_rejects_a_tampered_chunk(session_key, tmp_path):
+    data = os.urandom(vault_format.PARALLEL_MIN_CHUNKS * CHUNK * 2)
+    encrypted = _encrypt(session_key, tmp_path, data)
+    damaged = bytearray(encrypted.read_bytes())
+    damaged[vault_format.HEADER_SIZE + 9 * (CHUNK + vault_format.TAG_SIZE) + 1] ^= 1
+    encrypted.write_bytes(bytes(damaged))
+
+    destination = tmp_path / "descifrado.bin"
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        with pytest.raises(InvalidToken):
+            vault_format.decrypt_file(session_key, encrypted, destination, pool=pool)
+    assert not destination.exists()
+
+
+@pytest.mark.parametrize("offset, length", [(CHUNK + 1, 12 * CHUNK), (3 * CHUNK, 9 * CHUNK - 1)])
+def test_parallel_ranged_read(session_key, tmp_path, offset, length):
+    data = os.urandom(vault_format.PARALLEL_MIN_CHUNKS * CHUNK * 2 + 3)
+    encrypted = _encrypt(session_key, tmp_path, data)
+    with ThreadPoolExecutor(max_workers=4) as pool, vault_format.VaultFileReader(session_key, encrypted) as reader:
+        assert b"".join(reader.iter_chunks(offset, length, pool)) == data[offset:offset + length]
+
+
+def test_ordered_map_keeps_order_and_cancels_on_early_exit():
+    started = []
+
+    def work(index):
+        started.append(index)
+        # Los primeros tardan más: igual tienen que salir primero
+        time.sleep(0.002 * (5 - index % 5))
+        return index
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = vault_format.ordered_map(pool, work, ((index,) for index in range(20)), window=4)
+        assert [next(results) for _ in range(3)] == [0, 1, 2]
+        results.close()
+    # Al cortar no se siguen mandando tareas: a lo más la ventana en vuelo
+    assert len(started) <= 3 + 4
+
+
+CODECS = [name for name in chunk_codecs.available() if name != "none"]
+TEXT = b"linea de registro 2024-05-01 INFO usuario ok\n"
+
+
+def _write_compressed(session_key, path, data: bytes, codec: int):
+    header, file_key = vault_format.new_file_header(session_key, CHUNK, codec)
+    pieces = [data[i:i + CHUNK] for i in range(0, len(data), CHUNK)] or [b""]
+    with open(path, 'wb') as f:
+        f.write(header)
+        for index, piece in enumerate(pieces):
+            f.write(vault_format.pack_chunk(file_key, header, index, index == len(pieces) - 1, piece, codec))
+
+
+@pytest.mark.parametrize("name", CODECS)
+@pytest.mark.parametrize("size", SIZES)
+def test_compressed_round_trip(session_key, tmp_path, name, size):
+    # Texto y datos aleatorios mezclados: unos bloques se comprimen y otros no
+    data = (TEXT * (size // len(TEXT) + 1))[:size // 2] + os.urandom(size - size // 2)
+    encrypted = tmp_path / "comprimido.enc"
+    _write_compressed(session_key, encrypted, data, chunk_codecs.codec_from_name(name))
+
+    with vault_format.VaultFileReader(session_key, encrypted) as reader:
+        assert reader.size == len(data)
+        assert reader.read_range(CHUNK - 2, CHUNK + 4) == data[CHUNK - 2:2 * CHUNK + 2]
+    assert _decrypt(session_key, tmp_path, encrypted) == data
+
+
+def test_compressible_file_is_smaller_on_disk(session_key, tmp_path):
+    data = TEXT * 2000
+    encrypted = tmp_path / "comprimido.enc"
+    _write_compressed(session_key, encrypted, data, chunk_codecs.ZLIB)
+    assert os.path.getsize(encrypted) < len(data) // 4
+
+
+@pytest.mark.parametrize("position", ["frame", "payload", "plain_size"])
+def test_tampered_compressed_chunk_is_rejected(session_key, tmp_path, position):
+    encrypted = tmp_path / "comprimido.enc"
+    _write_compressed(session_key, encrypted, TEXT * 300, chunk_codecs.ZLIB)
+    data = bytearray(encrypted.read_bytes())
+    start = vault_format.HEADER_SIZE
+    # Largo cifrado, largo original o contenido del primer bloque
+    offset = {"frame": start + 3, "plain_size": start + 7, "payload": start + vault_format.FRAME_SIZE + 5}[position]
+    data[offset] ^= 1
+    encrypted.write_bytes(bytes(data))
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+
+
+def test_truncated_compressed_file_is_rejected(session_key, tmp_path):
+    encrypted = tmp_path / "comprimido.enc"
+    _write_compressed(session_key, encrypted, TEXT * 300, chunk_codecs.ZLIB)
+    encrypted.write_bytes(encrypted.read_bytes()[:-3])
+
+    with pytest.raises(InvalidToken):
+        _decrypt(session_key, tmp_path, encrypted)
+
+
+def _frames(path) -> list:
+    """[(inicio del largo, fin del bloque), ...] de un archivo comprimido."""
+    data = path.read_bytes()
+    frames, position = [], vault_format.HEADER_SIZE
+    while position < len(data):
+        sealed_size = int.from_bytes(data[position:position + 4], "big")
+        frames.append((position, position + vault_format.FRAME_SIZE + sealed_size))
+        position = frames[-1][1]
+    return frames
+
+
+@pytest.mark.parametrize("change", ["tamper", "drop", "swap"])
+def test_damaged_last_compressed_chunk_is_rejected(session_key, tmp_path, change):
+    encrypted = tmp_path / "comprimido.enc"
+    _write_compressed(session_key, encrypted, TEXT * 300 + b"final", chunk_codecs.ZLIB)
+    data = bytearray(encrypted.read_bytes())
+    frames = _frames(encrypted)
+    assert len(frames) >= 3
+    (start, end), (prev_start, _) = frames[-1], frames[-2]
+    if change == "tamper":
+        data[end - 1] ^= 1
+    elif change == "drop":
+        # Sin el último bloque, el penúltimo no está marcado como último
+        del data[start:]
+    else:
+        # Los dos últimos en orden inverso: cada bloque va atado a su posición
+        data = data[:prev_start] + data[start:end] + data[prev_start:start]
+    encrypted.write_bytes(bytes(data))
+
+    with pytest.raises(InvalidToken):
+        with vault_format.VaultFileReader(session_key, encrypted) as reader:
+            reader.read_range(reader.size - 10, 10)
+
+
+def test_oversized_last_compressed_chunk_is_rejected(session_key, tmp_path):
+    # Un bloque no puede decir que mide más que 'chunk_size' (ni ser una bomba de descompresión)
+    encrypted = tmp_path / "comprimido.enc"
+    header, file_key = vault_format.new_file_header(session_key, CHUNK, chunk_codecs.ZLIB)
+    with open(encrypted, 'wb') as f:
+        f.write(header)
+        f.write(vault_format.pack_chunk(file_key, header, 0, True, b"a" * (4 * CHUNK), chunk_codecs.ZLIB))
+
+    with pytest.raises(InvalidToken):
+        vault_format.VaultFileReader(session_key, encrypted)
+
+
+def test_compressed_chunk_that_expands_past_its_size_is_rejected(session_key, tmp_path):
+    # El largo original está autenticado, pero igual se comprueba al descomprimir
+    header, file_key = vault_format.new_file_header(session_key, CHUNK, chunk_codecs.ZLIB)
+    sealed = vault_format.pack_chunk(file_key, header, 0, True, b"a" * CHUNK, chunk_codecs.ZLIB)
+    with pytest.raises(InvalidToken):
+        vault_format.unpack_chunk(file_key, header, 0, True, sealed[vault_format.FRAME_SIZE:], CHUNK // 2)
+
+
+def test_unknown_or_missing_codecs(monkeypatch):
+    with pytest.raises(InvalidToken):
+        chunk_codecs.decompress(99, b"datos", 10)
+    with pytest.raises(ValueError):
+        chunk_codecs.codec_from_name("brotli")
+    with pytest.raises(ValueError):
+        chunk_codecs.compress(TEXT * 100, 99)
+
+    # Sin 'zstandard': no se ofrece, y un archivo que lo usa da un error claro
+    monkeypatch.setattr(chunk_codecs, "zstandard", None)
+    assert "zstd" not in chunk_codecs.available()
+    assert chunk_codecs.codec_from_name("auto") == chunk_codecs.ZLIB
+    with pytest.raises(ValueError):
+        chunk_codecs.codec_from_name("zstd")
+    with pytest.raises(ValueError, match="zstandard"):
+        chunk_codecs.decompress(chunk_codecs.ZSTD, b"datos", 10)
+
+
+def test_tiny_and_already_compressed_chunks_are_stored_as_is():
+    assert chunk_codecs.compress(b"a" * 63, chunk_codecs.ZLIB) == (chunk_codecs.NONE, b"a" * 63)
+    assert chunk_codecs.compress(b"", chunk_codecs.LZMA) == (chunk_codecs.NONE, b"")
+    assert chunk_codecs.entropy(b"") == 0.0
@@ -0,0 +1,185 @@
+import os
+import stat
+import pytest
+import vault_writer
+from vault_writer import ALIGNMENT, DIRECT_WRITE, SyncPolicy, VaultWriter
+
+
+class _RecordingFile:
+    """Envuelve el archivo del VaultWriter y anota el tamaño de cada write()."""
+    def __init__(self, f):
+        self.f = f
+        self.sizes = []
+
+    def write(self, data):
+        self.sizes.append(len(data))
+        return self.f.write(data)
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+
+@pytest.fixture
+def disk_log(monkeypatch):
+    """
+    Anota en orden los fsync (de archivos, por inodo, y de carpetas) y los
+    renombrados, para comprobar que nunca se renombra antes del fsync.
+    """
+    log = []
+    real_fsync, real_replace = os.fsync, os.replace
+
+    def fsync(fd):
+        info = os.fstat(fd)
+        log.append(("fsync_dir",) if stat.S_ISDIR(info.st_mode) else ("fsync", info.st_ino))
+        real_fsync(fd)
+
+    def replace(src, dst):
+        log.append(("replace", os.stat(src).st_ino, os.path.basename(dst)))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, "fsync", fsync)
+    monkeypatch.setattr(os, "replace", replace)
+    return log
+
+
+def _write(folder, name, sync, data=b"datos"):
+    writer = VaultWriter(folder / name, sync)
+    writer.write(data)
+    writer.commit()
+    return writer
+
+
+def test_final_name_appears_only_on_commit(tmp_path):
+    path = tmp_path / "a.enc"
+    writer = VaultWriter(path)
+    writer.write(b"cabecera")
+    writer.write(os.urandom(DIRECT_WRITE))
+    assert os.listdir(tmp_path) == ["a.enc" + vault_writer.TEMP_SUFFIX]
+
+    writer.commit()
+    assert os.listdir(tmp_path) == ["a.enc"]
+    assert writer.size == path.stat().st_size == len(b"cabecera") + DIRECT_WRITE
+
+
+def test_abort_leaves_nothing(tmp_path):
+    writer = VaultWriter(tmp_path / "a.enc")
+    writer.write(os.urandom(3 * ALIGNMENT))
+    writer.abort()
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_rename_removes_the_temp_file(tmp_path, monkeypatch):
+    def unplugged(src, dst):
+        raise OSError("USB desconectada")
+
+    monkeypatch.setattr(os, "replace", unplugged)
+    writer = VaultWriter(tmp_path / "a.enc")
+    writer.write(b"datos")
+    with pytest.raises(OSError):
+        writer.commit()
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("direct", [True, False])
+def test_writes_are_aligned(tmp_path, direct):
+    # Piezas chicas, medianas y grandes mezcladas, de tamaños que no son múltiplos de nada
+    sizes = [68, 1000, DIRECT_WRITE + 17, 5, 3 * ALIGNMENT + 1, DIRECT_WRITE * 2 + 3, 40_000, 12]
+    pieces = [os.urandom(size) for size in sizes]
+    writer = VaultWriter(tmp_path / "a.enc", buffer_size=2 * ALIGNMENT + 1, direct=direct)
+    assert writer.buffer_size == 2 * ALIGNMENT
+    writer._file = recorder = _RecordingFile(writer._file)
+    for piece in pieces:
+        writer.write(piece)
+    writer.commit()
+
+    # Todas las escrituras llenan clusters completos, menos la última
+    assert all(size % ALIGNMENT == 0 for size in recorder.sizes[:-1])
+    assert sum(recorder.sizes) == sum(sizes)
+    assert (tmp_path / "a.enc").read_bytes() == b"".join(pieces)
+
+
+@pytest.mark.parametrize("size", [100, DIRECT_WRITE + 1])
+def test_pieces_can_be_reused_after_write(tmp_path, size):
+    piece = bytearray(os.urandom(size))
+    original = bytes(piece)
+    writer = VaultWriter(tmp_path / "a.enc")
+    writer.write(memoryview(piece))
+    piece[:] = bytes(size)
+    writer.commit()
+    assert (tmp_path / "a.enc").read_bytes() == original
+
+
+def test_invalid_policy_is_rejected():
+    with pytest.raises(ValueError):
+        SyncPolicy("siempre")
+
+
+def test_file_policy_syncs_each_file_before_renaming(tmp_path, disk_log):
+    sync = SyncPolicy(vault_writer.FSYNC_FILE)
+    for name in ("a.enc", "b.enc"):
+        _write(tmp_path, name, sync)
+        assert (tmp_path / name).exists()
+
+    files = [entry for entry in disk_log if entry[0] != "fsync_dir"]
+    assert [entry[0] for entry in files] == ["fsync", "replace", "fsync", "replace"]
+    assert files[0][1] == files[1][1] and files[2][1] == files[3][1]
+    if hasattr(os, "O_DIRECTORY"):
+        assert disk_log.count(("fsync_dir",)) == 2
+
+
+def test_none_policy_renames_without_syncing(tmp_path, disk_log):
+    _write(tmp_path, "a.enc", SyncPolicy(vault_writer.FSYNC_NONE))
+    assert [entry[0] for entry in disk_log] == ["replace"]
+    assert (tmp_path / "a.enc").exists()
+
+
+def _assert_synced_before_renamed(log, names):
+    synced = set()
+    renamed = []
+    for entry in log:
+        if entry[0] == "fsync":
+            synced.add(entry[1])
+        elif entry[0] == "replace":
+            assert entry[1] in synced
+            renamed.append(entry[2])
+    assert sorted(renamed) == sorted(names)
+
+
+def test_batch_policy_renames_when_the_batch_is_full(tmp_path, disk_log):
+    sync = SyncPolicy(vault_writer.FSYNC_BATCH, batch_files=3)
+    for name in ("a.enc", "b.enc"):
+        _write(tmp_path, name, sync)
+    # Terminados pero esperando: solo con nombre temporal
+    assert sorted(os.listdir(tmp_path)) == ["a.enc.tmp", "b.enc.tmp"]
+    assert disk_log == []
+
+    _write(tmp_path, "c.enc", sync)
+    assert sorted(os.listdir(tmp_path)) == ["a.enc", "b.enc", "c.enc"]
+    _assert_synced_before_renamed(disk_log, ["a.enc", "b.enc", "c.enc"])
+
+
+def test_batch_policy_also_counts_bytes(tmp_path, disk_log):
+    sync = SyncPolicy(vault_writer.FSYNC_BATCH, batch_files=100, batch_bytes=ALIGNMENT)
+    _write(tmp_path, "a.enc", sync, b"x" * 10)
+    assert os.listdir(tmp_path) == ["a.enc.tmp"]
+    _write(tmp_path, "b.enc", sync, b"x" * ALIGNMENT)
+    assert sorted(os.listdir(tmp_path)) == ["a.enc", "b.enc"]
+
+
+def test_end_policy_waits_for_flush(tmp_path, disk_log):
+    sync = SyncPolicy(vault_writer.FSYNC_END, batch_files=1, batch_bytes=1)
+    names = [f"{index}.enc" for index in range(5)]
+    for name in names:
+        _write(tmp_path, name, sync)
+    assert all(name.endswith(vault_writer.TEMP_SUFFIX) for name in os.listdir(tmp_path))
+
+    sync.flush()
+    assert sorted(os.listdir(tmp_path)) == names
+    _assert_synced_before_renamed(disk_log, names)
+    # Un segundo flush no tiene nada que hacer
+    del disk_log[:]
+    sync.flush()
+    assert disk_log == []
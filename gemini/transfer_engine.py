@@ -0,0 +1,846 @@
+import io
+import os
+import hashlib
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+import vault_format
+import manifest
+import scanner
+import chunk_codecs
+import dedup_store
+import pack_store
+import vault_writer
+import instrumentation
+from buffer_pool import BufferPool
+from cryptography.fernet import InvalidToken
+
+# Motores de importación (PC -> baúl) y exportación (baúl -> PC).
+#
+# Los dos se pueden cancelar con cancel(): se detienen en el siguiente límite
+# de bloque y borran el archivo que quedó a medias. Ninguno toca widgets;
+# transfers.py los corre en segundo plano y lleva el avance a la interfaz.
+#
+# Motor de importación en paralelo (PC -> baúl).
+#
+# El trabajo se divide en etapas que corren al mismo tiempo, conectadas por
+# colas con tamaño máximo (así la memoria no crece aunque se suelten 50k
+# archivos de golpe):
+#
+#   recorrido -> nombres -> lectura -> cifrado (pool) -> escritura
+#
+# - recorrido: 1 hilo que recorre las carpetas soltadas y crea las carpetas
+#   destino en el baúl.
+# - nombres:   1 hilo que asigna a cada archivo su id corto en disco (el
+#   nombre real va cifrado en el manifiesto de la carpeta, ver manifest.py).
+# - lectura:   N hilos que leen los archivos por bloques.
+# - cifrado:   un pool de hilos o de procesos que cifra cada bloque. Como se
+#   manda bloque por bloque, un solo archivo enorme también se reparte entre
+#   todos los núcleos (hasta 'queue_size' bloques en vuelo).
+# - escritura: 1 hilo que escribe en la USB en orden (a la memoria flash le
+#   va mejor una sola escritura secuencial que muchas en paralelo), con
+#   nombres temporales, bloques grandes y la política de fsync elegida (ver
+#   vault_writer.py).
+#
+# En modo deduplicado (dedup=True) la lectura parte cada archivo en trozos
+# según su contenido y los guarda en el almacén del baúl (ver
+# dedup_store.py); a la escritura solo le llega la lista de trozos.
+#
+# Los archivos pequeños no se escriben como .enc propios: la escritura los va
+# agregando a un paquete compartido (ver pack_store.py) y los registra en el
+# manifiesto cuando el paquete queda completo en disco.
+#
+# Importación incremental: el manifiesto guarda de cada archivo el tamaño, el
+# mtime y un BLAKE2 del archivo original. Al volver a soltar la misma carpeta,
+# los archivos con el mismo tamaño y mtime se saltan sin leerlos; si solo
+# cambió el mtime se compara el hash (leer es mucho más barato que cifrar y
+# escribir en la USB). Los que sí cambiaron reemplazan a la versión anterior.
+#
+# Con zero_copy=True (y un pool de hilos) los bloques no se copian en bytes
+# nuevos: la lectura los deja en buffers de un BufferPool (o los toma de un
+# mmap, ver vault_format.iter_source_chunks), el cifrado escribe en otro
+# buffer del pool y la escritura los devuelve al pool apenas escribe el
+# bloque. Lo mismo al exportar con VaultFileReader.iter_chunks(buffers=...).
+# Comparación con el camino anterior:
+#   python -m benchmarks.bench_zero_copy
+
+_DONE = object()  # Marca de fin de una cola
+
+
+def measure_sources(sources, cancel_event=None):
+    """
+    Cuenta los archivos y bytes de 'sources' (archivos o carpetas de la PC)
+    para poder calcular el porcentaje y el tiempo restante.
+
+    Retorna:
+        tuple: (archivos, bytes)
+    """
+    files = total = 0
+    for source in sources:
+        if os.path.isfile(source):
+            files += 1
+            total += os.path.getsize(source)
+            continue
+        for _, entries in scanner.walk(source):
+            if cancel_event is not None and cancel_event.is_set():
+                return files, total
+            for entry in entries:
+                if not entry.is_dir:
+                    files += 1
+                    total += entry.size
+    return files, total
+
+
+@dataclass
+class FileResult:
+    """Resultado de transferir (o revisar) un archivo."""
+    source: str
+    destination: str = ""
+    size: int = 0
+    written: int = 0
+    seconds: float = 0.0
+    error: str = ""
+    skipped: bool = False   # Sin cambios desde la importación anterior
+    name: str = ""          # Nombre real, cuando 'source' es un archivo del baúl (ver scrub.py)
+
+    @property
+    def ok(self) -> bool:
+        return not self.error
+
+
+@dataclass
+class TransferReport:
+    """Resumen de una importación o exportación completa."""
+    results: list = field(default_factory=list)
+    elapsed: float = 0.0
+    cancelled: bool = False
+
+    @property
+    def files_ok(self) -> int:
+        return sum(1 for r in self.results if r.ok)
+
+    @property
+    def failed(self) -> list:
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def files_skipped(self) -> int:
+        return sum(1 for r in self.results if r.skipped)
+
+    @property
+    def bytes_read(self) -> int:
+        return sum(r.size for r in self.results if r.ok and not r.skipped)
+
+    @property
+    def bytes_skipped(self) -> int:
+        return sum(r.size for r in self.results if r.skipped)
+
+    @property
+    def bytes_written(self) -> int:
+        return sum(r.written for r in self.results)
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes_read / (1024 * 1024) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files_ok / self.elapsed if self.elapsed else 0.0
+
+
+def _remove_partial(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class _HashingReader:
+    """Envuelve un archivo abierto y calcula el hash de lo que se lee."""
+    def __init__(self, f, hasher):
+        self._file = f
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.hasher.update(data)
+        return data
+
+
+def file_hash(path, cancel_event=None):
+    """
+    BLAKE2 (hex) del contenido de un archivo de la PC.
+
+    Retorna:
+        str: El hash, o None si se canceló.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            data = f.read(vault_format.CHUNK_SIZE)
+            if not data:
+                return hasher.hexdigest()
+            hasher.update(data)
+
+
+class _FileJob:
+    def __init__(self, source: Path, dest_dir: str):
+        self.source = source
+        self.dest_dir = dest_dir
+        self.file_id = None
+        self.stat = None
+        self.previous = None    # (id, entrada) de la versión que ya está en el baúl
+        self.hasher = hashlib.blake2b(digest_size=16)
+        self.result = FileResult(source=str(source))
+        self.started = time.perf_counter()
+
+
+class ImportEngine:
+    """
+    Cifra y copia archivos y carpetas al baúl usando varios núcleos.
+
+    Parámetros:
+        session_key: La llave de sesión descifrada.
+        manifests: El ManifestStore del baúl, donde se registran los nombres.
+        workers: Hilos de lectura y tamaño del pool de cifrado
+                 (por defecto, un núcleo cada uno).
+        use_processes: Si es True el cifrado corre en un pool de procesos en
+                       vez de hilos.
+        queue_size: Máximo de elementos en cada cola entre etapas.
+        flush_every: Cada cuántos archivos se guardan los manifiestos (además
+                     de al terminar).
+        compression: Nombre del códec para comprimir antes de cifrar ("zlib",
+                     "lzma", "zstd" o "auto"); None para no comprimir. Ver
+                     chunk_codecs.py.
+        compression_level: Nivel del códec (None = el nivel por defecto).
+        dedup: Si es True los archivos se guardan como trozos deduplicados
+               (ver dedup_store.py).
+        incremental: Si es True se saltan los archivos que no cambiaron desde
+                     la importación anterior.
+        pack_small_files: Si es True los archivos de hasta
+                          pack_store.SMALL_FILE bytes se guardan en paquetes.
+        fsync: Cuándo se fuerza a disco lo escrito: "file", "batch" o "end"
+               (ver vault_writer.py).
+        zero_copy: Si es True los bloques se leen y cifran en buffers
+                   reutilizados en vez de bytes nuevos. No aplica con
+                   use_processes (los bloques se mandan copiados a cada proceso).
+    """
+    def __init__(self, session_key, manifests, workers: int = None, use_processes: bool = False,
+                 chunk_size: int = vault_format.CHUNK_SIZE, queue_size: int = 64,
+                 flush_every: int = 256, compression: str = None, compression_level: int = None,
+                 dedup: bool = False, incremental: bool = True, pack_small_files: bool = True,
+                 fsync: str = vault_writer.FSYNC_BATCH, zero_copy: bool = True):
+        self.session_key = session_key
+        self.manifests = manifests
+        self.flush_every = flush_every
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.codec = chunk_codecs.codec_from_name(compression) if compression else chunk_codecs.NONE
+        self.compression_level = compression_level
+        self.incremental = incremental
+        self.pack_small_files = pack_small_files
+        self.fsync = fsync
+        self.zero_copy = zero_copy and not use_processes
+        self.chunk_store = None
+        if dedup:
+            self.chunk_store = manifests.chunk_store(create=True)
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Pide que la importación se detenga en el siguiente bloque."""
+        self._cancel.set()
+
+    def measure(self, sources):
+        return measure_sources(sources, self._cancel)
+
+    def run(self, sources, destination_folder: str, on_file_done=None, on_progress=None) -> TransferReport:
+        """
+        Importa 'sources' (rutas de archivos o carpetas) dentro de
+        'destination_folder' y espera a que termine.
+
+        'on_file_done(FileResult)' se llama desde un hilo del motor cada vez
+        que un archivo termina (bien o mal) y 'on_progress(bytes)' cada vez
+        que se escribe un bloque. Si se usan desde la interfaz hay que pasarlos
+        al hilo de Tk con 'after()'.
+
+        Retorna:
+            TransferReport: El resultado de cada archivo y el rendimiento total.
+        """
+        report = TransferReport()
+        self._on_file_done = on_file_done
+        self._on_progress = on_progress
+        self._report = report
+        self._report_lock = threading.Lock()
+        self._sync = vault_writer.SyncPolicy(self.fsync)
+        self._buffers = None
+        if self.zero_copy:
+            # Por lector: el bloque en lectura y el siguiente, más los que van
+            # en vuelo hacia la escritura (dos buffers cada uno). Si se
+            # acaban, la lectura espera a que la escritura devuelva alguno.
+            self._buffers = BufferPool(vault_format.chunk_buffer_size(self.chunk_size), 4 * self.workers + 4)
+        started = time.perf_counter()
+
+        name_q = queue.Queue(self.queue_size)
+        read_q = queue.Queue(self.queue_size)
+        write_q = queue.Queue(self.queue_size)
+
+        pool_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        with pool_class(max_workers=self.workers) as pool:
+            threads = [
+                threading.Thread(target=self._walk_stage, args=(sources, destination_folder, name_q)),
+                threading.Thread(target=self._name_stage, args=(name_q, read_q)),
+                threading.Thread(target=self._write_stage, args=(write_q,)),
+            ]
+            threads += [threading.Thread(target=self._read_stage, args=(read_q, write_q, pool))
+                        for _ in range(self.workers)]
+            for t in threads:
+                t.daemon = True
+                t.start()
+            for t in threads:
+                t.join()
+
+        self._flush()
+        if self.chunk_store is not None:
+            self.chunk_store.save()
+        report.elapsed = time.perf_counter() - started
+        report.cancelled = self._cancel.is_set()
+        return report
+
+    def _flush(self):
+        # Primero los archivos (fsync y nombre final) y después el manifiesto
+        # que los nombra
+        self._sync.flush()
+        self.manifests.flush()
+
+    def _finish(self, job: _FileJob, error: str = ""):
+        job.result.error = error
+        if job.result.skipped and self._on_progress:
+            self._on_progress(job.result.size)
+        job.result.seconds = time.perf_counter() - job.started
+        with self._report_lock:
+            self._report.results.append(job.result)
+        instrumentation.count("files_imported")
+        if self._on_file_done:
+            self._on_file_done(job.result)
+
+    # --- Etapa 1: recorrido ---
+    def _walk_stage(self, sources, destination_folder, name_q):
+        try:
+            for source in sources:
+                if self._cancel.is_set():
+                    break
+                self._walk(Path(source), destination_folder, name_q)
+        finally:
+            name_q.put(_DONE)
+
+    def _walk(self, source: Path, dest_dir: str, name_q):
+        if source.is_dir():
+            self._walk_dir(str(source), dest_dir, name_q)
+        elif source.is_file():
+            name_q.put(_FileJob(source, dest_dir))
+        elif not source.exists():
+            self._finish(_FileJob(source, dest_dir), "No se encontró el archivo")
+
+    def _walk_dir(self, folder: str, dest_dir: str, name_q):
+        # Las carpetas se recrean sin cifrar en el destino
+        new_dest_dir = os.path.join(dest_dir, os.path.basename(folder))
+        try:
+            os.makedirs(new_dest_dir, exist_ok=True)
+            # Una sola lectura por carpeta; el tipo de cada elemento ya viene
+            # incluido (ver scanner.py)
+            entries = scanner.scan_dir(folder, with_stat=False)
+        except OSError as e:
+            self._finish(_FileJob(Path(folder), dest_dir), str(e))
+            return
+        for entry in entries:
+            if self._cancel.is_set():
+                return
+            if entry.is_dir:
+                self._walk_dir(entry.path, new_dest_dir, name_q)
+            else:
+                name_q.put(_FileJob(Path(entry.path), new_dest_dir))
+
+    # --- Etapa 2: nombres ---
+    def _name_stage(self, name_q, read_q):
+        by_name = {}    # carpeta destino -> {nombre: (id, entrada)}
+        while True:
+            job = name_q.get()
+            if job is _DONE:
+                break
+            try:
+                # El tamaño y mtime se toman antes de leer: si el archivo cambia
+                # mientras se importa, la próxima vez se vuelve a importar
+                job.stat = job.source.stat()
+            except OSError as e:
+                self._finish(job, str(e))
+                continue
+            if self.incremental:
+                if job.dest_dir not in by_name:
+                    by_name[job.dest_dir] = {entry.get("name"): (file_id, entry) for file_id, entry
+                                             in self.manifests.entries(job.dest_dir).items()}
+                job.previous = by_name[job.dest_dir].get(job.source.name)
+                if job.previous and self._unchanged(job.previous[1], job.stat):
+                    job.result.destination = os.path.join(job.dest_dir, job.previous[0])
+                    job.result.size = job.stat.st_size
+                    job.result.skipped = True
+                    self._finish(job)
+                    continue
+            job.file_id = manifest.new_file_id()
+            job.result.destination = os.path.join(job.dest_dir, job.file_id)
+            read_q.put(job)
+        for _ in range(self.workers):
+            read_q.put(_DONE)
+
+    @staticmethod
+    def _unchanged(entry: dict, stat) -> bool:
+        return entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime
+
+    def _same_content(self, job: _FileJob) -> bool:
+        """
+        Mismo tamaño pero otro mtime (por ejemplo, una copia o un 'touch'):
+        se compara el hash guardado con el del archivo.
+        """
+        if job.previous is None:
+            return False
+        file_id, entry = job.previous
+        if entry.get("size") != job.stat.st_size or "blake2b" not in entry:
+            return False
+        try:
+            if file_hash(job.source, self._cancel) != entry["blake2b"]:
+                return False
+        except OSError:
+            return False
+        # Se actualiza el mtime para no volver a leerlo la próxima vez
+        metadata = {key: value for key, value in entry.items() if key != "name"}
+        metadata["mtime"] = job.stat.st_mtime
+        self.manifests.add(job.dest_dir, file_id, entry["name"], **metadata)
+        job.result.destination = os.path.join(job.dest_dir, file_id)
+        job.result.size = job.stat.st_size
+        job.result.skipped = True
+        return True
+
+    # --- Etapas 3 y 4: lectura y cifrado ---
+    def _read_stage(self, read_q, write_q, pool):
+        while True:
+            job = read_q.get()
+            if job is _DONE:
+                break
+            if self._cancel.is_set():
+                # Los archivos que ni siquiera se empezaron no se reportan
+                continue
+            if self._same_content(job):
+                self._finish(job)
+                continue
+            if self.pack_small_files and job.stat.st_size <= pack_store.SMALL_FILE:
+                self._read_small(job, write_q)
+                continue
+            if self.chunk_store is not None:
+                self._store_deduplicated(job, write_q)
+                continue
+            # Los formatos que ya vienen comprimidos se guardan tal cual
+            codec = self.codec if chunk_codecs.should_compress_file(job.source) else chunk_codecs.NONE
+            header, file_key = vault_format.new_file_header(self.session_key, self.chunk_size, codec)
+            write_q.put(("data", job, (header, 0, ())))
+            if self._buffers is not None:
+                self._read_chunks_into(job, header, file_key, codec, write_q, pool)
+                continue
+            try:
+                with open(job.source, 'rb') as f:
+                    src = _HashingReader(f, job.hasher)
+                    for index, is_last, data in vault_format.read_plain_chunks(src, self.chunk_size):
+                        if self._cancel.is_set():
+                            break
+                        job.result.size += len(data)
+                        if codec:
+                            future = pool.submit(vault_format.pack_chunk, file_key, header, index, is_last, data,
+                                                 codec, self.compression_level)
+                        else:
+                            future = pool.submit(vault_format.seal_chunk, file_key, header, index, is_last, data)
+                        write_q.put(("data", job, (future, len(data), ())))
+            except OSError as e:
+                write_q.put(("error", job, str(e)))
+                continue
+            write_q.put(("cancel" if self._cancel.is_set() else "end", job, None))
+        write_q.put(("stop", None, None))
+
+    def _read_chunks_into(self, job: _FileJob, header, file_key, codec, write_q, pool):
+        """
+        Como el bucle de _read_stage pero con buffers del BufferPool: cada
+        bloque va a la escritura junto con los buffers que ocupa (el leído y
+        el cifrado), y la escritura los devuelve al pool.
+        """
+        buffers = self._buffers
+        try:
+            with open(job.source, 'rb') as f:
+                for index, is_last, data, buffer in vault_format.iter_source_chunks(f, self.chunk_size, buffers):
+                    if self._cancel.is_set():
+                        if buffer is not None:
+                            buffers.release(buffer)
+                        break
+                    job.hasher.update(data)
+                    job.result.size += len(data)
+                    out = buffers.acquire()
+                    if codec:
+                        future = pool.submit(vault_format.pack_chunk_into, file_key, header, index, is_last, data,
+                                             codec, self.compression_level, out)
+                    else:
+                        future = pool.submit(vault_format.seal_chunk_into, file_key, header, index, is_last,
+                                             data, out)
+                    write_q.put(("data", job, (future, len(data), (buffer, out))))
+        except OSError as e:
+            write_q.put(("error", job, str(e)))
+            return
+        write_q.put(("cancel" if self._cancel.is_set() else "end", job, None))
+
+    def _read_small(self, job: _FileJob, write_q):
+        """Archivo pequeño: se lee completo y la escritura lo agrega a un paquete."""
+        try:
+            with open(job.source, 'rb') as f, instrumentation.span("read", job.stat.st_size):
+                data = f.read()
+        except OSError as e:
+            self._finish(job, str(e))
+            return
+        job.hasher.update(data)
+        job.result.size = len(data)
+        write_q.put(("small", job, data))
+
+    def _store_deduplicated(self, job: _FileJob, write_q):
+        """
+        Modo deduplicado: los trozos van directo al almacén y al baúl solo la
+        lista de trozos (un archivo .enc normal con FLAG_RECIPE).
+        """
+        try:
+            with open(job.source, 'rb') as f:
+                stored = self.chunk_store.store_file(_HashingReader(f, job.hasher), self._cancel.is_set, self.codec)
+        except (OSError, ValueError) as e:
+            # Los trozos que sí se guardaron los limpia el próximo gc()
+            self._finish(job, str(e))
+            return
+        if stored is None:
+            return
+        recipe, job.result.size, job.result.written = stored
+
+        header, file_key = vault_format.new_file_header(self.session_key, self.chunk_size,
+                                                        flags=vault_format.FLAG_RECIPE)
+        write_q.put(("data", job, (header, 0, ())))
+        for index, is_last, data in vault_format.read_plain_chunks(io.BytesIO(recipe), self.chunk_size):
+            sealed = vault_format.seal_chunk(file_key, header, index, is_last, data)
+            write_q.put(("data", job, (sealed, job.result.size if is_last else 0, ())))
+        write_q.put(("end", job, None))
+
+    # --- Etapa 5: escritura ---
+    def _write_stage(self, write_q):
+        open_files = {}
+        failed = set()
+        since_flush = 0
+        readers_left = self.workers
+        pack = None
+        packed = []     # (job, posición) de los archivos del paquete abierto
+        while readers_left:
+            kind, job, payload = write_q.get()
+            if kind == "stop":
+                readers_left -= 1
+                continue
+            if job in failed:
+                if kind == "data":
+                    self._release_buffers(*payload)
+                continue
+
+            if kind == "small":
+                try:
+                    if pack is None:
+                        pack = pack_store.PackWriter(self.session_key, self.manifests.baul_path,
+                                                     self.codec, self.compression_level, self.chunk_size)
+                    packed.append((job, pack.append(payload)))
+                except OSError as e:
+                    self._discard_pack(pack, packed + [(job, 0)], str(e))
+                    pack, packed = None, []
+                    continue
+                job.result.written = len(payload)
+                if self._on_progress:
+                    self._on_progress(len(payload))
+                if pack.size >= pack_store.PACK_SIZE:
+                    self._close_pack(pack, packed)
+                    pack, packed = None, []
+                continue
+
+            try:
+                if kind == "data":
+                    piece, plain_size, held = payload
+                    try:
+                        data = piece if isinstance(piece, bytes) else piece.result()
+                        if job not in open_files:
+                            open_files[job] = vault_writer.VaultWriter(job.result.destination, self._sync,
+                                                                       direct=self.zero_copy)
+                        open_files[job].write(data)
+                    finally:
+                        self._release_buffers(piece, plain_size, held)
+                    job.result.written += len(data)
+                    if self._on_progress and plain_size:
+                        self._on_progress(plain_size)
+                elif kind == "cancel":
+                    # Cancelado a medias: se borra sin reportarlo como error
+                    failed.add(job)
+                    open_files.pop(job).abort()
+                elif kind == "end":
+                    open_files.pop(job).commit()
+                    self._register(job)
+                    since_flush += 1
+                    if since_flush >= self.flush_every:
+                        self._flush()
+                        since_flush = 0
+                    self._finish(job)
+                elif kind == "error":
+                    raise OSError(payload)
+            except Exception as e:
+                # Se descarta el archivo a medias y se sigue con los demás
+                failed.add(job)
+                writer = open_files.pop(job, None)
+                if writer:
+                    writer.abort()
+                self._finish(job, str(e))
+
+        # Los archivos del último paquete (también si se canceló: los que
+        # alcanzaron a entrar están completos)
+        if pack is not None:
+            self._close_pack(pack, packed)
+
+    def _release_buffers(self, piece, plain_size, held):
+        """Devuelve al pool los buffers de un bloque, cuando su tarea ya terminó."""
+        if not held:
+            return
+        wait([piece])
+        for buffer in held:
+            if buffer is not None:
+                self._buffers.release(buffer)
+
+    def _register(self, job: _FileJob, **location):
+        # El nombre se registra solo cuando el archivo ya está completo en
+        # disco; si había una versión anterior con el mismo nombre, el
+        # manifiesto la reemplaza y la borra
+        self.manifests.add(job.dest_dir, job.file_id, job.source.name,
+                           size=job.result.size, mtime=job.stat.st_mtime,
+                           blake2b=job.hasher.hexdigest(), **location)
+
+    def _close_pack(self, pack, packed):
+        try:
+            pack.close()
+        except OSError as e:
+            self._discard_pack(pack, packed, str(e))
+            return
+        for job, offset in packed:
+            self._register(job, pack=pack.name, offset=offset)
+        # Un solo guardado de manifiestos por paquete
+        self._flush()
+        for job, _ in packed:
+            self._finish(job)
+
+    def _discard_pack(self, pack, packed, error: str):
+        if pack is not None:
+            pack.discard()
+        for job, _ in packed:
+            self._finish(job, error)
+
+
+class ExportEngine:
+    """
+    Descifra archivos y carpetas del baúl y los copia a la PC.
+
+    Los archivos se exportan de uno en uno (la USB se lee en orden), pero los
+    bloques de un archivo grande se descifran en paralelo en 'pool'.
+
+    Con 'destination_folder=None' en run() solo se verifica: cada archivo se
+    descifra completo (cada bloque se autentica) sin escribir nada, y si el
+    manifiesto tiene el hash del original también se compara.
+
+    Parámetros:
+        session_key: La llave de sesión descifrada.
+        manifests: El ManifestStore del baúl, de donde salen los nombres reales.
+        pool: Pool opcional para descifrar bloques en paralelo.
+        zero_copy: Si es True los bloques se leen y descifran en buffers
+                   reutilizados (ver VaultFileReader.iter_chunks).
+    """
+    def __init__(self, session_key, manifests, pool=None, zero_copy: bool = True):
+        self.session_key = session_key
+        self.manifests = manifests
+        self.pool = pool
+        self._buffers = None
+        if zero_copy:
+            # Un par de buffers por bloque en vuelo (ver VaultFileReader._chunks_into)
+            self._buffers = BufferPool(vault_format.chunk_buffer_size(vault_format.CHUNK_SIZE),
+                                       2 * (vault_format.PARALLEL_WINDOW + 1))
+        self._packs = pack_store.PackCache(session_key, manifests.baul_path)
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Pide que la exportación se detenga en el siguiente bloque."""
+        self._cancel.set()
+
+    def measure(self, sources):
+        """
+        Retorna (archivos, bytes) a exportar. Los bytes salen del manifiesto
+        cuando está el tamaño original y si no, del tamaño en disco.
+        """
+        files = total = 0
+        for source in map(str, sources):
+            if os.path.isfile(source):
+                if source.endswith(".enc"):
+                    files += 1
+                    total += self._plain_size(os.path.dirname(source), os.path.basename(source),
+                                              os.path.getsize(source))
+                continue
+            packed = self._packed_entry(source)
+            if packed is not None:
+                files += 1
+                total += packed["size"]
+                continue
+            for folder, entries in scanner.walk(source):
+                if self._cancel.is_set():
+                    return files, total
+                if manifest.is_internal_dir(os.path.basename(folder)):
+                    continue
+                for entry in entries:
+                    if not entry.is_dir and entry.name.endswith(".enc"):
+                        files += 1
+                        total += self._plain_size(folder, entry.name, entry.size)
+                for entry in self.manifests.entries(folder).values():
+                    if pack_store.is_packed(entry):
+                        files += 1
+                        total += entry["size"]
+        return files, total
+
+    def _packed_entry(self, source):
+        """La entrada del manifiesto de 'source' si es un archivo empaquetado."""
+        entry = self.manifests.lookup(os.path.dirname(str(source)), os.path.basename(str(source)))
+        return entry if pack_store.is_packed(entry) else None
+
+    def _plain_size(self, folder, file_id, disk_size):
+        entry = self.manifests.lookup(folder, file_id) or {}
+        return entry.get("size", disk_size)
+
+    def run(self, sources, destination_folder: str, on_file_done=None, on_progress=None) -> TransferReport:
+        """
+        Exporta 'sources' (rutas reales dentro del baúl) a 'destination_folder'
+        (None para solo verificar) y espera a que termine. Los callbacks
+        funcionan igual que en ImportEngine.run.
+
+        Retorna:
+            TransferReport: El resultado de cada archivo y el rendimiento total.
+        """
+        report = TransferReport()
+        started = time.perf_counter()
+        try:
+            for source in sources:
+                if self._cancel.is_set():
+                    break
+                self._export(Path(source), destination_folder, report, on_file_done, on_progress)
+        finally:
+            self._packs.close()
+        report.elapsed = time.perf_counter() - started
+        report.cancelled = self._cancel.is_set()
+        return report
+
+    def _export(self, source: Path, dest_dir: str, report, on_file_done, on_progress):
+        if source.is_dir():
+            # Las carpetas no están cifradas: se recrean con el mismo nombre
+            new_dest_dir = None if dest_dir is None else os.path.join(dest_dir, source.name)
+            try:
+                if new_dest_dir is not None:
+                    os.makedirs(new_dest_dir, exist_ok=True)
+                entries = scanner.scan_dir(source, with_stat=False)
+            except OSError as e:
+                self._finish(_FileJob(source, dest_dir), report, on_file_done, str(e))
+                return
+            packed = [os.path.join(source, file_id) for file_id, entry in self.manifests.entries(source).items()
+                      if pack_store.is_packed(entry)]
+            for path in [entry.path for entry in entries if entry.is_dir or entry.name.endswith(".enc")] + packed:
+                if self._cancel.is_set():
+                    return
+                if not manifest.is_internal_dir(os.path.basename(path)):
+                    self._export(Path(path), new_dest_dir, report, on_file_done, on_progress)
+        elif source.name.endswith(".enc") and (source.is_file() or self._packed_entry(source)):
+            self._export_file(_FileJob(source, dest_dir), report, on_file_done, on_progress)
+
+    def _export_file(self, job: _FileJob, report, on_file_done, on_progress):
+        source = job.source
+        try:
+            name = manifest.resolve_name(self.manifests, source.parent, source.name)
+        except Exception:
+            self._finish(job, report, on_file_done, "No se pudo descifrar el nombre del archivo")
+            return
+        verifying = job.dest_dir is None
+        job.result.destination = "" if verifying else os.path.join(job.dest_dir, name)
+        expected = (self.manifests.lookup(source.parent, source.name) or {}).get("blake2b") if verifying else None
+        hasher = hashlib.blake2b(digest_size=16)
+
+        try:
+            with self._open_reader(source) as reader, \
+                    (nullcontext() if verifying else open(job.result.destination, 'wb')) as dst:
+                job.result.size = reader.size
+                if isinstance(reader, vault_format.VaultFileReader):
+                    chunks = reader.iter_chunks(pool=self.pool, buffers=self._buffers)
+                else:
+                    chunks = reader.iter_chunks(pool=self.pool)
+                for plain in chunks:
+                    # Revisamos la cancelación entre bloques; al salir del
+                    # bucle se cancelan los bloques que iban en paralelo
+                    if self._cancel.is_set():
+                        break
+                    if verifying:
+                        hasher.update(plain)
+                    else:
+                        with instrumentation.span("write", len(plain)):
+                            dst.write(plain)
+                        job.result.written += len(plain)
+                    if on_progress:
+                        on_progress(len(plain))
+        except InvalidToken:
+            _remove_partial(job.result.destination)
+            self._finish(job, report, on_file_done, "Error de llave al descifrar. ¿Archivo corrupto?")
+            return
+        except OSError as e:
+            _remove_partial(job.result.destination)
+            self._finish(job, report, on_file_done, str(e))
+            return
+
+        if self._cancel.is_set():
+            _remove_partial(job.result.destination)
+            return
+        if expected is not None and hasher.hexdigest() != expected:
+            self._finish(job, report, on_file_done, "El contenido no coincide con el hash del manifiesto")
+            return
+        self._finish(job, report, on_file_done)
+
+    def _open_reader(self, source):
+        """
+        VaultFileReader, PackedFileReader si el archivo está en un paquete o
+        RecipeReader si está deduplicado.
+        """
+        entry = self._packed_entry(source)
+        if entry is not None:
+            return pack_store.PackedFileReader(self.session_key, self.manifests.baul_path, entry, self._packs)
+        reader = vault_format.VaultFileReader(self.session_key, source)
+        if not reader.is_recipe:
+            return reader
+        try:
+            chunk_store = self.manifests.chunk_store()
+        except Exception:
+            reader.close()
+            raise
+        return dedup_store.RecipeReader(chunk_store, reader)
+
+    def _finish(self, job: _FileJob, report, on_file_done, error: str = ""):
+        job.result.error = error
+        job.result.seconds = time.perf_counter() - job.started
+        report.results.append(job.result)
+        instrumentation.count("files_exported")
+        if on_file_done:
+            on_file_done(job.result)
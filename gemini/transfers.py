@@ -0,0 +1,205 @@
+import queue
+import threading
+import time
+import tkinter as tk
+from dataclasses import dataclass
+
+# Cola de transferencias en segundo plano.
+#
+# Antes cifrar o descifrar corría dentro del callback de Tk y la ventana se
+# quedaba en "No responde" hasta terminar. TransferManager corre los trabajos
+# (ImportEngine / ExportEngine de transfer_engine.py) de uno en uno, en el
+# orden en que se pidieron, en un hilo aparte. El avance y el resultado
+# vuelven al hilo de Tk con 'after()', igual que en ChangeHandler.
+# run_in_background hace lo mismo para un solo trabajo corto, como
+# desbloquear la llave en login_gui y setup_gui.
+
+
+@dataclass
+class TransferProgress:
+    """Foto del avance de una transferencia, para mostrar en la interfaz."""
+    label: str
+    files_done: int = 0
+    files_total: int = 0
+    bytes_done: int = 0
+    bytes_total: int = 0
+    elapsed: float = 0.0
+    queued: int = 0      # Trabajos esperando detrás de este
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes_done / (1024 * 1024) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def fraction(self) -> float:
+        return min(1.0, self.bytes_done / self.bytes_total) if self.bytes_total else 0.0
+
+    @property
+    def eta_seconds(self):
+        """Segundos que faltan, o None si todavía no hay con qué calcularlo."""
+        if not self.bytes_done or not self.elapsed:
+            return None
+        speed = self.bytes_done / self.elapsed
+        return max(0.0, (self.bytes_total - self.bytes_done) / speed)
+
+
+def format_eta(seconds) -> str:
+    """'1 h 02 min', '3 min 05 s', '12 s' o '...' si no se conoce."""
+    if seconds is None:
+        return "..."
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return f"{seconds // 3600} h {seconds % 3600 // 60:02d} min"
+    if seconds >= 60:
+        return f"{seconds // 60} min {seconds % 60:02d} s"
+    return f"{seconds} s"
+
+
+def run_in_background(widget, work, on_success, on_error):
+    """
+    Corre work() en un hilo aparte para no congelar la ventana (la derivación
+    de la llave tarda casi un segundo a propósito). Al terminar se llama, en
+    el hilo de Tk, on_success(resultado) u on_error(excepción).
+    """
+    def worker():
+        try:
+            result = work()
+        except Exception as e:
+            callback, value = on_error, e
+        else:
+            callback, value = on_success, result
+        try:
+            widget.after(0, callback, value)
+        except (RuntimeError, tk.TclError):
+            pass # La ventana se cerró mientras tanto
+
+    threading.Thread(target=worker, daemon=True).start()
+
+
+class TransferJob:
+    """Un trabajo en la cola: un motor y lo que tiene que copiar."""
+    def __init__(self, label: str, engine, sources, destination: str):
+        self.label = label
+        self.engine = engine
+        self.sources = list(sources)
+        self.destination = destination
+        self.report = None   # TransferReport al terminar
+        self.error = ""      # Si el motor falló por completo
+
+
+class TransferManager:
+    """
+    Corre trabajos de transferencia en orden, en un hilo de fondo.
+
+    Parámetros:
+        widget: Cualquier widget de Tk; se usa su 'after()' para volver al
+                hilo de la interfaz.
+        on_progress: on_progress(TransferProgress), como mucho cada
+                     'min_interval' segundos mientras hay un trabajo.
+        on_finished: on_finished(TransferJob) al terminar (o cancelar) cada
+                     trabajo; el resultado está en 'job.report'.
+    """
+    def __init__(self, widget, on_progress, on_finished, min_interval: float = 0.1):
+        self.widget = widget
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.min_interval = min_interval
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._current = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self) -> bool:
+        return self._current is not None or not self._jobs.empty()
+
+    def submit(self, label: str, engine, sources, destination: str) -> TransferJob:
+        """Agrega un trabajo al final de la cola."""
+        job = TransferJob(label, engine, sources, destination)
+        self._jobs.put(job)
+        return job
+
+    def cancel(self, all_jobs: bool = False):
+        """
+        Cancela el trabajo en curso (se detiene en el siguiente bloque).
+        Con 'all_jobs' también se descartan los que esperaban en la cola.
+        """
+        if all_jobs:
+            while True:
+                try:
+                    self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+        with self._lock:
+            if self._current is not None:
+                self._current.engine.cancel()
+
+    def shutdown(self):
+        """Cancela todo y detiene el hilo (al cerrar la ventana)."""
+        self._closed = True
+        self.cancel(all_jobs=True)
+        self._jobs.put(None)
+
+    def _post(self, callback, *args):
+        if self._closed:
+            return
+        try:
+            self.widget.after(0, callback, *args)
+        except RuntimeError:
+            # La ventana ya se cerró
+            pass
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            with self._lock:
+                self._current = job
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._current = None
+            self._post(self.on_finished, job)
+
+    def _run(self, job: TransferJob):
+        progress = TransferProgress(job.label, queued=self._jobs.qsize())
+        self._post(self.on_progress, TransferProgress(**vars(progress)))
+        progress.files_total, progress.bytes_total = job.engine.measure(job.sources)
+
+        started = time.perf_counter()
+        last_post = 0.0
+        lock = threading.Lock()
+
+        def post(force=False):
+            nonlocal last_post
+            now = time.perf_counter()
+            if force or now - last_post >= self.min_interval:
+                last_post = now
+                progress.elapsed = now - started
+                progress.queued = self._jobs.qsize()
+                self._post(self.on_progress, TransferProgress(**vars(progress)))
+
+        def on_progress(nbytes):
+            with lock:
+                progress.bytes_done += nbytes
+                post()
+
+        def on_file_done(result):
+            with lock:
+                progress.files_done += 1
+                post()
+
+        try:
+            job.report = job.engine.run(job.sources, job.destination,
+                                        on_file_done=on_file_done, on_progress=on_progress)
+        except Exception as e:
+            # Un error inesperado del motor no debe matar la cola
+            print(f"Error en la transferencia '{job.label}': {e}")
+            job.error = str(e)
+            return
+        with lock:
+            post(force=True)
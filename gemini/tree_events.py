@@ -0,0 +1,194 @@
+import os
+import threading
+from watchdog.events import FileSystemEventHandler
+import manifest
+import pack_store
+from tree_model import TreeNode
+
+# Cambios en disco (eventos de watchdog) aplicados al árbol.
+#
+# ChangeHandler junta los eventos que llegan desde el hilo de watchdog y los
+# entrega en lotes al hilo de Tk. TreeUpdater convierte cada lote en insert/
+# remove/rename sobre los nodos afectados del TreeModel, sin volver a leer
+# las carpetas. Solo si se juntan demasiados eventos antes de aplicarlos se
+# relee todo.
+#
+# Ninguno de los dos toca widgets: FileTreeView y App les dan el modelo, la
+# forma de calcular los nombres y after().
+
+
+class TreeUpdater:
+    """
+    Aplica eventos de watchdog sobre un TreeModel. Los eventos de carpetas
+    que nunca se han expandido se ignoran (se leerán al expandirlas).
+
+    Parámetros:
+        model (TreeModel): El árbol a actualizar.
+        manifests (ManifestStore): Manifiestos del baúl.
+        display_name (callable): display_name(carpeta, nombre en disco) ->
+                                 nombre a mostrar de un archivo.
+    """
+    def __init__(self, model, manifests, display_name):
+        self.model = model
+        self.manifests = manifests
+        self.display_name = display_name
+
+    def apply(self, events) -> bool:
+        """
+        Aplica un lote de eventos.
+
+        Retorna:
+            bool: True si cambió algo (hay que recalcular las filas).
+        """
+        changed = False
+        manifest_folders = set()
+
+        for event in events:
+            src = event.src_path
+            dest = getattr(event, "dest_path", "") or ""
+            # Si cambió un manifiesto, pueden cambiar los nombres de su carpeta
+            if manifest.MANIFEST_NAME in (os.path.basename(src), os.path.basename(dest)):
+                manifest_folders.add(os.path.dirname(dest or src))
+                continue
+
+            if event.event_type == "created":
+                changed |= self.add_path(src, event.is_directory)
+            elif event.event_type == "deleted":
+                changed |= self.remove_path(src)
+            elif event.event_type == "moved":
+                changed |= self.move_path(src, dest, event.is_directory)
+            elif event.event_type == "modified" and not event.is_directory:
+                # Las carpetas cambian de mtime cada vez que se agrega o quita
+                # algo adentro; eso ya llega como eventos de sus hijos
+                changed |= self.modify_path(src)
+
+        for folder in manifest_folders:
+            changed |= self.rename_from_manifest(folder)
+        return changed
+
+    def add_path(self, real_path, is_dir) -> bool:
+        parent = self.model.find(os.path.dirname(real_path))
+        if parent is None or not parent.loaded or self.model.find(real_path) is not None:
+            return False
+        item = os.path.basename(real_path)
+        if is_dir and manifest.is_internal_dir(item):
+            return False
+        if is_dir:
+            node = TreeNode(item, real_path, True)
+        elif item.endswith(".enc"):
+            node = TreeNode(self.display_name(parent.real_path, item), real_path, False)
+        else:
+            return False
+        self.model.insert(parent, node)
+        return True
+
+    def remove_path(self, real_path) -> bool:
+        node = self.model.find(real_path)
+        if node is None or node is self.model.root:
+            return False
+        self.model.remove(node)
+        return True
+
+    def move_path(self, src, dest, is_dir) -> bool:
+        node = self.model.find(src)
+        new_parent = self.model.find(os.path.dirname(dest))
+        if node is None:
+            # Venía de una carpeta no cargada: es como si se hubiera creado
+            return self.add_path(dest, is_dir)
+        if new_parent is None or not new_parent.loaded or not (is_dir or dest.endswith(".enc")):
+            return self.remove_path(src)
+
+        item = os.path.basename(dest)
+        new_name = item if node.is_dir else self.display_name(new_parent.real_path, item)
+        self.model.rename(node, dest, new_name, new_parent)
+        return True
+
+    def modify_path(self, real_path) -> bool:
+        """
+        Cambió el contenido de un archivo. Si no estaba en el árbol (por
+        ejemplo, su 'created' llegó antes de que se cargara la carpeta) se
+        agrega; si estaba, se vuelve a calcular su nombre: un archivo antiguo
+        reescrito puede tener otro nombre o haber quedado corrupto.
+        """
+        node = self.model.find(real_path)
+        if node is None:
+            return self.add_path(real_path, False)
+        if node.is_dir or node.parent is None:
+            return False
+        name = self.display_name(node.parent.real_path, os.path.basename(real_path))
+        if name == node.name:
+            return False
+        node.name = name
+        self.model.resort(node.parent)
+        return True
+
+    def rename_from_manifest(self, folder) -> bool:
+        """Vuelve a poner los nombres de los archivos de 'folder' según su manifiesto."""
+        node = self.model.find(folder)
+        if node is None or not node.loaded:
+            return False
+        self.manifests.revalidate(folder)
+        entries = self.manifests.entries(folder)
+        for child in list(node.children):
+            if child.is_dir:
+                continue
+            file_id = os.path.basename(child.real_path)
+            if file_id not in entries and not os.path.exists(child.real_path):
+                # Archivo empaquetado que se quitó del manifiesto
+                self.model.remove(child)
+                continue
+            child.name = self.display_name(node.real_path, file_id)
+        # Archivos empaquetados nuevos: no generan eventos propios en disco
+        new_nodes = []
+        for file_id, entry in entries.items():
+            path = os.path.join(node.real_path, file_id)
+            if pack_store.is_packed(entry) and self.model.find(path) is None:
+                new_nodes.append(TreeNode(entry["name"], path, False))
+        self.model.insert_many(node, new_nodes)
+        return True
+
+
+# Esta clase se encarga de checar si hubo actualizaciones en la carpeta
+# de la USB y hace que la interfaz también se actualice
+class ChangeHandler(FileSystemEventHandler):
+    # Si se juntan más eventos que esto antes de aplicarlos, se relee todo
+    MAX_PENDING_EVENTS = 5000
+
+    def __init__(self, app_instance):
+        self.app = app_instance
+        self.lock = threading.Lock()
+        self.pending = []
+        self.overflow = False
+        self.scheduled = False
+        self.batch_delay = 100 # ms para juntar eventos en un solo lote
+
+    def on_any_event(self, event):
+        # Ningún evento se descarta: se acumulan y el hilo de Tk los aplica
+        # todos juntos en el siguiente lote.
+        with self.lock:
+            if self.overflow:
+                pass
+            elif len(self.pending) >= self.MAX_PENDING_EVENTS:
+                self.overflow = True
+                self.pending = []
+            else:
+                self.pending.append(event)
+            if self.scheduled:
+                return
+            self.scheduled = True
+
+        if self.app.winfo_exists():
+            self.app.after(self.batch_delay, self.apply_pending)
+
+    def apply_pending(self):
+        with self.lock:
+            events, self.pending = self.pending, []
+            overflow, self.overflow = self.overflow, False
+            self.scheduled = False
+
+        if overflow:
+            self.app.tree_view.refresh()
+            self.app.search_index.start()
+        else:
+            self.app.tree_view.apply_events(events)
+            self.app.search_index.apply_events(events)
@@ -0,0 +1,197 @@
+# Modelo del árbol de archivos, separado de los widgets.
+#
+# FileTreeView ya no crea un checkbox por archivo: dibuja solo las filas que
+# caben en la ventana y las toma de la lista plana 'TreeModel.rows'. El estado
+# (marcado, hijos, etc.) vive aquí, en los nodos, y no en los widgets.
+#
+# Las carpetas se leen del disco solo cuando se expanden por primera vez
+# ('loaded'). Al contraerlas se conservan sus hijos en memoria, así que
+# volver a expandirlas es inmediato.
+#
+# Los cambios en disco (eventos de watchdog) se aplican con insert/remove/
+# rename sobre los nodos afectados, sin volver a leer todo el árbol.
+
+import os
+
+
+def _sort_key(node):
+    """Primero carpetas y luego archivos, cada grupo por nombre."""
+    return (not node.is_dir, node.name.lower())
+
+
+class TreeNode:
+    """Un archivo o carpeta del baúl."""
+    __slots__ = ("name", "real_path", "is_dir", "parent", "children", "depth", "checked",
+                 "expanded", "loaded", "loading", "stale")
+
+    def __init__(self, name, real_path, is_dir, parent=None):
+        self.name = name              # Nombre a mostrar (ya descifrado)
+        self.real_path = real_path    # Ruta real (cifrada) en la USB
+        self.is_dir = is_dir
+        self.parent = parent
+        self.children = []
+        self.depth = parent.depth + 1 if parent else -1
+        self.checked = False
+        self.expanded = False   # Se muestran sus hijos
+        self.loaded = False     # Sus hijos ya se leyeron del disco
+        self.loading = False    # Hay una lectura en segundo plano en curso
+        self.stale = False      # Sus hijos en caché pueden estar desactualizados
+
+    def iter_descendants(self):
+        for child in self.children:
+            yield child
+            yield from child.iter_descendants()
+
+
+class TreeModel:
+    """
+    Árbol completo de nodos más la lista plana de filas a mostrar.
+    La raíz (la carpeta del baúl) no se muestra; sus hijos tienen depth 0.
+    """
+    def __init__(self, root_path):
+        self.root = TreeNode("", str(root_path), True)
+        self.root.expanded = True
+        self.rows = []
+        self.nodes = {self._key(self.root.real_path): self.root}  # ruta real -> nodo
+
+    def _key(self, real_path) -> str:
+        return os.path.normcase(os.path.normpath(real_path))
+
+    def find(self, real_path):
+        """Retorna el nodo de 'real_path' o None si no está cargado."""
+        return self.nodes.get(self._key(real_path))
+
+    def _index(self, node):
+        self.nodes[self._key(node.real_path)] = node
+        for child in node.iter_descendants():
+            self.nodes[self._key(child.real_path)] = child
+
+    def _unindex(self, node):
+        self.nodes.pop(self._key(node.real_path), None)
+        for child in node.iter_descendants():
+            self.nodes.pop(self._key(child.real_path), None)
+
+    def set_children(self, node, children):
+        """
+        Asigna los hijos recién leídos de 'node'. Los hijos que ya existían
+        (misma ruta real) conservan su estado: marcado, expandido y sus
+        propios hijos en caché. Los nuevos heredan el marcado de la carpeta.
+        """
+        previous = {child.real_path: child for child in node.children}
+        merged = []
+        for child in children:
+            old = previous.pop(child.real_path, None)
+            if old is not None and old.is_dir == child.is_dir:
+                old.name = child.name
+                child = old
+            else:
+                if old is not None:
+                    self._unindex(old)
+                child.checked = node.checked
+            child.parent = node
+            child.depth = node.depth + 1
+            merged.append(child)
+        for gone in previous.values():
+            self._unindex(gone)
+        merged.sort(key=_sort_key)
+        node.children = merged
+        self._index(node)
+        node.loaded = True
+        node.loading = False
+        node.stale = False
+
+    def insert(self, parent, node):
+        """Agrega 'node' como hijo de 'parent' en su lugar ordenado."""
+        node.parent = parent
+        node.depth = parent.depth + 1
+        node.checked = parent.checked
+        keys = [_sort_key(child) for child in parent.children]
+        position = len(keys)
+        for i, key in enumerate(keys):
+            if key > _sort_key(node):
+                position = i
+                break
+        parent.children.insert(position, node)
+        self._index(node)
+
+    def insert_many(self, parent, nodes):
+        """Como insert() para muchos nodos a la vez: se ordena una sola vez."""
+        for node in nodes:
+            node.parent = parent
+            node.depth = parent.depth + 1
+            node.checked = parent.checked
+            parent.children.append(node)
+            self._index(node)
+        self.resort(parent)
+
+    def remove(self, node):
+        """Quita 'node' (y todo lo que tenga debajo) del árbol."""
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        self._unindex(node)
+
+    def rename(self, node, new_real_path, new_name, new_parent):
+        """
+        Mueve/renombra un nodo. Si es carpeta, sus hijos en caché se conservan
+        y se actualizan sus rutas reales.
+        """
+        old_prefix = node.real_path
+        self.remove(node)
+        node.real_path = new_real_path
+        node.name = new_name
+        for child in node.iter_descendants():
+            child.real_path = new_real_path + child.real_path[len(old_prefix):]
+        checked = node.checked
+        self.insert(new_parent, node)
+        node.checked = checked
+        self._fix_depths(node)
+
+    def _fix_depths(self, node):
+        for child in node.children:
+            child.depth = node.depth + 1
+            self._fix_depths(child)
+
+    def resort(self, node):
+        node.children.sort(key=_sort_key)
+
+    def iter_visible(self, node=None):
+        """Recorre en preorden solo los nodos cuyas carpetas padre están expandidas."""
+        for child in (node or self.root).children:
+            yield child
+            if child.is_dir and child.expanded:
+                yield from self.iter_visible(child)
+
+    def iter_loaded_dirs(self):
+        """Carpetas cuyos hijos ya están en memoria (incluida la raíz)."""
+        pending = [self.root]
+        while pending:
+            node = pending.pop()
+            if node.loaded:
+                yield node
+                pending.extend(child for child in node.children if child.is_dir)
+
+    def is_shown(self, node) -> bool:
+        """True si todas las carpetas por encima de 'node' están expandidas."""
+        while node.parent is not None:
+            node = node.parent
+            if not node.expanded:
+                return False
+        return True
+
+    def rebuild_rows(self):
+        """Recalcula la lista plana de filas (solo las carpetas expandidas)."""
+        self.rows = list(self.iter_visible())
+
+    def set_checked(self, node, state: bool):
+        """Marca o desmarca un nodo; si es carpeta, también a todos sus hijos."""
+        node.checked = state
+        for child in node.iter_descendants():
+            child.checked = state
+
+    def checked_paths(self):
+        """
+        Rutas reales de los nodos marcados, en el orden del árbol. Una carpeta
+        marcada que nunca se expandió aparece sola (al exportarla se recorre
+        completa desde el disco).
+        """
+        return [node.real_path for node in self.root.iter_descendants() if node.checked]
@@ -0,0 +1,909 @@
+import os
+import mmap
+import struct
+from collections import deque
+from cryptography.fernet import InvalidToken
+import chunk_codecs
+import instrumentation
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.backends import default_backend
+
+# Formato por bloques de los archivos .enc del baúl.
+#
+# Antes cada archivo era un solo token Fernet: había que leerlo completo en RAM
+# y cifrarlo de una vez. Ahora el contenido se parte en bloques de tamaño fijo,
+# cada uno autenticado por separado con AES-GCM:
+#
+#   [cabecera][bloque 0 + tag][bloque 1 + tag] ... [último bloque + tag]
+#
+# - La cabecera guarda la versión, el tamaño de bloque y un salt aleatorio.
+# - Versión 2: cada archivo tiene su propia llave aleatoria, guardada en la
+#   cabecera "envuelta" (cifrada con AES-GCM) con la llave maestra, junto con
+#   el id de esa llave maestra. Rotar la llave maestra solo reescribe esos
+#   pocos bytes de cada cabecera (ver rekey.py), no el contenido.
+# - Versión 1: la llave del archivo se deriva (HKDF) de la llave maestra y
+#   el salt. Se sigue pudiendo leer.
+# - El nonce de cada bloque es su índice más una marca de "último bloque",
+#   así no se pueden reordenar, repetir ni truncar bloques sin que se note.
+# - La parte fija de la cabecera (sin la llave envuelta) va como dato
+#   asociado (AAD) en cada bloque.
+#
+# - Si la cabecera indica un códec de compresión (ver chunk_codecs.py), los
+#   bloques tienen tamaño variable y cada uno va precedido por su largo
+#   cifrado y su largo original:
+#
+#     [cabecera][largo, largo original][bloque 0 + tag][largo, ...][bloque 1 + tag] ...
+#
+#   y dentro de cada bloque el primer byte dice con qué códec se comprimió.
+#
+# - Con FLAG_RECIPE el contenido no es el archivo sino la lista de trozos del
+#   almacén deduplicado que lo forman (ver dedup_store.py).
+#
+# Los archivos antiguos (un token Fernet completo) se siguen pudiendo leer.
+#
+# Las funciones *_into (seal_chunk_into, open_chunk_into, ...) hacen lo mismo
+# que las normales pero escriben el resultado en un buffer que se reutiliza
+# (update_into de AES-GCM) en vez de crear un bytes nuevo por bloque, y
+# aceptan memoryview (de un mmap o de otro buffer). Las usan los motores de
+# transferencia con un BufferPool (ver buffer_pool.py).
+
+MAGIC = b"BAUL"
+VERSION = 2
+CHUNK_SIZE = 1024 * 1024  # 1 MiB de texto plano por bloque
+TAG_SIZE = 16
+
+# A partir de cuántos bloques vale la pena repartir un archivo en un pool
+PARALLEL_MIN_CHUNKS = 8
+# Bloques en vuelo por archivo cuando se usa un pool (limita la memoria)
+PARALLEL_WINDOW = 2 * (os.cpu_count() or 1)
+# Leer el archivo de origen con mmap (ver iter_source_chunks). En Windows un
+# archivo mapeado no se puede truncar mientras se lee; en Linux/macOS
+# truncarlo a medias mataría el proceso (SIGBUS), así que ahí se usa readinto.
+MMAP_READS = os.name == "nt"
+# update_into pide espacio de sobra en el destino: un bloque AES menos 1 byte
+_UPDATE_SLACK = 15
+
+# magic, versión, flags, códec, reservado, tamaño de bloque, salt
+_HEADER = struct.Struct(">4sBBBBI16s")
+BASE_HEADER_SIZE = _HEADER.size
+# Solo en la versión 2: id de la llave maestra, nonce, llave del archivo envuelta
+_KEY_RECORD = struct.Struct(">8s12s48s")
+KEY_RECORD_SIZE = _KEY_RECORD.size
+HEADER_SIZE = BASE_HEADER_SIZE + KEY_RECORD_SIZE
+# Antes de cada bloque de un archivo comprimido: largo cifrado, largo original
+_FRAME = struct.Struct(">II")
+FRAME_SIZE = _FRAME.size
+
+# Bits del campo 'flags' de la cabecera
+FLAG_RECIPE = 0x01
+
+
+def derive_file_key(session_key, salt: bytes) -> bytes:
+    """
+    Deriva la llave AES-256 de un archivo de la versión 1 a partir de la llave
+    maestra y el salt guardado en su cabecera. Esos archivos son anteriores a
+    cualquier rotación, así que se usa la llave maestra más antigua.
+    """
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        info=b"baul-contenido-v1",
+        backend=default_backend()
+    )
+    return hkdf.derive(session_key.oldest_master_key)
+
+
+def _wrapping_key(master_key: bytes) -> bytes:
+    """Llave con la que se envuelven las llaves de los archivos."""
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"baul-envoltura-v2",
+        backend=default_backend()
+    )
+    return hkdf.derive(master_key)
+
+
+def wrap_file_key(session_key, base_header: bytes, file_key: bytes) -> bytes:
+    """
+    Envuelve la llave de un archivo con la llave maestra actual.
+
+    Retorna:
+        bytes: El registro de la cabecera (id de la llave maestra, nonce y llave envuelta).
+    """
+    nonce = os.urandom(12)
+    wrapped = AESGCM(_wrapping_key(session_key.master_key)).encrypt(nonce, file_key, base_header)
+    return _KEY_RECORD.pack(session_key.key_id, nonce, wrapped)
+
+
+def unwrap_file_key(session_key, base_header: bytes, record: bytes) -> bytes:
+    """
+    Lanza:
+        InvalidToken: Si la llave maestra del registro no está en la sesión o
+                      el registro fue alterado.
+    """
+    master_id, nonce, wrapped = _KEY_RECORD.unpack(record)
+    master_key = session_key.masters.get(master_id)
+    if master_key is None:
+        raise InvalidToken
+    try:
+        return AESGCM(_wrapping_key(master_key)).decrypt(nonce, wrapped, base_header)
+    except InvalidTag:
+        raise InvalidToken
+
+
+def file_key_for(session_key, header: bytes) -> bytes:
+    """Retorna la llave de contenido de un archivo a partir de su cabecera completa."""
+    info = unpack_header(header)
+    if info["version"] == 1:
+        return derive_file_key(session_key, info["salt"])
+    return unwrap_file_key(session_key, header[:BASE_HEADER_SIZE], header[BASE_HEADER_SIZE:HEADER_SIZE])
+
+
+def rewrap_header(session_key, header: bytes):
+    """
+    Vuelve a envolver la llave de un archivo de la versión 2 con la llave
+    maestra actual. El contenido del archivo no cambia.
+
+    Retorna:
+        bytes: El nuevo registro de llave (KEY_RECORD_SIZE bytes), o None si
+               el archivo ya usa la llave maestra actual.
+    """
+    record = header[BASE_HEADER_SIZE:HEADER_SIZE]
+    if record[:8] == session_key.key_id:
+        return None
+    base = header[:BASE_HEADER_SIZE]
+    return wrap_file_key(session_key, base, unwrap_file_key(session_key, base, record))
+
+
+def chunk_nonce(index: int, is_last: bool) -> bytes:
+    """Nonce de 12 bytes: índice del bloque (8) + marca de último bloque (4)."""
+    return struct.pack(">QI", index, 1 if is_last else 0)
+
+
+def pack_header(chunk_size: int, salt: bytes, version: int = VERSION, codec: int = chunk_codecs.NONE,
+                flags: int = 0) -> bytes:
+    """Parte fija de la cabecera (sin el registro de llave)."""
+    return _HEADER.pack(MAGIC, version, flags, codec, 0, chunk_size, salt)
+
+
+def unpack_header(data: bytes) -> dict:
+    """
+    Lee la cabecera de un archivo por bloques.
+
+    Lanza:
+        InvalidToken: Si la cabecera no es válida o la versión no se reconoce.
+    """
+    if len(data) < BASE_HEADER_SIZE:
+        raise InvalidToken
+    magic, version, flags, codec, _, chunk_size, salt = _HEADER.unpack(data[:BASE_HEADER_SIZE])
+    if magic != MAGIC or version not in (1, 2) or chunk_size == 0:
+        raise InvalidToken
+    return {"version": version, "flags": flags, "codec": codec,
+            "chunk_size": chunk_size, "salt": salt,
+            "header_size": BASE_HEADER_SIZE if version == 1 else HEADER_SIZE}
+
+
+def is_chunked(first_bytes: bytes) -> bool:
+    """Los tokens Fernet empiezan con 'gAAAAA', nunca con nuestro MAGIC."""
+    return first_bytes[:len(MAGIC)] == MAGIC
+
+
+def _read_full(f, size):
+    """Lee exactamente 'size' bytes (o menos solo si se llega al final)."""
+    with instrumentation.span("read", size):
+        data = f.read(size)
+        while len(data) < size:
+            more = f.read(size - len(data))
+            if not more:
+                break
+            data += more
+    instrumentation.count("bytes_copied", len(data))
+    instrumentation.count("bytes_allocated", len(data))
+    return data
+
+
+def new_file_header(session_key, chunk_size: int = CHUNK_SIZE, codec: int = chunk_codecs.NONE, flags: int = 0):
+    """
+    Prepara la cabecera de un archivo nuevo: un salt y una llave aleatorios,
+    con la llave envuelta por la llave maestra actual. Con un 'codec' los
+    bloques se escriben con pack_chunk en vez de seal_chunk.
+
+    Retorna:
+        tuple: (cabecera, llave del archivo)
+    """
+    base = pack_header(chunk_size, os.urandom(16), codec=codec, flags=flags)
+    file_key = AESGCM.generate_key(bit_length=256)
+    return base + wrap_file_key(session_key, base, file_key), file_key
+
+
+def seal_chunk(file_key: bytes, header: bytes, index: int, is_last: bool, data: bytes) -> bytes:
+    """
+    Cifra un bloque. Solo recibe bytes, así que se puede mandar a otro
+    proceso (ProcessPoolExecutor) sin pasarle la llave de sesión.
+    """
+    with instrumentation.span("encrypt", len(data)):
+        sealed = AESGCM(file_key).encrypt(chunk_nonce(index, is_last), data, header[:BASE_HEADER_SIZE])
+    instrumentation.count("bytes_copied", len(data))
+    instrumentation.count("bytes_allocated", len(sealed))
+    return sealed
+
+
+def open_chunk(file_key: bytes, header: bytes, index: int, is_last: bool, sealed: bytes) -> bytes:
+    """
+    Descifra un bloque. Igual que seal_chunk, solo recibe bytes.
+
+    Lanza:
+        InvalidToken: Si el bloque fue alterado.
+    """
+    try:
+        with instrumentation.span("decrypt", len(sealed)):
+            data = AESGCM(file_key).decrypt(chunk_nonce(index, is_last), sealed, header[:BASE_HEADER_SIZE])
+    except InvalidTag:
+        raise InvalidToken
+    instrumentation.count("bytes_copied", len(data))
+    instrumentation.count("bytes_allocated", len(data))
+    return data
+
+
+def pack_chunk(file_key: bytes, header: bytes, index: int, is_last: bool, data: bytes,
+               codec: int, level: int = None) -> bytes:
+    """
+    Comprime (si vale la pena) y cifra un bloque de un archivo con códec.
+
+    Retorna:
+        bytes: El bloque listo para escribir, con su largo por delante.
+    """
+    with instrumentation.span("compress", len(data)):
+        used, payload = chunk_codecs.compress(data, codec, level)
+    if used != chunk_codecs.NONE:
+        instrumentation.count("bytes_copied", len(payload))
+        instrumentation.count("bytes_allocated", len(payload))
+    sealed = seal_chunk(file_key, header, index, is_last, bytes((used,)) + payload)
+    # Las dos concatenaciones copian el bloque completo otra vez
+    instrumentation.count("bytes_copied", 2 * len(sealed))
+    instrumentation.count("bytes_allocated", 2 * len(sealed))
+    return _FRAME.pack(len(sealed), len(data)) + sealed
+
+
+def unpack_chunk(file_key: bytes, header: bytes, index: int, is_last: bool, sealed: bytes,
+                 plain_size: int) -> bytes:
+    """
+    Descifra y descomprime un bloque escrito con pack_chunk (sin el largo).
+
+    Lanza:
+        InvalidToken: Si el bloque fue alterado.
+    """
+    payload = open_chunk(file_key, header, index, is_last, sealed)
+    with instrumentation.span("decompress", plain_size):
+        data = chunk_codecs.decompress(payload[0], payload[1:], plain_size)
+    if len(data) != plain_size:
+        raise InvalidToken
+    # Sin comprimir, payload[1:] copia el bloque; comprimido, se crea al descomprimir
+    instrumentation.count("bytes_copied", len(data))
+    instrumentation.count("bytes_allocated", len(data))
+    return data
+
+
+def chunk_buffer_size(chunk_size: int) -> int:
+    """
+    Tamaño de buffer que alcanza para cualquier bloque de 'chunk_size' bytes
+    de texto plano ya cifrado: largo, byte del códec, datos y tag (más lo que
+    update_into pide de sobra).
+    """
+    return FRAME_SIZE + 1 + chunk_size + TAG_SIZE + _UPDATE_SLACK
+
+
+def _read_into(f, view) -> int:
+    """
+    Como _read_full pero lee en 'view' (un memoryview) en vez de crear un bytes.
+
+    Retorna:
+        int: Bytes leídos (menos que len(view) solo si se llega al final).
+    """
+    size = len(view)
+    got = 0
+    with instrumentation.span("read", size):
+        while got < size:
+            n = f.readinto(view[got:])
+            if not n:
+                break
+            got += n
+    instrumentation.count("bytes_copied", got)
+    return got
+
+
+def _gcm(file_key: bytes, header, index: int, is_last: bool, tag: bytes = None):
+    """Cifrador (o descifrador, si se pasa el 'tag') AES-GCM de un bloque."""
+    mode = modes.GCM(chunk_nonce(index, is_last), tag)
+    cipher = Cipher(algorithms.AES(file_key), mode)
+    context = cipher.decryptor() if tag is not None else cipher.encryptor()
+    context.authenticate_additional_data(bytes(header[:BASE_HEADER_SIZE]))
+    return context
+
+
+def seal_chunk_into(file_key: bytes, header: bytes, index: int, is_last: bool, data, out: bytearray):
+    """
+    Igual que seal_chunk, pero escribe el bloque cifrado en 'out' (de al menos
+    chunk_buffer_size bytes) en vez de crear uno nuevo.
+
+    Retorna:
+        memoryview: La parte de 'out' con el bloque cifrado y su tag.
+    """
+    view = memoryview(out)
+    size = len(data)
+    with instrumentation.span("encrypt", size):
+        context = _gcm(file_key, header, index, is_last)
+        context.update_into(data, view[:size + _UPDATE_SLACK])
+        context.finalize()
+        view[size:size + TAG_SIZE] = context.tag
+    instrumentation.count("bytes_copied", size)
+    return view[:size + TAG_SIZE]
+
+
+def pack_chunk_into(file_key: bytes, header: bytes, index: int, is_last: bool, data, codec: int,
+                    level: int, out: bytearray):
+    """
+    Igual que pack_chunk, pero escribe el bloque (con su largo por delante)
+    en 'out'. El byte del códec y los datos se cifran por separado en vez de
+    concatenarlos antes.
+
+    Retorna:
+        memoryview: La parte de 'out' lista para escribir.
+    """
+    with instrumentation.span("compress", len(data)):
+        used, payload = chunk_codecs.compress(data, codec, level)
+    if used != chunk_codecs.NONE:
+        instrumentation.count("bytes_copied", len(payload))
+        instrumentation.count("bytes_allocated", len(payload))
+    view = memoryview(out)
+    size = len(payload)
+    start = FRAME_SIZE + 1
+    with instrumentation.span("encrypt", size + 1):
+        context = _gcm(file_key, header, index, is_last)
+        context.update_into(bytes((used,)), view[FRAME_SIZE:start + _UPDATE_SLACK])
+        context.update_into(payload, view[start:start + size + _UPDATE_SLACK])
+        context.finalize()
+        view[start + size:start + size + TAG_SIZE] = context.tag
+    sealed_size = 1 + size + TAG_SIZE
+    _FRAME.pack_into(out, 0, sealed_size, len(data))
+    instrumentation.count("bytes_copied", size)
+    return view[:FRAME_SIZE + sealed_size]
+
+
+def open_chunk_into(file_key: bytes, header: bytes, index: int, is_last: bool, sealed, out: bytearray):
+    """
+    Igual que open_chunk, pero descifra en 'out'.
+
+    Retorna:
+        memoryview: La parte de 'out' con el texto plano.
+
+    Lanza:
+        InvalidToken: Si el bloque fue alterado.
+    """
+    size = len(sealed) - TAG_SIZE
+    if size < 0:
+        raise InvalidToken
+    view = memoryview(out)
+    sealed = memoryview(sealed)
+    try:
+        with instrumentation.span("decrypt", len(sealed)):
+            context = _gcm(file_key, header, index, is_last, bytes(sealed[size:]))
+            context.update_into(sealed[:size], view[:size + _UPDATE_SLACK])
+            context.finalize()
+    except InvalidTag:
+        raise InvalidToken
+    instrumentation.count("bytes_copied", size)
+    return view[:size]
+
+
+def unpack_chunk_into(file_key: bytes, header: bytes, index: int, is_last: bool, sealed, plain_size: int,
+                      out: bytearray):
+    """
+    Igual que unpack_chunk, pero descifra en 'out'. Los bloques que se
+    guardaron sin comprimir no se vuelven a copiar.
+
+    Retorna:
+        memoryview o bytes: El texto plano.
+
+    Lanza:
+        InvalidToken: Si el bloque fue alterado.
+    """
+    payload = open_chunk_into(file_key, header, index, is_last, sealed, out)
+    if not payload:
+        raise InvalidToken
+    with instrumentation.span("decompress", plain_size):
+        data = chunk_codecs.decompress(payload[0], payload[1:], plain_size)
+    if len(data) != plain_size:
+        raise InvalidToken
+    if not isinstance(data, memoryview):
+        instrumentation.count("bytes_copied", len(data))
+        instrumentation.count("bytes_allocated", len(data))
+    return data
+
+
+def ordered_map(pool, fn, calls, window: int = PARALLEL_WINDOW):
+    """
+    Ejecuta fn(*args) para cada 'args' de 'calls' en el pool, con hasta
+    'window' tareas en vuelo, y produce los resultados en el orden original.
+    Así un archivo grande se cifra en paralelo pero se escribe en orden.
+    """
+    pending = deque()
+    try:
+        for args in calls:
+            pending.append(pool.submit(fn, *args))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def read_plain_chunks(src, chunk_size: int = CHUNK_SIZE):
+    """
+    Lee un archivo abierto en bloques de 'chunk_size'.
+    Produce (índice, es_el_último, datos). Siempre hay al menos un bloque
+    (aunque esté vacío) para poder marcar el final.
+    """
+    # Leemos un bloque por adelantado para saber cuál es el último
+    index = 0
+    current = _read_full(src, chunk_size)
+    while True:
+        following = _read_full(src, chunk_size) if len(current) == chunk_size else b""
+        is_last = not following
+        yield index, is_last, current
+        if is_last:
+            break
+        current = following
+        index += 1
+
+
+def iter_source_chunks(src, chunk_size: int, buffers):
+    """
+    Como read_plain_chunks pero sin crear un bytes por bloque. Produce
+    (índice, es_el_último, datos, buffer): 'datos' es un memoryview y
+    'buffer' el bytearray de 'buffers' (un BufferPool) que lo contiene.
+    Desde que se produce, el buffer es de quien lo recibe, que debe
+    devolverlo al pool con release() cuando ya no use los datos.
+
+    Con MMAP_READS los datos son una vista de un mmap del archivo (un mapeo
+    por bloque, que se libera solo cuando nadie lo usa) y 'buffer' es None.
+    """
+    size = os.fstat(src.fileno()).st_size
+    if MMAP_READS and size and chunk_size % mmap.ALLOCATIONGRANULARITY == 0:
+        count = -(-size // chunk_size)
+        for index in range(count):
+            offset = index * chunk_size
+            with instrumentation.span("read", min(chunk_size, size - offset)):
+                mapping = mmap.mmap(src.fileno(), min(chunk_size, size - offset),
+                                    access=mmap.ACCESS_READ, offset=offset)
+            yield index, index == count - 1, memoryview(mapping), None
+        return
+
+    # Igual que en read_plain_chunks, un bloque por adelantado para saber
+    # cuál es el último
+    index = 0
+    current = buffers.acquire()
+    following = None
+    try:
+        got = _read_into(src, memoryview(current)[:chunk_size])
+        while True:
+            following_got = 0
+            if got == chunk_size:
+                following = buffers.acquire()
+                following_got = _read_into(src, memoryview(following)[:chunk_size])
+            is_last = not following_got
+            data, buffer = memoryview(current)[:got], current
+            current = None
+            yield index, is_last, data, buffer
+            if is_last:
+                break
+            current, following, got = following, None, following_got
+            index += 1
+    finally:
+        for buffer in (current, following):
+            if buffer is not None:
+                buffers.release(buffer)
+
+
+def encrypt_chunks(session_key, src, chunk_size: int = CHUNK_SIZE):
+    """
+    Cifra un archivo abierto en modo binario, bloque por bloque.
+
+    Es un generador: produce primero la cabecera y después cada bloque cifrado
+    en cuanto está listo, para que se pueda ir escribiendo en la USB sin tener
+    el archivo entero en memoria.
+    """
+    header, file_key = new_file_header(session_key, chunk_size)
+    aead = AESGCM(file_key)
+    yield header
+
+    for index, is_last, data in read_plain_chunks(src, chunk_size):
+        yield aead.encrypt(chunk_nonce(index, is_last), data, header[:BASE_HEADER_SIZE])
+
+
+def encrypt_file(session_key, source_path, destination_path, chunk_size: int = CHUNK_SIZE, pool=None):
+    """
+    Cifra 'source_path' en 'destination_path' usando el formato por bloques.
+    La memoria usada no depende del tamaño del archivo.
+
+    Si se pasa un 'pool' (ThreadPoolExecutor o ProcessPoolExecutor) y el
+    archivo es grande, los bloques se cifran en paralelo y se escriben en orden.
+
+    Retorna:
+        int: Bytes escritos en el destino.
+    """
+    use_pool = pool is not None and os.path.getsize(source_path) >= PARALLEL_MIN_CHUNKS * chunk_size
+    written = 0
+    with open(source_path, 'rb') as src, open(destination_path, 'wb') as dst:
+        if use_pool:
+            header, file_key = new_file_header(session_key, chunk_size)
+            calls = ((file_key, header, index, is_last, data)
+                     for index, is_last, data in read_plain_chunks(src, chunk_size))
+            pieces = ordered_map(pool, seal_chunk, calls)
+            dst.write(header)
+            written += len(header)
+        else:
+            pieces = encrypt_chunks(session_key, src, chunk_size)
+
+        for piece in pieces:
+            dst.write(piece)
+            written += len(piece)
+    return written
+
+
+def _rechunk(pieces, chunk_size: int):
+    """
+    Reparte una secuencia de trozos de texto plano en bloques de exactamente
+    'chunk_size' (menos el último). Produce (índice, es_el_último, datos).
+    """
+    buffer = bytearray()
+    index = 0
+    ready = None
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            if ready is not None:
+                yield index, False, ready
+                index += 1
+            ready = bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer or ready is None:
+        if ready is not None:
+            yield index, False, ready
+            index += 1
+        yield index, True, bytes(buffer)
+    else:
+        yield index, True, ready
+
+
+def reencrypt_file(session_key, source_path, destination_path, pool=None) -> int:
+    """
+    Vuelve a cifrar un archivo del baúl (Fernet antiguo, versión 1 o 2) en el
+    formato actual, con una llave nueva envuelta por la llave maestra actual.
+
+    Retorna:
+        int: Bytes de texto plano del archivo.
+    """
+    with VaultFileReader(session_key, source_path) as reader, open(destination_path, 'wb') as dst:
+        chunk_size = CHUNK_SIZE if reader.is_legacy else reader.chunk_size
+        header, file_key = new_file_header(session_key, chunk_size, flags=reader.flags)
+        dst.write(header)
+        for index, is_last, data in _rechunk(reader.iter_chunks(pool=pool), chunk_size):
+            dst.write(seal_chunk(file_key, header, index, is_last, data))
+        return reader.size
+
+
+class VaultFileReader:
+    """
+    Lector de un archivo .enc del baúl.
+
+    Descifra solo los bloques que se piden: se puede recorrer el archivo
+    bloque por bloque (memoria constante) o pedir un rango de bytes
+    (offset, length) sin descifrar el archivo completo. Los archivos en
+    formato Fernet antiguo se descifran completos en memoria al abrirlos.
+
+    Uso:
+        with VaultFileReader(llave, ruta) as reader:
+            inicio = reader.read_range(0, 4096)
+    """
+    def __init__(self, session_key, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._open(session_key)
+        except Exception:
+            self._file.close()
+            raise
+
+    def _open(self, session_key):
+        first_bytes = _read_full(self._file, BASE_HEADER_SIZE)
+
+        if not is_chunked(first_bytes):
+            # Formato antiguo: un solo token Fernet
+            self._legacy_data = session_key.decrypt(first_bytes + self._file.read())
+            self.chunk_size = len(self._legacy_data) or 1
+            self.chunk_count = 1
+            self.size = len(self._legacy_data)
+            self.flags = 0
+            return
+
+        self._legacy_data = None
+        info = unpack_header(first_bytes)
+        self.header_size = info["header_size"]
+        self.header = first_bytes + _read_full(self._file, self.header_size - BASE_HEADER_SIZE)
+        if len(self.header) < self.header_size:
+            raise InvalidToken
+        self.chunk_size = info["chunk_size"]
+        self.flags = info["flags"]
+        self._file_key = file_key_for(session_key, self.header)
+        self._aead = AESGCM(self._file_key)
+        self._aad = self.header[:BASE_HEADER_SIZE]
+        self._sealed_size = self.chunk_size + TAG_SIZE
+        self._frames = None
+        body_size = os.fstat(self._file.fileno()).st_size - self.header_size
+
+        if info["codec"] != chunk_codecs.NONE:
+            self._read_frames(body_size)
+            return
+
+        # Con el tamaño en disco sabemos cuántos bloques hay y cuánto mide el
+        # texto plano, sin leer nada más.
+        self.chunk_count = max(1, -(-body_size // self._sealed_size))
+        last_sealed = body_size - (self.chunk_count - 1) * self._sealed_size
+        if last_sealed < TAG_SIZE:
+            raise InvalidToken
+        self.size = body_size - self.chunk_count * TAG_SIZE
+
+    def _read_frames(self, body_size: int):
+        """
+        Archivo comprimido: recorre los largos de los bloques (un salto por
+        bloque, sin leer su contenido) para saber dónde empieza cada uno.
+        """
+        self._frames = []  # (posición, largo cifrado, largo original)
+        position = self.header_size
+        end = self.header_size + body_size
+        while position < end:
+            self._file.seek(position)
+            frame = _read_full(self._file, FRAME_SIZE)
+            if len(frame) < FRAME_SIZE:
+                raise InvalidToken
+            sealed_size, plain_size = _FRAME.unpack(frame)
+            position += FRAME_SIZE + sealed_size
+            if sealed_size < TAG_SIZE + 1 or position > end:
+                raise InvalidToken
+            self._frames.append((position - sealed_size, sealed_size, plain_size))
+        if not self._frames:
+            raise InvalidToken
+        # Todos los bloques menos el último miden exactamente 'chunk_size'
+        if any(plain != self.chunk_size for _, _, plain in self._frames[:-1]):
+            raise InvalidToken
+        if self._frames[-1][2] > self.chunk_size:
+            raise InvalidToken
+        self.chunk_count = len(self._frames)
+        self.size = sum(plain for _, _, plain in self._frames)
+
+    @property
+    def is_legacy(self) -> bool:
+        return self._legacy_data is not None
+
+    @property
+    def is_recipe(self) -> bool:
+        """El contenido es una lista de trozos del almacén deduplicado."""
+        return bool(self.flags & FLAG_RECIPE)
+
+    def _read_sealed(self, index: int) -> bytes:
+        if self._frames is not None:
+            position, sealed_size, _ = self._frames[index]
+            self._file.seek(position)
+            return _read_full(self._file, sealed_size)
+        self._file.seek(self.header_size + index * self._sealed_size)
+        return _read_full(self._file, self._sealed_size)
+
+    def _read_sealed_into(self, index: int, buffer: bytearray):
+        """Como _read_sealed, pero lee en 'buffer'. Retorna un memoryview."""
+        if self._frames is not None:
+            position, sealed_size, _ = self._frames[index]
+        else:
+            position, sealed_size = self.header_size + index * self._sealed_size, self._sealed_size
+        self._file.seek(position)
+        view = memoryview(buffer)[:sealed_size]
+        return view[:_read_into(self._file, view)]
+
+    def _open_into(self, index: int, sealed, out: bytearray):
+        """Descifra en 'out' el bloque 'index' ya leído con _read_sealed_into."""
+        is_last = index == self.chunk_count - 1
+        if self._frames is not None:
+            return unpack_chunk_into(self._file_key, self.header, index, is_last, sealed,
+                                     self._frames[index][2], out)
+        return open_chunk_into(self._file_key, self.header, index, is_last, sealed, out)
+
+    def _chunks_into(self, indexes, pool, buffers):
+        """
+        Descifra los bloques 'indexes' usando buffers de 'buffers' (un
+        BufferPool). Cada bloque producido es una vista de un buffer que se
+        reutiliza: solo vale hasta pedir el siguiente.
+        """
+        parallel = pool is not None and len(indexes) >= PARALLEL_MIN_CHUNKS
+        # Un par de buffers (cifrado y texto plano) por bloque en vuelo; con
+        # pool, ordered_map tiene hasta 'window' tareas a la vez más el bloque
+        # que se está entregando.
+        window = PARALLEL_WINDOW
+        slot_count = window + 1 if parallel else 1
+        slots = []
+        finished = False
+
+        def slot(position):
+            # Por posición dentro del rango, no por número de bloque: un rango
+            # que no empieza en el bloque 0 también estrena los pares en orden
+            if len(slots) < slot_count:
+                slots.append((buffers.acquire(), buffers.acquire()))
+            return slots[position % slot_count]
+
+        def calls():
+            for position, index in enumerate(indexes):
+                sealed_buffer, plain_buffer = slot(position)
+                yield index, self._read_sealed_into(index, sealed_buffer), plain_buffer
+
+        try:
+            if parallel:
+                yield from ordered_map(pool, self._open_into, calls(), window)
+            else:
+                for args in calls():
+                    yield self._open_into(*args)
+            finished = True
+        finally:
+            for pair in slots:
+                for buffer in pair:
+                    # Si se cortó a medias, alguna tarea del pool puede seguir
+                    # escribiendo en su buffer: esos no se reciclan.
+                    if finished or not parallel:
+                        buffers.release(buffer)
+                    else:
+                        buffers.discard(buffer)
+
+    def read_chunk(self, index: int) -> bytes:
+        """
+        Descifra y retorna el bloque 'index'.
+
+        Lanza:
+            InvalidToken: Si el bloque fue alterado.
+        """
+        if not 0 <= index < self.chunk_count:
+            raise IndexError(index)
+        if self.is_legacy:
+            return self._legacy_data
+
+        is_last = index == self.chunk_count - 1
+        if self._frames is not None:
+            return unpack_chunk(self._file_key, self.header, index, is_last, self._read_sealed(index),
+                                self._frames[index][2])
+        sealed = self._read_sealed(index)
+        try:
+            with instrumentation.span("decrypt", len(sealed)):
+                data = self._aead.decrypt(chunk_nonce(index, is_last), sealed, self._aad)
+        except InvalidTag:
+            raise InvalidToken
+        instrumentation.count("bytes_copied", len(data))
+        instrumentation.count("bytes_allocated", len(data))
+        return data
+
+    def iter_chunks(self, offset: int = 0, length: int = None, pool=None, buffers=None):
+        """
+        Produce el texto plano de [offset, offset + length) bloque por bloque,
+        descifrando solo los bloques que cubren ese rango.
+
+        Con un 'pool', si el rango abarca muchos bloques, estos se descifran
+        en paralelo (la lectura del disco sigue siendo secuencial) y se
+        producen en orden.
+
+        Con 'buffers' (un BufferPool de al menos chunk_buffer_size bytes) los
+        bloques se leen y descifran en buffers reutilizados y se producen
+        memoryview que solo valen hasta pedir el siguiente bloque.
+        """
+        end = self.size if length is None else min(self.size, offset + length)
+        if offset >= end:
+            if not self.size and not self.is_legacy:
+                # Un archivo vacío es un solo bloque vacío: se autentica igual,
+                # si no un tag alterado (o de otro archivo) pasaría sin error
+                self.read_chunk(0)
+            return
+        if self.is_legacy:
+            yield self._legacy_data[offset:end]
+            return
+
+        first = offset // self.chunk_size
+        last = (end - 1) // self.chunk_size
+        indexes = range(first, last + 1)
+        if buffers is not None and buffers.size >= chunk_buffer_size(self.chunk_size):
+            chunks = self._chunks_into(indexes, pool, buffers)
+        elif pool is not None and len(indexes) >= PARALLEL_MIN_CHUNKS and self._frames is not None:
+            calls = ((self._file_key, self.header, index, index == self.chunk_count - 1, self._read_sealed(index),
+                      self._frames[index][2])
+                     for index in indexes)
+            chunks = ordered_map(pool, unpack_chunk, calls)
+        elif pool is not None and len(indexes) >= PARALLEL_MIN_CHUNKS:
+            calls = ((self._file_key, self.header, index, index == self.chunk_count - 1, self._read_sealed(index))
+                     for index in indexes)
+            chunks = ordered_map(pool, open_chunk, calls)
+        else:
+            chunks = (self.read_chunk(index) for index in indexes)
+
+        try:
+            # 'chunks' primero, para que termine (y suelte sus buffers) al acabar
+            for chunk, index in zip(chunks, indexes):
+                chunk_start = index * self.chunk_size
+                start, stop = max(0, offset - chunk_start), end - chunk_start
+                if (start or stop < len(chunk)) and not isinstance(chunk, memoryview):
+                    instrumentation.count("bytes_copied", min(stop, len(chunk)) - start)
+                yield chunk[start:stop]
+        finally:
+            if buffers is not None:
+                chunks.close()
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        """Retorna hasta 'length' bytes de texto plano a partir de 'offset'."""
+        return b"".join(self.iter_chunks(offset, length))
+
+    def copy_to(self, dst, offset: int = 0, length: int = None, pool=None) -> int:
+        """
+        Escribe el texto plano (o un rango) en el archivo abierto 'dst'.
+
+        Retorna:
+            int: Bytes escritos.
+        """
+        written = 0
+        for plain in self.iter_chunks(offset, length, pool):
+            dst.write(plain)
+            written += len(plain)
+        return written
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def decrypt_file(session_key, source_path, destination_path, resume: bool = False, pool=None):
+    """
+    Descifra un archivo .enc del baúl en 'destination_path', bloque por bloque.
+    Acepta tanto el formato por bloques como los tokens Fernet antiguos.
+
+    Si 'resume' es True y el destino ya existe, se continúa desde el byte en
+    que se quedó la copia anterior en vez de empezar de cero. Con un 'pool',
+    los archivos grandes se descifran en paralelo (ver iter_chunks).
+
+    Retorna:
+        int: Bytes de texto plano escritos.
+
+    Lanza:
+        InvalidToken: Si la llave no corresponde o el archivo está corrupto.
+    """
+    with VaultFileReader(session_key, source_path) as reader:
+        offset = 0
+        if resume and os.path.exists(destination_path):
+            offset = min(os.path.getsize(destination_path), reader.size)
+
+        mode = 'ab' if offset else 'wb'
+        try:
+            with open(destination_path, mode) as dst:
+                dst.truncate(offset)
+                return reader.copy_to(dst, offset, pool=pool)
+        except InvalidToken:
+            # No dejamos a medias un archivo que no se pudo autenticar
+            # (salvo lo que ya estaba de una copia anterior)
+            if not offset:
+                os.remove(destination_path)
+            raise
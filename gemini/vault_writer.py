@@ -0,0 +1,209 @@
+import os
+import threading
+import instrumentation
+
+# Escritura de archivos en la USB.
+#
+# Antes cada archivo se abría con su nombre final y se escribía pieza por
+# pieza: si se desconectaba la USB a medias quedaba un .enc truncado (el árbol
+# lo mostraba como "¡Archivo corrupto!") y las escrituras pequeñas le van mal a
+# la memoria flash. Ahora:
+#
+# - Se escribe a un nombre temporal ('<nombre>.tmp', que el árbol no lista) y
+#   al terminar se renombra con os.replace(): el nombre final solo aparece con
+#   el archivo completo.
+# - Las piezas se juntan en un buffer de BUFFER_SIZE y se escriben en bloques
+#   múltiplos de ALIGNMENT (un múltiplo del tamaño de cluster de FAT32/exFAT),
+#   así cada write() llena clusters completos.
+# - Las piezas grandes (desde DIRECT_WRITE, por ejemplo un bloque cifrado de
+#   1 MiB) no se copian al buffer: solo se completa el buffer hasta el
+#   siguiente múltiplo de ALIGNMENT y el resto alineado se escribe directo
+#   desde la pieza. Así un bloque no se copia una vez más antes de llegar
+#   al disco.
+# - Cuándo se fuerza a disco (fsync) lo decide una política, compartida por
+#   todos los archivos de una importación (ver SyncPolicy).
+#
+# Si se corta la luz o se desconecta la USB quedan a lo más archivos '.tmp',
+# que no aparecen en el árbol y se pueden borrar.
+#
+# Comparación con la escritura directa anterior:
+#   python -m benchmarks.bench_writer --target /mnt/fat32
+
+BUFFER_SIZE = 4 * 1024 * 1024
+ALIGNMENT = 64 * 1024
+DIRECT_WRITE = 256 * 1024
+TEMP_SUFFIX = ".tmp"
+
+# Políticas de fsync
+FSYNC_FILE = "file"     # Cada archivo, antes de renombrarlo
+FSYNC_BATCH = "batch"   # Por lotes: los archivos esperan con su nombre temporal
+FSYNC_END = "end"       # Todos al final del trabajo
+FSYNC_NONE = "none"     # Nunca (por ejemplo, al exportar al disco de la PC)
+POLICIES = (FSYNC_FILE, FSYNC_BATCH, FSYNC_END, FSYNC_NONE)
+
+
+def _fsync_dir(folder):
+    """Guarda en disco la entrada de directorio de un renombrado (solo POSIX)."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    try:
+        fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        with instrumentation.span("fsync_dir"):
+            os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SyncPolicy:
+    """
+    Decide cuándo se hace fsync y se renombran los archivos terminados.
+
+    Con FSYNC_BATCH y FSYNC_END los archivos terminados esperan con su nombre
+    temporal; en flush() se hace fsync de cada uno y recién entonces se
+    renombran, así nunca hay un nombre final con datos que no llegaron al
+    disco. Se puede usar desde varios hilos.
+
+    Parámetros:
+        policy: Una de POLICIES.
+        batch_files: Con FSYNC_BATCH, cuántos archivos se juntan por lote.
+        batch_bytes: Con FSYNC_BATCH, cuántos bytes se juntan por lote.
+    """
+    def __init__(self, policy: str = FSYNC_BATCH, batch_files: int = 64, batch_bytes: int = 64 * 1024 * 1024):
+        if policy not in POLICIES:
+            raise ValueError(f"Política de fsync desconocida: {policy}")
+        self.policy = policy
+        self.batch_files = batch_files
+        self.batch_bytes = batch_bytes
+        self._pending = []      # (temporal, final)
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+
+    def finished(self, f, tmp_path: str, final_path: str, size: int):
+        """Lo llama VaultWriter.commit() con el archivo todavía abierto."""
+        if self.policy == FSYNC_FILE:
+            with instrumentation.span("fsync"):
+                os.fsync(f.fileno())
+        f.close()
+        if self.policy in (FSYNC_FILE, FSYNC_NONE):
+            os.replace(tmp_path, final_path)
+            if self.policy == FSYNC_FILE:
+                _fsync_dir(os.path.dirname(final_path))
+            return
+        with self._lock:
+            self._pending.append((tmp_path, final_path))
+            self._pending_bytes += size
+            full = (self.policy == FSYNC_BATCH and
+                    (len(self._pending) >= self.batch_files or self._pending_bytes >= self.batch_bytes))
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Hace fsync de los archivos pendientes y los renombra. Hay que
+        llamarlo antes de guardar un manifiesto que los nombre y al terminar
+        el trabajo.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._pending_bytes = 0
+        folders = set()
+        for tmp_path, final_path in pending:
+            # Se vuelve a abrir solo para el fsync (en Windows hace falta
+            # acceso de escritura)
+            with open(tmp_path, 'r+b') as f, instrumentation.span("fsync"):
+                os.fsync(f.fileno())
+            os.replace(tmp_path, final_path)
+            folders.add(os.path.dirname(final_path))
+        for folder in folders:
+            _fsync_dir(folder)
+
+
+class VaultWriter:
+    """
+    Un archivo nuevo que se escribe en un nombre temporal, en bloques grandes
+    y alineados, y aparece con su nombre final solo al llamar commit().
+
+    Uso:
+        writer = VaultWriter(ruta, sync)
+        try:
+            writer.write(cabecera)
+            ...
+            writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+    """
+    def __init__(self, path, sync: SyncPolicy = None, buffer_size: int = BUFFER_SIZE, direct: bool = True):
+        self.path = str(path)
+        self.tmp_path = self.path + TEMP_SUFFIX
+        self.sync = sync or SyncPolicy(FSYNC_FILE)
+        self.buffer_size = max(ALIGNMENT, buffer_size - buffer_size % ALIGNMENT)
+        self.size = 0
+        self.direct = direct
+        self._buffer = bytearray()
+        # Sin el buffer de Python: los tamaños de cada write() los decidimos aquí
+        self._file = open(self.tmp_path, 'wb', buffering=0)
+
+    def write(self, data):
+        """
+        Agrega 'data' (bytes o memoryview) al archivo. La pieza se puede
+        reutilizar en cuanto write() retorna.
+        """
+        if self.direct and len(data) >= DIRECT_WRITE:
+            self._write_direct(memoryview(data))
+            return
+        self._buffer += data
+        self.size += len(data)
+        instrumentation.count("bytes_copied", len(data))
+        if len(self._buffer) >= self.buffer_size:
+            # Se escriben solo múltiplos de ALIGNMENT; el resto espera
+            ready = len(self._buffer) - len(self._buffer) % ALIGNMENT
+            self._write_all(memoryview(self._buffer)[:ready])
+            del self._buffer[:ready]
+
+    def _write_direct(self, view):
+        # Lo escrito hasta ahora es múltiplo de ALIGNMENT; lo que falta para
+        # el siguiente se toma de la pieza y el buffer se escribe entero
+        self.size += len(view)
+        fill = min(len(view), -len(self._buffer) % ALIGNMENT)
+        if self._buffer:
+            self._buffer += view[:fill]
+            self._write_all(memoryview(self._buffer))
+            self._buffer.clear()
+            view = view[fill:]
+            instrumentation.count("bytes_copied", fill)
+        bulk = len(view) - len(view) % ALIGNMENT
+        if bulk:
+            self._write_all(view[:bulk])
+        self._buffer += view[bulk:]
+        instrumentation.count("bytes_copied", len(view) - bulk)
+
+    def _write_all(self, view):
+        with instrumentation.span("write", len(view)):
+            while view:
+                written = self._file.write(view)
+                view = view[written:]
+
+    def commit(self):
+        """Escribe lo que falta y deja el archivo con su nombre final (según la política)."""
+        try:
+            if self._buffer:
+                self._write_all(memoryview(self._buffer))
+                self._buffer.clear()
+            self.sync.finished(self._file, self.tmp_path, self.path, self.size)
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self):
+        """Descarta el archivo a medias."""
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
@@ -40,8 +40,9 @@ class FileTreeView(ctk.CTkScrollableFrame):
             int: The next available grid row.
         """
         try:
-            # Get a sorted list of items in the directory
-            items = sorted(os.listdir(current_path))
+            # Read the directory once; os.scandir already knows each entry's type
+            with os.scandir(current_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
         except FileNotFoundError:
             print(f"Error: Directory not found at {current_path}")
             return row
@@ -50,8 +51,8 @@ class FileTreeView(ctk.CTkScrollableFrame):
             return row
 
         # Separate directories and files to display directories first
-        dirs = [item for item in items if os.path.isdir(os.path.join(current_path, item))]
-        files = [item for item in items if not os.path.isdir(os.path.join(current_path, item))]
+        dirs = [e.name for e in entries if e.is_dir()]
+        files = [e.name for e in entries if not e.is_dir()]
 
         # Process directories first
         for item in dirs:
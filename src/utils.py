@@ -46,7 +46,8 @@ class FileTreeView(ctk.CTkScrollableFrame):
 
     def populate_tree(self, current_path, row, indent=0):
         try:
-            items = sorted(os.listdir(current_path))
+            with os.scandir(current_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
         except (FileNotFoundError, PermissionError) as e:
             print(f"Error al acceder a {current_path}: {e}")
             return row
@@ -56,8 +57,10 @@ class FileTreeView(ctk.CTkScrollableFrame):
         if parent_path not in self.folder_children:
             self.folder_children[parent_path] = []
 
-        dirs = [item for item in items if os.path.isdir(os.path.join(current_path, item))]
-        files = [item for item in items if not os.path.isdir(os.path.join(current_path, item))]
+        # Una sola lectura de la carpeta: os.scandir ya trae el tipo de cada elemento
+        dirs = [e.name for e in entries if e.is_dir()]
+        dir_set = set(dirs)
+        files = [e.name for e in entries if not e.is_dir()]
         
         all_items = dirs + files # Procesamos carpetas y luego archivos
 
@@ -66,7 +69,7 @@ class FileTreeView(ctk.CTkScrollableFrame):
 
         for item in all_items:
             item_path = os.path.join(current_path, item)
-            is_dir = os.path.isdir(item_path)
+            is_dir = item in dir_set
             icon = "📁" if is_dir else "📄"
             
             # MODIFICADO: Añadimos el 'command' al checkbox